@@ -16,13 +16,14 @@ The class is responsible for:
 import os, sys, gc
 
 import six
-import time, atexit, weakref
+import time, atexit, weakref, threading
 from acq4.util import Qt
 import acq4.util.reload as reload
 
 from .util import DataManager, ptime, configfile
 from .Interfaces import *
 from .util.Mutex import Mutex
+from .util.WriterPool import WriterPool
 from .util.debug import *
 from .util import debug
 import getopt, glob
@@ -80,6 +81,7 @@ class Manager(Qt.QObject):
         self.disableAllDevs = False
         self.alreadyQuit = False
         self.taskLock = Mutex(Qt.QMutex.Recursive)
+        self.writerPool = None
         
         try:
             if Manager.CREATED:
@@ -327,6 +329,14 @@ class Manager(Qt.QObject):
                     import acq4.pyqtgraph.metaarray as ma
                     ma.MetaArray.defaultCompression = comp
 
+                elif key == 'indexFormat':
+                    print("=== Setting data index format: %s ===" % cfg[key])
+                    DataManager.setIndexFormat(cfg[key])
+
+                elif key == 'dataCacheSize':
+                    print("=== Setting data cache size: %s bytes ===" % cfg[key])
+                    DataManager.getDataCache().setMaxBytes(cfg[key])
+
                 ## load stylesheet
                 elif key == 'stylesheet':
                     try:
@@ -637,6 +647,16 @@ class Manager(Qt.QObject):
         self.sigTaskCreated.emit(cmd, t)
         return t
 
+    def getWriterPool(self):
+        """Return the WriterPool used to store task results in the background.
+        
+        Use WriterPool.stats() to inspect per-device storage latency.
+        """
+        with self.lock:
+            if self.writerPool is None:
+                self.writerPool = WriterPool()
+            return self.writerPool
+
     def showGUI(self):
         """Show the Manager GUI"""
         if self.gui is None:
@@ -827,6 +847,10 @@ class Manager(Qt.QObject):
                         #del self.modules[m]
                     dlg.setValue(lm-len(self.modules))
                 #pdb.set_trace()
+
+                if self.writerPool is not None:
+                    print("Waiting for background storage to finish..")
+                    self.writerPool.shutdown(wait=True)
                     
                 print("Requesting all devices shut down..")
                 for d in self.devices:
@@ -862,8 +886,18 @@ class Task:
         
         self.lockedDevs = []
         self.startedDevs = []
+        self.stopped = False
+        self.abortRequested = False
         self.startTime = None
         self.stopTime = None
+        self._storePending = False
+        self.storageJobs = {}   # devName: WriteJob for results being stored in the background
+        self.storageTimes = {}  # devName: time spent storing results
+        
+        ## used to wake threads waiting for the task to complete (see waitUntilDone)
+        self._doneCondition = threading.Condition()
+        self._wakeRequested = False
+        self._waitingOn = None  # the first device task found to be unfinished by _tasksDone
 
         #self.reserved = False
         try:
@@ -1032,23 +1066,15 @@ class Task:
                 ## Wait until all tasks are done
                 #print "Waiting for all tasks to finish.."
 
-                lastProcess = ptime.time()
                 isGuiThread = Qt.QThread.currentThread() == Qt.QCoreApplication.instance().thread()
                 #print "isGuiThread:", isGuiThread
-                while not self.isDone():
-                    now = ptime.time()
-                    elapsed = now - self.startTime
-                    if isGuiThread:
-                        if processEvents and now-lastProcess > 20e-3:  ## only process Qt events every 20ms
-                            Qt.QApplication.processEvents()
-                            lastProcess = ptime.time()
-                        
-                    if elapsed < self.cfg['duration']-10e-3:  ## If the task duration has not elapsed yet, only wake up every 10ms, and attempt to wake up 5ms before the end
-                        sleep = min(10e-3, self.cfg['duration']-elapsed-5e-3)
-                    else:
-                        sleep = 1.0e-3  ## afterward, wake up more quickly so we can respond as soon as the task finishes
-                    #print "sleep for", sleep
-                    time.sleep(sleep)
+                if isGuiThread and processEvents:
+                    ## only process Qt events every 20ms
+                    while not self.waitUntilDone(timeout=20e-3):
+                        Qt.QApplication.processEvents()
+                else:
+                    while not self.waitUntilDone():
+                        pass
                 #print "all tasks finshed."
                 
                 self.stop()
@@ -1111,10 +1137,57 @@ class Task:
         for t in self.tasks:
             if not self.tasks[t].isDone():
                 #print "Task %s not finished" % t
+                self._waitingOn = self.tasks[t]
                 return False
+        self._waitingOn = None
         if self.stopTime is None:
             self.stopTime = ptime.time()
         return True
+
+    def waitUntilDone(self, timeout=None):
+        """Block until the task is done, *timeout* seconds have elapsed, or
+        wake() is called. Return the value of isDone().
+        
+        Until the requested duration has elapsed, this method simply sleeps.
+        After that, device tasks that support completion notification (see
+        DeviceTask.notifyDone) wake this method as soon as they finish; device
+        tasks that do not are polled every 1 ms.
+        """
+        start = ptime.time()
+        with self._doneCondition:
+            while True:
+                if self.isDone():
+                    return True
+                if self._wakeRequested:
+                    self._wakeRequested = False
+                    return False
+                now = ptime.time()
+                if timeout is not None and now - start >= timeout:
+                    return False
+                
+                remaining = self.startTime + self.cfg['duration'] - now
+                if remaining > 0 and not self.abortRequested:
+                    wait = remaining
+                elif self._waitingOn is not None and not self._waitingOn.canNotifyDone():
+                    wait = 1e-3
+                else:
+                    # we will be notified when the device finishes; wake up 
+                    # occasionally anyway to check for timeout.
+                    wait = 0.1
+                if timeout is not None:
+                    wait = min(wait, start + timeout - now)
+                self._doneCondition.wait(wait)
+
+    def deviceTaskDone(self, devTask):
+        """Called by device tasks (via DeviceTask.notifyDone) when they complete."""
+        with self._doneCondition:
+            self._doneCondition.notify_all()
+
+    def wake(self):
+        """Cause any thread blocked in waitUntilDone() to return immediately."""
+        with self._doneCondition:
+            self._wakeRequested = True
+            self._doneCondition.notify_all()
     
     def duration(self):
         """Return the requested task duration, or None if it was not given."""
@@ -1131,8 +1204,12 @@ class Task:
             return ptime.time() - self.startTime
         return self.stopTime - self.startTime
         
-    def stop(self, abort=False):
+    def stop(self, abort=False, storeData=True):
         """Stop all tasks and read data. If abort is True, do not attempt to collect results from the task.
+
+        If *storeData* is False, then results are collected but not written to
+        disk; the caller is responsible for calling storeResult() later (for
+        example, from a background thread while the next task is running).
         """
         with self.taskLock:
 
@@ -1169,10 +1246,9 @@ class Task:
                     #print "RESULT 1:", self.result
                     
                     ## Store data if requested
-                    if 'storeData' in self.cfg and self.cfg['storeData'] is True:
-                        self.cfg['storageDir'].setInfo(result['protocol'])
-                        for t in self.tasks:
-                            self.tasks[t].storeResult(self.cfg['storageDir'])
+                    self._storePending = self.cfg.get('storeData', False) is True
+                    if storeData:
+                        self.storeResult()
                     prof.mark("store data")
             finally:   
                 ## Regardless of any other problems, at least make sure we 
@@ -1189,11 +1265,67 @@ class Task:
             #print "tasks:", self.tasks
             #print "RESULT:", self.result        
         
-    def getResult(self):
+    def getResult(self, storeData=True):
         with self.taskLock:
-            self.stop()
+            self.stop(storeData=storeData)
             return self.result
 
+    def storeResult(self, background=None):
+        """Write results from all device tasks into the storage directory.
+
+        This is normally called automatically by stop(), but may be deferred
+        by calling stop(storeData=False). Calling this method more than once
+        has no effect.
+        
+        If *background* is True, then each device's results are handed to the
+        Manager's WriterPool and this method returns immediately (so that
+        stop() can release all devices without waiting for the disk). Use
+        storageDone() or waitForStorage() to check for completion and errors.
+        By default, background storage is used if the task command sets
+        protocol['backgroundStorage'] = True.
+        """
+        with self.taskLock:
+            if not self._storePending:
+                return
+            self._storePending = False
+            if background is None:
+                background = self.cfg.get('backgroundStorage', False)
+            dh = self.cfg['storageDir']
+            dh.setInfo(self.result['protocol'])
+            if background:
+                pool = self.dm.getWriterPool()
+                for devName, task in self.tasks.items():
+                    self.storageJobs[devName] = pool.submit(devName, task.storeResult, dh)
+            else:
+                for devName, task in self.tasks.items():
+                    start = ptime.time()
+                    task.storeResult(dh)
+                    self.storageTimes[devName] = ptime.time() - start
+
+    def storageDone(self):
+        """Return True if all background storage for this task has finished
+        (successfully or not).
+        """
+        return all([job.isDone() for job in self.storageJobs.values()])
+
+    def waitForStorage(self, timeout=None):
+        """Block until all background storage for this task has finished.
+        
+        Return a dict of {devName: storage time}. If any device failed to
+        store its results, raise an exception listing the failed devices.
+        """
+        failed = []
+        for devName, job in list(self.storageJobs.items()):
+            try:
+                job.wait(timeout)
+            except Exception:
+                failed.append(devName)
+            if job.elapsed is not None:
+                self.storageTimes[devName] = job.elapsed
+        if len(failed) > 0:
+            raise HelpfulException("Error storing results for device(s): %s" % ', '.join(failed))
+        return self.storageTimes
+
     def _releaseAll(self):
         with self.taskLock:
             #print self.id,"Task.releaseAll:"
@@ -192,7 +192,7 @@ class EventDetector(AnalysisModule):
                 
             ## insert all data to DB
             with pg.ProgressDialog("Storing events...", 0, 100) as dlg:
-                for n, nmax in db.iterInsert(table, records, chunkSize=50):
+                for n, nmax in db.iterInsertArray(table, records, chunkSize=1000):
                     dlg.setMaximum(nmax)
                     dlg.setValue(n)
                     if dlg.wasCanceled():
@@ -492,7 +492,7 @@ class Scan(Qt.QObject):
             fh = self.dataModel.getClampFile(fh)
             
         ## plot all data, incl. events
-        data = fh.read()['primary']
+        data = fh.read(cached=True)['primary']
         data = fn.besselFilter(data, 4e3)
         pc = plot.plot(data, pen=pen, clear=False)
         items.append(pc)
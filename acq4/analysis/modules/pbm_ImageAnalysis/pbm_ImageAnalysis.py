@@ -908,9 +908,9 @@ class pbm_ImageAnalysis(AnalysisModule):
             # store primary channel data and read command amplitude
         #print 'decimate factor: %d' % (decimate_factor)
         #print 'Number of points in original data set: ', shdat
-        tdat = data.infoCopy()[1]['values']
+        tdat = data.xvals(1)
         tdat = tdat[::decimate_factor]
-        self.tdat = data.infoCopy()[1]['values']  # / 1000. NOT
+        self.tdat = data.xvals(1)  # / 1000. NOT
         self.physPlot.plot(tdat, self.physData[::decimate_factor], pen=pg.mkPen('w')) # , decimate=decimate_factor)
         self.showPhysTrigger()
         try:
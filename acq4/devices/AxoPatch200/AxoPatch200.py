@@ -62,6 +62,9 @@ class AP200DataMapping(DataMapping):
     def mapFromDaq(self, chan, data, mode=None):
         gain = self.getGain(chan, mode)
         return data / gain
+
+    def linearMapFromDaq(self, chan, mode=None):
+        return (1.0 / self.getGain(chan, mode), 0.0)
         
     
     
@@ -462,7 +465,9 @@ class AxoPatch200Task(DAQGenericTask):
     def storeResult(self, dirHandle):
         #DAQGenericTask.storeResult(self, dirHandle)
         #dirHandle.setInfo(self.ampState)
-        result = self.getResult()
+        result = self.getRawResult()  ## channels configured with storeRaw (see DAQGeneric)
+        if result is None:
+            result = self.getResult()
         result._info[-1]['ClampState'] = self.ampState
         dirHandle.writeFile(result, self.dev.name())
         
@@ -10,7 +10,7 @@ from acq4.util.Thread import Thread
 #from acq4.devices.Device import *
 from acq4.devices.Microscope import Microscope
 from acq4.util import Qt
-import time
+import time, threading
 from numpy import *
 from acq4.util.metaarray import *
 from .taskGUI import *
@@ -22,6 +22,7 @@ from acq4.util import imaging
 from acq4.pyqtgraph import Vector, SRTTransform3D
 
 from .CameraInterface import CameraInterface
+from .FrameBuffer import FrameBuffer
 
 
 class Camera(DAQGeneric, OptomechDevice):
@@ -54,7 +55,8 @@ class Camera(DAQGeneric, OptomechDevice):
     sigCameraStopped = Qt.Signal()
     sigCameraStarted = Qt.Signal()
     sigShowMessage = Qt.Signal(object)  # (string message)
-    sigNewFrame = Qt.Signal(object)  # (frame data)
+    sigNewFrame = Qt.Signal(object)  # (frame) emitted for every acquired frame
+    sigNewFrames = Qt.Signal(object)  # (list of frames) every frame acquired since the last emission; emitted before sigNewFrame
     sigParamsChanged = Qt.Signal(object)
 
     def __init__(self, dm, config, name):
@@ -104,12 +106,20 @@ class Camera(DAQGeneric, OptomechDevice):
         self.setDeviceTransform(self.deviceTransform() * tr)
         
         
+        ## Recently acquired frames are held here; consumers read them by index.
+        ## Frames not yet delivered to the GUI thread are never overwritten; the buffer
+        ## grows instead (up to frameBufferMaxSize frames, if configured).
+        self.frameBuffer = FrameBuffer(self.camConfig.get('frameBufferSize', 100), frameClass=Frame,
+                                       maxSize=self.camConfig.get('frameBufferMaxSize', None))
+        self.frameBuffer.keepFrom(0)
+        self._lastEmittedFrame = -1
+        
         self.acqThread = AcquireThread(self)
         #print "Camera: acqThread created, about to connect signals."
         self.acqThread.finished.connect(self.acqThreadFinished)
         self.acqThread.started.connect(self.acqThreadStarted)
         self.acqThread.sigShowMessage.connect(self.showMessage)
-        self.acqThread.sigNewFrame.connect(self.newFrame)
+        self.acqThread.sigFramesAvailable.connect(self.framesAvailable)
         #print "Camera: signals connected:"
         
         self.sigGlobalTransformChanged.connect(self.transformChanged)
@@ -434,8 +444,30 @@ class Camera(DAQGeneric, OptomechDevice):
     def showMessage(self, msg):
         self.sigShowMessage.emit(msg)
 
-    def newFrame(self, data):
-        self.sigNewFrame.emit(data)
+    def framesAvailable(self):
+        ## Called in the main thread when the acquisition thread has added frames
+        ## to the frame buffer. Notifications are coalesced, so this may cover many frames.
+        self.acqThread.notificationReceived()
+        buf = self.frameBuffer
+        last = buf.lastIndex()
+        if last is None or last <= self._lastEmittedFrame:
+            return
+        start = self._lastEmittedFrame + 1
+        if start < buf.firstIndex():
+            ## only possible when frameBufferMaxSize is reached
+            logMsg("Camera %s frame buffer overran (frameBufferMaxSize=%d); %d frames were lost." % (
+                self.name(), buf.maxSize, buf.firstIndex() - start), msgType='error')
+        frames = buf.frames(start, last + 1)
+        self._lastEmittedFrame = last
+        buf.keepFrom(last + 1)
+        self.sigNewFrames.emit(frames)
+        for frame in frames:
+            self.sigNewFrame.emit(frame)
+
+    def lastFrame(self):
+        """Return the most recently acquired frame, or None."""
+        last = self.frameBuffer.lastIndex()
+        return None if last is None else self.frameBuffer.frame(last)
         
     def isRunning(self):
         return self.acqThread.isRunning()
@@ -448,8 +480,9 @@ class Frame(imaging.Frame):
     def __init__(self, data, info):
         ## make frame transform to map from image coordinates to sensor coordinates.
         ## (these may differ due to binning and region of interest settings)
-        tr = Camera.makeFrameTransform(info['region'], info['binning'])
-        info['frameTransform'] = tr
+        ## AcquireThread computes this once per camera state and passes it in.
+        if 'frameTransform' not in info:
+            info['frameTransform'] = Camera.makeFrameTransform(info['region'], info['binning'])
 
         imaging.Frame.__init__(self, data, info)
     
@@ -544,14 +577,19 @@ class CameraTask(DAQGenericTask):
             
     def newFrame(self, frame):
         disconnect = False
+        notify = False
         with self.lock:
             if self.recording:
                 self.frames.append(frame)
+                ## wake up the parent task as soon as the last required frame arrives
+                notify = len(self.frames) == self.camCmd.get('minFrames', None)
             if self.stopRecording and frame.info()['time'] > self._stopTime:
                 self.recording = False
                 disconnect = True
         if disconnect:   ## Must be done only after unlocking mutex
             self.dev.acqThread.disconnectCallback(self.newFrame)
+        if notify:
+            self.notifyDone()
 
     def start(self):
         ## arm recording
@@ -575,6 +613,9 @@ class CameraTask(DAQGenericTask):
                 if len(self.frames) < self.camCmd['minFrames']:
                     return False
         return DAQGenericTask.isDone(self)  ## Should return True.
+
+    def canNotifyDone(self):
+        return True
         
     def stop(self, abort=False):
         ## Stop DAQ first
@@ -739,8 +780,16 @@ class CameraTaskResult:
         
         
 class AcquireThread(Thread):
-    
-    sigNewFrame = Qt.Signal(object)
+    """Polls the camera for new frames, stores them in the device's frameBuffer,
+    and notifies consumers.
+
+    Callbacks registered with connectCallback() are invoked from this thread
+    for every frame. Other consumers are notified via sigFramesAvailable, which
+    is emitted at most once until notificationReceived() is called, so a busy
+    GUI thread receives one notification for a whole batch of frames rather
+    than a queued signal per frame.
+    """
+    sigFramesAvailable = Qt.Signal()
     sigShowMessage = Qt.Signal(object)
     
     def __init__(self, dev):
@@ -758,6 +807,8 @@ class AcquireThread(Thread):
         self.bufferTime = 5.0
         #self.ringSize = 30
         self.tasks = []
+        self._wakeup = threading.Event()   # set to interrupt the polling sleep
+        self._notifyPending = False
         
         ## This thread does not run an event loop,
         ## so we may need to deliver frames manually to some places
@@ -772,6 +823,7 @@ class AcquireThread(Thread):
     def start(self, *args):
         self.lock.lock()
         self.stopThread = False
+        self._wakeup.clear()
         self.lock.unlock()
         Thread.start(self, *args)
     
@@ -783,54 +835,36 @@ class AcquireThread(Thread):
         with self.connectMutex:
             if method in self.connections:
                 self.connections.remove(method)
-    #
-    #def setParam(self, param, value):
-    #    #print "PVCam:setParam", param, value
-    #    start = False
-    #    if self.isRunning():
-    #        start = True
-    #        #print "Camera.setParam: Stopping camera before setting parameter.."
-    #        self.stop(block=True)
-    #        #print "Camera.setParam: camera stopped"
-    #    with self.lock:
-    #        self.state[param] = value
-    #    if start:
-    #        #self.start(Qt.QThread.HighPriority)
-    #        self.start()
-    #    
-    
+
+    def notificationReceived(self):
+        """Called by the receiver of sigFramesAvailable before it reads the frame
+        buffer, allowing the next batch of frames to generate a new notification.
+        """
+        self._notifyPending = False
+
     def run(self):
-        #import cProfile
-        ##cProfile.runctx('self._run()', globals(), locals(), sort='cumulative')
-        #pr = cProfile.Profile()
-        #pr.enable()
-        #self._run()
-        #pr.disable()
-        #pr.print_stats(sort='cumulative')
-        
-    #def _run(self):
-        size = self.dev.getParam('sensorSize')
-        lastFrame = None
         lastFrameTime = None
         lastFrameId = None
-        fps = None
 
         camState = dict(self.dev.getParams(['binning', 'exposure', 'region', 'triggerMode']))
         binning = camState['binning']
         exposure = camState['exposure']
         region = camState['region']
         mode = camState['triggerMode']
+        frameBuffer = self.dev.frameBuffer
+        frameTransform = Camera.makeFrameTransform(region, binning)
+
+        ## Poll a few times per frame interval, but not more often than every 0.5 ms
+        pollInterval = min(max(exposure * 0.25, 0.5e-3), 5e-3)
         
         try:
             #self.dev.setParam('ringSize', self.ringSize, autoRestart=False)
             self.dev.startCamera()
             
             lastFrameTime = lastStopCheck = ptime.time()
-            frameInfo = {}
             scopeState = None
 
             while True:
-                ti = 0
                 now = ptime.time()
                 frames = self.dev.newFrames()
                 
@@ -839,65 +873,60 @@ class AcquireThread(Thread):
                     if lastFrameId is not None:
                         drop = frames[0]['id'] - lastFrameId - 1
                         if drop > 0:
+                            frameBuffer.addDropped(drop)
                             print("WARNING: Camera dropped %d frames" % drop)
                         
-                    ## Build meta-info for this frame(s)
-                    info = camState.copy()
-                    
+                    ## Build meta-info shared by all frames until the scope state changes
                     ss = self.dev.getScopeState()
-
                     if ss['id'] != scopeState:
                         scopeState = ss['id']
-                        ## regenerate frameInfo here
                         ps = ss['pixelSize']  ## size of CCD pixel
                         transform = pg.SRTTransform3D(ss['transform'])
-
-                        frameInfo = {
+                        info = camState.copy()
+                        info.update({
                             'pixelSize': [ps[0] * binning[0], ps[1] * binning[1]],  ## size of image pixel
                             'objective': ss.get('objective', None),
                             'deviceTransform': transform,
-                            'illumination': ss.get('illumination', None)
-                        }
-
-                    ## Copy frame info to info array
-                    info.update(frameInfo)                    
+                            'illumination': ss.get('illumination', None),
+                            'frameTransform': frameTransform,
+                            'transform': pg.SRTTransform3D(transform * frameTransform),
+                        })
+                        frameBuffer.setInfo(info)
                     
                     ## Process all waiting frames. If there is more than one frame waiting, guess the frame times.
                     dt = (now - lastFrameTime) / len(frames)
-                    if dt > 0:
-                        info['fps'] = 1.0/dt
-                    else:
-                        info['fps'] = None
+                    fps = 1.0 / dt if dt > 0 else None
                     
+                    with self.connectMutex:
+                        conn = list(self.connections)
                     for frame in frames:
-                        frameInfo = info.copy()
                         data = frame.pop('data')
-                        frameInfo.update(frame)  # copies 'time' key supplied by camera
-                        out = Frame(data, frameInfo)
-                        with self.connectMutex:
-                            conn = list(self.connections)
-                        for c in conn:
-                            c(out)
-                        self.sigNewFrame.emit(out)
+                        frameId = frame.pop('id')
+                        frameTime = frame.pop('time')
+                        index = frameBuffer.add(data, frameId, frameTime, fps, extra=frame or None)
+                        if len(conn) > 0:
+                            out = frameBuffer.frame(index)
+                            for c in conn:
+                                c(out)
+
+                    if not self._notifyPending:
+                        self._notifyPending = True
+                        self.sigFramesAvailable.emit()
                         
                     lastFrameTime = now
-                    lastFrameId = frames[-1]['id']
-                    loopCount = 0
-                        
-                time.sleep(1e-3)
+                    lastFrameId = frameId
                 
-                ## check for stop request every 10ms
-                if now - lastStopCheck > 10e-3: 
-                    lastStopCheck = now
-                    
-                    ## If no frame has arrived yet, do NOT allow the camera to stop (this can hang the driver)   << bug should be fixed in pvcam driver, not here.
-                    self.lock.lock()
+                ## sleep until the next poll; stop() interrupts this wait
+                self._wakeup.wait(pollInterval)
+                
+                with self.lock:
                     if self.stopThread:
                         self.stopThread = False
-                        self.lock.unlock()
                         break
-                    self.lock.unlock()
-                    
+
+                ## check for stalled acquisition every 10ms
+                if now - lastStopCheck > 10e-3: 
+                    lastStopCheck = now
                     diff = ptime.time()-lastFrameTime
                     if diff > (10 + exposure):
                         if mode == 'Normal':
@@ -906,13 +935,9 @@ class AcquireThread(Thread):
                         else:
                             pass  ## do not exit loop if there is a possibility we are waiting for a trigger
                                 
-                
-            #from debug import Profiler
-            #prof = Profiler()
             with self.camLock:
                 #self.cam.stop()
                 self.dev.stopCamera()
-            #prof.mark('      camera stop:')
         except:
             printExc("Error starting camera acquisition:")
             try:
@@ -929,6 +954,7 @@ class AcquireThread(Thread):
         #print "AcquireThread.stop: Requesting thread stop, acquiring lock first.."
         with self.lock:
             self.stopThread = True
+        self._wakeup.set()
         #print "AcquireThread.stop: got lock, requested stop."
         #print "AcquireThread.stop: Unlocked, waiting for thread exit (%s)" % block
         if block:
@@ -45,7 +45,7 @@ class CameraInterface(CameraModuleInterface):
 
         # takes care of displaying image data, 
         # contrast & background subtraction user interfaces
-        self.imagingCtrl = ImagingCtrl()
+        self.imagingCtrl = ImagingCtrl(compression=camera.camConfig.get('stackCompression', None))
         self.frameDisplay = self.imagingCtrl.frameDisplay
 
         ## Move control panels into docks
@@ -117,7 +117,7 @@ class CameraInterface(CameraModuleInterface):
         self.ui.spinExposure.valueChanged.connect(self.setExposure)  ## note that this signal (from acq4.util.SpinBox) is delayed.
 
         ## Signals from Camera device
-        self.cam.sigNewFrame.connect(self.newFrame)
+        self.cam.sigNewFrames.connect(self.newFrames)
         self.cam.sigCameraStopped.connect(self.cameraStopped)
         self.cam.sigCameraStarted.connect(self.cameraStarted)
         self.cam.sigShowMessage.connect(self.showMessage)
@@ -137,8 +137,12 @@ class CameraInterface(CameraModuleInterface):
             dev.addKeyCallback(key['key'], self.hotkeyPressed, (action,))
     
     def newFrame(self, frame):
-        self.imagingCtrl.newFrame(frame)
-        self.sigNewFrame.emit(self, frame)
+        self.newFrames([frame])
+
+    def newFrames(self, frames):
+        self.imagingCtrl.newFrames(frames)
+        for frame in frames:
+            self.sigNewFrame.emit(self, frame)
 
     def controlWidget(self):
         return self.widget
@@ -218,7 +222,7 @@ class CameraInterface(CameraModuleInterface):
             return
 
         try:
-            self.cam.sigNewFrame.disconnect(self.newFrame)
+            self.cam.sigNewFrames.disconnect(self.newFrames)
             self.cam.sigCameraStopped.disconnect(self.cameraStopped)
             self.cam.sigCameraStarted.disconnect(self.cameraStarted)
             self.cam.sigShowMessage.disconnect(self.showMessage)
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+import numpy as np
+from acq4.util.Mutex import Mutex
+
+
+class FrameBuffer(object):
+    """Fixed-size ring holding the most recently acquired camera frames.
+
+    Frames are addressed by a sequential index (0 for the first frame added,
+    counting up forever); only the last *size* frames are retained. Each slot
+    holds a reference to the image array returned by the camera driver (no copy
+    is made) and one row of a preallocated structured array with the per-frame
+    metadata (id, time, fps). Everything else in a frame's info dict (camera
+    parameters, scope state, transforms) is stored once per acquisition state
+    via setInfo() and shared by all frames acquired in that state.
+
+    Frame objects are only constructed when a consumer asks for them, and the
+    same object is returned to every consumer of a given frame.
+
+    Frames that a consumer has not read yet can be protected with keepFrom().
+    Rather than overwriting them, add() then grows the ring (up to *maxSize*
+    frames, if given).
+    """
+    metaDtype = [('id', np.int64), ('time', np.float64), ('fps', np.float64), ('info', np.int32)]
+
+    def __init__(self, size=100, frameClass=None, maxSize=None):
+        self.size = size
+        self.maxSize = maxSize
+        self.frameClass = frameClass
+        self.lock = Mutex(Mutex.Recursive)
+        self._data = [None] * size
+        self._frames = [None] * size
+        self._extra = [None] * size   # uncommon per-frame info keys supplied by some drivers
+        self._meta = np.zeros(size, dtype=self.metaDtype)
+        self._infos = {}     # info index: shared info dict
+        self._infoIndex = -1
+        self._count = 0      # total number of frames added
+        self._first = 0      # index of the oldest frame still held
+        self._keepFrom = None
+        self._dropped = 0
+        self._overwritten = 0
+
+    def setInfo(self, info):
+        """Set the info dict shared by all frames added after this call.
+        """
+        with self.lock:
+            self._infoIndex += 1
+            self._infos[self._infoIndex] = info
+            # forget info dicts that are no longer referenced by any slot
+            slots = np.arange(self._first, self._count) % self.size
+            oldest = self._meta['info'][slots].min() if len(slots) > 0 else self._infoIndex
+            for i in [i for i in self._infos if i < oldest]:
+                del self._infos[i]
+
+    def add(self, data, id, time, fps, extra=None):
+        """Store a new frame and return its index.
+
+        *extra* may be a dict of additional per-frame info keys.
+        """
+        with self.lock:
+            index = self._count
+            if index - self.size >= self._first and self._keepFrom is not None and index - self.size >= self._keepFrom:
+                ## the oldest frame has not been read yet
+                if self.maxSize is None or self.size < self.maxSize:
+                    self._resize(self.size * 2 if self.maxSize is None else min(self.size * 2, self.maxSize))
+                else:
+                    self._overwritten += 1
+            slot = index % self.size
+            self._data[slot] = data
+            self._frames[slot] = None
+            self._extra[slot] = extra
+            self._meta[slot] = (id, time, np.nan if fps is None else fps, self._infoIndex)
+            self._count += 1
+            self._first = max(self._first, self._count - self.size)
+            return index
+
+    def keepFrom(self, index):
+        """Do not overwrite frames from *index* onward; the ring grows instead
+        (up to maxSize). Consumers call this again as they catch up. None allows
+        all frames to be overwritten.
+        """
+        with self.lock:
+            self._keepFrom = index
+
+    def overwritten(self):
+        """Return the number of protected frames that were overwritten because
+        the buffer had reached maxSize.
+        """
+        return self._overwritten
+
+    def _resize(self, size):
+        data = [None] * size
+        frames = [None] * size
+        extra = [None] * size
+        meta = np.zeros(size, dtype=self.metaDtype)
+        for i in range(self._first, self._count):
+            old, new = i % self.size, i % size
+            data[new] = self._data[old]
+            frames[new] = self._frames[old]
+            extra[new] = self._extra[old]
+            meta[new] = self._meta[old]
+        self._data, self._frames, self._extra, self._meta = data, frames, extra, meta
+        self.size = size
+
+    def addDropped(self, n):
+        """Record that *n* frames were lost before reaching the buffer."""
+        with self.lock:
+            self._dropped += n
+
+    def count(self):
+        """Return the total number of frames added to the buffer."""
+        return self._count
+
+    def dropped(self):
+        """Return the number of frames the camera reported as dropped."""
+        return self._dropped
+
+    def lastIndex(self):
+        """Return the index of the newest frame, or None if the buffer is empty."""
+        return self._count - 1 if self._count > 0 else None
+
+    def firstIndex(self):
+        """Return the index of the oldest frame still held in the buffer."""
+        return self._first
+
+    def hasFrame(self, index):
+        return self.firstIndex() <= index < self._count
+
+    def data(self, index):
+        """Return the image data for frame *index* without building a Frame."""
+        with self.lock:
+            self._checkIndex(index)
+            return self._data[index % self.size]
+
+    def meta(self, index):
+        """Return the compact metadata record (id, time, fps, info) for frame *index*."""
+        with self.lock:
+            self._checkIndex(index)
+            return self._meta[index % self.size].copy()
+
+    def frame(self, index):
+        """Return the Frame at *index*.
+
+        Raise IndexError if the frame has not been acquired yet or has already
+        been overwritten.
+        """
+        with self.lock:
+            self._checkIndex(index)
+            slot = index % self.size
+            frame = self._frames[slot]
+            if frame is None:
+                meta = self._meta[slot]
+                info = self._infos[int(meta['info'])].copy()
+                info['id'] = int(meta['id'])
+                info['time'] = float(meta['time'])
+                fps = float(meta['fps'])
+                info['fps'] = None if np.isnan(fps) else fps
+                if self._extra[slot] is not None:
+                    info.update(self._extra[slot])
+                frame = self.frameClass(self._data[slot], info)
+                self._frames[slot] = frame
+            return frame
+
+    def frames(self, start, stop=None):
+        """Return a list of Frames from *start* up to (not including) *stop*.
+
+        Frames that have already been overwritten are skipped. By default,
+        all frames from *start* to the newest frame are returned.
+        """
+        with self.lock:
+            if stop is None:
+                stop = self._count
+            start = max(start, self.firstIndex())
+            return [self.frame(i) for i in range(start, stop)]
+
+    def _checkIndex(self, index):
+        if not (self._first <= index < self._count):
+            raise IndexError("Frame %d is not in the buffer (have %d..%d)" % (
+                index, self._first, self._count - 1))
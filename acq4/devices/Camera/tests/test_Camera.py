@@ -0,0 +1,58 @@
+from __future__ import print_function
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.util import Qt
+from acq4.devices.Camera.Camera import Camera
+from acq4.devices.Camera.FrameBuffer import FrameBuffer
+
+
+class Frame(object):
+    def __init__(self, data, info):
+        self.data = data
+        self.info = info
+
+
+class FakeAcqThread(object):
+    def notificationReceived(self):
+        pass
+
+
+class FakeCamera(Qt.QObject):
+    """Just enough of Camera to run framesAvailable()."""
+    sigNewFrame = Qt.Signal(object)
+    sigNewFrames = Qt.Signal(object)
+
+    def __init__(self, size):
+        Qt.QObject.__init__(self)
+        self.acqThread = FakeAcqThread()
+        self.frameBuffer = FrameBuffer(size, frameClass=Frame)
+        self.frameBuffer.keepFrom(0)
+        self.frameBuffer.setInfo({})
+        self._lastEmittedFrame = -1
+
+    def name(self):
+        return 'FakeCamera'
+
+    framesAvailable = Camera.__dict__['framesAvailable']
+
+
+def test_frames_available():
+    pg.mkQApp()
+    cam = FakeCamera(size=4)
+    single = []
+    batches = []
+    cam.sigNewFrame.connect(single.append)
+    cam.sigNewFrames.connect(batches.append)
+
+    # the GUI thread falls behind by more frames than the initial buffer size
+    for i in range(10):
+        cam.frameBuffer.add(i, id=i, time=i, fps=None)
+    cam.framesAvailable()
+    for i in range(10, 12):
+        cam.frameBuffer.add(i, id=i, time=i, fps=None)
+    cam.framesAvailable()
+    cam.framesAvailable()
+
+    # every frame is delivered, both individually and in batches
+    assert [f.data for f in single] == list(range(12))
+    assert [[f.data for f in b] for b in batches] == [list(range(10)), [10, 11]]
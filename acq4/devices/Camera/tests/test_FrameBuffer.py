@@ -0,0 +1,76 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+from acq4.devices.Camera.FrameBuffer import FrameBuffer
+
+
+class Frame(object):
+    def __init__(self, data, info):
+        self.data = data
+        self.info = info
+
+
+def test_framebuffer():
+    buf = FrameBuffer(size=4, frameClass=Frame)
+    assert buf.lastIndex() is None
+
+    buf.setInfo({'exposure': 0.01})
+    images = [np.full((3, 3), i) for i in range(6)]
+    for i, img in enumerate(images[:3]):
+        assert buf.add(img, id=i, time=i * 0.1, fps=10.) == i
+    buf.setInfo({'exposure': 0.02})
+    for i, img in enumerate(images[3:], start=3):
+        buf.add(img, id=i, time=i * 0.1, fps=None, extra={'exposeDoneTime': i} if i == 5 else None)
+
+    assert buf.count() == 6
+    assert buf.firstIndex() == 2
+    assert buf.lastIndex() == 5
+    with pytest.raises(IndexError):
+        buf.frame(1)
+    with pytest.raises(IndexError):
+        buf.frame(6)
+
+    # data is stored by reference and Frame objects are shared between consumers
+    f = buf.frame(2)
+    assert f.data is images[2]
+    assert buf.frame(2) is f
+    assert f.info == {'exposure': 0.01, 'id': 2, 'time': 0.2, 'fps': 10.}
+    assert buf.frame(5).info == {'exposure': 0.02, 'id': 5, 'time': 0.5, 'fps': None, 'exposeDoneTime': 5}
+
+    # requests for overwritten frames are clipped to what is still available
+    assert [fr.info['id'] for fr in buf.frames(0)] == [2, 3, 4, 5]
+
+    # shared info dicts are released once no frame refers to them
+    for i in range(4):
+        buf.add(images[0], id=6 + i, time=0, fps=None)
+    buf.setInfo({'exposure': 0.03})
+    assert len(buf._infos) == 2
+
+
+def test_framebuffer_keep():
+    # frames that have not been read are not overwritten; the ring grows instead
+    buf = FrameBuffer(size=4, frameClass=Frame)
+    buf.setInfo({})
+    buf.keepFrom(0)
+    for i in range(10):
+        buf.add(i, id=i, time=0, fps=None)
+    assert buf.size >= 10 and buf.overwritten() == 0
+    assert [f.data for f in buf.frames(0)] == list(range(10))
+
+    # once read, frames may be overwritten again without further growth
+    size = buf.size
+    buf.keepFrom(10)
+    for i in range(10, 10 + size):
+        buf.add(i, id=i, time=0, fps=None)
+    assert buf.size == size
+    assert buf.firstIndex() == 10 and buf.frame(10).data == 10
+
+    # growth is limited by maxSize
+    buf = FrameBuffer(size=2, frameClass=Frame, maxSize=4)
+    buf.setInfo({})
+    buf.keepFrom(0)
+    for i in range(6):
+        buf.add(i, id=i, time=0, fps=None)
+    assert buf.size == 4 and buf.overwritten() == 2
+    assert buf.firstIndex() == 2
+    assert [f.data for f in buf.frames(0)] == [2, 3, 4, 5]
@@ -44,6 +44,18 @@ class DataMapping:
         scale = self.scale[chan]
         offset = self.offset[chan]
         return (data + offset) * scale
+
+    def linearMapFromDaq(self, chan):
+        """Return (scale, offset) such that mapFromDaq(chan, data) is equivalent to
+        data * scale + offset, or None if the mapping for *chan* is not linear.
+        
+        Subclasses that override mapFromDaq() must also override this method
+        if their mapping is linear.
+        """
+        if six.get_unbound_function(type(self).mapFromDaq) is not six.get_unbound_function(DataMapping.mapFromDaq):
+            return None
+        scale = self.scale[chan]
+        return (scale, self.offset[chan] * scale)
             
 
 class ChannelHandle(object):
@@ -74,6 +86,19 @@ class DAQGeneric(Device):
                 channel: '/Dev1/line7'
                 type: 'di'
                 invert: True
+                
+    Channels may also set `storeRaw: True` to store their data in the native
+    dtype returned by the DAQ (for example int16 or uint8) along with the
+    scale and offset needed to convert it to physical units. The conversion is
+    applied when the file is read (see acq4.filetypes.MetaArray). Output
+    channels are generated as float64; they may set storeRaw to a smaller
+    dtype (eg. `storeRaw: 'float32'`) to have their values converted to it.
+    Channels without storeRaw, or whose mapping is not linear, are stored in
+    physical units. All channels share one array, whose dtype is the smallest
+    that holds every channel's values (eg. int16 and float32 channels are
+    stored as float32); stored data are only written this way if that dtype
+    is smaller than the physical-unit result. Task results held in memory are
+    always in physical units.
         
     """
     sigHoldingChanged = Qt.Signal(object, object)
@@ -271,6 +296,7 @@ class DAQGenericTask(DeviceTask):
         self._DAQCmd = cmd
         ## Stores the list of channels that will generate or acquire buffered samples
         self.bufferedChannels = []
+        self._channelData = None
         
     def getConfigOrder(self):
         """return lists of devices that should be configured (before, after) this device"""
@@ -421,64 +447,118 @@ class DAQGenericTask(DeviceTask):
                 self.dev.setChanHolding(ch)
                 prof('reset to holding %s' % ch)
         
+    def getChannelData(self):
+        """Return an OrderedDict {channel: {'data': ..., 'info': ...}} of the
+        unmapped data recorded or generated by each buffered channel, as
+        returned by the DAQ.
+        """
+        if self._channelData is None:
+            data = OrderedDict()
+            for ch in self.bufferedChannels:
+                data[ch] = self.daqTasks[ch].getData(self.dev._DGConfig[ch]['channel'])
+            self._channelData = data
+        return self._channelData
+
     def getResult(self):
         ## Access data recorded from DAQ task
         ## create MetaArray and fill with MC state info
         
         ## Collect data and info for each channel in the command
-        result = {}
-        for ch in self.bufferedChannels:
-            result[ch] = self.daqTasks[ch].getData(self.dev._DGConfig[ch]['channel'])
-            result[ch]['data'] = self.mapping.mapFromDaq(ch, result[ch]['data']) ## scale/offset/invert
-            result[ch]['units'] = self.getChanUnits(ch)
-        
-        if len(result) > 0:
-            meta = result[list(result.keys())[0]]['info']
-            rate = meta['rate']
-            nPts = meta['numPts']
-            ## Create an array of time values
-            timeVals = np.linspace(0, float(nPts-1) / float(rate), nPts)
-            
-            ## Concatenate all channels together into a single array, generate MetaArray info
-            chanList = [np.atleast_2d(result[x]['data']) for x in result]
-            cols = [(x, result[x]['units']) for x in result]
-            # print cols
-            try:
-                arr = np.concatenate(chanList)
-            except:
-                print(chanList)
-                print([a.shape for a in chanList])
-                raise
-            
-            daqState = OrderedDict()
-            for ch in self.dev._DGConfig:
-                if ch in result:
-                    daqState[ch] = result[ch]['info']
-                else:
-                    daqState[ch] = {}
-                
-                ## record current holding value for all output channels (even those that were not buffered for this task)    
-                if self.dev._DGConfig[ch]['type'] in ['ao', 'do']:
-                    
-                    daqState[ch]['holding'] = self.holdingVals[ch]
-            
-            info = [axis(name='Channel', cols=cols), axis(name='Time', units='s', values=timeVals)] + [{'DAQ': daqState}]
-            
-            
-            protInfo = self._DAQCmd.copy()  ## copy everything but the command arrays and low-level configuration info
-            for ch in protInfo:
-                protInfo[ch].pop('command', None)
-                protInfo[ch].pop('lowLevelConf', None)
-            info[-1]['Protocol'] = protInfo
-                
-            marr = MetaArray(arr, info=info)
-            return marr
-            
-        else:
+        result = self.getChannelData()
+        if len(result) == 0:
             return None
+        
+        ## Map all channels into a single array. Each channel is mapped and copied in
+        ## turn, so at most one channel is duplicated in memory at a time.
+        chans = list(result.keys())
+        raw = [np.atleast_2d(result[ch]['data']) for ch in chans]
+        dtype = np.result_type(*[self.mapping.mapFromDaq(ch, r[:, :1]) for ch, r in zip(chans, raw)])
+        try:
+            arr = np.empty((sum([r.shape[0] for r in raw]),) + raw[0].shape[1:], dtype=dtype)
+            row = 0
+            for ch, r in zip(chans, raw):
+                arr[row:row+r.shape[0]] = self.mapping.mapFromDaq(ch, r)  ## scale/offset/invert
+                row += r.shape[0]
+        except:
+            print([r.shape for r in raw])
+            raise
+        
+        return MetaArray(arr, info=self._resultInfo(result))
+        
+    def getRawResult(self):
+        """Return a MetaArray with the data from all channels in the dtypes set
+        by their storeRaw options (see DAQGeneric), or None if storing it this way
+        would not make the file smaller. Channels stored raw have 'rawScale' and
+        'rawOffset' values in their column such that
+        physical value = raw * rawScale + rawOffset.
+        """
+        if six.get_unbound_function(type(self).getResult) is not six.get_unbound_function(DAQGenericTask.getResult):
+            return None  ## subclass modifies the result; store that instead
+        result = self.getChannelData()
+        if len(result) == 0:
+            return None
+        chans = []  ## (data, (scale, offset) or None) for each channel
+        for ch in result:
+            data = np.atleast_2d(result[ch]['data'])
+            storeRaw = self.dev._DGConfig[ch].get('storeRaw', False)
+            lin = self.mapping.linearMapFromDaq(ch) if storeRaw else None
+            if lin is None:
+                data = self.mapping.mapFromDaq(ch, data)
+            if isinstance(storeRaw, six.string_types):
+                data = data.astype(storeRaw)
+            chans.append((data, lin))
+        if all([lin is None for data, lin in chans]):
+            return None
+        dtype = np.result_type(*[data.dtype for data, lin in chans])
+        mappedDtype = np.result_type(*[self.mapping.mapFromDaq(ch, np.atleast_2d(result[ch]['data'])[:, :1]) for ch in result])
+        if dtype.itemsize >= mappedDtype.itemsize:
+            return None
+        
+        arr = np.empty((sum([data.shape[0] for data, lin in chans]),) + chans[0][0].shape[1:], dtype=dtype)
+        row = 0
+        for data, lin in chans:
+            arr[row:row+data.shape[0]] = data
+            row += data.shape[0]
+        info = self._resultInfo(result)
+        for col, (data, lin) in zip(info[0]['cols'], chans):
+            if lin is not None:
+                col['rawScale'], col['rawOffset'] = lin
+        return MetaArray(arr, info=info)
+        
+    def _resultInfo(self, result):
+        ## generate MetaArray info for the channels in result
+        meta = result[list(result.keys())[0]]['info']
+        rate = meta['rate']
+        
+        cols = [(x, self.getChanUnits(x)) for x in result]
+        
+        daqState = OrderedDict()
+        for ch in self.dev._DGConfig:
+            if ch in result:
+                daqState[ch] = result[ch]['info'].copy()
+            else:
+                daqState[ch] = {}
+            
+            ## record current holding value for all output channels (even those that were not buffered for this task)    
+            if self.dev._DGConfig[ch]['type'] in ['ao', 'do']:
+                daqState[ch]['holding'] = self.holdingVals[ch]
+        
+        ## time values are implicit (start, rate); no array of time values is stored
+        info = [axis(name='Channel', cols=cols), axis(name='Time', units='s', start=0.0, rate=rate)] + [{'DAQ': daqState}]
+        
+        ## copy everything but the command arrays and low-level configuration info
+        protInfo = OrderedDict()
+        for ch in self._DAQCmd:
+            protInfo[ch] = dict([(k, v) for k, v in self._DAQCmd[ch].items() if k not in ('command', 'lowLevelConf')])
+        info[-1]['Protocol'] = protInfo
+        return info
             
     def storeResult(self, dirHandle):
-        DeviceTask.storeResult(self, dirHandle)
+        result = self.getRawResult()
+        if result is None:
+            DeviceTask.storeResult(self, dirHandle)
+        else:
+            dirHandle.writeFile(result, self.dev.name())
         for ch in self._DAQCmd:
             if self._DAQCmd[ch].get('recordInit', False):
             #if 'recordInit' in self._DAQCmd[ch] and self._DAQCmd[ch]['recordInit']:
@@ -102,6 +102,9 @@ class DaqChannelGui(Qt.QWidget):
     def taskSequenceStarted(self):
         pass
     
+    def prepareTaskSequence(self):
+        pass
+    
     def quit(self):
         #print "quit DAQGeneric channel", self.name
         self.plot.close()
@@ -216,12 +219,11 @@ class OutputChannelGui(DaqChannelGui):
         self.clearPlots()
         
         ## display sequence waves
-        params = {}
-        ps = self.ui.waveGeneratorWidget.listSequences()
-        for k in ps:
-            params[k] = range(len(ps[k]))
-        waves = []
-        runSequence(lambda p: waves.append(self.getSingleWave(p)), params, list(params.keys())) ## appends waveforms for the entire parameter space to waves
+        waves = self.getSequenceWaves()  ## waveforms for the entire parameter space
+        if waves is None:
+            waves = []
+        else:
+            waves = waves.reshape(-1, waves.shape[-1])
 
         autoRange = self.plot.getViewBox().autoRangeEnabled()
         self.plot.enableAutoRange(x=False, y=False)
@@ -266,6 +268,23 @@ class OutputChannelGui(DaqChannelGui):
         wave = self.ui.waveGeneratorWidget.getSingle(self.rate, self.numPts, params)
         
         return wave
+
+    def prepareTaskSequence(self):
+        ## generate the command waveforms for the whole sequence in one evaluation
+        if not self.stateGroup.state()['functionCheck']:
+            return
+        h = self.getHoldingValue()
+        if h is not None:
+            self.ui.waveGeneratorWidget.setOffset(h)
+        self.ui.waveGeneratorWidget.cacheSequence(self.rate, self.numPts)
+
+    def getSequenceWaves(self):
+        """Return the waveforms for the entire sequence parameter space as one
+        array (see StimGenerator.getSequence), or None."""
+        h = self.getHoldingValue()
+        if h is not None:
+            self.ui.waveGeneratorWidget.setOffset(h)
+        return self.ui.waveGeneratorWidget.getSequence(self.rate, self.numPts)
         
     def holdingCheckChanged(self, *v):
         self.ui.holdingSpin.setEnabled(self.ui.holdingCheck.isChecked())
@@ -116,6 +116,10 @@ class DAQGenericTaskGui(TaskGui):
                     chParams[k[len(search):]] = params[k]
             self.channels[ch].taskStarted(chParams)
             
+    def prepareTaskSequence(self):
+        for ch in self.channels:
+            self.channels[ch].prepareTaskSequence()
+        
     def taskSequenceStarted(self):  ## automatically invoked from TaskGui
         for ch in self.channels:
             self.channels[ch].taskSequenceStarted()
@@ -0,0 +1,138 @@
+from __future__ import print_function
+from collections import OrderedDict
+import numpy as np
+import pytest
+from acq4.devices.DAQGeneric.DAQGeneric import DAQGenericTask, DataMapping
+from acq4.devices.AxoPatch200.AxoPatch200 import AxoPatch200Task, AP200DataMapping
+import acq4.filetypes.MetaArray as MetaArrayFileType
+
+
+class FakeDevice(object):
+    """Just enough of DAQGeneric to build task results."""
+    def __init__(self, config):
+        self._DGConfig = config
+
+    def name(self):
+        return 'Clamp'
+
+    def listChannels(self):
+        return list(self._DGConfig.keys())
+
+    def getChanScale(self, ch):
+        return self._DGConfig[ch]['scale']
+
+    def getChanOffset(self, ch):
+        return self._DGConfig[ch].get('offset', 0.0)
+
+    def getChanUnits(self, ch):
+        return self._DGConfig[ch]['units']
+
+
+class FakeHandle(object):
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def name(self):
+        return self.fileName
+
+
+class FakeDirHandle(object):
+    def __init__(self):
+        self.files = {}
+
+    def writeFile(self, data, name):
+        self.files[name] = data
+
+
+def makeTask(config, cls=DAQGenericTask, mapping=None):
+    rng = np.random.RandomState(0)
+    dev = FakeDevice(config)
+    task = cls.__new__(cls)
+    task.dev = dev
+    task.mapping = DataMapping(dev) if mapping is None else mapping
+    task._DAQCmd = OrderedDict([(ch, {}) for ch in config])
+    task.holdingVals = dict([(ch, 0.0) for ch in config if config[ch]['type'] == 'ao'])
+    task._channelData = OrderedDict()
+    for ch, conf in config.items():
+        if conf['type'] == 'ao':
+            data = rng.normal(size=200)  ## command waveforms are generated as float64 volts
+        else:
+            data = rng.randint(-2000, 2000, size=200).astype(np.int16)
+        task._channelData[ch] = {'data': data, 'info': {'rate': 1e4}}
+    return task
+
+
+def config(**storeRaw):
+    conf = OrderedDict([
+        ('command', {'type': 'ao', 'units': 'V', 'scale': 0.02}),
+        ('primary', {'type': 'ai', 'units': 'A', 'scale': 1e-9, 'offset': 0.01}),
+        ('secondary', {'type': 'ai', 'units': 'V', 'scale': 0.1}),
+    ])
+    for ch, val in storeRaw.items():
+        conf[ch]['storeRaw'] = val
+    return conf
+
+
+def readBack(result, tmpdir):
+    fileName = str(tmpdir.join('result.ma'))
+    result.write(fileName)
+    return MetaArrayFileType.MetaArray.read(FakeHandle(fileName))
+
+
+@pytest.mark.parametrize('storeRaw, dtype', [
+    ({'primary': True, 'secondary': True}, None),                         # float64 command
+    ({'command': 'float32', 'primary': True, 'secondary': True}, np.float32),
+    ({'command': 'float32', 'primary': True}, None),                      # float64 secondary
+    ({'command': 'float16', 'secondary': True}, None),                    # float64 primary
+])
+def test_raw_result(storeRaw, dtype, tmpdir):
+    task = makeTask(config(**storeRaw))
+    mapped = task.getResult()
+    raw = task.getRawResult()
+    if dtype is None:
+        assert raw is None
+        return
+    assert raw.dtype == dtype
+    cols = raw._info[0]['cols']
+    assert [c.get('rawScale', None) for c in cols] == [0.02, 1e-9, 0.1]
+
+    data = readBack(raw, tmpdir)
+    assert data.dtype == np.float64
+    assert np.allclose(data['Channel': 'primary'].asarray(), mapped['Channel': 'primary'].asarray(), rtol=1e-12, atol=0)
+    assert np.allclose(data['Channel': 'secondary'].asarray(), mapped['Channel': 'secondary'].asarray(), rtol=1e-12, atol=0)
+    assert np.allclose(data['Channel': 'command'].asarray(), mapped['Channel': 'command'].asarray(), rtol=1e-6, atol=0)
+
+
+class FakeAxoPatch(FakeDevice):
+    ivModes = {'VC': 'vc', 'IC': 'ic'}
+
+    def getGainSwitchValue(self):
+        return 3
+
+    def interpretGainSwitchValue(self, val, mode):
+        return {'vc': 5e8, 'ic': 50.0}[self.ivModes[mode]]
+
+
+def test_axopatch_raw_result(tmpdir):
+    conf = config(command='float32', primary=True, secondary=True)
+    dev = FakeAxoPatch(conf)
+    mapping = AP200DataMapping(dev, dev.ivModes, mode='VC')
+    task = makeTask(conf, cls=AxoPatch200Task, mapping=mapping)
+    task.dev = dev
+    task.ampState = {'mode': 'VC', 'LPF': 5e3, 'gain': 5e8}
+    mapped = task.getResult()
+
+    dh = FakeDirHandle()
+    task.storeResult(dh)
+    stored = dh.files['Clamp']
+    assert stored.dtype == np.float32
+    assert stored._info[-1]['ClampState'] == task.ampState
+    data = readBack(stored, tmpdir)
+    assert np.allclose(data['Channel': 'primary'].asarray(), mapped['Channel': 'primary'].asarray(), rtol=1e-12, atol=0)
+    assert np.allclose(data['Channel': 'command'].asarray(), mapped['Channel': 'command'].asarray(), rtol=1e-6, atol=0)
+
+    # without storeRaw the mapped result is stored
+    task = makeTask(config(), cls=AxoPatch200Task, mapping=mapping)
+    task.ampState = {'mode': 'VC'}
+    task.storeResult(dh)
+    assert np.array_equal(dh.files['Clamp'].asarray(), task.getResult().asarray())
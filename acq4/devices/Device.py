@@ -225,6 +225,25 @@ class DeviceTask(object):
         The default implementation returns True.
         """
         return True
+
+    def canNotifyDone(self):
+        """
+        Return True if this DeviceTask calls notifyDone() when it completes.
+        
+        The parent task waits for devices that support notification without
+        polling; devices that return False (the default) have their isDone()
+        method polled once the task duration has elapsed.
+        """
+        return False
+
+    def notifyDone(self):
+        """
+        Inform the parent task that this DeviceTask may have completed, so
+        that it can check isDone() immediately. May be called from any thread.
+        """
+        parent = self.parentTask()
+        if parent is not None:
+            parent.deviceTaskDone(self)
     
     def stop(self, abort=False):
         """
@@ -314,6 +333,12 @@ class TaskGui(Qt.QWidget):
         """Called once before the start of each task or task sequence. Allows the device to execute any one-time preparations it needs."""
         pass
         
+    def prepareTaskSequence(self):
+        """Called once before the commands for all tasks in a sequence are generated
+        (not when commands are generated lazily). Allows the device to precompute
+        its commands for the whole sequence."""
+        pass
+        
     def saveState(self):
         """Return a dictionary representing the current state of the widget."""
         return {}
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the camera acquisition path: runs a MockCamera at its fastest
+frame rate and reports how many frames reach consumers, how many batched
+notifications were needed to deliver them, and how many frames were dropped.
+
+Usage:  python -m acq4.devices.MockCamera.fps_benchmark [seconds]
+"""
+from __future__ import print_function
+import sys
+import acq4.util.ptime as ptime
+from acq4.util import Qt
+
+
+def run(duration=5.0, region=(0, 0, 512, 512), binning=(1, 1), exposure=1e-3):
+    import acq4.Manager
+    man = acq4.Manager.Manager.single or acq4.Manager.Manager(argv=['-n', '-D'])
+    cam = man.getDevice('BenchmarkCamera') if 'BenchmarkCamera' in man.listDevices() else \
+        man.loadDevice('MockCamera', {}, 'BenchmarkCamera')
+    cam.setParams({'exposure': exposure, 'binningX': binning[0], 'binningY': binning[1],
+                   'regionX': region[0], 'regionY': region[1], 'regionW': region[2], 'regionH': region[3]})
+
+    counts = {'callback': 0, 'batches': 0, 'frames': 0}
+    def callback(frame):
+        # invoked from the acquisition thread for every frame
+        counts['callback'] += 1
+    def newFrames(frames):
+        # invoked in the main thread once per batch
+        counts['batches'] += 1
+        counts['frames'] += len(frames)
+
+    cam.acqThread.connectCallback(callback)
+    cam.sigNewFrames.connect(newFrames)
+    dropped = cam.frameBuffer.dropped()
+    try:
+        cam.start()
+        app = Qt.QApplication.instance()
+        start = ptime.time()
+        while ptime.time() - start < duration:
+            app.processEvents()
+        cam.stop(block=True)
+        app.processEvents()
+        elapsed = ptime.time() - start
+    finally:
+        cam.acqThread.disconnectCallback(callback)
+        cam.sigNewFrames.disconnect(newFrames)
+
+    print("%dx%d bin %dx%d:  %6.1f fps acquired  %6.1f fps delivered  %5.2f frames/notification  %d dropped" % (
+        region[2], region[3], binning[0], binning[1], counts['callback'] / elapsed,
+        counts['frames'] / elapsed, counts['frames'] / max(1, counts['batches']),
+        cam.frameBuffer.dropped() - dropped))
+
+
+if __name__ == '__main__':
+    app = Qt.QApplication([])
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    for binning in [(4, 4), (2, 2), (1, 1)]:
+        run(duration, binning=binning)
+    import acq4.Manager
+    acq4.Manager.getManager().quit()
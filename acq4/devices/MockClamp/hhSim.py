@@ -1,13 +1,18 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 """
-Simple Hodgkin-Huxley simulator for Python. VERY slow.
+Simple Hodgkin-Huxley simulator for Python.
 Includes Ih from Destexhe 1993 [disabled]
 Also simulates voltage clamp and current clamp with access resistance.
 
+Two integrators are provided: runSim() uses scipy's odeint on hh() (slow,
+used as the reference), and runSimFast() uses a fixed-step exponential
+Euler / Rush-Larsen scheme that can also simulate many sweeps at once.
+
 Luke Campagnola 2013
 """
 
+import math
 import numpy as np
 import scipy.integrate
 from acq4.util import Qt
@@ -137,8 +142,8 @@ def hh(y, t, mode, cmd, dt):
 #plt2 = win.addPlot(labels={'left': ('Im', 'A'), 'bottom': ('Time', 's')})
 
 def runSim(initState, mode='ic', cmd=None, dt=0.1, dur=100, **args):
-    npts = int(dur/dt)
-    t = np.linspace(0, dur, npts)
+    npts = int(round(dur/dt))
+    t = np.arange(npts) * dt   ## sample times must match those of cmd
     result = np.empty((npts, 9))
     
     # Run the simulation
@@ -153,6 +158,176 @@ def runSim(initState, mode='ic', cmd=None, dt=0.1, dur=100, **args):
     return result  ## result is array with dims: [npts, (time, Ie, Ve, Vm, Im, m, h, n, f, s)]
 
 
+def gateRates(Vm):
+    """Return (alpha, beta) arrays for the m, h and n gates at membrane potential
+    Vm (V); same rate equations as hh().
+    """
+    Vm = (Vm + 65e-3) * 1000.
+    am = (2.5-0.1*Vm) / (np.exp(2.5-0.1*Vm) - 1.0)
+    bm = 4. * np.exp(-Vm / 18.)
+    ah = 0.07 * np.exp(-Vm / 20.)
+    bh = 1.0 / (np.exp(3.0 - 0.1 * Vm) + 1.0)
+    an = (0.1 - 0.01*(Vm-gKShift)) / (np.exp(1.0 - 0.1*(Vm-gKShift)) - 1.0)
+    bn = 0.125 * np.exp(-Vm / 80.)
+    return np.array([am, ah, an]), np.array([bm, bh, bn])
+
+
+## Gate update tables for runSimFast, keyed by time step
+gateTableRange = (-200e-3, 150e-3, 2e-6)  # (min, max, step) membrane potential
+_gateTables = {}
+
+def gateTables(dt):
+    """Return (mInf, mDecay, hInf, hDecay, nInf, nDecay) tabulated over
+    gateTableRange, where the gate value after a step of dt (ms) at constant
+    Vm is inf + (x - inf) * decay.
+    """
+    if dt not in _gateTables:
+        vmin, vmax, dv = gateTableRange
+        with np.errstate(invalid='ignore', divide='ignore'):
+            a, b = gateRates(np.arange(vmin, vmax + dv, dv))
+            inf = a / (a + b)
+        decay = np.exp(-(a + b) * dt)
+        ## fill the 0/0 singularities of alpha_m and alpha_n from their neighbours
+        for tab in (inf, decay):
+            for row in tab:
+                bad = ~np.isfinite(row)
+                row[bad] = np.interp(np.where(bad)[0], np.where(~bad)[0], row[~bad])
+        if len(_gateTables) > 10:
+            _gateTables.clear()
+        _gateTables[dt] = (inf[0], decay[0], inf[1], decay[1], inf[2], decay[2])
+    return _gateTables[dt]
+
+
+def alphaConductance(t):
+    """Conductance of the synaptic alpha current (see IAlpha) at times t (ms)."""
+    tn = np.asarray(t, dtype=float) - Alpha_t0
+    active = (tn >= 0) & (tn <= 10.0 * Alpha_tau)
+    tn = np.where(active, tn, 0)
+    return np.where(active, gAlpha * (tn/Alpha_tau) * np.exp(-(tn-Alpha_tau)/Alpha_tau), 0.)
+
+
+def runSimFast(initState, mode='ic', cmd=None, dt=0.1, dur=100, maxStep=0.025):
+    """Fixed-step version of runSim().
+    
+    The membrane potential is advanced with an exponential integrator that is
+    exact for constant conductances and a linearly changing command over a
+    step, and the gates with Rush-Larsen steps using precomputed tables. The
+    pipette node, whose time constant is well below 1 us, is treated as
+    quasi-steady; its capacitance is added to the membrane capacitance as seen
+    through the access resistance. The command is linearly interpolated
+    between samples, as in hh(). (Holding the command constant over each step
+    would make the clamp lag a command ramp by half a step, doubling the
+    current at command steps in voltage clamp.)
+    
+    Each sample interval *dt* (ms) is divided into steps of at most *maxStep* ms.
+    Results agree with runSim() to within a sample of spike timing.
+    
+    *initState* may be an array of shape (nCells, 7) and *cmd* an array of shape
+    (nSweeps, npts) to simulate a batch of cells or sweeps at once; the result
+    then has shape (nBatch, npts, 9), otherwise (npts, 9) as for runSim().
+    """
+    initState = np.asarray(initState, dtype=float)
+    batch = initState.ndim > 1 or (cmd is not None and np.ndim(cmd) > 1)
+    if cmd is None:
+        cmd = np.zeros(int(round(dur/dt)))
+        mode = 'ic'
+    cmd = np.atleast_2d(np.asarray(cmd, dtype=float))
+    initState = np.atleast_2d(initState)
+    nb = max(len(initState), len(cmd))
+    npts = cmd.shape[1]
+    cmd = np.broadcast_to(cmd, (nb, npts))
+    state = np.array(np.broadcast_to(initState, (nb, 7)))
+    
+    nSub = max(1, int(np.ceil(dt / maxStep - 1e-9)))
+    h = dt / nSub
+    
+    ## precompute the command at the boundaries of every step and the synaptic
+    ## conductance at the middle of every step
+    frac = np.arange(nSub+1) / float(nSub)
+    nextCmd = np.concatenate([cmd[:, 1:], cmd[:, -1:]], axis=1)
+    stepCmd = (cmd[:, :, np.newaxis] * (1-frac[:-1]) + nextCmd[:, :, np.newaxis] * frac[:-1]).reshape(nb, npts*nSub)
+    stepCmd = np.concatenate([stepCmd, nextCmd[:, -1:]], axis=1)
+    gA = alphaConductance(((np.arange(npts)[:, np.newaxis] + frac[:-1] + 0.5/nSub) * dt).ravel())
+    
+    ## Clamp current = I0 - gS * Vm; r = dVe/dVm for the quasi-steady pipette
+    if mode == 'vc':
+        G = 50e-6 # arbitrary VC gain (as in hh)
+        gS = 1.0 / (1.0/G + Raccess)
+        I0 = gS * stepCmd
+        r = 1.0 / (1.0 + G * Raccess)
+    else:
+        gS = 0.0
+        I0 = stepCmd
+        r = 1.0
+    kc = 1e-3 * h / (C + Cpip * r**2)    # 1e-3 is because t is expressed in ms
+    gRest = gL + gS
+    eRest = gL * EL
+    
+    vmin, vmax, dv = gateTableRange
+    mInf, mDec, hInf, hDec, nInf, nDec = gateTables(h)
+    nTab = len(mInf) - 1
+    
+    if nb == 1:
+        ## a single cell runs much faster on python floats than on length-1 arrays
+        exp = math.exp
+        expm1 = math.expm1
+        index = lambda v: min(max(int((v - vmin) / dv + 0.5), 0), nTab)
+        mInf, mDec, hInf, hDec, nInf, nDec = [t.tolist() for t in (mInf, mDec, hInf, hDec, nInf, nDec)]
+        I0 = I0[0].tolist()
+        gA = gA.tolist()
+        Vm, m, hg, n = state[0, 1:5].tolist()
+    else:
+        exp = np.exp
+        expm1 = np.expm1
+        index = lambda v: np.clip(((v - vmin) / dv + 0.5).astype(np.intp), 0, nTab)
+        I0 = np.ascontiguousarray(I0.T)   # [step, cell]
+        Vm, m, hg, n = [state[:, i].copy() for i in range(1, 5)]
+    
+    rec = np.empty((4, npts, nb))   # Vm, m, h, n at each sample
+    rec[:, 0] = state[:, 1:5].T
+    j = 0
+    for i in range(1, npts):
+        for k in range(nSub):
+            ## Rush-Larsen gate updates at the current membrane potential
+            ind = index(Vm)
+            mi = mInf[ind]
+            m = mi + (m - mi) * mDec[ind]
+            hi = hInf[ind]
+            hg = hi + (hg - hi) * hDec[ind]
+            ni = nInf[ind]
+            n = ni + (n - ni) * nDec[ind]
+            
+            ## exponential step of the membrane potential; the steady state
+            ## moves linearly from Vinf0 to Vinf1 with the command
+            gna = gNa * m**3 * hg
+            gk = gK * n**4
+            ga = gA[j]
+            gTot = gna + gk + (gRest + ga)
+            Vinf0 = (gna * ENa + gk * EK + (eRest + ga * EAlpha) + I0[j]) / gTot
+            Vinf1 = Vinf0 + (I0[j+1] - I0[j]) / gTot
+            x = kc * gTot
+            Vm = Vinf1 + (Vm - Vinf0) * exp(-x) + (Vinf1 - Vinf0) * expm1(-x) / x
+            j += 1
+        rec[0, i] = Vm
+        rec[1, i] = m
+        rec[2, i] = hg
+        rec[3, i] = n
+    
+    result = np.empty((nb, npts, 9))
+    result[:, :, 0] = np.arange(npts) * dt
+    Vout = rec[0].T
+    result[:, :, 3] = Vout
+    if mode == 'vc':
+        result[:, :, 2] = (G * cmd + Vout / Raccess) / (G + 1.0 / Raccess)
+    else:
+        result[:, :, 2] = Vout + cmd * Raccess
+    result[:, :, 1] = (result[:, :, 2] - Vout) / Raccess
+    result[:, :, 4:7] = rec[1:].transpose(2, 1, 0)
+    result[:, :, 7:] = state[:, np.newaxis, 5:]
+    
+    return result if batch else result[0]  ## [(batch), npts, (time, Ie, Ve, Vm, m, h, n, f, s)]
+
+
 initState = [-65e-3, -65e-3, 0.05, 0.6, 0.3, 0.0, 0.0]
 
 def run(cmd):
@@ -163,6 +338,7 @@ def run(cmd):
             'dt': 1e-4,
             'mode': 'ic',
             'data': np.array([...]),
+            'integrator': 'fast',   # optional; 'fast' (runSimFast) or 'odeint' (runSim)
         }
         
     Return array of Vm or Im values.        
@@ -174,7 +350,10 @@ def run(cmd):
     data = cmd['data']
     mode = cmd['mode']
     
-    result = runSim(initState, cmd=data, mode=mode, dt=dt, dur=dt*len(data))
+    if cmd.get('integrator', 'fast') == 'odeint':
+        result = runSim(initState, cmd=data, mode=mode, dt=dt, dur=dt*len(data))
+    else:
+        result = runSimFast(initState, cmd=data, mode=mode, dt=dt, dur=dt*len(data))
     
     initState = result[-1, 2:]
     if mode == 'ic':
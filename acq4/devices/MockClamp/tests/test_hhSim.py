@@ -0,0 +1,64 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+
+pytest.importorskip('scipy.integrate')
+from acq4.devices.MockClamp import hhSim
+
+dt = 0.1     # ms
+npts = 600
+
+
+def sweeps(mode):
+    if mode == 'ic':
+        cmd = np.zeros((2, npts))
+        cmd[0, 100:500] = 0.2e-9
+        cmd[1, 100:500] = 0.1e-9
+    else:
+        cmd = np.full((2, npts), -65e-3)
+        cmd[0, 100:400] = -20e-3
+        cmd[1, 100:400] = -90e-3
+    return cmd
+
+
+def spikeCount(vm):
+    return np.sum((vm[1:] > 0) & (vm[:-1] <= 0))
+
+
+@pytest.mark.parametrize('mode', ['ic', 'vc'])
+def test_runSimFast(mode):
+    # the fixed-step integrator must agree with the odeint reference
+    spikes = []
+    for cmd in sweeps(mode):
+        ref = hhSim.runSim(hhSim.initState, mode=mode, cmd=cmd, dt=dt, dur=dt*npts)
+        fast = hhSim.runSimFast(hhSim.initState, mode=mode, cmd=cmd, dt=dt, dur=dt*npts)
+        assert fast.shape == ref.shape
+        assert np.all(fast[:, 0] == np.arange(npts) * dt)
+        spikes.append(spikeCount(ref[:, 3]))
+        assert spikeCount(fast[:, 3]) == spikes[-1]
+        rms = np.sqrt(np.mean((fast[:, 3] - ref[:, 3])**2))
+        assert rms < 1.5e-3
+        if mode == 'vc':
+            # clamp current, including the transients at the command steps
+            err = np.abs(fast[:, 1] - ref[:, 1])
+            span = np.ptp(ref[:, 1])
+            assert np.sqrt(np.mean(err**2)) < 5e-3 * span
+            assert err.max() < 2e-2 * span
+    assert (sum(spikes) > 0) == (mode == 'ic')
+
+
+@pytest.mark.parametrize('mode', ['ic', 'vc'])
+def test_runSimFast_batch(mode):
+    # simulating sweeps as a batch gives the same result as separate runs
+    cmd = sweeps(mode)
+    batch = hhSim.runSimFast(hhSim.initState, mode=mode, cmd=cmd, dt=dt, dur=dt*npts)
+    assert batch.shape == (len(cmd), npts, 9)
+    for i in range(len(cmd)):
+        single = hhSim.runSimFast(hhSim.initState, mode=mode, cmd=cmd[i], dt=dt, dur=dt*npts)
+        assert np.allclose(batch[i], single, rtol=1e-9, atol=1e-15)
+
+    # and a batch of initial states with one command
+    init = np.array([hhSim.initState, hhSim.initState])
+    batch = hhSim.runSimFast(init, mode=mode, cmd=cmd[0], dt=dt, dur=dt*npts)
+    assert batch.shape == (2, npts, 9)
+    assert np.all(batch[0] == batch[1])
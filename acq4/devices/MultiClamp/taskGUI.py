@@ -146,12 +146,11 @@ class MultiClampTaskGui(TaskGui):
         self.clearCmdPlots()
         
         ## compute sequence waves
-        params = {}
-        ps = self.ui.waveGeneratorWidget.listSequences()
-        for k in ps:
-            params[k] = range(len(ps[k]))
-        waves = []
-        runSequence(lambda p: waves.append(self.getSingleWave(p)), params, list(params.keys()))
+        waves = self.getSequenceWaves()  ## waveforms for the entire parameter space
+        if waves is None:
+            waves = []
+        else:
+            waves = waves.reshape(-1, waves.shape[-1])
 
         # Plot all waves but disable auto-range first to improve performance.
         autoRange = self.ui.bottomPlotWidget.getViewBox().autoRangeEnabled()
@@ -240,6 +239,20 @@ class MultiClampTaskGui(TaskGui):
         if wave is None:
             return None
         return wave
+
+    def prepareTaskSequence(self):
+        ## generate the command waveforms for the whole sequence in one evaluation
+        if self.getMode() == 'I=0':
+            return
+        self.ui.waveGeneratorWidget.setOffset(self.stateGroup.state()['holdingSpin'])
+        self.ui.waveGeneratorWidget.cacheSequence(self.rate, self.numPts)
+
+    def getSequenceWaves(self):
+        """Return the waveforms for the entire sequence parameter space as one
+        array (see StimGenerator.getSequence), or None."""
+        state = self.stateGroup.state()
+        self.ui.waveGeneratorWidget.setOffset(state['holdingSpin'])
+        return self.ui.waveGeneratorWidget.getSequence(self.rate, self.numPts)
         
         
     def getMode(self):
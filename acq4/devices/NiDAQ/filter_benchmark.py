@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for NiDAQ post-processing: compares the original per-channel filter path
+(filter redesigned for every channel, b/a coefficients, lfilter) against cached
+second-order-section designs applied to all AI channels at once.
+
+Usage:  python -m acq4.devices.NiDAQ.filter_benchmark
+"""
+from __future__ import print_function
+import time
+import numpy as np
+import scipy.signal
+from acq4.devices.NiDAQ.nidaq import NiDAQ
+
+
+def referenceLowpass(data, cutoff, order=4, samplerate=None):
+    """Per-channel bessel filter + mean resample as implemented before filter caching."""
+    cutoff /= 0.5 * samplerate
+    b, a = scipy.signal.bessel(order, cutoff, btype='low')
+    padded = np.hstack([data[:100], data, data[-100:]])
+    return scipy.signal.lfilter(b, a, scipy.signal.lfilter(b, a, padded)[::-1])[::-1][100:-100]
+
+
+def run(nChans, rate=100e3, duration=1.0, cutoff=10e3, ds=10, reps=5):
+    nPts = int(rate * duration)
+    data = np.random.normal(size=(nChans, nPts))
+
+    # original: redesign + filter + downsample each channel separately
+    start = time.time()
+    for i in range(reps):
+        ref = [NiDAQ.meanResample(referenceLowpass(d, cutoff, samplerate=rate), ds) for d in data]
+    tRef = (time.time() - start) / reps
+
+    # batched: one cached design, all channels filtered as a 2D array
+    start = time.time()
+    for i in range(reps):
+        out = NiDAQ.meanResample(NiDAQ.lowpass(data, cutoff, filter='bessel', samplerate=rate), ds)
+    tBatch = (time.time() - start) / reps
+
+    err = np.abs(np.vstack(ref) - out).max()
+    print("%2d chans x %d pts:  per-channel %7.1f ms   batched %7.1f ms   speedup %4.1fx   max err %0.2g" % (
+        nChans, nPts, tRef * 1000, tBatch * 1000, tRef / tBatch, err))
+
+
+if __name__ == '__main__':
+    for n in [1, 2, 4, 8, 16]:
+        run(n)
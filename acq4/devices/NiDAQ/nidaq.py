@@ -3,7 +3,7 @@ from __future__ import print_function
 from acq4.util.debug import *
     
 from acq4.devices.Device import *
-import time, traceback, sys
+import time, traceback, sys, threading
 from .taskGUI import *
 #from numpy import byte
 import numpy
@@ -12,6 +12,7 @@ import scipy.signal, scipy.ndimage
 import acq4.util.advancedTypes as advancedTypes
 from acq4.util.debug import *
 import acq4.util.Mutex as Mutex
+from acq4.pyqtgraph.util.lru_cache import LRUCache
 
 class NiDAQ(Device):
     """
@@ -160,23 +161,35 @@ class NiDAQ(Device):
         
     @staticmethod
     def meanResample(data, ds, binary=False):
-        """Resample data by taking mean of ds samples at a time"""
-        newLen = int(data.shape[0] / ds) * ds
-        data = data[:newLen]
-        data.shape = (data.shape[0]/ds, ds)
+        """Resample data by taking mean of ds samples at a time.
+        If data is 2D, then each row is resampled independently."""
+        newLen = (data.shape[-1] // ds) * ds
+        data = data[..., :newLen]
+        data = data.reshape(data.shape[:-1] + (newLen // ds, ds))
         if binary:
-            data = data.mean(axis=1).round().astype(numpy.byte)
+            data = data.mean(axis=-1).round().astype(numpy.byte)
         else:
-            data = data.mean(axis=1)
+            data = data.mean(axis=-1)
         return data
     
+    _filterCache = LRUCache(100, 70)
+    _filterCacheLock = threading.Lock()
+
     @staticmethod
-    def lowpass(data, cutoff, order=4, bidir=True, filter='bessel', stopCutoff=None, gpass=2., gstop=20., samplerate=None):
-        """Bi-directional bessel/butterworth lowpass filter"""
-        if samplerate is not None:
-            cutoff /= 0.5*samplerate
-            if stopCutoff is not None:
-                stopCutoff /= 0.5*samplerate
+    def filterCoefficients(filter, cutoff, order=4, stopCutoff=None, gpass=2., gstop=20.):
+        """Return second-order sections (see scipy.signal.sosfilt) for a lowpass filter.
+        
+        Cutoff frequencies are given as a fraction of the Nyquist frequency. Filter
+        designs are cached because the same filter is usually requested for every 
+        channel of every task in a sequence.
+        """
+        if filter == 'butterworth' and stopCutoff is None:
+            stopCutoff = cutoff * 2.0
+        key = (filter, order, cutoff, stopCutoff, gpass, gstop)
+        with NiDAQ._filterCacheLock:
+            sos = NiDAQ._filterCache.get(key)
+        if sos is not None:
+            return sos
         
         if filter == 'bessel':
             ## How do we compute Wn?
@@ -187,22 +200,36 @@ class NiDAQ(Device):
                 #return 105. / (w**8 + 10*w**6 + 135*w**4 + 1575*w**2 + 11025.)**0.5
             #v = fsolve(lambda x: m(x)-limit, 1.0)
             #Wn = cutoff / (sampr*v)
-            b,a = scipy.signal.bessel(order, cutoff, btype='low') 
+            sos = scipy.signal.bessel(order, cutoff, btype='low', output='sos')
         elif filter == 'butterworth':
-            if stopCutoff is None:
-                stopCutoff = cutoff * 2.0
             ord, Wn = scipy.signal.buttord(cutoff, stopCutoff, gpass, gstop)
             #print "butterworth ord %f   Wn %f   c %f   sc %f" % (ord, Wn, cutoff, stopCutoff)
-            b,a = scipy.signal.butter(ord, Wn, btype='low') 
+            sos = scipy.signal.butter(ord, Wn, btype='low', output='sos')
         else:
             raise Exception('Unknown filter type "%s"' % filter)
+        
+        with NiDAQ._filterCacheLock:
+            NiDAQ._filterCache[key] = sos
+        return sos
+    
+    @staticmethod
+    def lowpass(data, cutoff, order=4, bidir=True, filter='bessel', stopCutoff=None, gpass=2., gstop=20., samplerate=None):
+        """Bi-directional bessel/butterworth lowpass filter.
+        If data is 2D, then each row is filtered independently."""
+        if samplerate is not None:
+            cutoff /= 0.5*samplerate
+            if stopCutoff is not None:
+                stopCutoff /= 0.5*samplerate
+        
+        sos = NiDAQ.filterCoefficients(filter, cutoff, order=order, stopCutoff=stopCutoff, gpass=gpass, gstop=gstop)
             
-        padded = numpy.hstack([data[:100], data, data[-100:]])   ## can we intelligently decide how many samples to pad with?
+        padded = numpy.concatenate([data[..., :100], data, data[..., -100:]], axis=-1)   ## can we intelligently decide how many samples to pad with?
 
         if bidir:
-            data = scipy.signal.lfilter(b, a, scipy.signal.lfilter(b, a, padded)[::-1])[::-1][100:-100]  ## filter twice; once forward, once reversed. (This eliminates phase changes)
+            ## filter twice; once forward, once reversed. (This eliminates phase changes)
+            data = scipy.signal.sosfilt(sos, scipy.signal.sosfilt(sos, padded, axis=-1)[..., ::-1], axis=-1)[..., ::-1][..., 100:-100]
         else:
-            data = scipy.signal.lfilter(b, a, padded)[100:-100]
+            data = scipy.signal.sosfilt(sos, padded, axis=-1)[..., 100:-100]
         return data
 
     @staticmethod
@@ -236,6 +263,7 @@ class Task(DeviceTask):
         
         ## Create supertask from nidaq driver
         self.st = self.dev.n.createSuperTask()
+        self._processedAI = {}  # {task key: (data, info)} for AI channels that have been filtered / downsampled
 
     def getChanSampleRate(self, ch):
         """Return the sample rate that will be used for ch"""
@@ -262,6 +290,9 @@ class Task(DeviceTask):
         ## Determine the sample clock source, configure tasks
         self.st.configureClocks(rate=self.cmd['rate'], nPts=self.cmd['numPts'])
         
+        ## Let the parent task know as soon as the acquisition is complete
+        self.st.notifyWhenDone(self.notifyDone)
+        
         ## Determine how the task will be triggered
         if 'triggerChan' in self.cmd:
             self.st.setTrigger(self.cmd['triggerChan'])
@@ -296,6 +327,7 @@ class Task(DeviceTask):
         return self.st.setWaveform(*args, **kwargs)
         
     def start(self):
+        self._processedAI = {}
         if self.st.hasTasks():
             self.st.start()
         
@@ -304,6 +336,9 @@ class Task(DeviceTask):
             return self.st.isDone()
         else:
             return True
+
+    def canNotifyDone(self):
+        return True
         
         
     def stop(self, wait=False, abort=False):
@@ -328,10 +363,37 @@ class Task(DeviceTask):
         """
         #prof = Profiler("    NiDAQ.getData")
         res = self.st.getResult(channel)
-        data = res['data']
         
-            
-            
+        if res['info']['type'] == 'ai':
+            ## All AI channels on a DAQ share the same filter / downsampling settings,
+            ## so we process them together as a single 2D array the first time any 
+            ## one of them is requested.
+            chInfo = self.st.channelInfo[self.st.absChanName(channel)]
+            key = chInfo['task']
+            if key not in self._processedAI:
+                raw = self.st.getResult()[key]['data']
+                self._processedAI[key] = self.processData(raw, res['info'])
+            data, info = self._processedAI[key]
+            data = data[chInfo['index']]
+        else:
+            data, info = self.processData(res['data'], res['info'])
+        
+        res['info'].update(info)
+        res['data'] = data
+        res['info']['numPts'] = data.shape[-1]
+                
+        return res
+
+    def processData(self, data, info):
+        """Apply the filtering, downsampling, and denoising requested in the task
+        command to *data*, which may be a single channel or a 2D array with one
+        channel per row.
+        
+        Return (data, info), where info is a dict of the meta-info that describes
+        the processing.
+        """
+        info = {'type': info['type'], 'rate': info['rate']}
+        
         if 'downsample' in self.cmd:
             ds = self.cmd['downsample']
         else:
@@ -340,8 +402,6 @@ class Task(DeviceTask):
         if 'filterMethod' in self.cmd:
             method = self.cmd['filterMethod']
             
-            fScale = 0.5 * res['info']['rate'] / ds
-            
             if method == 'None':
                 pass
             #elif method == 'gaussian':
@@ -349,18 +409,18 @@ class Task(DeviceTask):
                 
                 #data = scipy.ndimage.gaussian_filter(data, width)
                 
-                #res['info']['filterMethod'] = method
-                #res['info']['filterWidth'] = width
+                #info['filterMethod'] = method
+                #info['filterWidth'] = width
             elif method == 'Bessel':
                 cutoff = self.cmd['besselCutoff']
                 order = self.cmd['besselOrder']
                 bidir = self.cmd.get('besselBidirectional', True)
-                data = NiDAQ.lowpass(data, filter='bessel', bidir=bidir, cutoff=cutoff, order=order, samplerate=res['info']['rate'])
+                data = NiDAQ.lowpass(data, filter='bessel', bidir=bidir, cutoff=cutoff, order=order, samplerate=info['rate'])
                 
-                res['info']['filterMethod'] = method
-                res['info']['filterCutoff'] = cutoff
-                res['info']['filterOrder'] = order
-                res['info']['filterBidirectional'] = bidir
+                info['filterMethod'] = method
+                info['filterCutoff'] = cutoff
+                info['filterOrder'] = order
+                info['filterBidirectional'] = bidir
             elif method == 'Butterworth':
                 passF = self.cmd['butterworthPassband']
                 stopF = self.cmd['butterworthStopband']
@@ -368,14 +428,14 @@ class Task(DeviceTask):
                 stopDB = self.cmd['butterworthStopDB']
                 bidir = self.cmd.get('butterworthBidirectional', True)
                 
-                data = NiDAQ.lowpass(data, filter='butterworth', bidir=bidir, cutoff=passF, stopCutoff=stopF, gpass=passDB, gstop=stopDB, samplerate=res['info']['rate'])
+                data = NiDAQ.lowpass(data, filter='butterworth', bidir=bidir, cutoff=passF, stopCutoff=stopF, gpass=passDB, gstop=stopDB, samplerate=info['rate'])
                 
-                res['info']['filterMethod'] = method
-                res['info']['filterPassband'] = passF
-                res['info']['filterStopband'] = stopF
-                res['info']['filterPassbandDB'] = passDB
-                res['info']['filterStopbandDB'] = stopDB
-                res['info']['filterBidirectional'] = bidir
+                info['filterMethod'] = method
+                info['filterPassband'] = passF
+                info['filterStopband'] = stopF
+                info['filterPassbandDB'] = passDB
+                info['filterStopbandDB'] = stopDB
+                info['filterBidirectional'] = bidir
                 
             else:
                 printExc("Unknown filter method '%s'" % str(method))
@@ -383,20 +443,16 @@ class Task(DeviceTask):
         
         if ds > 1:
         
-            if res['info']['type'] in ['di', 'do']:
-                res['data'] = (res['data'] > 0).astype(numpy.byte)
-                dsMethod = 'subsample'
-                data = data[::ds]
-                res['info']['downsampling'] = ds
-                res['info']['downsampleMethod'] = 'subsample'
-                res['info']['rate'] = res['info']['rate'] / ds
-            elif res['info']['type'] in ['ai', 'ao']:
+            if info['type'] in ['di', 'do']:
+                data = data[..., ::ds]
+                info['downsampling'] = ds
+                info['downsampleMethod'] = 'subsample'
+                info['rate'] = info['rate'] / ds
+            elif info['type'] in ['ai', 'ao']:
                 data = NiDAQ.meanResample(data, ds)
-                res['info']['downsampling'] = ds
-                res['info']['downsampleMethod'] = 'mean'
-                res['info']['rate'] = res['info']['rate'] / ds
-            else:
-                dsMethod = None
+                info['downsampling'] = ds
+                info['downsampleMethod'] = 'mean'
+                info['rate'] = info['rate'] / ds
 
         if 'denoiseMethod' in self.cmd:
             method = self.cmd['denoiseMethod']
@@ -406,18 +462,17 @@ class Task(DeviceTask):
                 width = self.cmd['denoiseWidth']
                 thresh = self.cmd['denoiseThreshold']
                 
-                res['info']['denoiseMethod'] = method
-                res['info']['denoiseWidth'] = width
-                res['info']['denoiseThreshold'] = thresh
-                data = NiDAQ.denoise(data, width, thresh)
+                info['denoiseMethod'] = method
+                info['denoiseWidth'] = width
+                info['denoiseThreshold'] = thresh
+                if data.ndim == 1:
+                    data = NiDAQ.denoise(data, width, thresh)
+                else:
+                    data = numpy.vstack([NiDAQ.denoise(d, width, thresh) for d in data])
             else:
                 printExc("Unknown denoise method '%s'" % str(method))
 
-                
-        res['data'] = data
-        res['info']['numPts'] = data.shape[0]
-                
-        return res
+        return data, info
         
     def devName(self):
         return self.dev.name()
@@ -164,6 +164,21 @@ class Scanner(Device, OptomechDevice):
         #print "voltage:", x1, y1
         return [x1, y1]
         
+    def calibrationKey(self, laser, opticState=None):
+        """Return a hashable value that changes whenever the mapping performed
+        by mapToScanner() for *laser* and *opticState* changes.
+
+        This includes the calibration parameters and the current transform of
+        the parent device, so it may be used to cache generated mirror voltages.
+        """
+        if opticState is None:
+            opticState = self.getDeviceStateKey()
+        cal = self.getCalibration(laser, opticState)
+        params = None if cal is None else tuple(tuple(p) for p in cal['params'])
+        # three points fully determine the (affine) global->parent mapping
+        x, y = self.mapGlobalToParent((np.array([0., 1., 0.]), np.array([0., 0., 1.])))[:2]
+        return (laser, opticState, params, tuple(np.asarray(x).tolist()), tuple(np.asarray(y).tolist()))
+
     def getCalibrationIndex(self):
         with self.lock:
             if self.calibrationIndex is None:
@@ -73,6 +73,21 @@ class ScanProgramComponent(object):
         """
         return self.program().scanner.mapToScanner(x, y, self.laser.name())
 
+    def stateKey(self):
+        """Return a hashable key that changes whenever the arrays generated by
+        this component would change (excluding scanner calibration).
+
+        The default implementation uses the repr of saveState(); subclasses may
+        override this with something cheaper or more precise.
+        """
+        return (self.laser.name(), repr(self.saveState()))
+
+    def calibrationKey(self):
+        """Return a hashable key describing the scanner calibration used by
+        mapToScanner().
+        """
+        return self.program().scanner.calibrationKey(self.laser.name())
+
     def generateVoltageArray(self, array):
         """Generate mirror voltages for this scan component and store inside
         *array*. Returns the start and stop indexes used by this component.
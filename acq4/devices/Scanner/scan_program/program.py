@@ -55,6 +55,12 @@ class ScanProgram:
         self.sampleRate = 100e3
         self.numSamples = 10e3
         self.downsample = 1
+
+        # compiled arrays for recently used combinations of program state,
+        # sampling and scanner calibration (see compile())
+        self.compiledCacheSize = 8
+        self._compiled = OrderedDict()
+        self._cacheStats = {'hits': 0, 'misses': 0}
         
         self.ctrlGroup = ScanProgramCtrlGroup()  # used to display GUI for components
         self.ctrlGroup.sigAddNewRequested.connect(self.paramRequestedNewComponent)
@@ -128,7 +134,7 @@ class ScanProgram:
         """Set the sampling properties used by all components in the program:
         sample rate, number of samples, and downsampling factor.
         """
-        if self.sampleRate or samples != self.numSamples or downsample != self.downsample:
+        if rate != self.sampleRate or samples != self.numSamples or downsample != self.downsample:
             self.sampleRate = rate
             self.numSamples = samples
             self.downsample = downsample
@@ -166,15 +172,85 @@ class ScanProgram:
                 if i.scene() is not None:
                     i.scene().removeItem(i)
 
+    def cacheKey(self, voltage=True):
+        """Return a hashable key describing everything that determines the
+        arrays generated by this program: the state of each active component,
+        the sampling parameters, and (if *voltage* is True) the scanner
+        calibration and current mirror voltage.
+        """
+        key = [self.sampleRate, self.numSamples, self.downsample]
+        for component in self.components:
+            if not component.isActive():
+                continue
+            ckey = component.stateKey()
+            if voltage:
+                ckey = (ckey, component.calibrationKey())
+            key.append(ckey)
+        if voltage:
+            key.append(tuple(self.scanner.getVoltage()))
+        return tuple(key)
+
+    def compile(self, voltage=True):
+        """Return a CompiledScan containing the command array and masks for
+        the current state of this program.
+
+        Results are cached; repeated calls return the same (read-only) arrays
+        until the program state, sampling parameters, or scanner calibration
+        change. If *voltage* is False, the command array holds global positions
+        rather than mirror voltages.
+        """
+        key = (voltage, self.cacheKey(voltage))
+        compiled = self._compiled.get(key, None)
+        if compiled is not None:
+            self._cacheStats['hits'] += 1
+            self._compiled.pop(key)
+            self._compiled[key] = compiled
+            return compiled
+
+        self._cacheStats['misses'] += 1
+        compiled = CompiledScan(self, voltage)
+        self._compiled[key] = compiled
+        while len(self._compiled) > self.compiledCacheSize:
+            self._compiled.popitem(last=False)
+        return compiled
+
+    def cacheStats(self):
+        """Return a dict with the number of cache hits, misses, the hit rate
+        and number of entries held by compile().
+        """
+        stats = self._cacheStats.copy()
+        total = stats['hits'] + stats['misses']
+        stats['hitRate'] = stats['hits'] / float(total) if total > 0 else 0.0
+        stats['size'] = len(self._compiled)
+        return stats
+
+    def clearCache(self):
+        """Discard all compiled arrays. Call this if the scanner calibration
+        is modified in a way that cacheKey() cannot detect.
+        """
+        self._compiled.clear()
+
     def generateVoltageArray(self):
         """Generate an array of x,y voltage commands needed to drive the scanner
         for this program.
+
+        The returned array is a copy and may be modified by the caller; use
+        compile() to share the cached array instead.
         """
-        return self.generatePositionArray(_voltage=True)
+        return self.compile(voltage=True).commands.copy()
 
     def generatePositionArray(self, _voltage=False):
         """Generate an array of x,y position values for this scan program.
         """
+        return self.compile(voltage=_voltage).commands.copy()
+
+    def generateLaserMask(self):
+        """Return a boolean array that is True wherever any active component
+        drives the scan mirrors.
+        """
+        return self.compile(voltage=False).scanMask.copy()
+
+    def _generateArray(self, voltage, mask):
         arr = np.zeros((self.numSamples, 2))
 
         # Generate command for each component
@@ -182,20 +258,20 @@ class ScanProgram:
             if not component.isActive():
                 continue
             
-            if _voltage:
+            if voltage:
                 component.generateVoltageArray(arr)
             else:
                 component.generatePositionArray(arr)
 
         # Fill in gaps
-        mask = self.generateLaserMask().astype(np.byte)
+        mask = mask.astype(np.byte)
         dif = mask[1:] - mask[:-1]
         on = list(np.argwhere(dif == 1)[:,0]+1)
         off = list(np.argwhere(dif == -1)[:,0]+1)
         if mask[-1] == 0:
             on.append(len(mask))
 
-        if _voltage:
+        if voltage:
             lastValue = np.array(self.scanner.getVoltage())
         else:
             lastValue = np.array([np.nan, np.nan])
@@ -214,15 +290,6 @@ class ScanProgram:
                 lastValue = arr[nextOff-1]
             
         return arr
-    
-    def generateLaserMask(self):
-        mask = np.zeros(self.numSamples, dtype=bool)
-        for component in self.components:
-            if not component.isActive():
-                continue
-            mask |= component.scanMask()
-
-        return mask
 
     def close(self):
         self.clearGraphicsItems()
@@ -244,6 +311,51 @@ class ScanProgram:
         return self._visible
 
 
+class CompiledScan(object):
+    """Arrays generated by a ScanProgram for one combination of program
+    state, sampling parameters, and scanner calibration.
+
+    Instances are created and cached by ScanProgram.compile(). All arrays are
+    read-only because they are shared between every caller that compiles the
+    same program.
+
+    ================ =======================================================
+    **Attributes**
+    commands         (numSamples, 2) array of mirror voltages (or global
+                     positions if the scan was compiled with voltage=False)
+    scanMask         Boolean array; True where any component drives the
+                     scan mirrors
+    laserMask        Boolean array; True where any component intends the
+                     laser to be active
+    componentMasks   List of (scanMask, laserMask) for each active component
+    ================ =======================================================
+    """
+    def __init__(self, program, voltage):
+        self.voltage = voltage
+        self.componentMasks = []
+        self.scanMask = np.zeros(program.numSamples, dtype=bool)
+        self.laserMask = np.zeros(program.numSamples, dtype=bool)
+        for component in program.components:
+            if not component.isActive():
+                continue
+            scanMask = np.array(component.scanMask(), dtype=bool)
+            laserMask = np.array(component.laserMask(), dtype=bool)
+            self.scanMask |= scanMask
+            self.laserMask |= laserMask
+            self.componentMasks.append((self._readonly(scanMask), self._readonly(laserMask)))
+
+        # gaps are filled relative to the regions in which components drive
+        # the mirrors
+        self.commands = self._readonly(program._generateArray(voltage, self.scanMask))
+        self._readonly(self.scanMask)
+        self._readonly(self.laserMask)
+
+    @staticmethod
+    def _readonly(arr):
+        arr.flags.writeable = False
+        return arr
+
+
 class ScanProgramPreview(object):
     """Displays and animates the path of the scanner and timing of components.
     """
@@ -292,8 +404,9 @@ class ScanProgramPreview(object):
         self.spot.scale(1e-6, 1e-6)
         self.spot.setPen(pg.mkPen('y'))
 
-        self.data = self.program.generatePositionArray()
-        self.laserMask = self.program.generateLaserMask()
+        compiled = self.program.compile(voltage=False)
+        self.data = compiled.commands
+        self.laserMask = compiled.scanMask
         self.lastTime = pg.ptime.time()
         self.index = 0
         self.sampleRate = self.program.sampleRate
@@ -356,12 +469,12 @@ class ScanProgramPreview(object):
         self.clearTimeline()
         numSamples = self.program.numSamples
         sampleRate = self.program.sampleRate
-        components = self.program.components
+        components = [c for c in self.program.components if c.isActive()]
+        masks = self.program.compile(voltage=False).componentMasks
 
         time = np.linspace(0, (numSamples-1) / sampleRate, numSamples)
         for i, component in enumerate(components):
-            scanMask = component.scanMask()
-            laserMask = component.laserMask()
+            scanMask, laserMask = masks[i]
             color = pg.mkColor((i, len(components)*1.3))
             fill = pg.mkColor(color)
             fill.setAlpha(50)
@@ -46,6 +46,9 @@ class RectScanComponent(ScanProgramComponent):
         rs.writeArray(array, self.mapToScanner)
         return rs.scanOffset, rs.scanOffset + rs.scanStride[0]
 
+    def stateKey(self):
+        return (self.laser.name(), self.ctrl.params.system.stateKey())
+
     def generatePositionArray(self, array):
         rs = self.ctrl.params.system
         rs.writeArray(array)
@@ -320,6 +323,25 @@ class RectScan(SystemSolver):
             ])
 
 
+    def stateKey(self):
+        """Return a hashable key built from the fixed values and range
+        constraints of this system.
+
+        Systems with equal keys solve to the same scan, so this may be used to
+        cache arrays generated by writeArray(), writeLaserMask() and
+        writeScanMask().
+        """
+        key = []
+        for name, var in self._vars.items():
+            if var[2] == 'fixed':
+                val = var[0]
+                if isinstance(val, np.ndarray):
+                    val = tuple(val.ravel().tolist())
+                key.append((name, val))
+            elif isinstance(var[2], tuple):
+                key.append((name, var[2]))
+        return tuple(key)
+
     ### Array handling functions:
 
     def writeArray(self, array, mapping=None):
@@ -413,14 +435,13 @@ class RectScan(SystemSolver):
         using linear interpolation.
         """
         offset = self.imageOffset + offset * self.sampleRate / self.downsample
-        intOffset = np.floor(offset)
+        intOffset = int(np.floor(offset))
         fracOffset = offset - intOffset
 
         shape = self.imageShape
         stride = self.imageStride
 
         if subpixel and fracOffset != 0:
-            print(fracOffset)
             interp = data[:-1] * (1.0 - fracOffset) + data[1:] * fracOffset
             image = pg.subArray(interp, intOffset, shape, stride)            
         else:
@@ -432,11 +453,16 @@ class RectScan(SystemSolver):
 
         return image
 
-    def measureMirrorLag(self, data, subpixel=False, minOffset=0., maxOffset=500e-6):
+    def measureMirrorLag(self, data, subpixel=False, minOffset=0., maxOffset=500e-6, guess=None, searchWidth=None):
         """Estimate the mirror lag in a bidirectional raster scan.
 
         The *data* argument is a photodetector recording array.
         The return value can be used as the *offset* argument to extractImage().
+
+        If *guess* is given (usually the lag measured from a previous frame),
+        then only offsets within *searchWidth* seconds of the guess are
+        searched (default is 4 pixels). This is fast enough to be repeated on
+        every frame of a video, allowing the lag to be tracked while imaging.
         """
         if not self.bidirectional:
             raise Exception("Mirror lag can only be measured for bidirectional scans.")
@@ -445,6 +471,12 @@ class RectScan(SystemSolver):
         rowTime = self.activeShape[2] / self.sampleRate
         pxTime = self.downsample / self.sampleRate
         maxOffset = min(maxOffset, rowTime * 0.6)
+        if guess is not None:
+            if searchWidth is None:
+                searchWidth = 4 * pxTime
+            guess = min(max(guess, minOffset), maxOffset)
+            minOffset = max(minOffset, guess - searchWidth)
+            maxOffset = min(maxOffset, guess + searchWidth + pxTime * 0.5)
 
         # see whether we need to pad the data
         stride = self.imageStride
@@ -453,49 +485,88 @@ class RectScan(SystemSolver):
         minSize = stride[0] * shape[0] + offset
         if data.shape[0] < minSize:
             appendShape = list(data.shape)
-            appendShape[0] = 1 + minSize - data.shape[0]
+            appendShape[0] = int(1 + minSize - data.shape[0])
             data = np.concatenate([data, np.zeros(appendShape, dtype=data.dtype)], axis=0)
 
         # find optimal shift by pixel
         offsets = np.arange(minOffset, maxOffset, pxTime)
+        if len(offsets) == 0:
+            offsets = np.array([minOffset])
         bestOffset = self._findBestOffset(data, offsets, subpixel=False)
 
         # Refine optimal shift by subpixel
         if subpixel:
             # Refine the estimate in two stages
+            w = pxTime
             for i in range(2):
-                w = offsets[1] - offsets[0]
                 minOffset = bestOffset - (w/2)
                 maxOffset = bestOffset + (w/2)
                 offsets = np.linspace(minOffset, maxOffset, 5)
+                w = offsets[1] - offsets[0]
                 bestOffset = self._findBestOffset(data, offsets, subpixel=True)
 
         return bestOffset
 
     def _findBestOffset(self, data, offsets, subpixel):
-        # Try generating image using each item from a list of offsets. 
         # Return the offset that produced the least error between fields.
-        bestOffset = None
-        bestError = None
-        errs = []
-        for offset in offsets:
-            # get base image averaged over frames
-            img = self.extractImage(data, offset=offset, subpixel=subpixel).mean(axis=0)
-
-            # split image into fields
-            nr = 2 * (img.shape[0] // 2)
-            f1 = img[0:nr:2]
-            f2 = img[1:nr+1:2]
-
-            err1 = np.abs((f1[:-1]-f2[:-1])**2).sum() / f1.size
-            err2 = np.abs((f1[1:] -f2[:-1])**2).sum() / f1.size
-            totErr = err1 + err2
-            errs.append(totErr)
-            if bestError is None or totErr < bestError:
-                bestError = totErr
-                bestOffset = offset
-        # pg.plot(errs)
-        return bestOffset
+        errs = self.fieldErrors(data, offsets, subpixel=subpixel)
+        return offsets[np.argmin(errs)]
+
+    def fieldErrors(self, data, offsets, subpixel=False):
+        """Return the mismatch between even and odd rows (fields) of the
+        frame-averaged image that extractImage() would produce for each
+        value in *offsets*.
+
+        The error for each offset is the mean squared difference between
+        every odd row and the even rows above and below it. All integer
+        sample offsets are evaluated together from sliding-window views of the
+        data, without extracting an image for each offset.
+        """
+        offsets = np.asarray(offsets, dtype=float)
+        nf, nr, nc = self.imageShape
+        stride = self.imageStride
+        sampleOffsets = self.imageOffset + offsets * self.sampleRate / self.downsample
+        intOffsets = np.floor(sampleOffsets).astype(int)
+        fracOffsets = sampleOffsets - intOffsets
+        k0 = intOffsets.min()
+        nk = intOffsets.max() - k0 + 1
+
+        # Extraction is linear, so averaging the raw rows across frames before
+        # extraction gives the same image as averaging the extracted frames.
+        rowLen = nc + nk - 1
+        if subpixel:
+            rowLen += 1
+        data = np.ascontiguousarray(data)
+        extraShape = data.shape[1:]
+        data = data.reshape(data.shape[0], -1)
+        rows = pg.subArray(data, k0, (nf, nr, rowLen), stride).mean(axis=0)  # (rows, rowLen, chans)
+
+        # field pairs compared by the error: (even, odd) and (even below, odd)
+        nh = nr // 2
+        even = np.concatenate([np.arange(0, 2*nh-2, 2), np.arange(2, 2*nh, 2)])
+        odd = np.concatenate([np.arange(1, 2*nh-2, 2), np.arange(1, 2*nh-2, 2)])
+        norm = float(nh * nc * int(np.prod(extraShape)))
+
+        if not subpixel or np.all(fracOffsets == 0):
+            # sliding windows of length nc starting at each candidate offset;
+            # odd rows are read backward as in extractImage()
+            def windows(r):
+                r = np.ascontiguousarray(r)
+                s0, s1, s2 = r.strides
+                return np.lib.stride_tricks.as_strided(r, shape=(r.shape[0], nk, nc, r.shape[2]), strides=(s0, s1, s1, s2))
+            cross = np.einsum('rkcz,rkcz->k', windows(rows[even]), windows(rows[odd])[:, :, ::-1])
+            sq = np.concatenate([np.zeros((nr, 1)), np.cumsum((rows**2).sum(axis=2), axis=1)], axis=1)
+            power = sq[:, nc:nc+nk] - sq[:, :nk]   # (rows, offsets)
+            errs = (power[even].sum(axis=0) + power[odd].sum(axis=0) - 2 * cross) / norm
+            return errs[intOffsets - k0]
+
+        errs = np.empty(len(offsets))
+        for i, k in enumerate(intOffsets - k0):
+            f = fracOffsets[i]
+            img = rows[:, k:k+nc] * (1.0 - f) + rows[:, k+1:k+nc+1] * f
+            d = img[even] - img[odd, ::-1]
+            errs[i] = (d**2).sum() / norm
+        return errs
 
     def imageTransform(self):
         """
@@ -0,0 +1,85 @@
+from __future__ import print_function, division
+import numpy as np
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.devices.Scanner.scan_program.rect import RectScan
+
+
+def makeScan(rows=64, cols=64, frames=3):
+    rs = RectScan()
+    rs.p0 = (0, 100e-6)
+    rs.p1 = (100e-6, 100e-6)
+    rs.p2 = (0, 0)
+    rs.imageRows = rows
+    rs.imageCols = cols
+    rs.minOverscan = 50e-6
+    rs.bidirectional = True
+    rs.sampleRate = 1e6
+    rs.downsample = 1
+    rs.numFrames = frames
+    rs.startTime = 0
+    rs.interFrameDuration = 0
+    rs.pixelAspectRatio = 1.0
+    rs.solve()
+    return rs
+
+
+def scanImage(rs, image, lag):
+    """Generate a photodetector recording of *image* delayed by *lag* samples."""
+    nf, nr, nc = rs.imageShape
+    stride = rs.imageStride
+    data = np.zeros(rs.imageOffset + stride[0] * nf + lag + 100)
+    frame = image.copy()
+    frame[1::2] = frame[1::2, ::-1]
+    target = pg.subArray(data, rs.imageOffset + lag, (nf, nr, nc), stride)
+    target[:] = frame[np.newaxis]
+    return data
+
+
+def referenceErrors(rs, data, offsets, subpixel):
+    # field error computed by extracting one image per offset
+    errs = []
+    for offset in offsets:
+        img = rs.extractImage(data, offset=offset, subpixel=subpixel).mean(axis=0)
+        nr = 2 * (img.shape[0] // 2)
+        f1 = img[0:nr:2]
+        f2 = img[1:nr+1:2]
+        err1 = ((f1[:-1] - f2[:-1])**2).sum() / f1.size
+        err2 = ((f1[1:] - f2[:-1])**2).sum() / f1.size
+        errs.append(err1 + err2)
+    return np.array(errs)
+
+
+@pytest.mark.parametrize('subpixel', [False, True])
+def test_field_errors(subpixel):
+    rs = makeScan(rows=33, cols=40)
+    data = np.random.normal(size=(rs.imageOffset + rs.imageStride[0] * 3 + 500, 2))
+    if subpixel:
+        offsets = np.linspace(10e-6, 12e-6, 7)
+    else:
+        offsets = np.arange(0, 100e-6, 1e-6)
+    assert np.allclose(rs.fieldErrors(data, offsets, subpixel=subpixel),
+                       referenceErrors(rs, data, offsets, subpixel))
+
+
+def smoothImage(image, sigma):
+    # separable gaussian blur (same-size output)
+    x = np.arange(-3 * sigma, 3 * sigma + 1)
+    kernel = np.exp(-0.5 * (x / sigma)**2)
+    kernel /= kernel.sum()
+    image = np.apply_along_axis(np.convolve, 0, image, kernel, mode='same')
+    return np.apply_along_axis(np.convolve, 1, image, kernel, mode='same')
+
+
+def test_measure_lag():
+    rs = makeScan()
+    image = np.random.normal(size=(64, 64))
+    image = smoothImage(image, 2)
+    data = scanImage(rs, image, lag=23)
+
+    lag = rs.measureMirrorLag(data)
+    assert lag == pytest.approx(23e-6)
+
+    # incremental search near a previous estimate
+    assert rs.measureMirrorLag(data, guess=21e-6) == pytest.approx(23e-6)
+    assert rs.measureMirrorLag(data, guess=23e-6, subpixel=True) == pytest.approx(23e-6, abs=0.3e-6)
@@ -0,0 +1,107 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.devices.Scanner.scan_program import ScanProgram
+
+pg.mkQApp()
+
+
+class MockLaser(object):
+    def name(self):
+        return 'Laser'
+
+
+class MockScanner(object):
+    """Maps position to voltage with an adjustable linear calibration."""
+    def __init__(self):
+        self.gain = 1.0
+        self.mapCount = 0
+
+    def getVoltage(self):
+        return [0.0, 0.0]
+
+    def calibrationKey(self, laser):
+        return (laser, self.gain)
+
+    def mapToScanner(self, x, y, laser):
+        self.mapCount += 1
+        return x * self.gain, y * self.gain
+
+
+def makeProgram():
+    sp = ScanProgram()
+    sp.setDevices(scanner=MockScanner(), laser=MockLaser())
+    rect = sp.addComponent('rect')
+    rparams = rect.ctrlParameter()
+    rparams['imageRows'] = 16
+    rparams['imageRows', 'fixed'] = True
+    rparams['imageCols'] = 16
+    rparams['imageCols', 'fixed'] = True
+    rparams['minOverscan'] = 0.0
+    rparams['pixelAspectRatio'] = 1.0
+    rparams['pixelAspectRatio', 'fixed'] = True
+    rparams['numFrames'] = 2
+    rparams.system.p0 = (0, 100e-6)
+    rparams.system.p1 = (100e-6, 100e-6)
+    rparams.system.p2 = (0, 0)
+    sp.setSampling(rate=100e3, samples=0, downsample=1)
+    system = rparams.system
+    system.solve()
+    sp.setSampling(rate=100e3, samples=system.scanStride[0] * system.numFrames, downsample=1)
+    return sp, rect
+
+
+def test_compile_cache():
+    sp, rect = makeProgram()
+    scanner = sp.scanner
+
+    c1 = sp.compile()
+    assert scanner.mapCount == 1
+    assert not c1.commands.flags.writeable
+    assert c1.commands.shape == (sp.numSamples, 2)
+
+    # repeated frames reuse the same arrays
+    c2 = sp.compile()
+    assert c2 is c1
+    assert scanner.mapCount == 1
+    stats = sp.cacheStats()
+    assert stats['hits'] == 1 and stats['misses'] == 1
+
+    # generated arrays are writable copies of the cached data
+    v = sp.generateVoltageArray()
+    assert v.flags.writeable
+    assert np.all(v == c1.commands)
+    assert np.all(sp.generateLaserMask() == c1.scanMask)
+
+    # calibration change forces recompile
+    scanner.gain = 2.0
+    c3 = sp.compile()
+    assert c3 is not c1
+    assert np.allclose(c3.commands, c1.commands * 2)
+
+    # ROI change forces recompile
+    rect.ctrlParameter().system.p0 = (1e-6, 100e-6)
+    c4 = sp.compile()
+    assert c4 is not c3
+    assert not np.allclose(c4.commands, c3.commands)
+
+    # restoring the original ROI hits the cache again
+    rect.ctrlParameter().system.p0 = (0, 100e-6)
+    assert sp.compile() is c3
+
+    stats = sp.cacheStats()
+    # the laser mask above was compiled once in position mode
+    assert stats['misses'] == 4 and stats['hits'] == 3
+    assert 0 < stats['hitRate'] < 1
+
+
+def test_position_array_unchanged():
+    sp, rect = makeProgram()
+    # positions and voltages agree for a unity calibration
+    pos = sp.generatePositionArray()
+    volt = sp.generateVoltageArray()
+    mask = sp.generateLaserMask()
+    assert np.allclose(pos[mask], volt[mask])
+    with pytest.raises(ValueError):
+        sp.compile().commands[0] = 0
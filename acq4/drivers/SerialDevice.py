@@ -1,5 +1,5 @@
 from __future__ import print_function
-import serial, time, sys
+import serial, time, sys, threading
 import logging
 
 import six
@@ -34,7 +34,16 @@ class SerialDevice(object):
 
     Provides some commonly used functions for reading and writing 
     serial packets.
+
+    While the port is open, a background thread reads all incoming data into
+    a buffer; read() and readUntil() wait on that buffer and return as soon as
+    the requested data has arrived. Subclasses should not read from
+    self.serial directly.
     """
+    # timeout used by the reader thread for each blocking read; this only
+    # limits how quickly the thread notices that the port is being closed.
+    readerTimeout = 0.1
+
     def __init__(self, **kwds):
         """
         All keyword arguments define the default arguments to use when 
@@ -43,13 +52,23 @@ class SerialDevice(object):
         If both 'port' and 'baudrate' are provided here, then 
         self.open() is called automatically.
         """
+        if getattr(self, 'serial', None) is not None:
+            # re-initializing (eg. to try another baud rate); stop the previous reader first
+            self.close()
         self.serial = None
         self.__serialOpts = {
             'bytesize': serial.EIGHTBITS, 
-            'timeout': 0, # no timeout. See SerialDevice._readWithTimeout()
+            'timeout': self.readerTimeout, # only used by the reader thread. See SerialDevice._readLoop()
         }
         self.__serialOpts.update(kwds)
 
+        self._rxBuffer = bytearray()
+        self._rxCondition = threading.Condition()
+        self._rxError = None
+        self._readerThread = None
+        self._stopReader = None
+        self._resetStats()
+
         if 'port' in kwds and 'baudrate' in self.__serialOpts:
             self.open()
 
@@ -84,29 +103,98 @@ class SerialDevice(object):
             'baudrate': baudrate,
             })
         self.__serialOpts.update(kwds)
+        if self.serial is not None:
+            self.close()
         self.serial = serial.Serial(**self.__serialOpts)
         logging.info('Opened serial port: %s', self.__serialOpts)
 
+        with self._rxCondition:
+            del self._rxBuffer[:]
+            self._rxError = None
+        self._stopReader = threading.Event()
+        self._readerThread = threading.Thread(target=self._readLoop, args=(self.serial, self._stopReader), name="SerialDevice reader %s" % port)
+        self._readerThread.daemon = True
+        self._readerThread.start()
+
     def close(self):
         """Close the serial port."""
+        if self._stopReader is not None:
+            self._stopReader.set()
+        if hasattr(self.serial, 'cancel_read'):
+            self.serial.cancel_read()
+        if self._readerThread is not None:
+            self._readerThread.join()
+            self._readerThread = None
         self.serial.close()
         self.serial = None
         logging.info('Closed serial port: %s', self.__serialOpts['port'])
 
+    def _readLoop(self, port, stop):
+        # Note: pyserial's timeout mechanism is broken (specifically, calling setTimeout can cause 
+        # serial data to be lost), so the timeout is only set when the port is opened and all reads
+        # happen in this thread. Each read blocks until at least one byte arrives (or readerTimeout
+        # elapses), so readers are woken as soon as data is available without polling.
+        while not stop.is_set():
+            try:
+                data = port.read(max(1, port.inWaiting()))
+            except Exception as exc:
+                if stop.is_set():
+                    break
+                with self._rxCondition:
+                    self._rxError = exc
+                    self._rxCondition.notify_all()
+                logging.error('Serial port %s reader stopped: %r', self.__serialOpts['port'], exc)
+                break
+            if len(data) > 0:
+                with self._rxCondition:
+                    self._rxBuffer.extend(data)
+                    self._stats['bytesRead'] += len(data)
+                    self._rxCondition.notify_all()
+
+    def _waitFor(self, check, timeout):
+        """Wait until check() returns a value other than None or *timeout* elapses.
+        Must be called with self._rxCondition acquired. Returns the value from check(),
+        or None if the wait timed out.
+        """
+        deadline = time.time() + timeout
+        while True:
+            result = check()
+            if result is not None:
+                return result
+            if self._rxError is not None:
+                raise self._rxError
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            self._rxCondition.wait(remaining)
+
+    def _takeBytes(self, n):
+        # remove and return the first n bytes of the receive buffer (with lock held)
+        packet = bytes(self._rxBuffer[:n])
+        del self._rxBuffer[:n]
+        return packet
+
+    def inWaiting(self):
+        """Return the number of received bytes that have not been read yet."""
+        with self._rxCondition:
+            return len(self._rxBuffer)
+
     def readAll(self):
         """Read all bytes waiting in buffer; non-blocking."""
-        n = self.serial.inWaiting()
-        if n > 0:
-            d = self.serial.read(n)
+        with self._rxCondition:
+            d = self._takeBytes(len(self._rxBuffer))
+        if len(d) > 0:
             logging.info('Serial port %s readAll: %r', self.__serialOpts['port'], d)
-            return d
-        return ''
+        return d
     
     def write(self, data):
         """Write *data* to the serial port"""
         if sys.version > '3' and isinstance(data, str):
             data = data.encode()
         logging.info('Serial port %s write: %r', self.__serialOpts['port'], data)
+        with self._rxCondition:
+            self._stats['bytesWritten'] += len(data)
+            self._lastWrite = time.time()
         self.serial.write(data)
 
     def read(self, length, timeout=5, term=None):
@@ -117,10 +205,15 @@ class SerialDevice(object):
         return the packet excluding *term*. If the packet is not terminated 
         with *term*, then DataError is raised.
         """
-        #self.serial.setTimeout(timeout) #broken!
-        packet = self._readWithTimeout(length, timeout)
-        if len(packet) < length:
-            raise TimeoutError("Timed out waiting for serial data (received so far: %s)" % repr(packet), packet)
+        if isinstance(term, str):
+            term = term.encode()
+        with self._rxCondition:
+            enough = lambda: True if len(self._rxBuffer) >= length else None
+            if self._waitFor(enough, timeout) is None:
+                packet = self._takeBytes(len(self._rxBuffer))
+                raise TimeoutError("Timed out waiting for serial data (received so far: %s)" % repr(packet), packet)
+            packet = self._takeBytes(length)
+            self._recordLatency()
         if term is not None:
             if packet[-len(term):] != term:
                 time.sleep(0.01)
@@ -131,27 +224,6 @@ class SerialDevice(object):
             return packet[:-len(term)]
         logging.info('Serial port %s read: %r', self.__serialOpts['port'], packet)
         return packet
-        
-    def _readWithTimeout(self, nBytes, timeout):
-        # Note: pyserial's timeout mechanism is broken (specifically, calling setTimeout can cause 
-        # serial data to be lost) so we implement our own in readWithTimeout().
-        start = time.time()
-        packet = b''
-        # Interval between serial port checks is adaptive:
-        #   * start with very short interval for low-latency reads
-        #   * iteratively increase interval duration to reduce CPU usage on long reads
-        sleep = 100e-6  # initial sleep is 100 us
-        while time.time()-start < timeout:
-            waiting = self.serial.inWaiting()
-            if waiting > 0:
-                readBytes = min(waiting, nBytes-len(packet))
-                packet += self.serial.read(readBytes)
-                sleep = 100e-6  # every time we read data, reset sleep time
-            if len(packet) >= nBytes:
-                break
-            time.sleep(sleep)
-            sleep = min(0.05, 2*sleep) # wait a bit longer next time
-        return packet
 
     def readUntil(self, term, minBytes=0, timeout=5):
         """Read from the serial port until *term* is received, or *timeout* has elapsed.
@@ -162,25 +234,85 @@ class SerialDevice(object):
         if isinstance(term, str):
             term = term.encode()
 
-        start = time.time()
+        searched = [minBytes]  # bytes already searched for term, so each byte is only searched once
+        def findTerm():
+            i = self._rxBuffer.find(term, searched[0])
+            if i < 0:
+                searched[0] = max(minBytes, len(self._rxBuffer) - len(term) + 1)
+                return None
+            return i + len(term)
+
+        with self._rxCondition:
+            end = self._waitFor(findTerm, timeout)
+            if end is None:
+                packet = self._takeBytes(len(self._rxBuffer))
+                raise TimeoutError("Timed out while reading serial packet. Data so far: '%r'" % packet, packet)
+            packet = self._takeBytes(end)
+            self._recordLatency()
+        logging.info('Serial port %s read: %r', self.__serialOpts['port'], packet)
+        return packet
 
-        if minBytes > 0:
-            packet = self.read(minBytes, timeout=timeout)
-        else:
-            packet = b''
+    def query(self, data, length=None, term=None, timeout=5):
+        """Write *data* and return the reply.
 
-        while True:
-            elapsed = time.time()-start
-            if elapsed >= timeout:
-                err = TimeoutError("Timed out while reading serial packet. Data so far: '%r'" % packet, packet)
-                raise err
-            try:
-                packet += self.read(1, timeout=timeout-elapsed)
-            except TimeoutError:
-                raise TimeoutError("Timed out while reading serial packet. Data so far: '%r'" % packet, packet)
+        If *length* is given, the reply is read with read(length, timeout, term);
+        otherwise it is read with readUntil(term, timeout=timeout).
+        """
+        return self.pipeline([(data, length, term)], timeout=timeout)[0]
 
-            if len(packet) > minBytes and packet[-len(term):] == term:
-                return packet
+    def pipeline(self, requests, timeout=5):
+        """Write several requests at once, then read their replies in order.
+
+        Each item in *requests* is a tuple (data, length, term) as accepted by
+        query(). Sending all requests before waiting for the first reply saves
+        one round trip per request for devices that queue commands. Returns a
+        list of replies; *timeout* applies to each reply separately.
+        """
+        self.write(b''.join(d.encode() if isinstance(d, six.text_type) else d for d, _, _ in requests))
+        replies = []
+        for data, length, term in requests:
+            if length is None:
+                replies.append(self.readUntil(term, timeout=timeout))
+            else:
+                replies.append(self.read(length, timeout=timeout, term=term))
+        return replies
+
+    def _resetStats(self):
+        self._lastWrite = None
+        self._stats = {'bytesRead': 0, 'bytesWritten': 0, 'replies': 0, 'totalLatency': 0.0, 'maxLatency': 0.0, 'lastLatency': None}
+
+    def _recordLatency(self):
+        # record the time from the last write to the completion of the first read after it (lock held)
+        if self._lastWrite is None:
+            return
+        latency = time.time() - self._lastWrite
+        self._lastWrite = None
+        stats = self._stats
+        stats['replies'] += 1
+        stats['totalLatency'] += latency
+        stats['maxLatency'] = max(stats['maxLatency'], latency)
+        stats['lastLatency'] = latency
+
+    def latencyStats(self, reset=False):
+        """Return a dict of communication statistics for this device.
+
+        Latency is measured from each write() to the completion of the first
+        read after it. Keys are 'bytesRead', 'bytesWritten', 'replies',
+        'meanLatency', 'maxLatency' and 'lastLatency' (seconds; None if no
+        replies have been received). If *reset* is True, the statistics are
+        cleared after being returned.
+        """
+        with self._rxCondition:
+            stats = self._stats.copy()
+            n = stats.pop('replies')
+            total = stats.pop('totalLatency')
+            stats['replies'] = n
+            stats['meanLatency'] = total / n if n > 0 else None
+            if n == 0:
+                stats['maxLatency'] = None
+            if reset:
+                self._resetStats()
+        return stats
 
     def clearBuffer(self):
         ## not recommended..
@@ -1,11 +1,12 @@
 # -*- coding: utf-8 -*-
 from __future__ import print_function
 import six
-import time
+import time, threading
 from numpy import *
 import acq4.util.ptime as ptime  ## platform-independent precision timing
 from collections import OrderedDict
 from .base import NIDAQError
+from .stream import StreamReader
 
 
 class SuperTask:
@@ -20,6 +21,11 @@ class SuperTask:
         self.devs = daq.listDevices()
         self.triggerChannel = None
         self.result = None
+        self._doneCallbacks = []
+        self._runId = 0   # incremented on every start/stop; used to retire stale done-watchers
+        self.continuous = False
+        self.stream = None
+        self._streamCallbacks = []
         
     def absChanName(self, chan):
         parts = chan.lstrip('/').split('/')
@@ -163,14 +169,21 @@ class SuperTask:
     def hasTasks(self):
         return len(self.tasks) > 0
         
-    def configureClocks(self, rate, nPts):
-        """Configure sample clock and triggering for all tasks"""
+    def configureClocks(self, rate, nPts, continuous=False):
+        """Configure sample clock and triggering for all tasks.
+        
+        If *continuous* is True, tasks acquire until stopped and *nPts* sets
+        the size of the driver's buffer (per channel) rather than the number
+        of samples to acquire. See startStream().
+        """
         clkSource = None
         if len(self.tasks) == 0:
             raise Exception("No tasks to configure.")
         keys = list(self.tasks.keys())
         self.numPts = nPts
         self.rate = rate
+        self.continuous = continuous
+        sampleMode = self.daq.Val_ContSamps if continuous else self.daq.Val_FiniteSamps
         
         ## Make sure we're only using 1 DAQ device (not sure how to tie 2 together yet)
         ndevs = len(set([k[0] for k in keys]))
@@ -215,10 +228,10 @@ class SuperTask:
             if k[1] != clkSource:
                 #print "%s CfgSampClkTiming(%s, %f, Val_Rising, Val_FiniteSamps, %d)" % (str(k), clk, rate, nPts)
 
-                self.tasks[k].CfgSampClkTiming(clk, rate, self.daq.Val_Rising, self.daq.Val_FiniteSamps, nPts)
+                self.tasks[k].CfgSampClkTiming(clk, rate, self.daq.Val_Rising, sampleMode, nPts)
             else:
                 #print "%s CfgSampClkTiming('', %f, Val_Rising, Val_FiniteSamps, %d)" % (str(k), rate, nPts)
-                self.tasks[k].CfgSampClkTiming("", rate, self.daq.Val_Rising, self.daq.Val_FiniteSamps, nPts)
+                self.tasks[k].CfgSampClkTiming("", rate, self.daq.Val_Rising, sampleMode, nPts)
 
         
     def setTrigger(self, trig):
@@ -265,6 +278,86 @@ class SuperTask:
             ## Set up callback to record time when trigger starts
             pass
             
+        self._runId += 1
+        if len(self._doneCallbacks) > 0 and not self.continuous:
+            watcher = threading.Thread(target=self._watchDone, args=(self._runId,), name="SuperTaskDoneWatcher")
+            watcher.daemon = True
+            watcher.start()
+
+    def addStreamCallback(self, callback):
+        """Request that *callback*(chunks, startSample) be invoked for every
+        chunk acquired in streaming mode (see startStream()).
+        
+        *chunks* is a dict of {taskKey: array} with one read-only array of shape
+        (nChans, chunkSize) per input task. The arrays are views into the
+        stream's ring buffer and are overwritten once the buffer wraps around;
+        callbacks run in the reader thread and should copy anything they need
+        to keep for longer.
+        """
+        self._streamCallbacks.append(callback)
+
+    def removeStreamCallback(self, callback):
+        self._streamCallbacks.remove(callback)
+
+    def startStream(self, chunkSize, bufferChunks=32):
+        """Start continuous acquisition.
+        
+        All input tasks are read in chunks of *chunkSize* samples per channel
+        by a background thread, directly into a preallocated ring buffer that
+        holds *bufferChunks* chunks per task. Each chunk is delivered to the
+        callbacks registered with addStreamCallback(). Output tasks regenerate
+        their waveform until the stream is stopped.
+        
+        configureClocks() must have been called with continuous=True.
+        """
+        if not self.continuous:
+            raise Exception("Clocks must be configured with continuous=True before starting a stream.")
+        if self.stream is not None:
+            raise Exception("Stream is already running.")
+        inputs = OrderedDict([(k, t) for k, t in self.tasks.items() if t.isInputTask()])
+        self.stream = StreamReader(inputs, chunkSize, bufferChunks, self.rate, self._streamCallbacks)
+        self.start()
+        self.stream.start()
+        return self.stream
+
+    def stopStream(self):
+        """Stop a stream started with startStream() and return its final stats().
+        """
+        stream = self.stream
+        if stream is None:
+            return None
+        self.stream = None
+        try:
+            stream.stop()
+        finally:
+            self.stop(abort=True)
+        if stream.error is not None:
+            raise stream.error
+        return stream.stats()
+
+    def notifyWhenDone(self, callback):
+        """Request that *callback*() be invoked as soon as all tasks are done.
+        
+        Must be called before start(). The callback is invoked from a background
+        thread that blocks in the driver's wait function rather than polling
+        isDone(). It is not invoked if the supertask is stopped before completion.
+        """
+        self._doneCallbacks.append(callback)
+
+    def _watchDone(self, runId):
+        try:
+            for t in list(self.tasks.values()):
+                while not t.waitUntilDone(0.5):
+                    if self._runId != runId:
+                        return
+        except Exception:
+            # task was stopped or cleared while we were waiting; the
+            # caller will fall back to polling isDone().
+            return
+        if self._runId != runId:
+            return
+        for cb in self._doneCallbacks:
+            cb()
             
     def isDone(self):
         for t in self.tasks:
@@ -284,6 +377,7 @@ class SuperTask:
     def stop(self, wait=False, abort=False):
         #print "ST stopping, wait=",wait, " abort:", abort
         ## need to be very careful about stopping and unreserving all hardware, even if there is a failure at some point.
+        self._runId += 1
         try:
             if wait:
                 while not self.isDone():
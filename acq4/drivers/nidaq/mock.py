@@ -159,7 +159,13 @@ class MockNIDAQ:
         if diff > 0:
             time.sleep(diff)
 
+    def clearClock(self, clock):
+        """Stop a clock immediately (used for continuous tasks, which never finish)."""
+        self.clocks.pop(clock, None)
+
     def checkClock(self, clock):
+        if clock not in self.clocks:
+            return True
         now = time.time()
         start, dur = self.clocks[clock]
         diff = (start+dur)-now
@@ -175,6 +181,8 @@ class Task:
         self.nativeClock = None
         self.data = None
         self.mode = None
+        self.continuous = False
+        self.readPos = 0
         
     #def __getattr__(self, attr):
         #return lambda *args: self
@@ -210,6 +218,7 @@ class Task:
         self.clock = clock 
         self.rate = rate 
         self.nPts = nPts
+        self.continuous = (c == self.nd.lib.Val_ContSamps)
         #print self.chans, self.clock
         
     def GetSampClkMaxRate(self):
@@ -244,24 +253,58 @@ class Task:
                 data[i] = 0
         return (data, self.nPts)
 
+    def readInto(self, buf, timeout=10.):
+        """Continuous-mode read: wait until the mock clock has produced the next
+        buf.shape[1] samples, then fill *buf* with the sample times.
+        """
+        clock = self.nativeClock if self.clock is None else self.clock
+        n = buf.shape[1]
+        if clock not in self.nd.clocks:
+            raise Exception("Mock clock '%s' is not running." % clock)
+        start, dur = self.nd.clocks[clock]
+        ready = start + (self.readPos + n) / self.rate
+        wait = ready - time.time()
+        if wait > timeout:
+            time.sleep(timeout)
+            raise Exception("Timed out waiting for mock samples.")
+        if wait > 0:
+            time.sleep(wait)
+        buf[:] = (self.readPos + np.arange(n)) / self.rate
+        self.readPos += n
+        return n
+
     def start(self):
+        self.readPos = 0
         ## only start clock if it matches the native clock for this channel
         if self.clock is None or self.clock == self.nativeClock:
-            dur = self.nPts / self.rate
+            dur = np.inf if self.continuous else self.nPts / self.rate
             self.nd.startClock(self.nativeClock, dur)
         
         
     def stop(self):        
-        if self.clock is None:
-            self.nd.stopClock(self.nativeClock)
+        clock = self.nativeClock if self.clock is None else self.clock
+        if self.continuous:
+            self.nd.clearClock(clock)
         else:
-            self.nd.stopClock(self.clock)
+            self.nd.stopClock(clock)
 
     def isDone(self):
         if self.clock is None:
             return self.nd.checkClock(self.nativeClock)
         else:
             return self.nd.checkClock(self.clock)
+
+    def waitUntilDone(self, timeout=10.):
+        clock = self.nativeClock if self.clock is None else self.clock
+        if clock not in self.nd.clocks:
+            return True
+        start, dur = self.nd.clocks[clock]
+        remaining = (start + dur) - time.time()
+        if remaining > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(max(0, remaining))
+        return True
         
 
     def GetTaskNumChans(self):
@@ -251,6 +251,7 @@ class Task:
     def __init__(self, nidaq, taskName=""):
         self.nidaq = nidaq
         self.handle = self.nidaq.CreateTask(taskName)
+        self._readFromCurrent = False
 
     def __del__(self):
         self.nidaq.ClearTask(self.handle)
@@ -271,6 +272,18 @@ class Task:
     def isDone(self):
         return self.IsTaskDone()
 
+    def waitUntilDone(self, timeout=10.):
+        """Block until the task is done or *timeout* (seconds) elapses.
+        Return True if the task is done.
+        """
+        try:
+            self.WaitUntilTaskDone(timeout)
+        except NIDAQError as exc:
+            if exc.errCode == -200560:  # DAQmxErrorWaitUntilDoneDoesNotIndicateDone (timed out)
+                return False
+            raise
+        return True
+
     def read(self, samples=None, timeout=10., dtype=None):
         #reqSamps = samples
         #if samples is None:
@@ -285,6 +298,42 @@ class Task:
         shape = (numChans, samples)
         #print "Shape: ", shape
         
+        fName, dtype = self._readFunction(dtype)
+        buf = empty(shape, dtype=dtype)
+        #samplesRead = ctypes.c_long()
+        
+        self.SetReadRelativeTo(LIB.Val_FirstSample)
+        self.SetReadOffset(0)
+        self._readFromCurrent = False
+        
+        ## buf.ctypes is a c_void_p, but the function requires a specific pointer type so we are forced to recast the pointer:
+        fn = LIB('functions', fName)
+        cbuf = ctypes.cast(buf.ctypes, fn.argCType('readArray'))
+        
+        nPts = getattr(self, fName)(reqSamps, timeout, LIB.Val_GroupByChannel, cbuf, buf.size)
+        return (buf, nPts)
+
+    def readInto(self, buf, timeout=10.):
+        """Read the next buf.shape[1] samples per channel directly into *buf*.
+
+        Unlike read(), samples are read relative to the current read position,
+        so repeated calls return consecutive chunks of a continuous acquisition.
+        *buf* must be a C-contiguous array of shape (nChans, nSamples).
+        Return the number of samples per channel read.
+        """
+        if not self._readFromCurrent:
+            self.SetReadRelativeTo(LIB.Val_CurrReadPos)
+            self.SetReadOffset(0)
+            self._readFromCurrent = True
+        fName, dtype = self._readFunction(buf.dtype)
+        fn = LIB('functions', fName)
+        cbuf = ctypes.cast(buf.ctypes, fn.argCType('readArray'))
+        return getattr(self, fName)(buf.shape[1], timeout, LIB.Val_GroupByChannel, cbuf, buf.size)
+
+    def _readFunction(self, dtype=None):
+        """Return the name of the read function to use for this task and dtype,
+        and the dtype (which is chosen based on the task type if None).
+        """
         ## Determine the default dtype based on the task type
         tt = self.taskType()
         if dtype is None:
@@ -295,9 +344,6 @@ class Task:
             else:
                 raise Exception("No default dtype for %s tasks." % chTypes[tt])
 
-        buf = empty(shape, dtype=dtype)
-        #samplesRead = ctypes.c_long()
-        
         ## Determine the correct function name to call based on the dtype requested
         fName = 'Read'
         if tt == LIB.Val_AI:
@@ -318,16 +364,7 @@ class Task:
             raise Exception("read() not allowed for this task type (%s)" % chTypes(tt))
             
         fName += dtypes[np.dtype(dtype).descr[0][1]]
-        
-        self.SetReadRelativeTo(LIB.Val_FirstSample)
-        self.SetReadOffset(0)
-        
-        ## buf.ctypes is a c_void_p, but the function requires a specific pointer type so we are forced to recast the pointer:
-        fn = LIB('functions', fName)
-        cbuf = ctypes.cast(buf.ctypes, fn.argCType('readArray'))
-        
-        nPts = getattr(self, fName)(reqSamps, timeout, LIB.Val_GroupByChannel, cbuf, buf.size)
-        return (buf, nPts)
+        return fName, dtype
 
     def write(self, data, timeout=10.):
         numChans = self.GetTaskNumChans()
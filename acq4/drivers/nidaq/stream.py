@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Continuous (streaming) acquisition support for SuperTask.
+
+A StreamReader thread reads fixed-size chunks from each input task directly
+into a preallocated RingBuffer and hands read-only views of each chunk to
+subscribers. No data is copied after it leaves the driver.
+"""
+from __future__ import print_function
+import threading
+import numpy as np
+import acq4.util.ptime as ptime
+from acq4.util.debug import printExc
+
+
+class RingBuffer(object):
+    """Preallocated circular buffer holding *nChunks* chunks of shape
+    (nChans, chunkSize).
+
+    Each chunk is stored contiguously so that it can be filled directly by the
+    driver and handed out as a view without copying. A chunk remains valid
+    until the buffer wraps around and overwrites it (nChunks chunks later).
+    """
+    def __init__(self, nChans, chunkSize, nChunks, dtype=np.float64):
+        self.data = np.empty((nChunks, nChans, chunkSize), dtype=dtype)
+        self.nChunks = nChunks
+        self.chunkSize = chunkSize
+        self.written = 0  # total number of chunks committed
+
+    def nextSlot(self):
+        """Return the (writable) array that the next chunk should be read into."""
+        return self.data[self.written % self.nChunks]
+
+    def commit(self):
+        """Mark the slot returned by nextSlot() as filled."""
+        self.written += 1
+
+    def chunk(self, index):
+        """Return a read-only view of chunk number *index* (counting from the
+        start of acquisition).
+
+        Raise IndexError if the chunk has not been acquired yet or has already
+        been overwritten.
+        """
+        if index >= self.written or index < self.written - self.nChunks or index < 0:
+            raise IndexError("Chunk %d is not available (have %d..%d)" % (
+                index, max(0, self.written - self.nChunks), self.written - 1))
+        view = self.data[index % self.nChunks].view()
+        view.flags.writeable = False
+        return view
+
+
+class StreamReader(threading.Thread):
+    """Thread that continuously reads chunks from a set of synchronized input
+    tasks.
+
+    ============== =========================================================
+    **Arguments**
+    tasks          dict of {taskKey: task}; all tasks must share a sample
+                   clock and be configured for continuous acquisition.
+    chunkSize      Number of samples per channel to read on each iteration
+    nChunks        Number of chunks held in each task's RingBuffer
+    rate           Sample rate (used to compute read timeouts and stats)
+    callbacks      List of functions to invoke after each chunk is read
+    ============== =========================================================
+
+    Each callback is invoked from the reader thread as
+    ``callback(chunks, startSample)``, where *chunks* is a dict of
+    {taskKey: read-only array view of shape (nChans, chunkSize)} and
+    *startSample* is the index of the first sample in the chunk. Callbacks
+    must return quickly; consumers that need more time should keep the chunk
+    index and fetch data later with getChunk() (or copy the view).
+    """
+    dtypes = {'ai': np.float64, 'di': np.uint32}
+
+    def __init__(self, tasks, chunkSize, nChunks, rate, callbacks=()):
+        threading.Thread.__init__(self, name="NiDAQStreamReader")
+        self.daemon = True
+        self.tasks = tasks
+        self.chunkSize = chunkSize
+        self.rate = rate
+        self.callbacks = list(callbacks)
+        self.buffers = {}
+        for key, task in tasks.items():
+            self.buffers[key] = RingBuffer(task.GetTaskNumChans(), chunkSize, nChunks, self.dtypes[key[1]])
+        self.error = None
+        self._stopRequested = threading.Event()
+        self._stats = {'chunks': 0, 'bytes': 0, 'readTime': 0.0, 'callbackTime': 0.0}
+        self.startTime = None
+
+    def run(self):
+        timeout = max(1.0, 2 * self.chunkSize / float(self.rate))
+        self.startTime = ptime.time()
+        chunkIndex = 0
+        try:
+            while not self._stopRequested.is_set():
+                t0 = ptime.time()
+                for key, task in self.tasks.items():
+                    buf = self.buffers[key]
+                    task.readInto(buf.nextSlot(), timeout)
+                    buf.commit()
+                t1 = ptime.time()
+                if len(self.callbacks) > 0:
+                    chunks = dict([(key, buf.chunk(chunkIndex)) for key, buf in self.buffers.items()])
+                    for cb in self.callbacks:
+                        cb(chunks, chunkIndex * self.chunkSize)
+                t2 = ptime.time()
+
+                s = self._stats
+                s['chunks'] += 1
+                s['bytes'] += sum([buf.data[0].nbytes for buf in self.buffers.values()])
+                s['readTime'] += t1 - t0
+                s['callbackTime'] += t2 - t1
+                chunkIndex += 1
+        except Exception as exc:
+            if not self._stopRequested.is_set():
+                self.error = exc
+                printExc("Error in NiDAQ stream reader:")
+
+    def stop(self, timeout=None):
+        """Ask the reader to exit after the current chunk and wait for it."""
+        self._stopRequested.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def getChunk(self, key, index):
+        """Return a read-only view of chunk *index* for the task *key*."""
+        return self.buffers[key].chunk(index)
+
+    def chunksRead(self):
+        return self._stats['chunks']
+
+    def stats(self):
+        """Return a dict describing acquisition throughput so far:
+        chunks, samples (per channel), bytes, elapsed, MBps, and the
+        mean time per chunk spent in the driver and in callbacks.
+        """
+        s = self._stats.copy()
+        elapsed = 0.0 if self.startTime is None else ptime.time() - self.startTime
+        n = max(1, s['chunks'])
+        return {
+            'chunks': s['chunks'],
+            'samples': s['chunks'] * self.chunkSize,
+            'bytes': s['bytes'],
+            'elapsed': elapsed,
+            'MBps': s['bytes'] / elapsed / 1e6 if elapsed > 0 else 0.0,
+            'readTime': s['readTime'] / n,
+            'callbackTime': s['callbackTime'] / n,
+        }
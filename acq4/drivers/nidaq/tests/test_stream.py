@@ -0,0 +1,64 @@
+from __future__ import print_function
+import time
+import numpy as np
+import pytest
+from acq4.drivers.nidaq.mock import NIDAQ
+from acq4.drivers.nidaq.stream import RingBuffer
+
+
+def test_ringbuffer():
+    rb = RingBuffer(nChans=2, chunkSize=5, nChunks=3)
+    with pytest.raises(IndexError):
+        rb.chunk(0)
+    for i in range(4):
+        rb.nextSlot()[:] = i
+        rb.commit()
+    # chunk 0 has been overwritten by chunk 3
+    with pytest.raises(IndexError):
+        rb.chunk(0)
+    c = rb.chunk(3)
+    assert c.shape == (2, 5)
+    assert np.all(c == 3)
+    assert c.base is not None and not c.flags.writeable
+
+
+def test_stream_throughput():
+    """Stream 4 AI channels at 500 kHz from the mock driver and check that the
+    reader keeps up and delivers contiguous chunks without copying."""
+    rate = 500e3
+    chunkSize = 5000
+    duration = 1.0
+
+    st = NIDAQ.createSuperTask()
+    for i in range(4):
+        st.addChannel('/Dev1/ai%d' % i, 'ai')
+    st.configureClocks(rate=rate, nPts=chunkSize * 10, continuous=True)
+
+    received = []
+    bufferIds = set()
+    def chunkReady(chunks, startSample):
+        data = chunks[('Dev1', 'ai')]
+        bufferIds.add(id(data.base))
+        received.append((startSample, data[0, 0], data[-1, -1]))
+    st.addStreamCallback(chunkReady)
+
+    stream = st.startStream(chunkSize, bufferChunks=8)
+    time.sleep(duration)
+    stats = st.stopStream()
+
+    print("streamed %d chunks, %0.1f MS/s per channel, %0.1f MB/s, read %0.2f ms/chunk" % (
+        stats['chunks'], stats['samples'] / stats['elapsed'] / 1e6, stats['MBps'], stats['readTime'] * 1e3))
+
+    # sustained rate: at least 80% of real time
+    assert stats['samples'] >= 0.8 * rate * duration
+    assert len(received) == stats['chunks']
+
+    # chunks are contiguous in time and all views share the preallocated buffer
+    for i, (start, first, last) in enumerate(received):
+        assert start == i * chunkSize
+        assert first == start / rate
+        assert last == (start + chunkSize - 1) / rate
+    assert bufferIds == {id(stream.buffers[('Dev1', 'ai')].data)}
+    assert st.stream is None
+    # the continuous mock clock is stopped along with the stream
+    assert not any(np.isinf(dur) for start, dur in NIDAQ.clocks.values())
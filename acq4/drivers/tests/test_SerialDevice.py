@@ -0,0 +1,111 @@
+from __future__ import print_function
+import os, sys, time, threading
+import pytest
+
+serial = pytest.importorskip('serial')
+if not hasattr(os, 'openpty'):
+    pytest.skip('pty loopback requires a posix system', allow_module_level=True)
+
+from acq4.drivers.SerialDevice import SerialDevice, TimeoutError, DataError
+
+
+class FakeDevice(object):
+    """Serial device on the master side of a pty. Each '\\r'-terminated
+    command is answered with *reply(command)*, written in two pieces to
+    exercise reassembly of fragmented packets.
+    """
+    def __init__(self, reply):
+        self.reply = reply
+        self.master, slave = os.openpty()
+        self.port = os.ttyname(slave)
+        self.slave = slave
+        self.commands = []
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        buf = b''
+        while True:
+            try:
+                buf += os.read(self.master, 1024)
+            except OSError:
+                return
+            while b'\r' in buf:
+                cmd, _, buf = buf.partition(b'\r')
+                self.commands.append(cmd)
+                resp = self.reply(cmd)
+                if resp is None:
+                    continue
+                os.write(self.master, resp[:2])
+                time.sleep(0.002)
+                os.write(self.master, resp[2:])
+
+    def close(self):
+        os.close(self.master)
+        os.close(self.slave)
+
+
+@pytest.fixture
+def device():
+    def reply(cmd):
+        if cmd == b'POS':
+            return b'10\t20\t30\r'
+        if cmd == b'SILENT':
+            return None
+        if cmd == b'BAD':
+            return b'12345'
+        return cmd + b'\r'
+    dev = FakeDevice(reply)
+    sd = SerialDevice(port=dev.port, baudrate=9600)
+    yield dev, sd
+    sd.close()
+    dev.close()
+
+
+def test_read(device):
+    dev, sd = device
+    assert sd.query('POS\r', term=b'\r') == b'10\t20\t30\r'
+    sd.write('ECHO\r')
+    assert sd.read(5, term='\r') == b'ECHO'
+    sd.write('abc\r')
+    assert sd.readUntil('c', minBytes=1) == b'abc'
+    assert sd.readUntil('\r') == b'\r'
+    assert sd.readAll() == b''
+
+    # timeouts include any partial data received
+    sd.write('SILENT\r')
+    with pytest.raises(TimeoutError) as exc:
+        sd.readUntil(b'\r', timeout=0.1)
+    assert exc.value.data == b''
+    sd.write('BAD\r')
+    with pytest.raises(TimeoutError) as exc:
+        sd.read(6, timeout=0.2)
+    assert exc.value.data == b'12345'
+    sd.write('BAD\r')
+    with pytest.raises(DataError):
+        sd.read(5, term=b'\r')
+
+    # reopening the port discards nothing the device sends afterward
+    sd.close()
+    sd.open()
+    assert sd.query(b'POS\r', term=b'\r') == b'10\t20\t30\r'
+
+
+def test_pipeline_latency(device):
+    dev, sd = device
+    sd.latencyStats(reset=True)
+    replies = sd.pipeline([('A\r', None, b'\r'), ('POS\r', None, b'\r'), ('BC\r', 3, b'\r')])
+    assert replies == [b'A\r', b'10\t20\t30\r', b'BC']
+    assert dev.commands[-3:] == [b'A', b'POS', b'BC']
+
+    start = time.time()
+    for i in range(20):
+        sd.query('POS\r', term=b'\r')
+    elapsed = time.time() - start
+    stats = sd.latencyStats()
+    assert stats['replies'] == 21
+    assert stats['bytesWritten'] == len(b'A\rPOS\rBC\r') + 20 * len(b'POS\r')
+    # replies are picked up as soon as they arrive, not on a polling interval
+    assert stats['meanLatency'] < 0.02
+    assert elapsed < 20 * 0.02
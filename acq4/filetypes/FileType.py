@@ -17,6 +17,7 @@ class FileType:
     extensions = []   ## list of extensions handled by this class
     dataTypes = []    ## list of python types handled by this class
     priority = 0      ## priority for this class when multiple classes support the same file types
+    supportsSelection = False  ## True if read() accepts a selection keyword argument (see FileHandle.read)
     
     @classmethod
     def typeName(cls):
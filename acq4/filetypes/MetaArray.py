@@ -2,6 +2,8 @@
 from __future__ import print_function
 
 from acq4.util.metaarray import MetaArray as MA
+import copy
+import numpy as np
 from numpy import ndarray
 from .FileType import *
 
@@ -24,6 +26,7 @@ class MetaArray(FileType):
     extensions = ['.ma']   ## list of extensions handled by this class
     dataTypes = [MA, ndarray]    ## list of python types handled by this class
     priority = 100      ## High priority; MetaArray is the preferred way to move data..
+    supportsSelection = True
     
     @classmethod
     def write(cls, data, dirHandle, fileName, **args):
@@ -41,5 +44,162 @@ class MetaArray(FileType):
         
     @classmethod
     def read(cls, fileHandle, *args, **kargs):
-        """Read a file, return a data object"""
-        return MA(file=fileHandle.name(), *args, **kargs)
+        """Read a file, return a data object.
+
+        If *selection* is given (see FileHandle.read), only the selected part
+        of the array is read from disk: HDF5 files are sliced through h5py and
+        .ma files are memory-mapped where possible.
+        
+        Channels that were stored in their raw DAQ dtype (see DAQGeneric) are
+        converted to physical units unless *raw* is True. This applies only to
+        the data that is read; older files are returned unchanged.
+        """
+        selection = kargs.pop('selection', None)
+        raw = kargs.pop('raw', False)
+        if selection is None:
+            data = MA(file=fileHandle.name(), *args, **kargs)
+            return data if raw else applyRawMapping(data)
+
+        fileName = fileHandle.name()
+        with open(fileName, 'rb') as fd:
+            isHDF = fd.read(8) == b'\x89HDF\r\n\x1a\n'
+        if isHDF:
+            arr = MA(file=fileName, readAllData=False)
+        else:
+            try:
+                arr = MA(file=fileName, mmap=True)
+            except Exception:
+                ## object arrays and files with a dynamic axis can not be mapped
+                arr = MA(file=fileName)
+        try:
+            index = selectionIndex(selection)
+            data = arr[index]
+            if isinstance(data, MA):
+                ## copy the selected region out of the file
+                data = MA(np.array(data.asarray()), info=data._info)
+                if not raw:
+                    data = applyRawMapping(data)
+            elif not raw:
+                ## a single value was selected; find the column it came from
+                nInd = arr._interpretIndexes(index)
+                for i, ax in enumerate(arr._info[:-1]):
+                    col = ax['cols'][nInd[i]] if 'cols' in ax else {}
+                    if 'rawScale' in col:
+                        data = data * col['rawScale'] + col['rawOffset']
+        finally:
+            if hasattr(arr, '_openFile'):
+                arr._openFile.close()
+        return data
+
+
+def applyRawMapping(data):
+    """Convert channels stored in their raw DAQ dtype to physical units.
+    
+    The columns of such channels have 'rawScale' and 'rawOffset' values
+    (physical value = raw * rawScale + rawOffset). Return a new float64
+    MetaArray without these keys, or *data* unchanged if it has no raw
+    columns. If the data have not been read into memory (for example, large
+    HDF5 files or readAllData=False), the conversion is applied to each
+    region as it is read (see RawMappedData).
+    """
+    if not isinstance(data, MA):
+        return data
+    info = data._info
+    ## columns along an axis that is still present
+    rawAxes = [i for i, ax in enumerate(info[:-1]) if any(['rawScale' in c for c in ax.get('cols', [])])]
+    ## columns of axes that were indexed out (see MetaArray.__getitem__)
+    rawExtra = [c for c in info[-1].get('cols', []) if isinstance(c, dict) and 'rawScale' in c]
+    if len(rawAxes) == 0 and len(rawExtra) == 0:
+        return data
+
+    info = data.infoCopy()
+    scale, offset = 1.0, 0.0
+    for c in info[-1].get('cols', []):
+        if isinstance(c, dict) and 'rawScale' in c:
+            scale, offset = c.pop('rawScale'), c.pop('rawOffset')
+    if len(rawAxes) == 0:
+        ax = None
+    else:
+        ax = rawAxes[0]
+        cols = info[ax]['cols']
+        offset = np.array([c.pop('rawOffset', 0.0) * scale + offset for c in cols])
+        scale = np.array([c.pop('rawScale', 1.0) * scale for c in cols])
+
+    if not isinstance(data._data, ndarray):
+        out = copy.copy(data)
+        out._data = RawMappedData(data._data, ax, scale, offset)
+        out._info = info
+        return out
+
+    arr = data.asarray()
+    out = np.empty(arr.shape, dtype=np.float64)
+    if ax is None:
+        np.multiply(arr, scale, out=out)
+        out += offset
+    else:
+        for j in range(len(scale)):
+            sl = [slice(None)] * arr.ndim
+            sl[ax] = j
+            sl = tuple(sl)
+            np.multiply(arr[sl], scale[j], out=out[sl])
+            out[sl] += offset[j]
+    return MA(out, info=info)
+
+
+class RawMappedData(object):
+    """Read-only wrapper around raw data that are not held in memory (such as
+    an h5py dataset). Indexing reads the requested region and converts it to
+    physical units (float64), so a MetaArray using this as its data never
+    exposes raw values.
+
+    *axis* is the channel axis whose columns have their own *scale* and
+    *offset* arrays, or None if *scale* and *offset* apply to all values.
+    """
+    def __init__(self, data, axis, scale, offset):
+        self.data = data
+        self.axis = axis
+        self.scale = scale
+        self.offset = offset
+        self.shape = data.shape
+        self.dtype = np.dtype(np.float64)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        raw = np.asarray(self.data[index])
+        scale, offset = self.scale, self.offset
+        if self.axis is not None:
+            axIndex = index[self.axis] if self.axis < len(index) else slice(None)
+            scale, offset = scale[axIndex], offset[axIndex]
+            if np.ndim(scale) > 0:
+                ## axes before the channel axis that were indexed by an integer are removed
+                outAxis = self.axis - len([i for i in index[:self.axis] if isinstance(i, (int, np.integer))])
+                shape = [1] * raw.ndim
+                shape[outAxis] = len(scale)
+                scale, offset = scale.reshape(shape), offset.reshape(shape)
+        return raw * scale + offset
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[(slice(None),) * len(self.shape)]
+        return data if dtype is None else data.astype(dtype)
+
+
+def selectionIndex(selection):
+    """Convert a selection into an index for MetaArray.__getitem__.
+
+    A dict {axisName: index} selects along named axes, where index may be a
+    column name, an integer, a list, or a slice. Slices with float bounds
+    select by axis values. Any other selection is used as the index directly.
+    """
+    if not isinstance(selection, dict):
+        return selection
+    ind = []
+    for axis, index in selection.items():
+        if isinstance(index, slice) and (isinstance(index.start, float) or isinstance(index.stop, float)):
+            ind.append(slice(axis, index.start, index.stop))  # select by axis values
+        else:
+            ind.append(slice(axis, index))
+    return tuple(ind)
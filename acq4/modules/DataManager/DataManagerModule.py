@@ -85,6 +85,8 @@ class DataManager(Module):
             self.ui.baseDirText.setText('')
         else:
             self.ui.baseDirText.setText(dh.name())
+            ## read the whole tree in the background so browsing it is served from memory
+            crawl(dh.name(), background=True)
         self.ui.fileTreeWidget.setBaseDirHandle(dh)
         
     def loadLog(self, *args, **kwargs):
@@ -44,7 +44,7 @@ class FileDataView(Qt.QSplitter):
             else:
                 image = False
                 with pg.BusyCursor():
-                    data = file.read()
+                    data = file.read(cached=True)
                 if typ == 'ImageFile': 
                     image = True
                 elif typ == 'MetaArray':
@@ -262,7 +262,7 @@ class Imager(Module):
 
         # takes care of displaying image data, 
         # contrast & background subtraction user interfaces
-        self.imagingCtrl = imaging.ImagingCtrl()
+        self.imagingCtrl = imaging.ImagingCtrl(compression=config.get('stackCompression', None))
         self.frameDisplay = self.imagingCtrl.frameDisplay
         self.imageItem = self.frameDisplay.imageItem()
 
@@ -292,8 +292,6 @@ class Imager(Module):
 
         self.fieldSize = 63.0*120e-6 # field size for 63x, will be scaled for others
 
-        self.scanVoltageCache = None  # cached scan protocol computed by generateScanProtocol
-        
         self.objectiveROImap = {} # this is a dict that we will populate with the name
         # of the objective and the associated ROI object .
         # That way, each objective has a scan region appopriate for it's magnification.
@@ -398,10 +396,12 @@ class Imager(Module):
                 dict(name='Power', type='float', value=0.00, suffix='W', readonly=True),
                 dict(name='Objective', type='str', value='Unknown', readonly=True),
                 dict(name='Filter', type='str', value='Unknown', readonly=True),
+                dict(name='Scan Cache', type='str', value='', readonly=True),
             ]),
             dict(name='Image Control', type='group', children=[
                 dict(name='Decomb', type='float', value=20e-6, suffix='s', siPrefix=True, bounds=[0, 1e-3], step=2e-7, decimals=5, children=[
                     dict(name='Auto', type='action'),
+                    dict(name='Live', type='bool', value=False),
                     dict(name='Subpixel', type='bool', value=False),
                     ]),
                 dict(name='Camera Module', type='interface', interfaceTypes=['cameraModule']),
@@ -442,7 +442,7 @@ class Imager(Module):
         self.updateParams() # also force update now to make sure all parameters are synchronized
         self.param.child('Scan Control').sigTreeStateChanged.connect(self.updateParams)
         self.param.child('Image Control').sigTreeStateChanged.connect(self.updateDecomb)
-        self.param.child('Image Control', 'Decomb', 'Auto').sigActivated.connect(self.autoDecomb)
+        self.param.child('Image Control', 'Decomb', 'Auto').sigActivated.connect(lambda: self.autoDecomb())
 
         self.manager.sigAbortAll.connect(self.abortTask)
 
@@ -592,8 +592,6 @@ class Imager(Module):
         if self.ignoreRoiChange:
             return
 
-        self.scanVoltageCache = None  # invalidate cache
-
         # update scan position
         self.setScanPosFromRoi()
 
@@ -699,8 +697,6 @@ class Imager(Module):
 
         scanControl = self.param.child('Scan Control')
 
-        self.scanVoltageCache = None  # invalidate cache
-
         sampleRate = scanControl['Sample Rate']
         downsample = scanControl['Downsample']
         # we'll let the rect tell us later how many samples are needed
@@ -767,9 +763,9 @@ class Imager(Module):
             self.lastFrame.setDecomb(self.param['Image Control', 'Decomb'], self.param['Image Control', 'Decomb', 'Subpixel'])
             self.frameDisplay.updateFrame()
 
-    def autoDecomb(self):
+    def autoDecomb(self, guess=None):
         if self.lastFrame is not None:
-            self.lastFrame.autoDecomb()
+            self.lastFrame.autoDecomb(guess=guess)
             self.param.child('Image Control', 'Decomb').setValue(self.lastFrame._decomb[0])
             
     def loadModeSettings(self, params):
@@ -869,6 +865,9 @@ class Imager(Module):
         """
         self.blanker.unblank()
         self.lastFrame = frame
+        if self.param['Image Control', 'Decomb', 'Live']:
+            # refine the lag measured from previous frames
+            self.autoDecomb(guess=self.param['Image Control', 'Decomb'])
         self.updateDecomb()
         self.imagingCtrl.newFrame(self.lastFrame)
 
@@ -876,15 +875,11 @@ class Imager(Module):
         # first make sure laser information is updated on the module interface
         self.updateLaserInfo()
 
-        # return cached command if possible
-        if self.scanVoltageCache is not None:
-            vscan = self.scanVoltageCache
-        else:
-            # Generate scan voltages
-            vscan = self.scanProgram.generateVoltageArray()
-            # scanner lags laser too much to make this worthwhile without some timing correction
-            # mask = self.scanProgram.generateLaserMask().astype(np.float32)
-            self.scanVoltageCache = vscan
+        # Generate scan voltages (reuses cached arrays unless the scan or calibration changed)
+        vscan = self.scanProgram.compile().commands
+        # scanner lags laser too much to make this worthwhile without some timing correction
+        # mask = self.scanProgram.generateLaserMask().astype(np.float32)
+        self.updateScanCacheStats()
 
         # sample rate, duration, and other meta data
         rect = self.scanProgram.components[0].ctrlParameter()
@@ -928,6 +923,11 @@ class Imager(Module):
 
         return prot
 
+    def updateScanCacheStats(self):
+        stats = self.scanProgram.cacheStats()
+        self.param['Scan Properties', 'Scan Cache'] = '%d%% hits (%d / %d)' % (
+            stats['hitRate'] * 100, stats['hits'], stats['hits'] + stats['misses'])
+
     def imageUpdated(self, frame):
         ## New image is displayed; update image transform
         self.imageItem.setTransform(frame.globalTransform().as2D())
@@ -1122,9 +1122,9 @@ class ImagingFrame(imaging.Frame):
             self._decomb = d
             self._image = None
 
-    def autoDecomb(self):
+    def autoDecomb(self, guess=None):
         offset, subpixel = self._decomb
-        offset = self.rectScan.measureMirrorLag(self._data, subpixel=subpixel)
+        offset = self.rectScan.measureMirrorLag(self._data, subpixel=subpixel, guess=guess)
         self.setDecomb(offset, subpixel)
 
 
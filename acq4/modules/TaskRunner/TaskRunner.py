@@ -16,7 +16,8 @@ from acq4.Manager import getManager, logMsg, logExc
 from acq4.util.debug import *
 import acq4.util.ptime as ptime
 from . import analysisModules
-import time, gc
+import time, gc, threading
+import six
 import sys, os
 from acq4.util.HelpfulException import HelpfulException
 import acq4.pyqtgraph as pg
@@ -102,6 +103,8 @@ class TaskRunner(Module):
             (self.ui.protoCycleTimeSpin, 'loopCycleTime'),
             (self.ui.seqCycleTimeSpin, 'cycleTime'),
             (self.ui.seqRepetitionSpin, 'repetitions', 1),
+            (self.ui.seqPipelineCheck, 'pipeline'),
+            (self.ui.seqLazyCheck, 'lazy'),
         ])
         
         try:
@@ -140,6 +143,7 @@ class TaskRunner(Module):
         self.taskThread.sigPaused.connect(self.taskThreadPaused)
         self.taskThread.sigTaskStarted.connect(self.taskStarted)
         self.taskThread.sigExitFromError.connect(self.taskErrored)
+        self.taskThread.sigPipelineStats.connect(self.pipelineStatsChanged)
         self.protoStateGroup.sigChanged.connect(self.protoGroupChanged)
         self.win.show()
         self.ui.sequenceParamList.itemChanged.connect(self.updateSeqReport)
@@ -596,7 +600,7 @@ class TaskRunner(Module):
             for i in items:
                 key = i[:2]
                 params[key] = i[2]
-                paramInds[key] = range(len(i[2]))
+                paramInds[key] = list(range(len(i[2])))
                 pLen *= len(i[2])
                 linkedParams[key] = i[3]
                 
@@ -618,17 +622,30 @@ class TaskRunner(Module):
                     self.docks[d].widget().prepareTaskStart()
                     
             #print params, linkedParams
-            ## Generate the complete array of command structures. This can take a long time, so we start a progress dialog.
-            with pg.ProgressDialog("Generating task commands..", 0, pLen) as progressDlg:
-                self.lastQtProcessTime = ptime.time()
-                prot = runSequence(lambda p: self.generateTask(dh, p, progressDlg), paramInds, list(paramInds.keys()), linkedParams=linkedParams)
+            lazy = self.ui.seqLazyCheck.isChecked()
+            if lazy:
+                ## Commands will be generated one at a time, just before each task runs, at the request of the task thread.
+                ## This lets acquisition start immediately and keeps memory use independent of sequence length.
+                ## Device GUIs are not thread-safe, so the generation itself always runs in the GUI thread.
+                prot = GuiThreadCall(lambda p: self.generateTask(dh, p))
+            else:
+                ## Generate the complete array of command structures. This can take a long time, so we start a progress dialog.
+                ## Devices first get a chance to compute their commands for the whole sequence at once.
+                for d in self.currentTask.devices:
+                    if self.currentTask.deviceEnabled(d):
+                        self.docks[d].widget().prepareTaskSequence()
+                with pg.ProgressDialog("Generating task commands..", 0, pLen) as progressDlg:
+                    self.lastQtProcessTime = ptime.time()
+                    prot = runSequence(lambda p: self.generateTask(dh, p, progressDlg), paramInds, list(paramInds.keys()), linkedParams=linkedParams)
             if dh is not None:
                 dh.flushSignals()  ## do this now rather than later when task is running
             
             self.sigTaskSequenceStarted.emit({})
             logMsg('Started %s task sequence of length %i' %(self.currentTask.name(),pLen), importance=6)
             #print 'PR task positions:
-            self.taskThread.startTask(prot, paramInds)
+            ## The precomputed command array already accounts for linked parameters
+            self.taskThread.startTask(prot, paramInds, pipeline=self.ui.seqPipelineCheck.isChecked(),
+                                      linkedParams=linkedParams if lazy else None)
             
         except:
             self.enableStartBtns(True)
@@ -769,6 +786,20 @@ class TaskRunner(Module):
         
         self.sigTaskStarted.emit(params)
     
+    def pipelineStatsChanged(self, stats):
+        ## report inter-task dead time and the time hidden from it by pipelining
+        n = stats['iterations'] - 1
+        if n < 1:
+            return
+        saved = stats['prepTime'] + stats['storeTime']
+        msg = "Pipelined sequence: dead time %0.1f ms/task; pipelining saved %0.1f ms/task (%0.1f s total)" % (
+            stats['deadTime'] * 1000. / n, saved * 1000. / n, saved)
+        ## per-device storage latency
+        devs = ['%s %0.1f ms' % (dev, ds['mean'] * 1000.) for dev, ds in sorted(stats['devices'].items())]
+        if len(devs) > 0:
+            msg += "; storage: " + ', '.join(devs)
+        self.win.statusBar().showMessage(msg)
+
     def handleFrame(self, frame):
         
         ## Request each device handles its own data
@@ -918,12 +949,78 @@ class Task:
             
         
         
+class GuiThreadCall(Qt.QObject):
+    """Wraps a function so that calling it from any thread runs it in the GUI
+    thread (the thread that created this object) and waits for it to return.
+    
+    Used for lazily generated sequence commands: generating a command reads the
+    state of device GUIs, which must not be accessed from the task thread.
+    Exceptions raised by the function are re-raised in the calling thread.
+    
+    Calls from the GUI thread run directly. Other threads post the call with a
+    queued connection and wait for it, so the GUI thread is never blocked by
+    this object. If the GUI thread is itself waiting on the caller, the wait
+    ends when cancel() is called (raising Exception('stop')) or after *timeout*
+    seconds, rather than deadlocking.
+    """
+    sigCall = Qt.Signal(object)
+    
+    def __init__(self, fn, timeout=60.):
+        Qt.QObject.__init__(self)
+        self.fn = fn
+        self.timeout = timeout
+        self._cancelled = threading.Event()
+        self.sigCall.connect(self._call, Qt.Qt.QueuedConnection)
+        
+    def __call__(self, *args):
+        if Qt.QThread.currentThread() is self.thread():
+            return self.fn(*args)
+        req = {'args': args, 'state': 'pending', 'lock': threading.Lock(), 'done': threading.Event()}
+        self.sigCall.emit(req)
+        start = ptime.time()
+        while not req['done'].wait(0.02):
+            cancelled = self._cancelled.is_set()
+            if not cancelled and (self.timeout is None or ptime.time() - start < self.timeout):
+                continue
+            with req['lock']:
+                if req['state'] == 'pending':
+                    ## the GUI thread has not picked up the call; make sure it never does
+                    req['state'] = 'abandoned'
+                    if cancelled:
+                        raise Exception('stop')
+                    raise Exception("Timed out after %g s waiting for the GUI thread to run %s" % (self.timeout, self.fn))
+            ## already running in the GUI thread; wait for it to finish
+            req['done'].wait()
+        if 'exc' in req:
+            six.reraise(*req['exc'])
+        return req['result']
+    
+    def cancel(self):
+        """Make calls waiting for the GUI thread (now or later) raise
+        Exception('stop') instead of running the function.
+        """
+        self._cancelled.set()
+    
+    def _call(self, req):
+        with req['lock']:
+            if req['state'] != 'pending':
+                return
+            req['state'] = 'running'
+        try:
+            req['result'] = self.fn(*req['args'])
+        except Exception:
+            req['exc'] = sys.exc_info()
+        finally:
+            req['done'].set()
+        
+        
 class TaskThread(Thread):
     
     sigPaused = Qt.Signal()
     sigNewFrame = Qt.Signal(object)
     sigExitFromError = Qt.Signal()
     sigTaskStarted = Qt.Signal(object)
+    sigPipelineStats = Qt.Signal(object)  ## dict of cumulative timing stats; emitted after each pipelined task
     
     def __init__(self, ui):
         Thread.__init__(self)
@@ -935,14 +1032,31 @@ class TaskThread(Thread):
         self.paused = False
         self._currentTask = None
         self._systrace = None
+        self.pipeline = False
+        self.pipelineStats = None
+        self.task = None
+        self.linkedParams = None
                 
-    def startTask(self, task, paramSpace=None):
+    def startTask(self, task, paramSpace=None, pipeline=False, linkedParams=None):
+        """Start running a single task or a task sequence.
+        
+        *task* is either the complete command structure (for sequences, an array of commands
+        with one axis per sequence parameter), or a function that accepts a dict of sequence
+        parameter indexes and returns the command structure for that point in the sequence.
+        In the latter case, commands are generated lazily, as the task thread reaches each
+        point (see GuiThreadCall for functions that must run in the GUI thread).
+        
+        *linkedParams* is passed to the SequenceRunner used to iterate over *paramSpace*, so
+        that the parameter dicts given to a *task* function include linked parameters.
+        """
         with self.lock:
             self._systrace = sys.gettrace()
             while self.isRunning():
                 raise Exception("Already running another task")
             self.task = task
             self.paramSpace = paramSpace
+            self.linkedParams = linkedParams
+            self.pipeline = pipeline
             self.lastRunTime = None
             self.start() ### causes self.run() to be called from new thread
             logMsg("Task started.", importance=1)
@@ -967,8 +1081,14 @@ class TaskThread(Thread):
                 except Exception as e:
                     if e.args[0] != 'stop':
                         raise
+            elif self.pipeline:
+                try:
+                    self.runPipelined()
+                except Exception as e:
+                    if len(e.args) == 0 or e.args[0] != 'stop':
+                        raise
             else:
-                runSequence(self.runOnce, self.paramSpace, list(self.paramSpace.keys()))
+                runSequence(self.runOnce, self.paramSpace, list(self.paramSpace.keys()), linkedParams=self.linkedParams)
             
         except:
             self.task = None  ## free up this memory
@@ -976,36 +1096,144 @@ class TaskThread(Thread):
             printExc("Error in task thread, exiting.")
             self.sigExitFromError.emit()
                     
-    def runOnce(self, params=None):
-        # good time to collect garbage
-        gc.collect()
-        
-        prof = Profiler("TaskRunner.TaskThread.runOnce", disabled=True, delayed=False)
-        startTime = ptime.time()
-        if params is None:
-            params = {}
+    def runPipelined(self):
+        """Run a task sequence, overlapping the preparation of each task with
+        the execution of the task before it.
+
+        While task N is acquiring, the command for task N+1 is selected (or
+        generated) and its Manager task is created. Results are collected as
+        soon as each task finishes, but are written to disk by the Manager's
+        WriterPool so that storage does not delay the start of the next task.
+        """
+        paramIter = iterSequence(self.paramSpace, list(self.paramSpace.keys()), linkedParams=self.linkedParams)
         
-        ## Select correct command to execute
-        cmd = self.task
-        if params is not None:
-            for p in params:
-                cmd = cmd[p: params[p]]
-        prof.mark('select command')        
+        self.pipelineStats = {'iterations': 0, 'deadTime': 0.0, 'prepTime': 0.0, 'storeTime': 0.0, 'devices': {}}
+        storing = []  # tasks whose results are still being written
+        lastStopTime = None
+        nextTask = None
+        try:
+            prepTime = ptime.time()
+            nextTask = self.prepareNextTask(paramIter)
+            prepTime = ptime.time() - prepTime
+            while nextTask is not None:
+                params, cmd, task = nextTask
+                if not self.waitForStart(cmd):
+                    return
+                nextTask = None
+                self.startPreparedTask(params, cmd, task)
+                
+                # measure the time between the end of the last task and the start of this one,
+                # and how much time was hidden from that gap by pipelining
+                stats = self.pipelineStats
+                stats['iterations'] += 1
+                if lastStopTime is not None:
+                    stats['deadTime'] += task.startTime - lastStopTime
+                    stats['prepTime'] += prepTime
                 
+                ## prepare the next task while this one is running
+                prepTime = ptime.time()
+                try:
+                    nextTask = self.prepareNextTask(paramIter)
+                except Exception as e:
+                    if len(e.args) == 0 or e.args[0] != 'stop':
+                        ## don't leave the running task behind
+                        self.abortRunningTask(task)
+                        raise
+                    ## command generation was cancelled by stop(); finish this task only
+                    nextTask = None
+                prepTime = ptime.time() - prepTime
+                
+                result = self.waitForTask(task, storeData=False)
+                if result is None:
+                    return
+                lastStopTime = task.stopTime
+                task.storeResult(background=True)
+                storing.append(task)
+                self.checkStorage(storing)
+                
+                frame = {'params': params, 'cmd': cmd, 'result': result}
+                self.sigNewFrame.emit(frame)
+                self.sigPipelineStats.emit(stats.copy())
+                if self.stopThread:
+                    return
+                Qt.QThread.yieldCurrentThread()
+        finally:
+            if nextTask is not None:
+                ## a task was prepared but will never run; make sure its devices are released
+                try:
+                    nextTask[2].stop(abort=True)
+                except:
+                    printExc("Error releasing unused pipelined task:")
+            self.checkStorage(storing, wait=True)
+
+    def checkStorage(self, tasks, wait=False):
+        """Remove tasks from the list whose background storage has finished,
+        accumulate their storage time, and raise an exception if any of them 
+        failed to store. If *wait* is True, block until all tasks have finished
+        storing.
+        """
+        stats = self.pipelineStats
+        for task in tasks[:]:
+            if not wait and not task.storageDone():
+                continue
+            tasks.remove(task)
+            times = task.waitForStorage()
+            if len(times) > 0:
+                # devices are stored in parallel
+                stats['storeTime'] += max(times.values())
+        stats['devices'] = self.dm.getWriterPool().stats()
+
+    def prepareNextTask(self, paramIter):
+        """Select the command for the next sequence iteration and create its
+        Manager task. Return (params, cmd, task), or None if the sequence is
+        complete.
+        """
+        try:
+            ind, params = next(paramIter)
+        except StopIteration:
+            return None
+        cmd = self.selectCommand(params)
+        self.checkCommand(cmd, params)
+        return params, cmd, self.dm.createTask(cmd)
+
+    def selectCommand(self, params):
+        """Return the command structure for a single iteration of the sequence,
+        generating it if necessary.
+        """
+        if callable(self.task):
+            return self.task(params)
+        cmd = self.task
+        for p in params:
+            cmd = cmd[p: params[p]]
+        return cmd
+
+    def checkCommand(self, cmd, params):
+        if type(cmd) is not dict:
+            print("========= TaskRunner.runOnce cmd: ==================")
+            print(cmd)
+            print("========= TaskRunner.runOnce params: ==================")
+            print("Params:", params)
+            print("===========================")
+            raise Exception("TaskRunner.runOnce failed to generate a proper command structure. Object type was '%s', should have been 'dict'." % type(cmd))
+
+    def waitForStart(self, cmd):
+        """Wait until the cycle time has elapsed since the last task and the
+        sequence is not paused. Return False if the thread was stopped or
+        aborted while waiting.
+        """
         ## Wait before starting if we've already run too recently
         while (self.lastRunTime is not None) and (ptime.time() < self.lastRunTime + cmd['protocol']['cycleTime']):
             with self.lock:
                 if self.abortThread or self.stopThread:
                     #print "Task run aborted by user"
-                    return
+                    return False
             time.sleep(1e-3)
-        prof.mark('sleep')
         
         emitSig = True
         while True:
             with self.lock:
                 if self.abortThread or self.stopThread:
-                    return
+                    return False
                 pause = self.paused
             if not pause:
                 break
@@ -1013,30 +1241,16 @@ class TaskThread(Thread):
                 emitSig = False
                 self.sigPaused.emit()
             time.sleep(10e-3)
-        
-        prof.mark('pause')
-        
-        if type(cmd) is not dict:
-            print("========= TaskRunner.runOnce cmd: ==================")
-            print(cmd)
-            print("========= TaskRunner.runOnce params: ==================")
-            print("Params:", params)
-            print("===========================")
-            raise Exception("TaskRunner.runOnce failed to generate a proper command structure. Object type was '%s', should have been 'dict'." % type(cmd))
-        
-        task = self.dm.createTask(cmd)
-        prof.mark('create task')
-        
+        return True
+
+    def startPreparedTask(self, params, cmd, task):
         self.lastRunTime = ptime.time()
         
         try:
             with self.lock:
                 self._currentTask = task
             task.execute(block=False)
-            # record estimated end time
-            endTime = time.time() + cmd['protocol']['duration']
             self.sigTaskStarted.emit(params)
-            prof.mark('execute')
         except:
             with self.lock:
                 self._currentTask = None
@@ -1047,27 +1261,33 @@ class TaskThread(Thread):
             printExc("\nError starting task:")
             exc = sys.exc_info()
             raise HelpfulException("\nError starting task:", exc)
+
+    def abortRunningTask(self, task):
+        with self.lock:
+            self._currentTask = None
+        try:
+            task.stop(abort=True)
+        except:
+            printExc("Error stopping task:")
+
+    def waitForTask(self, task, storeData=True):
+        """Wait for a running task to finish and return its result.
         
-        prof.mark('start task')
+        Return None if the task was aborted.
+        """
         ### Do not put code outside of these try: blocks; may cause device lockup
-        
         try:
             ## wait for finish, watch for abort requests
-            while True:
-                if task.isDone():
-                    prof.mark('task done')
-                    break
+            ## (abort() wakes the task so that we can respond immediately)
+            while not task.waitUntilDone():
                 with self.lock:
                     if self.abortThread:
                         # should be taken care of in TaskThread.abort()
                         # NO -- task.stop() is not thread-safe.
                         task.stop(abort=True)
-                        return
-                # adjust sleep time based on estimated time remaining in the task.
-                sleep = np.clip((endTime - time.time()) * 0.5, 1e-3, 20e-3)
-                time.sleep(sleep)
+                        return None
                 
-            result = task.getResult()
+            return task.getResult(storeData=storeData)
         except:
             ## Make sure the task is fully stopped if there was a failure at any point.
             #printExc("\nError during task execution:")
@@ -1078,6 +1298,33 @@ class TaskThread(Thread):
         finally:
             with self.lock:
                 self._currentTask = None
+
+    def runOnce(self, params=None):
+        # good time to collect garbage
+        gc.collect()
+        
+        prof = Profiler("TaskRunner.TaskThread.runOnce", disabled=True, delayed=False)
+        if params is None:
+            params = {}
+        
+        ## Select correct command to execute
+        cmd = self.selectCommand(params)
+        prof.mark('select command')        
+                
+        if not self.waitForStart(cmd):
+            return
+        prof.mark('sleep / pause')
+        
+        self.checkCommand(cmd, params)
+        task = self.dm.createTask(cmd)
+        prof.mark('create task')
+        
+        self.startPreparedTask(params, cmd, task)
+        prof.mark('start task')
+        
+        result = self.waitForTask(task)
+        if result is None:
+            return
         prof.mark('getResult')
             
         frame = {'params': params, 'cmd': cmd, 'result': result}
@@ -1099,16 +1346,24 @@ class TaskThread(Thread):
     def stop(self, block=False):
         with self.lock:
             self.stopThread = True
+        self.cancelCommandGeneration()
         if block:
             if not self.wait(10000):
                 raise Exception("Timed out while waiting for thread exit!")
             
     def abort(self):
+        self.cancelCommandGeneration()
         with self.lock:
             if self._currentTask is not None:
                 # bad idea -- task.stop() is not thread-safe; must ask the task thread to stop.
                 #self._currentTask.stop(abort=True)
                 self.abortThread = True
+                self._currentTask.wake()
 
-
+    def cancelCommandGeneration(self):
+        ## a command requested from the GUI thread would never be generated if
+        ## the GUI thread is waiting for this thread to exit
+        task = self.task
+        if isinstance(task, GuiThreadCall):
+            task.cancel()
 
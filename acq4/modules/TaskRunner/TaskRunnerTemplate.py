@@ -148,6 +148,12 @@ class Ui_MainWindow(object):
         self.seqRepetitionSpin.setMaximum(1000000)
         self.seqRepetitionSpin.setObjectName(_fromUtf8("seqRepetitionSpin"))
         self.verticalLayout.addWidget(self.seqRepetitionSpin)
+        self.seqPipelineCheck = QtGui.QCheckBox(self.dockWidgetContents_7)
+        self.seqPipelineCheck.setObjectName(_fromUtf8("seqPipelineCheck"))
+        self.verticalLayout.addWidget(self.seqPipelineCheck)
+        self.seqLazyCheck = QtGui.QCheckBox(self.dockWidgetContents_7)
+        self.seqLazyCheck.setObjectName(_fromUtf8("seqLazyCheck"))
+        self.verticalLayout.addWidget(self.seqLazyCheck)
         spacerItem3 = QtGui.QSpacerItem(17, 18, QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Expanding)
         self.verticalLayout.addItem(spacerItem3)
         self.label_2 = QtGui.QLabel(self.dockWidgetContents_7)
@@ -259,6 +265,12 @@ class Ui_MainWindow(object):
         self.label_10.setText(_translate("MainWindow", "Sequence Parameters", None))
         self.label_9.setText(_translate("MainWindow", "Cycle Time", None))
         self.label_11.setText(_translate("MainWindow", "Repetitions", None))
+        self.seqPipelineCheck.setToolTip(_translate("MainWindow", "Prepare the next task while the current task is running,\n"
+"and store results in the background.", None))
+        self.seqPipelineCheck.setText(_translate("MainWindow", "Pipeline", None))
+        self.seqLazyCheck.setToolTip(_translate("MainWindow", "Generate the command for each task just before it runs,\n"
+"rather than generating the entire sequence before starting.", None))
+        self.seqLazyCheck.setText(_translate("MainWindow", "Lazy", None))
         self.label_2.setText(_translate("MainWindow", "Parameter Space: ", None))
         self.paramSpaceLabel.setText(_translate("MainWindow", "0", None))
         self.label_4.setText(_translate("MainWindow", "Total time:", None))
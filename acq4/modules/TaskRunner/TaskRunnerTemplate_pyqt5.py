@@ -132,6 +132,12 @@ class Ui_MainWindow(object):
         self.seqRepetitionSpin.setMaximum(1000000)
         self.seqRepetitionSpin.setObjectName("seqRepetitionSpin")
         self.verticalLayout.addWidget(self.seqRepetitionSpin)
+        self.seqPipelineCheck = QtWidgets.QCheckBox(self.dockWidgetContents_7)
+        self.seqPipelineCheck.setObjectName("seqPipelineCheck")
+        self.verticalLayout.addWidget(self.seqPipelineCheck)
+        self.seqLazyCheck = QtWidgets.QCheckBox(self.dockWidgetContents_7)
+        self.seqLazyCheck.setObjectName("seqLazyCheck")
+        self.verticalLayout.addWidget(self.seqLazyCheck)
         spacerItem3 = QtWidgets.QSpacerItem(17, 18, QtWidgets.QSizePolicy.Minimum, QtWidgets.QSizePolicy.Expanding)
         self.verticalLayout.addItem(spacerItem3)
         self.label_2 = QtWidgets.QLabel(self.dockWidgetContents_7)
@@ -244,6 +250,12 @@ class Ui_MainWindow(object):
         self.label_10.setText(_translate("MainWindow", "Sequence Parameters"))
         self.label_9.setText(_translate("MainWindow", "Cycle Time"))
         self.label_11.setText(_translate("MainWindow", "Repetitions"))
+        self.seqPipelineCheck.setToolTip(_translate("MainWindow", "Prepare the next task while the current task is running,\n"
+"and store results in the background."))
+        self.seqPipelineCheck.setText(_translate("MainWindow", "Pipeline"))
+        self.seqLazyCheck.setToolTip(_translate("MainWindow", "Generate the command for each task just before it runs,\n"
+"rather than generating the entire sequence before starting."))
+        self.seqLazyCheck.setText(_translate("MainWindow", "Lazy"))
         self.label_2.setText(_translate("MainWindow", "Parameter Space: "))
         self.paramSpaceLabel.setText(_translate("MainWindow", "0"))
         self.label_4.setText(_translate("MainWindow", "Total time:"))
@@ -0,0 +1,166 @@
+from __future__ import print_function
+import time, threading
+from collections import OrderedDict
+import pytest
+import acq4.pyqtgraph as pg
+from acq4.util import Qt
+from acq4.modules.TaskRunner.TaskRunner import TaskThread, GuiThreadCall
+
+
+class FakeTask(object):
+    """Stands in for Manager.Task; finishes immediately."""
+    def __init__(self, cmd):
+        self.cmd = cmd
+        self.startTime = self.stopTime = None
+        self.stopped = False
+
+    def execute(self, block=True):
+        self.startTime = self.stopTime = time.time()
+
+    def waitUntilDone(self):
+        return True
+
+    def wake(self):
+        pass
+
+    def getResult(self, storeData=True):
+        return {'cmd': self.cmd}
+
+    def stop(self, abort=False):
+        self.stopped = True
+
+    def storeResult(self, background=None):
+        pass
+
+    def storageDone(self):
+        return True
+
+    def waitForStorage(self):
+        return {}
+
+
+class FakePool(object):
+    def stats(self):
+        return {}
+
+
+class FakeManager(object):
+    def __init__(self):
+        self.tasks = []
+
+    def createTask(self, cmd):
+        self.tasks.append(FakeTask(cmd))
+        return self.tasks[-1]
+
+    def getWriterPool(self):
+        return FakePool()
+
+
+class FakeUi(object):
+    def __init__(self):
+        self.manager = FakeManager()
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_lazy_linked_params(pipeline):
+    app = pg.mkQApp()
+    guiThread = Qt.QThread.currentThread()
+    calls = []
+
+    def generate(params):
+        calls.append((dict(params), Qt.QThread.currentThread() is guiThread))
+        return {'protocol': {'cycleTime': 0}, 'Dev2': {'b': params[('Dev2', 'b')]}}
+
+    # ('Dev2', 'b') is linked to ('Dev1', 'a') and has no axis of its own
+    paramSpace = OrderedDict([(('Dev1', 'a'), [0, 1, 2]), (('Dev1', 'c'), [0, 1])])
+    linked = {('Dev1', 'a'): [('Dev2', 'b')], ('Dev1', 'c'): []}
+
+    ui = FakeUi()
+    thread = TaskThread(ui)
+    thread.startTask(GuiThreadCall(generate), paramSpace, pipeline=pipeline, linkedParams=linked)
+    start = time.time()
+    while not thread.wait(10) and time.time() - start < 10:
+        app.processEvents()
+    assert thread.isFinished()
+
+    assert len(calls) == 6
+    for params, inGuiThread in calls:
+        assert inGuiThread
+        assert params[('Dev2', 'b')] == params[('Dev1', 'a')]
+    assert [t.cmd['Dev2']['b'] for t in ui.manager.tasks] == [0, 0, 1, 1, 2, 2]
+
+
+def callInThread(fn):
+    result = {}
+    def run():
+        try:
+            result['value'] = fn()
+        except Exception as e:
+            result['error'] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, result
+
+
+def test_gui_thread_call():
+    app = pg.mkQApp()
+    calls = []
+    def fn(x):
+        calls.append(x)
+        if x < 0:
+            raise ValueError(x)
+        return x * 2
+
+    call = GuiThreadCall(fn)
+    assert call(1) == 2   # GUI thread calls run directly
+    for arg, expect in [(2, 4), (-1, ValueError)]:
+        thread, result = callInThread(lambda: call(arg))
+        while thread.is_alive():
+            app.processEvents()
+            thread.join(0.01)
+        if expect is ValueError:
+            assert isinstance(result['error'], ValueError)
+        else:
+            assert result['value'] == expect
+    assert calls == [1, 2, -1]
+
+
+@pytest.mark.parametrize('cancel', [False, True])
+def test_gui_thread_call_no_deadlock(cancel):
+    # the GUI thread waits on the calling thread without processing events
+    app = pg.mkQApp()
+    calls = []
+    call = GuiThreadCall(calls.append, timeout=None if cancel else 0.2)
+    thread, result = callInThread(lambda: call(1))
+    if cancel:
+        time.sleep(0.1)
+        call.cancel()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert isinstance(result['error'], Exception)
+    assert (result['error'].args[0] == 'stop') == cancel
+
+    # the abandoned call is never run
+    app.processEvents()
+    assert calls == []
+
+
+@pytest.mark.parametrize('pipeline', [False, True])
+def test_stop_while_generating(pipeline):
+    # stop(block=True) from the GUI thread while the task thread waits for a command
+    app = pg.mkQApp()
+    calls = []
+    def generate(params):
+        calls.append(params)
+        return {'protocol': {'cycleTime': 0}}
+
+    ui = FakeUi()
+    thread = TaskThread(ui)
+    errors = []
+    thread.sigExitFromError.connect(lambda: errors.append(True))
+    thread.startTask(GuiThreadCall(generate), OrderedDict([(('Dev1', 'a'), [0, 1, 2])]), pipeline=pipeline)
+    time.sleep(0.1)
+    thread.stop(block=True)
+    app.processEvents()
+    assert thread.isFinished()
+    assert calls == [] and ui.manager.tasks == [] and errors == []
@@ -1426,6 +1426,11 @@ def downsample(data, n, axis=0, xvals='subsample'):
                 info[axis]['values'] = info[axis]['values'][::n][:nPts]
             elif xvals == 'downsample':
                 info[axis]['values'] = downsample(info[axis]['values'], n)
+        elif ma.axisIsImplicit(axis):
+            ## implicit axis values (start + i / rate)
+            if xvals == 'downsample':
+                info[axis]['start'] += (n - 1) / (2.0 * info[axis]['rate'])
+            info[axis]['rate'] /= float(n)
         return MetaArray(d2, info=info)
 
 
@@ -28,14 +28,21 @@ except:
     HAVE_HDF5 = False
 
 
-def axis(name=None, cols=None, values=None, units=None):
-    """Convenience function for generating axis descriptions when defining MetaArrays"""
+def axis(name=None, cols=None, values=None, units=None, start=None, rate=None):
+    """Convenience function for generating axis descriptions when defining MetaArrays
+    
+    Evenly sampled axes may be given *start* and *rate* instead of *values*; the
+    axis values (start + i / rate) are then computed only when requested.
+    """
     ax = {}
     cNameOrder = ['name', 'units', 'title']
     if name is not None:
         ax['name'] = name
     if values is not None:
         ax['values'] = values
+    if rate is not None:
+        ax['start'] = 0.0 if start is None else float(start)
+        ax['rate'] = float(rate)
     if units is not None:
         ax['units'] = units
     if cols is not None:
@@ -101,6 +108,10 @@ class MetaArray(object):
             array['rainfall', 'lon':5, 'lat':10]
         Notice that in the second example, there is no need for an extra (4th) axis description
         since the actual values are described (name and units) in the column info for the first axis.
+        
+    Evenly sampled axes (such as time) may be described with 'start' and 'rate' in place of
+    'values'. Such implicit axes behave as if they had values start + arange(n) / rate, but no
+    array of values is stored in memory or on disk.
     """
   
     version = '2'
@@ -177,6 +188,11 @@ class MetaArray(object):
                     if info[i]['values'].ndim != 1 or info[i]['values'].shape[0] != self.shape[i]:
                         raise Exception("Values array for axis %d has incorrect shape. (given %s, but should be %s)" %
                                         (i, str(info[i]['values'].shape), str((self.shape[i],))))
+                elif i < self.ndim and 'rate' in info[i]:
+                    if info[i]['rate'] == 0:
+                        raise Exception("Implicit axis %d has rate 0." % i)
+                    if 'start' not in info[i]:
+                        info[i]['start'] = 0.0
                 if i < self.ndim and 'cols' in info[i]:
                     if not isinstance(info[i]['cols'], list):
                         info[i]['cols'] = list(info[i]['cols'])
@@ -374,6 +390,9 @@ class MetaArray(object):
         ax = self._interpretAxis(axis)
         if 'values' in self._info[ax]:
             return self._info[ax]['values']
+        elif self.axisIsImplicit(ax):
+            info = self._info[ax]
+            return np.arange(self.shape[ax]) / float(info['rate']) + info['start']
         else:
             raise Exception('Array axis %s (%d) has no associated values.' % (str(axis), ax))
   
@@ -383,7 +402,13 @@ class MetaArray(object):
         
     def axisHasValues(self, axis):
         ax = self._interpretAxis(axis)
-        return 'values' in self._info[ax]
+        return 'values' in self._info[ax] or self.axisIsImplicit(ax)
+        
+    def axisIsImplicit(self, axis):
+        """Return True if the values for axis are described by 'start' and 'rate'
+        rather than stored as an array."""
+        ax = self._interpretAxis(axis)
+        return ax < self.ndim and 'values' not in self._info[ax] and 'rate' in self._info[ax]
         
     def axisHasColumns(self, axis):
         ax = self._interpretAxis(axis)
@@ -541,16 +566,21 @@ class MetaArray(object):
                     index = self._getIndex(axis, ind.stop)
                     
                 ## x[Axis:min:max]
-                elif (isinstance(ind.stop, float) or isinstance(ind.step, float)) and ('values' in self._info[axis]):
+                elif (isinstance(ind.stop, float) or isinstance(ind.step, float)) and self.axisHasValues(axis):
                     #print "    axis value range"
-                    if ind.stop is None:
-                        mask = self.xvals(axis) < ind.step
-                    elif ind.step is None:
-                        mask = self.xvals(axis) >= ind.stop
+                    if self.axisIsImplicit(axis) and self._info[axis]['rate'] > 0:
+                        ## compute the equivalent slice without generating the axis values
+                        index = slice(self._implicitIndex(axis, ind.stop, 0),
+                                      self._implicitIndex(axis, ind.step, self.shape[axis]))
                     else:
-                        mask = (self.xvals(axis) >= ind.stop) * (self.xvals(axis) < ind.step)
-                    ##print "mask:", mask
-                    index = mask
+                        if ind.stop is None:
+                            mask = self.xvals(axis) < ind.step
+                        elif ind.step is None:
+                            mask = self.xvals(axis) >= ind.stop
+                        else:
+                            mask = (self.xvals(axis) >= ind.stop) * (self.xvals(axis) < ind.step)
+                        ##print "mask:", mask
+                        index = mask
                     
                 ## x[Axis:columnIndex]
                 elif isinstance(ind.stop, int) or isinstance(ind.step, int):
@@ -594,6 +624,21 @@ class MetaArray(object):
             #print "  normal numerical index"
             return (pos, ind, False)
   
+    def _implicitIndex(self, axis, value, default):
+        ## return the first index on an implicit axis (rate > 0) whose value is >= value
+        if value is None:
+            return default
+        info = self._info[axis]
+        start, rate = info['start'], float(info['rate'])
+        n = self.shape[axis]
+        i = int(np.clip(np.ceil((value - start) * rate), 0, n))
+        ## correct for rounding so the result matches a comparison against axisValues()
+        while i > 0 and (i-1) / rate + start >= value:
+            i -= 1
+        while i < n and i / rate + start < value:
+            i += 1
+        return i
+  
     def _getAxis(self, name):
         for i in range(0, len(self._info)):
             axis = self._info[i]
@@ -614,7 +659,22 @@ class MetaArray(object):
   
     def _axisSlice(self, i, cols):
         #print "axisSlice", i, cols
-        if 'cols' in self._info[i] or 'values' in self._info[i]:
+        if self.axisIsImplicit(i):
+            ax = self._axisCopy(i)
+            if isinstance(cols, slice):
+                ## slicing an implicit axis gives another implicit axis
+                start, stop, step = cols.indices(self.shape[i])
+                ax['start'] = start / float(ax['rate']) + ax['start']
+                ax['rate'] = ax['rate'] / float(step)
+            else:
+                ax['values'] = self.axisValues(i)[cols]
+                del ax['start'], ax['rate']
+            if 'cols' in ax:
+                sl = np.array(ax['cols'])[cols]
+                if isinstance(sl, np.ndarray):
+                    sl = list(sl)
+                ax['cols'] = sl
+        elif 'cols' in self._info[i] or 'values' in self._info[i]:
             ax = self._axisCopy(i)
             if 'cols' in ax:
                 #print "  slicing columns..", array(ax['cols']), cols
@@ -651,7 +711,16 @@ class MetaArray(object):
             ax = self._info[i]
             axs = titles[i]
             axs += '%s[%d] :' % (' ' * (maxl - len(axs) + 5 - len(str(self.shape[i]))), self.shape[i])
-            if 'values' in ax:
+            if self.axisIsImplicit(i):
+                if self.shape[i] > 0:
+                    axs += "  values: [%g" % ax['start']
+                    if self.shape[i] > 1:
+                        axs += " ... %g] (step %g)" % ((self.shape[i] - 1) / float(ax['rate']) + ax['start'], 1.0 / ax['rate'])
+                    else:
+                        axs += "]"
+                else:
+                    axs += "  values: []"
+            elif 'values' in ax:
                 if self.shape[i] > 0:
                     v0 = ax['values'][0]
                     axs += "  values: [%g" % (v0)
@@ -741,7 +810,7 @@ class MetaArray(object):
         ## decide which read function to use
         with open(filename, 'rb') as fd:
             magic = fd.read(8)
-            if magic == '\x89HDF\r\n\x1a\n':
+            if magic == b'\x89HDF\r\n\x1a\n':
                 fd.close()
                 self._readHDF5(filename, **kwargs)
                 self._isHDF = True
@@ -749,7 +818,8 @@ class MetaArray(object):
                 fd.seek(0)
                 meta = MetaArray._readMeta(fd)
                 if not kwargs.get("readAllData", True):
-                    self._data = np.empty(meta['shape'], dtype=meta['type'])
+                    ## zero-stride placeholder with the correct shape and dtype; allocates no memory
+                    self._data = np.lib.stride_tricks.as_strided(np.zeros(1, dtype=meta['type']), shape=meta['shape'], strides=(0,)*len(meta['shape']))
                 if 'version' in meta:
                     ver = meta['version']
                 else:
@@ -792,7 +862,7 @@ class MetaArray(object):
             return
         ## the remaining data is the actual array
         if mmap:
-            subarr = np.memmap(fd, dtype=meta['type'], mode='r', shape=meta['shape'])
+            subarr = np.memmap(fd, dtype=meta['type'], mode='r', shape=meta['shape'], offset=fd.tell())
         else:
             subarr = np.fromstring(fd.read(), dtype=meta['type'])
             subarr.shape = meta['shape']
@@ -829,7 +899,7 @@ class MetaArray(object):
                 subarr = pickle.loads(fd.read())
             else:
                 if mmap:
-                    subarr = np.memmap(fd, dtype=meta['type'], mode='r', shape=meta['shape'])
+                    subarr = np.memmap(fd, dtype=meta['type'], mode='r', shape=meta['shape'], offset=fd.tell())
                 else:
                     subarr = np.fromstring(fd.read(), dtype=meta['type'])
             #subarr = subarr.view(subtype)
@@ -1128,6 +1198,8 @@ class MetaArray(object):
             axKeys.extend(opts.get("appendKeys", []))
             axInfo = f['info'][str(ax)]
             for key in axKeys:
+                if key == 'values' and 'values' not in self._info[ax] and 'rate' in axInfo.attrs:
+                    continue  ## implicit axis; values follow from the new length
                 if key in axInfo:
                     v = axInfo[key]
                     v2 = self._info[ax][key]
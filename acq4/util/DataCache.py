@@ -0,0 +1,195 @@
+from __future__ import print_function
+"""
+DataCache.py - Process-wide, size-bounded LRU cache of data read from files
+"""
+
+import os, sys, threading
+from collections import OrderedDict
+import numpy as np
+from six.moves import queue
+from .Mutex import Mutex
+from .debug import printExc
+
+
+class DataCache(object):
+    """Least-recently-used cache of the data returned by FileHandle.read().
+
+    Used via FileHandle.read(cached=True). Entries are keyed by the file path,
+    its modification time and size, and the read arguments (including any
+    selection), so a file that changes on disk is never served stale.
+
+    Arrays are returned as read-only views of the cached data, so callers
+    share one copy and must not modify it in place (copy first if needed).
+    MetaArrays share their meta-info as well, which must also not be modified.
+
+    The total size of cached data is bounded by *maxBytes*; least recently
+    used entries are evicted first. See stats() for hit/eviction counts.
+
+    prefetch() reads files into the cache in a background thread, eg. the
+    next few files of a sequence while the user looks at the current one.
+    """
+    def __init__(self, maxBytes=500e6):
+        self.maxBytes = int(maxBytes)
+        self.lock = Mutex(recursive=True)
+        self.entries = OrderedDict()   # key: (data, nbytes), least recently used first
+        self.nbytes = 0
+        self._inflight = {}            # key: Event set when a read of key finishes
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'evictedBytes': 0, 'uncacheable': 0}
+        self._prefetchQueue = queue.Queue()
+        self._prefetchThread = None
+
+    def setMaxBytes(self, maxBytes):
+        """Set the maximum total size of cached data, evicting entries as needed."""
+        with self.lock:
+            self.maxBytes = int(maxBytes)
+            self._evict(0)
+
+    def read(self, fileHandle, *args, **kargs):
+        """Return fileHandle.read(*args, **kargs), from the cache if possible."""
+        key = self._key(fileHandle, args, kargs)
+        while True:
+            with self.lock:
+                if key in self.entries:
+                    self._stats['hits'] += 1
+                    self.entries[key] = self.entries.pop(key)  # move to most-recent end
+                    return readOnlyView(self.entries[key][0])
+                event = self._inflight.get(key, None)
+                if event is None:
+                    self._stats['misses'] += 1
+                    event = threading.Event()
+                    self._inflight[key] = event
+                    break
+            ## another thread (probably the prefetcher) is already reading this file
+            event.wait()
+
+        try:
+            data = fileHandle.read(*args, **kargs)
+            stored = self._store(key, data)
+        finally:
+            with self.lock:
+                del self._inflight[key]
+            event.set()
+        return readOnlyView(data) if stored else data
+
+    def prefetch(self, fileHandles, *args, **kargs):
+        """Read each file in *fileHandles* into the cache in a background thread.
+
+        Arguments after *fileHandles* are passed to FileHandle.read(). Files
+        that are already cached are skipped. Any previously requested prefetch
+        that has not started yet is cancelled.
+        """
+        self.cancelPrefetch()
+        for fh in fileHandles:
+            self._prefetchQueue.put((fh, args, kargs))
+        with self.lock:
+            if self._prefetchThread is None:
+                self._prefetchThread = threading.Thread(target=self._prefetchLoop, name="DataCache prefetch")
+                self._prefetchThread.daemon = True
+                self._prefetchThread.start()
+
+    def cancelPrefetch(self):
+        """Discard all pending prefetch requests."""
+        while True:
+            try:
+                self._prefetchQueue.get_nowait()
+            except queue.Empty:
+                break
+
+    def clear(self):
+        """Remove all entries from the cache."""
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Return a dict of cache statistics: 'hits', 'misses', 'evictions',
+        'evictedBytes', 'uncacheable' (reads too large or of a type that can
+        not be cached), 'entries', 'bytes' and 'maxBytes'.
+        """
+        with self.lock:
+            stats = self._stats.copy()
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.nbytes
+            stats['maxBytes'] = self.maxBytes
+            return stats
+
+    def _key(self, fileHandle, args, kargs):
+        path = fileHandle.name()
+        st = os.stat(path)
+        ## selections may contain slices and dicts, which are not hashable
+        return (path, st.st_mtime, st.st_size, repr(args), repr(sorted(kargs.items())))
+
+    def _store(self, key, data):
+        nbytes = dataSize(data)
+        with self.lock:
+            if nbytes is None or nbytes > self.maxBytes:
+                self._stats['uncacheable'] += 1
+                return False
+            makeReadOnly(data)
+            self._evict(nbytes)
+            self.entries[key] = (data, nbytes)
+            self.nbytes += nbytes
+            return True
+
+    def _evict(self, nbytes):
+        ## remove least recently used entries until nbytes more will fit
+        while len(self.entries) > 0 and self.nbytes + nbytes > self.maxBytes:
+            key, (data, size) = self.entries.popitem(last=False)
+            self.nbytes -= size
+            self._stats['evictions'] += 1
+            self._stats['evictedBytes'] += size
+
+    def _prefetchLoop(self):
+        while True:
+            fh, args, kargs = self._prefetchQueue.get()
+            try:
+                if fh.exists():
+                    self.read(fh, *args, **kargs)
+            except Exception:
+                printExc("Error prefetching %s:" % fh.name())
+
+
+def _isMetaArray(data):
+    return hasattr(data, 'implements') and data.implements('MetaArray')
+
+
+def dataSize(data):
+    """Return the approximate number of bytes used by *data*, or None if it is
+    not a type that can be cached (eg. a MetaArray backed by an open HDF5 file).
+    """
+    if isinstance(data, np.ndarray):
+        if data.dtype == object:
+            return None
+        return data.nbytes
+    if _isMetaArray(data):
+        if not isinstance(data._data, np.ndarray) or data.dtype == object:
+            return None
+        size = data._data.nbytes
+        for ax in data._info:
+            if isinstance(ax.get('values', None), np.ndarray):
+                size += ax['values'].nbytes
+        return size
+    if isinstance(data, (bytes, type(u''))):
+        return sys.getsizeof(data)
+    return None
+
+
+def makeReadOnly(data):
+    """Mark the array(s) in *data* as not writeable."""
+    if _isMetaArray(data):
+        data = data._data
+    if isinstance(data, np.ndarray):
+        data.flags.writeable = False
+
+
+def readOnlyView(data):
+    """Return a new read-only view of the array (or MetaArray) *data*. Other
+    types are returned unchanged.
+    """
+    if _isMetaArray(data):
+        return type(data)(readOnlyView(data._data), info=data._info)
+    if isinstance(data, np.ndarray):
+        view = data.view()
+        view.flags.writeable = False
+        return view
+    return data
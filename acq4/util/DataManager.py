@@ -15,7 +15,8 @@ if __name__ == '__main__':
     path = os.path.dirname(os.path.abspath(__file__))
     sys.path.append(os.path.join(path, '..', '..'))
 
-import threading, os, re, sys, shutil
+import threading, os, re, sys, shutil, zlib, hashlib
+import numpy as np
 from acq4.util.functions import strncmp
 from acq4.util.configfile import *
 import time
@@ -29,6 +30,12 @@ import acq4.filetypes as filetypes
 from acq4.util.debug import *
 import copy
 import acq4.util.advancedTypes as advancedTypes
+from acq4.util import dirindex
+from acq4.util.DataCache import DataCache
+
+
+## Files in a managed directory that are not listed by DirHandle.ls()
+indexFileNames = ['.index', '.log', dirindex.LogIndex.fileName, '.index.old', dirindex.LogIndex.fileName + '.old', '.metacache']
 
 
 def abspath(fileName):
@@ -36,6 +43,19 @@ def abspath(fileName):
     return os.path.normcase(os.path.abspath(fileName))
 
 
+def userCacheDir():
+    """Return the per-user directory for caches that acq4 can regenerate (not
+    the data tree, which may be shared with other users).
+    """
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA', os.environ.get('APPDATA', os.path.expanduser('~')))
+        return os.path.join(base, 'acq4', 'cache')
+    elif sys.platform == 'darwin':
+        return os.path.expanduser('~/Library/Caches/acq4')
+    else:
+        return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'acq4')
+
+
 def getDataManager():
     inst = DataManager.INSTANCE
     if inst is None:
@@ -55,6 +75,37 @@ def getFileHandle(fileName):
     return getDataManager().getFileHandle(fileName)
 
 
+def setIndexFormat(fmt, migrate=True):
+    """Set the format used for new directory index files: 'text' (the
+    configfile-format `.index` files) or 'log' (binary append-only
+    `.indexlog` files; see acq4.util.dirindex).
+
+    If *migrate* is True, existing indexes in the other format are converted
+    the next time they are modified. Indexes in either format can always be
+    read.
+
+    Versions of acq4 that predate the log format only read `.index` files.
+    When a directory is migrated to the log format its `.index` file is left
+    in place, so older versions still see the directory as it was at the time
+    of migration, but not any later changes. Use DirHandle.convertIndex('text')
+    to bring the `.index` file up to date again.
+    """
+    getDataManager().setIndexFormat(fmt, migrate)
+
+
+def crawl(path, background=False):
+    """Read the listing and meta-info of every directory beneath *path* into
+    the tree-wide MetaCache, after which browsing the tree is served from
+    memory. See MetaCache.crawl().
+    """
+    return getDataManager().getMetaCache().crawl(path, background=background)
+
+
+def getDataCache():
+    """Return the DataCache used by FileHandle.read(cached=True)."""
+    return getDataManager().getDataCache()
+
+
 def cleanup():
     """
     Free memory by deleting cached handles that are not in use elsewhere.
@@ -78,6 +129,38 @@ class DataManager(Qt.QObject):
         DataManager.INSTANCE = self
         self.cache = {}
         self.lock = Mutex(Qt.QMutex.Recursive)
+        self.indexFormat = 'text'
+        self.migrateIndexes = False
+        self.metaCache = None
+        self.dataCache = None
+
+    def setIndexFormat(self, fmt, migrate=True):
+        """See setIndexFormat()."""
+        if fmt not in ('text', 'log'):
+            raise ValueError("Index format must be 'text' or 'log' (got %r)" % fmt)
+        self.indexFormat = fmt
+        self.migrateIndexes = migrate
+
+    def getMetaCache(self):
+        """Return the MetaCache shared by all handles, creating it if needed."""
+        with self.lock:
+            if self.metaCache is None:
+                self.metaCache = MetaCache()
+            return self.metaCache
+
+    def getDataCache(self):
+        """Return the DataCache used by FileHandle.read(cached=True), creating it if needed."""
+        with self.lock:
+            if self.dataCache is None:
+                self.dataCache = DataCache()
+            return self.dataCache
+
+    def _cachedTree(self, path):
+        ## Return the MetaCache if it holds path, otherwise None
+        cache = self.metaCache
+        if cache is not None and cache.covers(path):
+            return cache
+        return None
         
     def getDirHandle(self, dirName, create=False):
         with self.lock:
@@ -174,6 +257,290 @@ class DataManager(Qt.QObject):
         return abspath(name) in self.cache
         
 
+class MetaCache(object):
+    """Tree-wide cache of directory listings and meta-info.
+
+    crawl() walks an entire storage tree once (listing and reading the index
+    of many directories in parallel) and afterward DirHandle.ls(), subDirs()
+    and info() for any directory in the tree are answered from memory.
+
+    For each crawled tree a snapshot is saved in the per-user cache directory
+    (see snapshotPath()); nothing is written into the data tree. Each
+    directory entry in the snapshot is stamped with the modification times of
+    the directory and its index file, so that crawling the tree again only
+    re-reads directories that have changed. Snapshots are written as python
+    literals and read back with the restricted configfile evaluator, so a
+    snapshot can not execute code.
+
+    Changes made through file handles are reported to the cache by
+    FileHandle.emitChanged(); the affected entries are dropped and re-read the
+    next time they are requested. Like TextIndex.reload(), every lookup also
+    compares the modification times of the directory and its index file with
+    the stamp of the cached entry and re-reads the directory if they differ,
+    so changes made by other processes are picked up as well. Modifying a
+    file in place (which changes neither time stamp) does not invalidate
+    anything; file contents are not cached here.
+    """
+    snapshotVersion = 2
+    snapshotDir = None   # directory for snapshots; None uses userCacheDir()/metacache
+
+    def __init__(self, threads=8):
+        self.threads = threads
+        self.lock = Mutex(Qt.QMutex.Recursive)
+        self.roots = []       # abspath of each crawled tree
+        self.entries = {}     # abspath: entry dict (see _scanDir)
+        self.sorted = {}      # abspath: list of names sorted by date (not saved)
+        self._serial = 0      # incremented on each invalidation
+        self._invalidated = {}  # abspath: serial number at last invalidation
+
+    def crawl(self, path, background=False, save=True):
+        """Read the listing and meta-info for every directory beneath *path*.
+
+        If *background* is True, crawl in a separate thread and return the
+        thread. If *save* is True, write a snapshot of the tree when done
+        (see snapshotPath(); failures to write are ignored).
+        """
+        if background:
+            t = threading.Thread(target=self.crawl, args=(path,), kwargs={'save': save}, name="MetaCache crawl")
+            t.daemon = True
+            t.start()
+            return t
+
+        root = abspath(path)
+        snapshot = self._loadSnapshot(root)
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool(self.threads)
+        try:
+            level = [os.path.abspath(path)]
+            while len(level) > 0:
+                serial = self._serial
+                results = pool.map(lambda p: self._updateDir(p, snapshot), level)
+                nextLevel = []
+                with self.lock:
+                    for dirPath, entry in results:
+                        if entry is None:
+                            continue
+                        self._store(dirPath, entry, serial)
+                        nextLevel.extend([os.path.join(dirPath, d) for d in entry['dirs']])
+                level = nextLevel
+        finally:
+            pool.close()
+
+        with self.lock:
+            if root not in self.roots:
+                self.roots.append(root)
+        if save:
+            self.saveSnapshot(path)
+
+    def covers(self, path):
+        """Return True if *path* is inside a crawled tree."""
+        path = abspath(path)
+        for root in self.roots:
+            if path == root or path.startswith(os.path.join(root, '')):
+                return True
+        return False
+
+    def ls(self, path):
+        """Return the names of all files in directory *path*, sorted by date."""
+        key = abspath(path)
+        with self.lock:
+            entry = self._entry(path)
+            files = self.sorted.get(key, None)
+            if files is None:
+                files = sorted(entry['names'], key=lambda f: (self._fileCTime(path, entry, f), f))
+                self.sorted[key] = files
+            return files[:]
+
+    def subDirs(self, path):
+        """Return the names of all sub-directories of *path*, sorted by date."""
+        with self.lock:
+            dirs = set(self._entry(path)['dirs'])
+            return [f for f in self.ls(path) if f in dirs]
+
+    def info(self, path, fileName='.'):
+        """Return the meta-info for *fileName* in directory *path* (by default,
+        the info for the directory itself). The returned dict must not be
+        modified.
+        """
+        with self.lock:
+            index = self._entry(path)['index']
+            if index is None:
+                return {}
+            return index.get(fileName, {})
+
+    def isManaged(self, path):
+        with self.lock:
+            return self._entry(path)['index'] is not None
+
+    def dirType(self, path):
+        """Return the 'dirType' recorded in the meta-info for directory *path*, or None."""
+        return self.info(path).get('dirType', None)
+
+    def sequenceParams(self, path):
+        """Return the 'sequenceParams' recorded for directory *path* (a protocol
+        sequence), or None.
+        """
+        return self.info(path).get('sequenceParams', None)
+
+    def invalidate(self, path, recursive=False):
+        """Drop cached data for directory *path* so it is read again when next needed."""
+        key = abspath(path)
+        with self.lock:
+            self._serial += 1
+            keys = [key]
+            if recursive:
+                prefix = os.path.join(key, '')
+                keys.extend([k for k in self.entries if k.startswith(prefix)])
+            for k in keys:
+                self.entries.pop(k, None)
+                self.sorted.pop(k, None)
+                self._invalidated[k] = self._serial
+
+    def handleChanged(self, handle, change, args):
+        """Invalidate the entries affected by a change reported by FileHandle.emitChanged()."""
+        if change in ('moved', 'renamed', 'deleted'):
+            paths = args[:1] if change == 'deleted' else args[:2]
+            for p in paths:
+                self.invalidate(p, recursive=True)
+                self.invalidate(os.path.dirname(p))
+        elif handle.path is not None:
+            if handle.isDir():
+                self.invalidate(handle.path)
+            self.invalidate(os.path.dirname(handle.path))
+
+    def snapshotPath(self, path):
+        """Return the file used to store the snapshot of the tree rooted at *path*."""
+        snapshotDir = self.snapshotDir
+        if snapshotDir is None:
+            snapshotDir = os.path.join(userCacheDir(), 'metacache')
+        key = hashlib.sha1(abspath(path).encode('utf-8')).hexdigest()
+        return os.path.join(snapshotDir, key + '.metacache')
+
+    def saveSnapshot(self, path):
+        """Write all cached entries beneath *path* to its snapshot file."""
+        root = abspath(path)
+        prefix = os.path.join(root, '')
+        with self.lock:
+            entries = dict([(k[len(prefix):], v) for k, v in self.entries.items() if k.startswith(prefix)])
+            if root in self.entries:
+                entries[''] = self.entries[root]
+        fileName = self.snapshotPath(root)
+        try:
+            if not os.path.isdir(os.path.dirname(fileName)):
+                os.makedirs(os.path.dirname(fileName))
+            self._writeSnapshot(fileName, {'version': self.snapshotVersion, 'root': root, 'entries': entries})
+        except (IOError, OSError):
+            printExc("Could not write meta-info cache %s:" % fileName)
+
+    def _writeSnapshot(self, fileName, data):
+        ## repr() must not abbreviate large arrays, or they could not be read back
+        with np.printoptions(threshold=sys.maxsize):
+            text = repr(data)
+        tmpFile = fileName + '.tmp'
+        with open(tmpFile, 'wb') as fh:
+            fh.write(zlib.compress(text.encode('utf-8'), 1))
+        if os.path.exists(fileName) and not hasattr(os, 'replace'):
+            os.remove(fileName)
+        getattr(os, 'replace', os.rename)(tmpFile, fileName)
+
+    def _loadSnapshot(self, root):
+        # return {abspath: entry} from the snapshot of root, or {} if there is none
+        fileName = self.snapshotPath(root)
+        if not os.path.isfile(fileName):
+            return {}
+        try:
+            with open(fileName, 'rb') as fh:
+                text = zlib.decompress(fh.read()).decode('utf-8')
+            data = evalExpression(text, cache=False)
+            if data.get('version', None) != self.snapshotVersion or data.get('root', None) != root:
+                return {}
+        except Exception:
+            printExc("Ignoring unreadable meta-info cache %s:" % fileName)
+            return {}
+        return dict([(abspath(os.path.join(root, k)), v) for k, v in data['entries'].items()])
+
+    def _entry(self, path):
+        # return the entry for path, reading the directory if it is not cached
+        # or if it (or its index file) has been modified since it was read
+        key = abspath(path)
+        entry = self.entries.get(key, None)
+        if entry is not None:
+            try:
+                stamp = self._stamp(path)
+            except OSError:
+                stamp = None
+            if stamp != entry['stamp']:
+                self.entries.pop(key, None)
+                self.sorted.pop(key, None)
+                entry = None
+        if entry is None:
+            serial = self._serial
+            entry = self._scanDir(path)
+            self._store(path, entry, serial)
+        return entry
+
+    def _store(self, path, entry, serial):
+        key = abspath(path)
+        if self._invalidated.get(key, -1) >= serial:
+            return  # changed while being read
+        self.entries[key] = entry
+        self.sorted.pop(key, None)
+
+    def _stamp(self, path):
+        index = dirindex.openIndex(path)
+        indexStamp = None if index is None else (index.fileName, os.path.getmtime(index.path()))
+        return (os.path.getmtime(path), indexStamp)
+
+    def _updateDir(self, path, snapshot):
+        # runs in crawl thread pool; return (path, entry), re-using the snapshot entry if it is current
+        try:
+            old = snapshot.get(abspath(path), None)
+            if old is not None and old['stamp'] == self._stamp(path):
+                return path, old
+            return path, self._scanDir(path)
+        except Exception:
+            printExc("Error reading directory %s:" % path)
+            return path, None
+
+    def _scanDir(self, path):
+        """Read the listing and index for one directory.
+
+        Entries are dicts with keys 'stamp', 'names' (all files in the
+        directory except index/log files), 'dirs' (sub-directory names) and
+        'index' (the index contents as {fileName: info}, or None if the
+        directory is not managed).
+        """
+        stamp = self._stamp(path)
+        names = [f for f in os.listdir(path) if f not in indexFileNames]
+        dirs = [f for f in names if os.path.isdir(os.path.join(path, f))]
+        index = dirindex.openIndex(path)
+        if index is not None:
+            index.reload()
+            index = index.toDict()
+        return {'stamp': stamp, 'names': names, 'dirs': dirs, 'index': index}
+
+    def _fileCTime(self, path, entry, fileName):
+        ## Same order of preference as DirHandle._getFileCTime
+        index = entry['index']
+        if index is not None:
+            t = index.get(fileName, {}).get('__timestamp__', None)
+            if t is not None:
+                return t
+            if fileName in entry['dirs']:
+                try:
+                    t = self.info(os.path.join(path, fileName)).get('__timestamp__', None)
+                except Exception:
+                    t = None
+                if t is not None:
+                    return t
+        m = re.search(r'(20\d\d\.\d\d?\.\d\d?)', fileName)
+        if m is not None:
+            return time.mktime(time.strptime(m.groups()[0], "%Y.%m.%d"))
+        try:
+            return os.path.getctime(os.path.join(path, fileName))
+        except:
+            return 0
+
 
 class FileHandle(Qt.QObject):
     
@@ -339,7 +706,24 @@ class FileHandle(Qt.QObject):
             parent._childChanged()
         
     def read(self, *args, **kargs):
+        """Read and return the data in this file.
+
+        The optional keyword argument *selection* requests only part of the
+        data, eg. ``fh.read(selection={'Channel': 'primary'})`` or
+        ``fh.read(selection={'Time': slice(0, 1000)})``. It may be a dict of
+        {axisName: index} or any index accepted by the returned object. File
+        types that support it (see FileType.supportsSelection) read only the
+        selected region from disk; for other types the whole file is read and
+        then indexed.
+
+        If *cached* is True, the data is returned from (and stored in) the
+        DataCache shared by all modules (see getDataCache()). Arrays returned
+        this way are read-only.
+        """
         self.checkExists()
+        if kargs.pop('cached', False):
+            return self.manager.getDataCache().read(self, *args, **kargs)
+        selection = kargs.pop('selection', None)
         with self.lock:
             typ = self.fileType()
             
@@ -349,8 +733,13 @@ class FileHandle(Qt.QObject):
                 fd.close()
             else:
                 cls = filetypes.getFileType(typ)
+                if selection is not None and cls.supportsSelection:
+                    return cls.read(self, *args, selection=selection, **kargs)
                 data = cls.read(self, *args, **kargs)
-            
+
+            if selection is not None:
+                from acq4.filetypes.MetaArray import selectionIndex
+                data = data[selectionIndex(selection)]
             return data
         
     def fileType(self):
@@ -366,6 +755,8 @@ class FileHandle(Qt.QObject):
             return typ
 
     def emitChanged(self, change, *args):
+        if self.manager.metaCache is not None:
+            self.manager.metaCache.handleChanged(self, change, args)
         self.delayedChanges.append(change)
         self.sigChanged.emit(self, change, args)
 
@@ -442,11 +833,23 @@ class DirHandle(FileHandle):
                 self.createIndex()
         
         ## Let's avoid reading the index unless we really need to.
-        self._indexFileExists = os.path.isfile(self._indexFile())
+        self._indexFileExists = self._getIndex() is not None
     
     def _indexFile(self):
         """Return the name of the index file for this directory. NOT the same as indexFile()"""
-        return os.path.join(self.path, '.index')
+        index = self._getIndex()
+        if index is None:
+            index = dirindex.newIndex(self.path, self.manager.indexFormat)
+        return index.path()
+
+    def _getIndex(self):
+        """Return the index backend (see acq4.util.dirindex) for this directory,
+        or None if the directory is not managed. The index file is not read.
+        """
+        index = self._index
+        if index is None or index.dirPath != self.path or not index.exists():
+            self._index = dirindex.openIndex(self.path)
+        return self._index
     
     def _logFile(self):
         return os.path.join(self.path, '.log')
@@ -487,7 +890,7 @@ class DirHandle(FileHandle):
                     fd = open(logf, 'r')
                     lines = fd.readlines()
                     fd.close()
-                    log = [eval(l.strip()) for l in lines]
+                    log = [evalExpression(l.strip()) for l in lines]
                 except:
                     print("****************** Error reading log file %s! *********************" % logf)
                     raise
@@ -508,6 +911,9 @@ class DirHandle(FileHandle):
     def subDirs(self):
         """Return a list of string names for all sub-directories."""
         with self.lock:
+            cache = self.manager._cachedTree(self.path)
+            if cache is not None:
+                return cache.subDirs(self.path)
             ls = self.ls()
             subdirs = [d for d in ls if os.path.isdir(os.path.join(self.name(), d))]
             return subdirs
@@ -586,6 +992,10 @@ class DirHandle(FileHandle):
         If normcase is True, normalize the case of all names in the list.
         sortMode may be 'date', 'alpha', or None."""
         with self.lock:
+            cache = self.manager._cachedTree(self.path) if sortMode == 'date' else None
+            if cache is not None:
+                files = cache.ls(self.path)
+                return list(map(os.path.normcase, files)) if normcase else files
             if (not useCache) or (sortMode not in self.lsCache):
                 self._updateLsCache(sortMode)
             files = self.lsCache[sortMode]
@@ -603,7 +1013,7 @@ class DirHandle(FileHandle):
         except:
             printExc("Error while listing files in %s:" % self.name())
             files = []
-        for i in ['.index', '.log']:
+        for i in indexFileNames:
             if i in files:
                 files.remove(i)
         
@@ -658,12 +1068,16 @@ class DirHandle(FileHandle):
         return len(self.ls()) > 0
     
     def info(self):
-        self._readIndex(unmanagedOk=True)  ## returns None if this directory has no index file
+        if self.manager._cachedTree(self.path) is None:
+            self._readIndex(unmanagedOk=True)  ## returns None if this directory has no index file
         return advancedTypes.ProtectedDict(self._fileInfo('.'))
     
     def _fileInfo(self, file):
         """Return a dict of the meta info stored for file"""
         with self.lock:
+            cache = self.manager._cachedTree(self.path)
+            if cache is not None:
+                return cache.info(self.path, file)
             if not self.isManaged():
                 return {}
             index = self._readIndex()
@@ -770,14 +1184,9 @@ class DirHandle(FileHandle):
         with self.lock:
             if not self.isManaged(fileName):
                 return
-            index = self._readIndex(lock=False)
+            index = self._writableIndex()
             if fileName in index:
-                try:
-                    del index[fileName]
-                except:
-                    print(type(index))
-                    raise
-                self._writeIndex(index, lock=False)
+                index.remove(fileName)
                 self.emitChanged('meta', fileName)
         
     def isManaged(self, fileName=None):
@@ -817,67 +1226,80 @@ class DirHandle(FileHandle):
         with self.lock:
             if not self.isManaged():
                 self.createIndex()
-            index = self._readIndex(lock=False)
-            append = False
-            if fileName not in index:
-                index[fileName] = {}
-                append = True
-                
-            for k in info:
-                index[fileName][k] = info[k]
-                
-            if append:
-                self._appendIndex({fileName: info})
-                
-            else:
-                self._writeIndex(index, lock=False)
+            index = self._writableIndex()
+            index.update(fileName, info)
             self.emitChanged('meta', fileName)
         
     def _readIndex(self, lock=True, unmanagedOk=False):
+        """Return the index for this directory, re-reading it if the file has
+        changed. The index is a read-only mapping of {fileName: info}.
+        """
         with self.lock:
-            indexFile = self._indexFile()
-            if self._index is None or os.path.getmtime(indexFile) != self._indexMTime:
-                if not os.path.isfile(indexFile):
-                    if unmanagedOk:
-                        return None
-                    else:
-                        raise Exception("Directory '%s' is not managed!" % (self.name()))
-                try:
-                    self._index = readConfigFile(indexFile)
-                    self._indexMTime = os.path.getmtime(indexFile)
-                except:
-                    print("***************Error while reading index file %s!*******************" % indexFile)
-                    raise
-            return self._index
+            index = self._getIndex()
+            if index is None:
+                if unmanagedOk:
+                    return None
+                else:
+                    raise Exception("Directory '%s' is not managed!" % (self.name()))
+            index.reload()
+            return index
         
     def _writeIndex(self, newIndex, lock=True):
         with self.lock:
-            writeConfigFile(newIndex, self._indexFile())
-            self._index = newIndex
-            self._indexMTime = os.path.getmtime(self._indexFile())
+            index = self._getIndex()
+            if index is None:
+                index = dirindex.newIndex(self.path, self.manager.indexFormat)
+            index.write(newIndex)
+            self._index = index
             self._indexFileExists = True
 
-    def _appendIndex(self, info):
+    def _writableIndex(self):
+        """Return the index to be modified, converting it to the configured
+        format first if migration is enabled.
+        """
+        index = self._readIndex(lock=False)
+        if index.format != self.manager.indexFormat and self.manager.migrateIndexes:
+            index = self.convertIndex(self.manager.indexFormat)
+        return index
+
+    def convertIndex(self, fmt):
+        """Rewrite the index for this directory in format *fmt* ('text' or 'log').
+
+        When converting to the log format, the `.index` file is kept so that
+        older versions of acq4 can still read the directory (see
+        setIndexFormat). When converting back to text, `.indexlog` is renamed
+        with an added '.old' extension. Return the new index.
+        """
         with self.lock:
-            indexFile = self._indexFile()
-            appendConfigFile(info, indexFile)
-            self._indexFileExists = True
-            for k in info:
-                self._index[k] = info[k]
-            self._indexMTime = os.path.getmtime(indexFile)
+            index = self._readIndex()
+            if index.format == fmt:
+                return index
+            newIndex = dirindex.newIndex(self.path, fmt)
+            newIndex.write(index.toDict())
+            if index.format == 'log':
+                ## the log index takes precedence over .index, so it must be moved aside
+                oldFile = index.path()
+                backup = oldFile + '.old'
+                if os.path.exists(backup):
+                    os.remove(backup)
+                os.rename(oldFile, backup)
+            self._index = newIndex
+            return newIndex
         
     def checkIndex(self):
         ind = self._readIndex(unmanagedOk=True)
         if ind is None:
             return
-        changed = False
+        missing = []
         for f in ind:
             if not self.exists(f):
                 print("File %s is no more, removing from index." % (os.path.join(self.name(), f)))
-                del ind[f]
-                changed = True
-        if changed:
-            self._writeIndex(ind)
+                missing.append(f)
+        if len(missing) > 0:
+            data = ind.toDict()
+            for f in missing:
+                del data[f]
+            self._writeIndex(data)
         
     def _childChanged(self):
         self.lsCache = {}
@@ -8,12 +8,18 @@ Distributed under MIT/X11 license. See license.txt for more infomation.
 
 from acq4.util.metaarray import *
 import numpy as np
+import itertools
 
 def runSequence(func, params, order, dtype=None, passArgs=False, linkedParams=None):
     """Convenience function that iterates a function over a given parameter space, inserting the function's return value into an array (see SequenceRunner for documentation)"""
     seq = SequenceRunner(params, order, dtype=dtype, passArgs=passArgs, linkedParams=linkedParams)
     return seq.start(func)
 
+def iterSequence(params, order, linkedParams=None):
+    """Convenience function returning a generator that yields (index, params) for each point in a parameter space (see SequenceRunner.iterParams)"""
+    seq = SequenceRunner(params, order, linkedParams=linkedParams)
+    return seq.iterParams()
+
 
 class SequenceRunner:
     """Run a function multiple times with a sequence of parameters. Think of it as a multi-dimensional for-loop.
@@ -28,6 +34,9 @@ class SequenceRunner:
     There are two ways to invoke a SequenceRunner object:
         obj.start(func) -- func will be the kernel function invoked by the SR object.
         obj.start() -- the SR object will invoke obj.execute as the kernel function (This function must be defined in a subclass). 
+        
+    Alternatively, obj.iterParams() returns a generator that yields the parameters for one point at a time, 
+    leaving the caller in control of when (and whether) each point is processed.
     """
   
     def __init__(self, params=None, order=None, dtype=None, passArgs=False, linkedParams=None):
@@ -87,6 +96,18 @@ class SequenceRunner:
         else:
             return self._return
     
+    def iterParams(self):
+        """Generator that yields (index, params) for every point in the parameter space,
+        in the same order used by start(). Parameters are computed only as each point
+        is requested, so memory use does not depend on the size of the parameter space.
+        
+        End functions (see setEndFuncs) are not called.
+        """
+        self.makeParamSpace()
+        shape = [len(self._paramSpace[ax]) for ax in self._order]
+        for ind in itertools.product(*[range(n) for n in shape]):
+            yield ind, self.getParams(ind)
+    
     def nloop(self, ind=None, func=None):
         """Recursively loop over all points in the parameter space"""
         if ind is None:
@@ -94,6 +115,7 @@ class SequenceRunner:
         if len(ind) == len(self._order):
             params = self.getParams(ind)
             stop = False
+            hasResult = True
             try:
                 if self._passArgs:
                     ret = func(**params)
@@ -104,14 +126,18 @@ class SequenceRunner:
                     stop = True
                     if len(e.args) > 1:
                         ret = e.args[1]
+                    else:
+                        ## stopped before producing a result for this point
+                        hasResult = False
                 else:
                     raise
         
-            if self._return is None:
-                self.buildReturnArray(ret)
-                
-            self._return[tuple(ind)] = ret
-            self._runMask[tuple(ind)] = True
+            if hasResult:
+                if self._return is None:
+                    self.buildReturnArray(ret)
+                    
+                self._return[tuple(ind)] = ret
+                self._runMask[tuple(ind)] = True
             #print "--------"
             #print self._return
             if stop:
@@ -243,6 +269,11 @@ if __name__ == '__main__':
     print(s.start(fn, returnMask=True))
 
 
+    print("\n========== iterParams test: generate parameters one point at a time ============")
+    for ind, params in iterSequence({'x': [1,3,5], 'y': [2,4]}, ['x', 'y']):
+        print(ind, params)
+
+
     print("\n========== line end test: functions run at specific edges of the parameter space ============")
     s = SR({'x': [1,3,5,7], 'y': [2,4,6,8]}, ['x', 'y'], passArgs=True)
     def fn(x, y):
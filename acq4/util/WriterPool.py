@@ -0,0 +1,156 @@
+from __future__ import print_function
+"""
+WriterPool.py - Bounded pool of threads for writing data in the background
+"""
+
+import sys, threading
+from six.moves import queue
+from . import ptime
+from .Mutex import Mutex
+from .debug import printExc, logMsg
+
+
+class WriterPool(object):
+    """A fixed number of threads that execute write jobs in the order they are
+    submitted.
+
+    The number of pending jobs is bounded; submit() blocks when the queue is
+    full so that acquisition cannot outrun the disk indefinitely.
+
+    Each job is tagged with a name (usually a device name) and the pool keeps
+    per-name latency statistics (see stats()). Jobs that raise an exception
+    are reported with printExc when they fail, and remain available from
+    errors() for callers that do not wait on the job.
+
+    The threads are daemonic; call shutdown() before exiting to make sure
+    that all queued jobs have been written.
+    """
+    def __init__(self, threads=4, maxPending=32):
+        self.queue = queue.Queue(maxsize=maxPending)
+        self.lock = Mutex()
+        self._stats = {}
+        self._errors = []
+        self._shutdown = False
+        self.threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self._run, name="WriterPool-%d" % i)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def submit(self, name, fn, *args, **kwds):
+        """Queue fn(*args, **kwds) to be run by the next available thread.
+        Return a WriteJob that may be used to wait for completion.
+        """
+        with self.lock:
+            if self._shutdown:
+                raise RuntimeError("Cannot submit job '%s'; WriterPool has been shut down." % name)
+        job = WriteJob(name, fn, args, kwds)
+        self.queue.put(job)
+        return job
+
+    def shutdown(self, wait=True, timeout=None):
+        """Stop accepting new jobs and let the threads exit once all queued
+        jobs have finished.
+
+        If *wait* is True, block until the threads have exited (or *timeout*
+        elapses) and log a summary of any jobs that failed. Return True if all
+        threads have exited.
+        """
+        with self.lock:
+            if self._shutdown:
+                return not any(t.is_alive() for t in self.threads)
+            self._shutdown = True
+        for t in self.threads:
+            self.queue.put(None)
+        if not wait:
+            return False
+        for t in self.threads:
+            t.join(timeout)
+        done = not any(t.is_alive() for t in self.threads)
+        errors = self.errors()
+        if len(errors) > 0:
+            logMsg("%d background write job(s) failed: %s" % (len(errors), ', '.join(sorted(set(e[0] for e in errors)))), msgType='error')
+        if not done:
+            logMsg("Timed out waiting for background write jobs to finish (%d pending)." % self.pending(), msgType='error')
+        return done
+
+    def errors(self, clear=False):
+        """Return a list of (name, exception) for all jobs that have failed.
+        If *clear* is True, the list is emptied.
+        """
+        with self.lock:
+            errors = self._errors[:]
+            if clear:
+                self._errors = []
+            return errors
+
+    def pending(self):
+        """Return the approximate number of jobs waiting to be started."""
+        return self.queue.qsize()
+
+    def stats(self):
+        """Return a dict of {name: {'count', 'errors', 'mean', 'max', 'last'}}
+        describing the time spent executing jobs with each name.
+        """
+        with self.lock:
+            out = {}
+            for name, s in self._stats.items():
+                s = s.copy()
+                s['mean'] = s.pop('total') / s['count']
+                out[name] = s
+            return out
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            job._execute()
+            with self.lock:
+                s = self._stats.setdefault(job.name, {'count': 0, 'errors': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0})
+                s['count'] += 1
+                s['total'] += job.elapsed
+                s['max'] = max(s['max'], job.elapsed)
+                s['last'] = job.elapsed
+                if job.error is not None:
+                    s['errors'] += 1
+                    self._errors.append((job.name, job.error))
+            job._done.set()
+
+
+class WriteJob(object):
+    """Handle to a single job submitted to a WriterPool.
+    """
+    def __init__(self, name, fn, args, kwds):
+        self.name = name
+        self._call = (fn, args, kwds)
+        self._done = threading.Event()
+        self.submitTime = ptime.time()
+        self.elapsed = None   # time spent executing the job
+        self.error = None     # exception raised by the job, if any
+
+    def _execute(self):
+        fn, args, kwds = self._call
+        start = ptime.time()
+        try:
+            fn(*args, **kwds)
+        except Exception:
+            self.error = sys.exc_info()[1]
+            printExc("Error in background write job '%s':" % self.name)
+        finally:
+            self.elapsed = ptime.time() - start
+            self._call = None
+
+    def isDone(self):
+        """Return True if the job has finished (successfully or not)."""
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the job has finished. If the job raised an exception,
+        re-raise it here. Raise RuntimeError if the timeout elapses first.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError("Timed out waiting for write job '%s'." % self.name)
+        if self.error is not None:
+            raise self.error
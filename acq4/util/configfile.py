@@ -1,2 +1,413 @@
+# -*- coding: utf-8 -*-
+"""
+Reading and writing of the indented, python-like configuration file format
+used for device configs, .index files, log files and saved module state.
+
+This module is a drop-in replacement for acq4.pyqtgraph.configfile that reads
+and writes exactly the same format, but:
+
+* Parses the file in a single pass over its lines rather than recursing and
+  re-filtering at each level.
+* Evaluates values with a restricted expression evaluator instead of eval().
+  Values may contain literals, containers, arithmetic, comparisons, boolean
+  and conditional expressions, units (eg. 10*ms) and the names listed in
+  `evalNamespace`. Only the constructors listed in `evalCallables` may be
+  called (array, the numpy dtypes, OrderedDict, Point, ColorMap, the
+  datetime types, readConfigFile and the builtins in `safeBuiltins`);
+  attribute lookups and method calls on values, comprehensions and lambdas
+  are refused, so reading a file never executes code from it. Each distinct
+  value string is compiled only once.
+* Generates output as a list of chunks that is written in a single call,
+  rather than by repeated string concatenation.
+"""
 from __future__ import print_function
 from acq4.pyqtgraph.configfile import *
+import os, sys, ast, datetime, operator
+from six.moves import builtins
+import numpy
+from acq4.pyqtgraph import units
+from acq4.pyqtgraph.pgcollections import OrderedDict
+from acq4.pyqtgraph.python2_3 import asUnicode, basestring
+from acq4.pyqtgraph.Point import Point
+from acq4.pyqtgraph.colormap import ColorMap
+import acq4.pyqtgraph.configfile as _pgconfigfile
+
+
+def writeConfigFile(data, fname):
+    chunks = _genChunks(data)
+    with open(fname, 'w') as fd:
+        fd.writelines(chunks)
+
+
+def readConfigFile(fname):
+    if _pgconfigfile.GLOBAL_PATH is not None:
+        fname2 = os.path.join(_pgconfigfile.GLOBAL_PATH, fname)
+        if os.path.exists(fname2):
+            fname = fname2
+
+    _pgconfigfile.GLOBAL_PATH = os.path.dirname(os.path.abspath(fname))
+
+    try:
+        with open(fname) as fd:
+            s = asUnicode(fd.read())
+        s = s.replace("\r\n", "\n")
+        s = s.replace("\r", "\n")
+        data = parseString(s)[1]
+    except ParseError:
+        sys.exc_info()[1].fileName = fname
+        raise
+    except:
+        print("Error while reading config file %s:" % fname)
+        raise
+    return data
+
+
+def appendConfigFile(data, fname):
+    chunks = _genChunks(data)
+    with open(fname, 'a') as fd:
+        fd.writelines(chunks)
+
+
+def genString(data, indent=''):
+    return ''.join(_genChunks(data, indent))
+
+
+def _genChunks(data, indent='', chunks=None):
+    if chunks is None:
+        chunks = []
+    for k in data:
+        sk = str(k)
+        if len(sk) == 0:
+            print(data)
+            raise Exception('blank dict keys not allowed (see data above)')
+        if sk[0] == ' ' or ':' in sk:
+            print(data)
+            raise Exception('dict keys must not contain ":" or start with spaces [offending key is "%s"]' % sk)
+        val = data[k]
+        if isinstance(val, dict):
+            chunks.append(indent + sk + ':\n')
+            _genChunks(val, indent + '    ', chunks)
+        else:
+            chunks.append(indent + sk + ': ' + repr(val) + '\n')
+    return chunks
+
+
+def parseString(lines, start=0):
+    """Parse configfile-format text (a string or list of lines) beginning at
+    line *start*.
+
+    Return (ln, data) where *ln* is the index of the last line that was
+    parsed and *data* is an OrderedDict.
+    """
+    if isinstance(lines, basestring):
+        lines = lines.split('\n')
+
+    data = OrderedDict()
+    stack = None     # list of (indent, dict) for the blocks currently open
+    pending = None   # (key, dict, indent) for a key with no value, which begins a block if the next line is indented further
+    ln = start - 1
+    l = ''
+    try:
+        for ln in range(start, len(lines)):
+            l = lines[ln]
+
+            ## Skip blank lines or lines starting with #
+            content = l.strip()
+            if len(content) == 0 or content[0] == '#':
+                continue
+
+            lineInd = measureIndent(l)
+            if stack is None:
+                stack = [(lineInd, data)]
+
+            if pending is not None:
+                key, parent, parentInd = pending
+                pending = None
+                if lineInd > parentInd:
+                    block = OrderedDict()
+                    parent[key] = block
+                    stack.append((lineInd, block))
+                else:
+                    parent[key] = {}
+
+            ## Close blocks until we reach the indentation of this line
+            while lineInd < stack[-1][0]:
+                stack.pop()
+                if len(stack) == 0:
+                    ## dedented below the first line; the rest is not part of this block
+                    ln -= 1
+                    return (ln, data)
+            if lineInd > stack[-1][0]:
+                raise ParseError('Indentation is incorrect. Expected %d, got %d' % (stack[-1][0], lineInd), ln+1, l)
+
+            if ':' not in content:
+                raise ParseError('Missing colon', ln+1, l)
+
+            (k, p, v) = content.partition(':')
+            k = k.strip()
+            v = v.strip()
+
+            if len(k) < 1:
+                raise ParseError('Missing name preceding colon', ln+1, l)
+            if k[0] == '(' and k[-1] == ')':  ## If the key looks like a tuple, try evaluating it.
+                try:
+                    k1 = evalExpression(k)
+                    if type(k1) is tuple:
+                        k = k1
+                except:
+                    pass
+
+            block = stack[-1][1]
+            if len(v) > 0 and v[0] != '#':
+                try:
+                    block[k] = evalExpression(v)
+                except:
+                    ex = sys.exc_info()[1]
+                    raise ParseError("Error evaluating expression '%s': [%s: %s]" % (v, ex.__class__.__name__, str(ex)), (ln+1), l)
+            else:
+                pending = (k, block, lineInd)
+
+        if pending is not None:
+            pending[1][pending[0]] = {}
+    except ParseError:
+        raise
+    except:
+        ex = sys.exc_info()[1]
+        raise ParseError("%s: %s" % (ex.__class__.__name__, str(ex)), ln+1, l)
+    return (ln, data)
+
+
+## Names that may be used in config file values. Dotted names (eg. 'datetime.date')
+## are the only attribute lookups allowed.
+evalNamespace = units.allUnits.copy()
+evalNamespace.update({
+    'OrderedDict': OrderedDict,
+    'readConfigFile': readConfigFile,
+    'Point': Point,
+    'ColorMap': ColorMap,
+    'array': numpy.array,  # Needed for reconstructing numpy arrays
+    'True': True,
+    'False': False,
+    'None': None,
+})
+for _name in ['datetime', 'date', 'time', 'timedelta']:
+    evalNamespace['datetime.' + _name] = getattr(datetime, _name)
+if hasattr(datetime, 'timezone'):
+    evalNamespace['datetime.timezone'] = datetime.timezone
+    evalNamespace['datetime.timezone.utc'] = datetime.timezone.utc
+## Builtins that may be called in config file values (eval() exposed all of them)
+safeBuiltins = ['float', 'int', 'str', 'bool', 'list', 'tuple', 'dict', 'set', 'range', 'abs', 'min', 'max', 'round']
+for _name in safeBuiltins:
+    evalNamespace[_name] = getattr(builtins, _name)
+safeDtypes = ['int8', 'uint8',
+              'int16', 'uint16', 'float16',
+              'int32', 'uint32', 'float32',
+              'int64', 'uint64', 'float64']
+for _name in safeDtypes:
+    evalNamespace[_name] = getattr(numpy, _name)
+
+## The only objects that may be called in config file values
+evalCallables = set([OrderedDict, readConfigFile, Point, ColorMap, numpy.array])
+evalCallables.update([evalNamespace[k] for k in evalNamespace if k.startswith('datetime.') and k != 'datetime.timezone.utc'])
+evalCallables.update([getattr(builtins, k) for k in safeBuiltins])
+evalCallables.update([getattr(numpy, k) for k in safeDtypes])
+
+
+_compiledCache = {}
+_compiledCacheSize = 20000
+
+
+def evalExpression(expr, cache=True):
+    """Evaluate a config file value using the restricted evaluator.
+
+    Raises an exception if the expression is invalid or uses a construct that
+    is not allowed in config files. If *cache* is False, the compiled
+    expression is not kept (for large, one-off expressions).
+    """
+    fn = _compiledCache.get(expr, None)
+    if fn is None:
+        fn = _compile(ast.parse(expr, mode='eval').body)
+        if not cache:
+            return fn()
+        if len(_compiledCache) >= _compiledCacheSize:
+            _compiledCache.clear()
+        _compiledCache[expr] = fn
+    return fn()
+
+
+_binaryOps = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: getattr(operator, 'div', operator.truediv),  # match eval() under python 2
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+_unaryOps = {
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+    ast.Not: operator.not_,
+    ast.Invert: operator.invert,
+}
+_compareOps = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+    ast.Is: operator.is_,
+    ast.IsNot: operator.is_not,
+    ast.In: lambda a, b: a in b,
+    ast.NotIn: lambda a, b: a not in b,
+}
+_immutableTypes = (int, float, complex, bool, type(None), str, bytes, type(u''))
+if hasattr(ast, 'Constant'):
+    _constantNodes = (ast.Constant,)
+else:
+    _constantNodes = (ast.Num, ast.Str, ast.Bytes, ast.NameConstant)
+
+
+def _isImmutable(val):
+    if isinstance(val, tuple):
+        return all(_isImmutable(v) for v in val)
+    return type(val) in _immutableTypes
+
+
+def _constant(val):
+    return lambda: val
+
+
+def _compile(node):
+    """Return a function of no arguments that evaluates the expression *node*.
+
+    Sub-expressions that always produce the same immutable value are evaluated
+    here, once.
+    """
+    fn = _compileNode(node)
+    if getattr(fn, '_isConst', False):
+        val = fn()
+        if _isImmutable(val):
+            fn = _constant(val)
+            fn._isConst = True
+    return fn
+
+
+def _compileNode(node):
+    if isinstance(node, _constantNodes):
+        if hasattr(node, 'value'):
+            val = node.value
+        elif hasattr(node, 'n'):
+            val = node.n
+        else:
+            val = node.s
+        fn = _constant(val)
+        fn._isConst = True
+        return fn
+
+    if isinstance(node, (ast.Name, ast.Attribute)):
+        name = _dottedName(node)
+        if name not in evalNamespace:
+            raise NameError("name '%s' is not defined" % name)
+        fn = _constant(evalNamespace[name])
+        fn._isConst = True
+        return fn
+
+    if isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+        items = [_compile(n) for n in node.elts]
+        typ = {ast.Tuple: tuple, ast.List: list, ast.Set: set}[type(node)]
+        fn = lambda: typ([item() for item in items])
+        fn._isConst = typ is tuple and all(getattr(item, '_isConst', False) for item in items)
+        return fn
+
+    if isinstance(node, ast.Dict):
+        if None in node.keys:
+            raise ValueError("'**' is not allowed in config file values")
+        items = [(_compile(k), _compile(v)) for k, v in zip(node.keys, node.values)]
+        return lambda: dict([(k(), v()) for k, v in items])
+
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _unaryOps:
+        op = _unaryOps[type(node.op)]
+        operand = _compile(node.operand)
+        fn = lambda: op(operand())
+        fn._isConst = getattr(operand, '_isConst', False)
+        return fn
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _binaryOps:
+        op = _binaryOps[type(node.op)]
+        left = _compile(node.left)
+        right = _compile(node.right)
+        fn = lambda: op(left(), right())
+        fn._isConst = getattr(left, '_isConst', False) and getattr(right, '_isConst', False)
+        return fn
+
+    if isinstance(node, ast.Compare) and all(type(op) in _compareOps for op in node.ops):
+        ops = [_compareOps[type(op)] for op in node.ops]
+        operands = [_compile(node.left)] + [_compile(n) for n in node.comparators]
+        if len(ops) == 1:
+            op, left, right = ops[0], operands[0], operands[1]
+            fn = lambda: op(left(), right())
+            fn._isConst = getattr(left, '_isConst', False) and getattr(right, '_isConst', False)
+            return fn
+        def fn():
+            left = operands[0]()
+            for op, operand in zip(ops, operands[1:]):
+                right = operand()
+                if not op(left, right):
+                    return False
+                left = right
+            return True
+        fn._isConst = all(getattr(o, '_isConst', False) for o in operands)
+        return fn
+
+    if isinstance(node, ast.BoolOp):
+        values = [_compile(n) for n in node.values]
+        isAnd = isinstance(node.op, ast.And)
+        def fn():
+            for v in values:
+                val = v()
+                if bool(val) != isAnd:
+                    return val
+            return val
+        fn._isConst = all(getattr(v, '_isConst', False) for v in values)
+        return fn
+
+    if isinstance(node, ast.IfExp):
+        test = _compile(node.test)
+        body = _compile(node.body)
+        orelse = _compile(node.orelse)
+        fn = lambda: body() if test() else orelse()
+        fn._isConst = all(getattr(f, '_isConst', False) for f in (test, body, orelse))
+        return fn
+
+    if isinstance(node, ast.Call):
+        if any(isinstance(a, getattr(ast, 'Starred', ())) for a in node.args) or any(kw.arg is None for kw in node.keywords):
+            raise ValueError("'*' and '**' arguments are not allowed in config file values")
+        if getattr(node, 'starargs', None) is not None or getattr(node, 'kwargs', None) is not None:
+            raise ValueError("'*' and '**' arguments are not allowed in config file values")
+        if not isinstance(node.func, (ast.Name, ast.Attribute)):
+            raise ValueError("Only named constructors may be called in config file values")
+        name = _dottedName(node.func)
+        if evalNamespace.get(name, None) not in evalCallables:
+            raise ValueError("Calling '%s' is not allowed in config file values" % name)
+        func = _compile(node.func)
+        args = [_compile(a) for a in node.args]
+        kwds = [(kw.arg, _compile(kw.value)) for kw in node.keywords]
+        return lambda: func()(*[a() for a in args], **dict([(k, v()) for k, v in kwds]))
+
+    raise ValueError("Expression type '%s' is not allowed in config file values" % type(node).__name__)
+
+
+def _dottedName(node):
+    """Return the dotted name ('a.b.c') of a Name or Attribute node. Attribute
+    lookups on anything other than a plain name are refused.
+    """
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.insert(0, node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        raise ValueError("Attribute lookups are not allowed in config file values")
+    parts.insert(0, node.id)
+    return '.'.join(parts)
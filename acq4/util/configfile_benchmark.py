@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the configfile parser and writer (acq4.util.configfile) against
+the original implementation in acq4.pyqtgraph.configfile.
+
+The corpus is every .index, .log and .cfg file found below the paths given on
+the command line (eg. a day of experiment data). With no arguments, the
+config files in this repository are used together with a generated 10k-entry
+.index and .log in the format written by DataManager.
+
+Usage:  python -m acq4.util.configfile_benchmark [path ...]
+"""
+from __future__ import print_function
+import os, sys, tempfile, shutil
+import acq4.util.ptime as ptime
+import acq4.pyqtgraph.configfile as oldcf
+import acq4.util.configfile as newcf
+
+
+def findCorpus(paths):
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+        for dirPath, dirs, fileNames in os.walk(path):
+            for f in fileNames:
+                if f in ('.index', '.log') or f.endswith('.cfg'):
+                    files.append(os.path.join(dirPath, f))
+    return files
+
+
+def generateCorpus(path, n=10000):
+    """Write a .index and .log with *n* entries into *path*, resembling those of a protocol sequence directory."""
+    index = newcf.OrderedDict([('.', {'__timestamp__': 1.5e9, 'sequenceParams': {('Clamp1', 'holding'): list(range(10))}})])
+    with open(os.path.join(path, '.log'), 'w') as log:
+        for i in range(n):
+            t = 1.5e9 + i * 1.137
+            index['%03d' % i] = {'__timestamp__': t, '__object_type__': 'DirHandle',
+                                 'Clamp1.holding': -65e-3 + (i % 10) * 5e-3, 'notes': 'sweep %d' % i}
+            log.write("%s\n" % repr({'__timestamp__': t, '__message__': 'Recorded sweep %d' % i}))
+    newcf.writeConfigFile(index, os.path.join(path, '.index'))
+    return findCorpus([path])
+
+
+def readLog(module, fileName):
+    with open(fileName) as fd:
+        lines = fd.readlines()
+    evalFn = getattr(module, 'evalExpression', eval)
+    return [evalFn(l.strip()) for l in lines if l.strip() != '']
+
+
+def run(files):
+    times = {}
+    size = 0
+    for name, mod in [('original', oldcf), ('new', newcf)]:
+        start = ptime.time()
+        data = {}
+        for f in files:
+            mod.GLOBAL_PATH = oldcf.GLOBAL_PATH = None
+            if os.path.basename(f) == '.log':
+                data[f] = readLog(mod, f)
+            else:
+                data[f] = mod.readConfigFile(f)
+        times[name + ' read'] = ptime.time() - start
+
+        start = ptime.time()
+        for f in files:
+            if isinstance(data[f], dict):
+                mod.genString(data[f])
+        times[name + ' write'] = ptime.time() - start
+
+        if name == 'original':
+            expected = data
+        elif data != expected:
+            print("WARNING: parsed data differs between implementations!")
+
+    for f in files:
+        size += os.path.getsize(f)
+    print("%d files (%0.1f kB)" % (len(files), size / 1e3))
+    for op in ['read', 'write']:
+        old, new = times['original ' + op], times['new ' + op]
+        print("  %-5s  original %0.3f s   new %0.3f s   (%0.1fx)" % (op, old, new, old / max(new, 1e-9)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        run(findCorpus(sys.argv[1:]))
+    else:
+        repoPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..')
+        tmp = tempfile.mkdtemp()
+        try:
+            run(findCorpus([os.path.join(repoPath, 'config')]) + generateCorpus(tmp))
+        finally:
+            shutil.rmtree(tmp)
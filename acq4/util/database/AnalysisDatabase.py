@@ -3,6 +3,7 @@ import six
 from six.moves import range
 
 from .database import *
+from .database import _changeFieldType
 from acq4.util import DataManager
 from acq4.pyqtgraph.widgets.ProgressDialog import ProgressDialog
 import acq4.util.debug as debug
@@ -30,11 +31,26 @@ class AnalysisDatabase(SqliteDatabase):
     
     Version = '1'
 
+    ## tables used internally; queries on these are not recorded for the query plan report
+    InternalTables = ('DbParameters', 'TableConfig', 'ColumnConfig')
+    
+    ## maximum number of distinct queries remembered for queryPlanReport()
+    MaxRecordedQueries = 500
+
 
     def __init__(self, dbFile, dataModel, baseDir=None):
         create = False
         self.tableConfigCache = None
         self.columnConfigCache = advancedTypes.CaselessDict()
+        self._dirTypeCache = {}      # dir name: dir type
+        self._dirRowIDCache = {}     # (table, dir name): rowid
+        self._dirCache = {}          # (table, rowid): DirHandle
+        
+        ## record of queries and the columns they search on (see queryPlanReport)
+        self._queryLog = collections.OrderedDict()   # normalized SQL: [count, table, example SQL]
+        self._columnUse = collections.OrderedDict()  # (table, column): [count, table, column]
+        self._viewJoins = {}                         # view: [(table, column), ...]
+        self._autoIndex = None                       # (minUses, minRows) if enabled
         
         self.setDataModel(dataModel)
         self._baseDir = None
@@ -226,6 +242,31 @@ class AnalysisDatabase(SqliteDatabase):
         """Sets the base dir which prefixes all file names in the database. Must be a DirHandle."""
         self.setCtrlParam('BaseDirectory', baseDir.name())
         self._baseDir = baseDir
+        self._clearDirCache()
+
+    def clearCache(self):
+        """Clear all cached table configuration and directory lookups. 
+        This is only necessary if the DB was modified through a different connection.
+        """
+        self.tableConfigCache = None
+        self.columnConfigCache = advancedTypes.CaselessDict()
+        self._dirTypeCache = {}
+        self._clearDirCache()
+        
+    def _clearDirCache(self, table=None):
+        ## clear cached getDirRowID / getDir results for one directory table (or all)
+        if table is None:
+            self._dirRowIDCache = {}
+            self._dirCache = {}
+            return
+        table = table.lower()
+        for cache in (self._dirRowIDCache, self._dirCache):
+            for k in [k for k in cache if k[0] == table]:
+                del cache[k]
+
+    def _rolledBack(self):
+        SqliteDatabase._rolledBack(self)
+        self._clearDirCache()
 
     def ctrlParam(self, param):
         res = SqliteDatabase.select(self, 'DbParameters', ['Value'], sql="where Param='%s'"%param)
@@ -412,18 +453,12 @@ class AnalysisDatabase(SqliteDatabase):
             
             dirType = self.dataModel().dirType(dirHandle)
             self.createTable(tableName, columns, dirType=dirType)
+            self.createIndex(tableName, 'Dir')   ## used by getDirRowID
         
         return tableName
     
     def addDir(self, handle):
         """Create a record based on a DirHandle and its meta-info."""
-        info = handle.info().deepcopy()
-        for k in info:  ## replace tuple keys with strings
-            if isinstance(k, tuple):
-                n = "_".join(k)
-                info[n] = info[k]
-                del info[k]
-        
         with self.transaction():
             table = self.dirTableName(handle)
             if not self.hasTable(table):
@@ -435,6 +470,13 @@ class AnalysisDatabase(SqliteDatabase):
             if rid is not None:
                 return table, rid
             
+            info = handle.info().deepcopy()
+            for k in info:  ## replace tuple keys with strings
+                if isinstance(k, tuple):
+                    n = "_".join(k)
+                    info[n] = info[k]
+                    del info[k]
+            
             ## find all directory columns, make sure linked directories are present in DB
             conf = self.getColumnConfig(table)
             for colName, col in conf.items():
@@ -451,14 +493,17 @@ class AnalysisDatabase(SqliteDatabase):
             info['Dir'] = handle
             
             self.insert(table, info, ignoreExtraColumns=True)
+            rid = self.lastInsertRow()
+            self._dirRowIDCache[(table.lower(), self._dirKey(handle))] = rid
             
-            return table, self.lastInsertRow()
+            return table, rid
 
 
     def createView(self, viewName, tables):
         """Create a view that joins the tables listed."""
         # db('create view "sites" as select * from photostim_sites inner join DirTable_Protocol on photostim_sites.ProtocolDir=DirTable_Protocol.rowid inner join DirTable_Cell on DirTable_Protocol.CellDir=DirTable_Cell.rowid')
 
+        self._viewJoins.pop(viewName.lower(), None)
         with self.transaction():
             sel = self.makeJoinStatement(tables)
             cmd = 'create view "%s" as select * from %s' % (viewName, sel)
@@ -508,6 +553,8 @@ class AnalysisDatabase(SqliteDatabase):
                 raise Exception("Could not find criteria to join table '%s' to any of '%s'" % (joinTable, str(tables[:i])) )
             
             cmd += ' inner join "%s" on "%s"."%s"="%s"."%s"' % (nextTable, nextTable, cols[0], joinTable, cols[1])
+            self._recordColumnUse(nextTable, cols[0])
+            self._recordColumnUse(joinTable, cols[1])
         return cmd
     
     def findJoinColumns(self, t1, t2):
@@ -586,17 +633,27 @@ class AnalysisDatabase(SqliteDatabase):
             
         if not self.hasTable(table):
             return None
-        name = dirHandle.name(relativeTo=self.baseDir())
-        name1 = name.replace('/', '\\')
-        name2 = name.replace('\\', '/')
+        name2 = self._dirKey(dirHandle)
+        key = (table.lower(), name2)
+        if key in self._dirRowIDCache:
+            return self._dirRowIDCache[key]
+        name1 = name2.replace('/', '\\')
         rec = self.select(table, ['rowid'], sql="where Dir='%s' or Dir='%s'" % (name1, name2))
         if len(rec) < 1:
             return None
         #print rec[0]
+        self._dirRowIDCache[key] = rec[0]['rowid']
         return rec[0]['rowid']
 
+    def _dirKey(self, dirHandle):
+        ## name of dirHandle relative to the base dir, with '/' separators
+        return dirHandle.name(relativeTo=self.baseDir()).replace('\\', '/')
+
     def getDir(self, table, rowid):
         ## Return a DirHandle given table, rowid
+        key = (table.lower(), rowid)
+        if key in self._dirCache:
+            return self._dirCache[key]
         res = self.select(table, ['Dir'], sql='where rowid=%d'%rowid)
         if len(res) < 1:
             raise Exception('rowid %d does not exist in %s' % (rowid, table)) 
@@ -604,6 +661,7 @@ class AnalysisDatabase(SqliteDatabase):
             #return None
         #print res
         #return self.baseDir()[res[0]['Dir']]
+        self._dirCache[key] = res[0]['Dir']
         return res[0]['Dir']
 
     def dirTableName(self, dh):
@@ -611,7 +669,11 @@ class AnalysisDatabase(SqliteDatabase):
         dh may be either a directory handle OR the string result of self.dataModel().dirType(dh)
         """
         if isinstance(dh, DataManager.DirHandle):
-            typeName = self.dataModel().dirType(dh)
+            name = dh.name()
+            typeName = self._dirTypeCache.get(name, None)
+            if typeName is None:
+                typeName = self.dataModel().dirType(dh)
+                self._dirTypeCache[name] = typeName
         elif isinstance(dh, six.string_types):
             typeName = dh
         else:
@@ -714,30 +776,11 @@ class AnalysisDatabase(SqliteDatabase):
         config = self.getColumnConfig(table)
         
         ## convert file/dir handles
-        for column, conf in config.items():
-            if column not in data.columnNames():
-                continue
-            
-            if conf.get('Type', '').startswith('directory'):
-                rids = set([d[column] for d in data])
-                linkTable = conf['Link']
-                handles = dict([(rid, self.getDir(linkTable, rid)) for rid in rids if rid is not None])
-                handles[None] = None
-                data[column] = list(map(handles.get, data[column]))
-                    
-            elif conf.get('Type', None) == 'file':
-                def getHandle(name):
-                    if name is None:
-                        return None
-                    else:
-                        if os.sep == '/':
-                            sep = '\\'
-                        else:
-                            sep = '/'
-                        name = name.replace(sep, os.sep) ## make sure file handles have an operating-system-appropriate separator (/ for Unix, \ for Windows)
-                        return self.baseDir()[name]
-                data[column] = list(map(getHandle, data[column]))
-                
+        for column in data.columnNames():
+            handles = self._columnFromDB(config, column, data[column])
+            if handles is not None:
+                data[column] = handles
+
         prof.mark("converted file/dir handles")
                 
         ret = data.originalData()
@@ -761,48 +804,271 @@ class AnalysisDatabase(SqliteDatabase):
         config = self.getColumnConfig(table)
         
         data = TableData(data).copy()  ## have to copy here since we might be changing some values
-        dataCols = set(data.columnNames())
-        for colName, colConf in config.items():
-            if colName not in dataCols:
-                continue
-            
-            if colConf.get('Type', '').startswith('directory'):
-                ## Make sure all directories are present in the DB
-                handles = data[colName]
-                linkTable = colConf['Link']
-                if linkTable is None:
-                    raise Exception('Column "%s" is type "%s" but is not linked to any table.' % (colName, colConf['Type']))
-                rowids = {None: None}
-                for dh in set(handles):
-                    if dh is None:
-                        continue
-                    dirTable, rid = self.addDir(dh)
-                    if dirTable != linkTable:
-                        linkType = self.getTableConfig(linkTable)['DirType']
-                        dirType = self.getTableConfig(dirTable)['DirType']
-                        raise Exception("Trying to use directory '%s' (type='%s') for column %s.%s, but this column is for directories of type '%s'." % (dh.name(), dirType, table, colName, linkType))
-                    rowids[dh] = rid
-                    
-                ## convert dirhandles to rowids
-                data[colName] = list(map(rowids.get, handles))
-            elif colConf.get('Type', None) == 'file':
-                ## convert filehandles to strings
-                files = []
-                for f in data[colName]:
-                    if f is None:
-                        files.append(None)
-                    else:
-                        try:
-                            files.append(f.name(relativeTo=self.baseDir()))
-                        except:
-                            print("f:", f)
-                            raise
-                data[colName] = files
+        for colName in data.columnNames():
+            values = self._columnToDB(table, config, colName, data[colName])
+            if values is not None:
+                data[colName] = values
 
         newData = SqliteDatabase._prepareData(self, table, data, ignoreUnknownColumns, batch)
         
         return newData
+
+    def selectArray(self, table, columns='*', where=None, sql='', distinct=False, limit=None, offset=None, chunkSize=10000):
+        """Extends selectArray to convert directory/file columns back into Dir/FileHandles (see select())."""
+        data = SqliteDatabase.selectArray(self, table, columns, where=where, sql=sql, distinct=distinct, limit=limit, offset=offset, chunkSize=chunkSize)
+        config = self.getColumnConfig(table)
+        for column in data.dtype.names:
+            values = data[column].tolist()
+            if data.dtype[column].kind == 'f':
+                ## int columns containing NULL are returned as float with NaN
+                values = [None if v != v else v for v in values]
+            handles = self._columnFromDB(config, column, values)
+            if handles is not None:
+                data = _changeFieldType(data, column, object)
+                for i, h in enumerate(handles):
+                    data[column][i] = h
+        return data
+
+    def _prepareColumns(self, table, data, ignoreUnknownColumns=False):
+        """Extends SqliteDatabase._prepareColumns() to convert Dir/FileHandles (see _prepareData())."""
+        config = self.getColumnConfig(table)
+        names = data.dtype.names if isinstance(data, np.ndarray) else list(data.keys())
+        columns = collections.OrderedDict()
+        for colName in names:
+            values = self._columnToDB(table, config, colName, data[colName])
+            columns[colName] = data[colName] if values is None else values
+        return SqliteDatabase._prepareColumns(self, table, columns, ignoreUnknownColumns)
+
+    def _columnToDB(self, table, config, colName, values):
+        ## Convert one column of DirHandles to rowids (adding directories to their tables
+        ## if needed) or of FileHandles to file names relative to the DB base dir.
+        ## Returns None if the column does not need conversion.
+        colConf = config.get(colName, {})
+        if colConf.get('Type', '').startswith('directory'):
+            ## Make sure all directories are present in the DB
+            linkTable = colConf['Link']
+            if linkTable is None:
+                raise Exception('Column "%s" is type "%s" but is not linked to any table.' % (colName, colConf['Type']))
+            rowids = {None: None}
+            for dh in set(values):
+                if dh is None:
+                    continue
+                dirTable, rid = self.addDir(dh)
+                if dirTable != linkTable:
+                    linkType = self.getTableConfig(linkTable)['DirType']
+                    dirType = self.getTableConfig(dirTable)['DirType']
+                    raise Exception("Trying to use directory '%s' (type='%s') for column %s.%s, but this column is for directories of type '%s'." % (dh.name(), dirType, table, colName, linkType))
+                rowids[dh] = rid
+                
+            ## convert dirhandles to rowids
+            return list(map(rowids.get, values))
+        elif colConf.get('Type', None) == 'file':
+            ## convert filehandles to strings
+            files = []
+            for f in values:
+                if f is None:
+                    files.append(None)
+                else:
+                    try:
+                        files.append(f.name(relativeTo=self.baseDir()))
+                    except:
+                        print("f:", f)
+                        raise
+            return files
+        return None
+
+    def _columnFromDB(self, config, column, values):
+        ## Convert one column of rowids / file names read from the DB back into Dir/FileHandles.
+        ## Returns None if the column does not need conversion.
+        conf = config.get(column, {})
+        if conf.get('Type', '').startswith('directory'):
+            rids = set(values)
+            linkTable = conf['Link']
+            handles = dict([(rid, self.getDir(linkTable, rid)) for rid in rids if rid is not None])
+            handles[None] = None
+            return list(map(handles.get, values))
+                
+        elif conf.get('Type', None) == 'file':
+            def getHandle(name):
+                if name is None:
+                    return None
+                else:
+                    if os.sep == '/':
+                        sep = '\\'
+                    else:
+                        sep = '/'
+                    name = name.replace(sep, os.sep) ## make sure file handles have an operating-system-appropriate separator (/ for Unix, \ for Windows)
+                    return self.baseDir()[name]
+            return list(map(getHandle, values))
+        return None
+        
+        
         
         
+
+    def delete(self, table, where):
+        self._clearDirCache(table)
+        return SqliteDatabase.delete(self, table, where)
+
+    def update(self, table, vals, where=None, rowid=None, sql=''):
+        self._clearDirCache(table)
+        return SqliteDatabase.update(self, table, vals, where=where, rowid=rowid, sql=sql)
+
+    def removeTable(self, table):
+        self._clearDirCache(table)
+        self._viewJoins.pop(table.lower(), None)
+        return SqliteDatabase.removeTable(self, table)
+
+    def _selectCommand(self, table, columns='*', where=None, sql='', distinct=False, limit=None, offset=None):
+        ## Extends SqliteDatabase._selectCommand to record the columns each query searches on
+        cmd = SqliteDatabase._selectCommand(self, table, columns, where, sql, distinct, limit, offset)
+        if table not in self.InternalTables:
+            self._recordQuery(table, cmd, where, sql)
+        return cmd
+
+    def _recordQuery(self, table, cmd, where, sql):
+        key = _normalizeSql(cmd)
+        rec = self._queryLog.get(key, None)
+        if rec is None:
+            if len(self._queryLog) >= self.MaxRecordedQueries:
+                self._queryLog.popitem(last=False)
+            rec = self._queryLog[key] = [0, table, cmd]
+        rec[0] += 1
+        if not self.hasTable(table):
+            return
         
+        columns = set(_whereColumns(sql))
+        if where is not None:
+            columns.update(where.keys())
+        for col in columns:
+            self._recordColumnUse(table, col)
+            
+        ## joins inside views also count as uses of the joined columns
+        if table.lower() not in self._viewJoins:
+            self._viewJoins[table.lower()] = self._findViewJoins(table)
+        for joinTable, joinCol in self._viewJoins[table.lower()]:
+            self._recordColumnUse(joinTable, joinCol)
+
+    def _recordColumnUse(self, table, column):
+        if column.lower() == 'rowid' or not self.hasTable(table) or column not in self.tables[table]:
+            return
+        key = (table.lower(), column.lower())
+        rec = self._columnUse.get(key, None)
+        if rec is None:
+            rec = self._columnUse[key] = [0, table, column]
+        rec[0] += 1
+        if self._autoIndex is not None and rec[0] == self._autoIndex[0]:
+            if self._needsIndex(table, column, self._autoIndex[1]):
+                logMsg('Creating index on %s.%s' % (table, column))
+                self.createIndex(table, column)
+
+    def _findViewJoins(self, view):
+        ## Return [(table, column), ...] for the join conditions of a view created by createView()
+        res = self("select sql from sqlite_master where type='view' and lower(name)=lower('%s')" % view)
+        if len(res) == 0 or res[0]['sql'] is None:
+            return []
+        joins = []
+        for t1, c1, t2, c2 in re.findall(r'"([^"]+)"\."([^"]+)"\s*=\s*"([^"]+)"\."([^"]+)"', res[0]['sql']):
+            joins.extend([(t1, c1), (t2, c2)])
+        return joins
+
+    def _needsIndex(self, table, column, minRows):
+        ## True if table is a table (not a view) with at least minRows rows and 
+        ## no index that could be used to search on column
+        if self.isView(table):
+            return False
+        for index in self.listIndexes(table):
+            if index[0].lower() == column.lower():
+                return False
+        return self.tableLength(table) >= minRows
+
+    def setAutoIndex(self, enable=True, minUses=3, minRows=1000):
+        """Enable or disable automatic index creation.
         
+        When enabled, an index is created on any column of a table with at least *minRows* rows
+        as soon as that column has been searched on (in the where clause of a select, or in a join 
+        made by createView) *minUses* times, unless the column is already the first column of an index.
+        This is disabled by default; see suggestIndexes() for an advisory alternative.
+        """
+        if enable:
+            self._autoIndex = (minUses, minRows)
+        else:
+            self._autoIndex = None
+
+    def suggestIndexes(self, minUses=1, minRows=1000):
+        """Return a list of (table, column, uses) for all columns that have been searched on at least
+        *minUses* times since the DB was opened, but are not the first column of any index on a table
+        of at least *minRows* rows. The most frequently used columns are listed first.
+        """
+        suggestions = []
+        for uses, table, column in self._columnUse.values():
+            if uses >= minUses and self._needsIndex(table, column, minRows):
+                suggestions.append((table, column, uses))
+        suggestions.sort(key=lambda s: -s[2])
+        return suggestions
+    
+    def createSuggestedIndexes(self, minUses=1, minRows=1000):
+        """Create an index for each column returned by suggestIndexes(). Returns the list of suggestions."""
+        suggestions = self.suggestIndexes(minUses, minRows)
+        with self.transaction():
+            for table, column, uses in suggestions:
+                self.createIndex(table, column)
+        return suggestions
+
+    def queryPlanReport(self, minUses=1, minRows=1000):
+        """Return a report describing how the queries made through select() since the DB was opened are
+        executed. The report is a dict with keys:
+        
+        =============== ==============================================================================
+        queries         list of dicts, one per distinct query (ignoring literal values), most frequent
+                        first: {'sql': example query, 'count': n, 'plan': EXPLAIN QUERY PLAN output,
+                        'fullScans': names of tables that the query scans without using an index}
+        suggestions     the result of suggestIndexes(minUses, minRows)
+        =============== ==============================================================================
+        """
+        queries = []
+        for count, table, cmd in self._queryLog.values():
+            try:
+                plan = self.explainQuery(cmd)
+            except sqlite3.Error as exc:
+                plan = ['Error: %s' % exc]
+            scans = []
+            for line in plan:
+                m = re.match(r'SCAN (?:TABLE )?(\S+)', line)
+                if m is not None and 'USING' not in line:
+                    scans.append(m.group(1))
+            queries.append({'sql': cmd, 'count': count, 'plan': plan, 'fullScans': scans})
+        queries.sort(key=lambda q: -q['count'])
+        return {'queries': queries, 'suggestions': self.suggestIndexes(minUses, minRows)}
+    
+    def printQueryPlanReport(self, minUses=1, minRows=1000):
+        """Print the report generated by queryPlanReport()."""
+        report = self.queryPlanReport(minUses, minRows)
+        for q in report['queries']:
+            scans = (" (full scan of %s)" % ', '.join(q['fullScans'])) if q['fullScans'] else ""
+            print("%6d x  %s%s" % (q['count'], q['sql'].strip(), scans))
+            for line in q['plan']:
+                print("            " + line)
+        if len(report['suggestions']) == 0:
+            print("No new indexes suggested.")
+        for table, column, uses in report['suggestions']:
+            print('Suggested index: "%s" ("%s")  (searched %d times)' % (table, column, uses))
+
+
+def _normalizeSql(cmd):
+    ## Replace literal values in a query so that queries differing only by value compare equal
+    cmd = re.sub(r"'(?:[^']|'')*'", "?", cmd)
+    cmd = re.sub(r"(?<![\w\"])[-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?", "?", cmd)
+    return ' '.join(cmd.split())
+
+
+_sqlOperators = r'(?:=|==|!=|<>|<=|>=|<|>|\bin\b|\blike\b|\bis\b|\bbetween\b|\bglob\b)'
+_whereColumnRegex = re.compile(r'(?:"([^"]+)"|\b([A-Za-z_]\w*))\s*' + _sqlOperators, re.I)
+
+def _whereColumns(sql):
+    ## Return names that appear to be compared against a value in the where clause of an SQL fragment
+    m = re.search(r'\bwhere\b(.*?)(?:\border\s+by\b|\bgroup\s+by\b|\blimit\b|$)', sql, re.I | re.S)
+    if m is None:
+        return []
+    clause = re.sub(r"'(?:[^']|'')*'", "''", m.group(1))
+    return [a or b for a, b in _whereColumnRegex.findall(clause)]
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for bulk inserts and array fetches in SqliteDatabase: compares
+insert() / select(toArray=True) with insertArray() / selectArray() for
+tables of event-like records.
+
+Usage:  python -m acq4.util.database.benchmark [nRows ...]
+
+The default row counts are 1e5 and 1e6. Pass a file name with --file to
+benchmark an on-disk database instead of an in-memory one.
+"""
+from __future__ import print_function
+import os, sys, tempfile
+import numpy as np
+import acq4.util.ptime as ptime
+from acq4.util.database.database import SqliteDatabase
+
+
+columns = [('SourceFile', 'text'), ('index', 'int'), ('time', 'real'), ('amplitude', 'real'),
+           ('decayTau', 'real'), ('fitError', 'real'), ('params', 'blob')]
+
+
+def makeData(n):
+    data = np.empty(n, dtype=[('SourceFile', object), ('index', int), ('time', float), ('amplitude', float),
+                              ('decayTau', float), ('fitError', float), ('params', object)])
+    data['SourceFile'] = ['2019.01.01_000/cell_000/protocol_%03d/Clamp1.ma' % (i // 1000) for i in range(n)]
+    data['index'] = np.arange(n) % 1000
+    data['time'] = np.random.uniform(0, 10, n)
+    data['amplitude'] = np.random.normal(-20e-12, 5e-12, n)
+    data['decayTau'] = np.random.uniform(1e-3, 20e-3, n)
+    data['fitError'] = np.random.uniform(0, 1, n)
+    data['params'] = None
+    data['params'][::100] = [{'threshold': 10}] * len(data[::100])
+    return data
+
+
+def newDB(fileName):
+    if fileName is not None and os.path.exists(fileName):
+        os.remove(fileName)
+    db = SqliteDatabase(fileName or ':memory:')
+    db.createTable('events', columns)
+    return db
+
+
+def timeIt(fn):
+    start = ptime.time()
+    ret = fn()
+    return ptime.time() - start, ret
+
+
+def run(n, fileName=None):
+    data = makeData(n)
+    print("%d rows:" % n)
+
+    db = newDB(fileName)
+    tInsert, _ = timeIt(lambda: db.insert('events', data))
+    tSelect, old = timeIt(lambda: db.select('events', toArray=True))
+    db.close()
+
+    db = newDB(fileName)
+    tInsertArr, _ = timeIt(lambda: db.insertArray('events', data))
+    tSelectArr, new = timeIt(lambda: db.selectArray('events'))
+    db.close()
+
+    for name in ('index', 'time', 'amplitude'):
+        if not np.all(old[name] == new[name]):
+            print("  WARNING: results differ in column %s!" % name)
+
+    print("  insert  %7.2f s   insertArray %7.2f s   (%0.1fx)" % (tInsert, tInsertArr, tInsert / tInsertArr))
+    print("  select  %7.2f s   selectArray %7.2f s   (%0.1fx)" % (tSelect, tSelectArr, tSelect / tSelectArr))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    fileName = None
+    if '--file' in args:
+        i = args.index('--file')
+        fileName = args[i+1]
+        args = args[:i] + args[i+2:]
+    sizes = [int(float(a)) for a in args] or [100000, 1000000]
+    for n in sizes:
+        run(n, fileName)
+    if fileName is not None and os.path.exists(fileName):
+        os.remove(fileName)
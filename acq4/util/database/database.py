@@ -113,6 +113,58 @@ class SqliteDatabase:
         ============== ================================================================
         """
         p = debug.Profiler("SqliteDatabase.select", disabled=True)
+        cmd = self._selectCommand(table, columns, where, sql, distinct, limit, offset)
+        p.mark("generated command")
+        q = self.exe(cmd, toDict=toDict, toArray=toArray)
+        p.finish()
+        return q
+
+    def selectArray(self, table, columns='*', where=None, sql='', distinct=False, limit=None, offset=None, chunkSize=10000):
+        """
+        Construct and execute a SELECT statement, returning the results as a numpy structured array.
+
+        Arguments are the same as for select(). Column types are taken from the table schema:
+        int columns become int64 fields, real columns become float64, and all other columns
+        (including unpickled blob columns) become object fields. If the stored values do not
+        fit the declared type (sqlite allows any value in any column), the field is widened
+        (int columns containing NULL become float64 with NaN; anything else becomes object).
+
+        Results are read *chunkSize* rows at a time directly into a preallocated array, without
+        building a dict per record. Unlike select(toArray=True), an empty result is returned as
+        an empty array with the correct fields rather than None.
+        """
+        p = debug.Profiler("SqliteDatabase.selectArray", disabled=True)
+        cmd = self._selectCommand(table, columns, where, sql, distinct, limit, offset)
+        nRows = self('SELECT count(*) FROM (%s)' % cmd, toDict=False).fetchone()[0]
+        p.mark("counted rows")
+
+        cur = self.db.cursor()
+        cur.row_factory = None   ## plain tuples are much faster than sqlite3.Row
+        cur.execute(cmd)
+        names = [d[0] for d in cur.description]
+        schema = self.tableSchema(table)
+        types = [schema.get(n, '').lower() for n in names]
+        arr = np.empty(nRows, dtype=[(str(n), columnDType(t)) for n, t in zip(names, types)])
+
+        i = 0
+        while True:
+            rows = cur.fetchmany(chunkSize)
+            if len(rows) == 0:
+                break
+            rows = rows[:nRows-i]
+            for name, typ, col in zip(names, types, zip(*rows)):
+                if typ == 'blob':
+                    col = [None if v is None else pickle.loads(bytes(v)) for v in col]
+                arr = _setField(arr, name, slice(i, i+len(rows)), col)
+            i += len(rows)
+            if i >= nRows:
+                break
+        p.mark("read %d rows" % i)
+        p.finish()
+        return arr[:i]
+
+    def _selectCommand(self, table, columns='*', where=None, sql='', distinct=False, limit=None, offset=None):
+        ## Generate the SQL for select() and selectArray()
         if columns != '*':
             #if isinstance(columns, six.string_types):
                 #columns = columns.split(',')
@@ -131,11 +183,7 @@ class SqliteDatabase:
         limit = ("limit %d" % limit) if (limit is not None) else ""
         offset = ("offset %d" % offset) if (offset is not None) else ""
         
-        cmd = "SELECT %s %s FROM %s %s %s %s %s" % (distinct, columns, table, whereStr, sql, limit, offset)
-        p.mark("generated command")
-        q = self.exe(cmd, toDict=toDict, toArray=toArray)
-        p.finish()
-        return q
+        return "SELECT %s %s FROM %s %s %s %s %s" % (distinct, columns, table, whereStr, sql, limit, offset)
         
     def iterSelect(self, *args, **kargs):
         """
@@ -231,6 +279,47 @@ class SqliteDatabase:
 
         p.finish()
 
+    def insertArray(self, table, data, replaceOnConflict=False, ignoreExtraColumns=False):
+        """Insert many records from a numpy structured array (or a dict of column arrays / lists).
+
+        Values are converted to the column types one column at a time and inserted with
+        executemany() inside a single transaction, which is much faster than insert() for
+        large numbers of records. See insert() for a description of the other arguments.
+        Returns the number of records inserted.
+        """
+        n = 0
+        for n, nmax in self.iterInsertArray(table, data, replaceOnConflict=replaceOnConflict, ignoreExtraColumns=ignoreExtraColumns, chunkSize=None):
+            pass
+        return n
+
+    def iterInsertArray(self, table, data, replaceOnConflict=False, ignoreExtraColumns=False, chunkSize=10000):
+        """
+        Like insertArray(), but yields a tuple (n, max) after each chunk of *chunkSize*
+        records is inserted (see iterInsert()). All chunks are inserted within a single
+        transaction. If chunkSize is None, all records are inserted at once.
+        """
+        p = debug.Profiler("SqliteDatabase.insertArray", disabled=True)
+        with self.transaction():
+            columns = self._prepareColumns(table, data, ignoreUnknownColumns=ignoreExtraColumns)
+            p.mark("prepared columns")
+            names = list(columns.keys())
+            numRecs = len(columns[names[0]]) if len(names) > 0 else 0
+            if numRecs == 0:
+                return
+            insert = "INSERT"
+            if replaceOnConflict:
+                insert += " OR REPLACE"
+            cmd = "%s INTO %s (%s) VALUES (%s)" % (insert, table, quoteList(names), ','.join(['?'] * len(names)))
+            values = [columns[n] for n in names]
+            if chunkSize is None:
+                chunkSize = numRecs
+            chunkSize = int(chunkSize)
+            for offset in range(0, numRecs, chunkSize):
+                self.db.executemany(cmd, zip(*[v[offset:offset+chunkSize] for v in values]))
+                yield (min(offset + chunkSize, numRecs), numRecs)
+            p.mark("inserted %d records" % numRecs)
+        p.finish()
+
     def delete(self, table, where):
         with self.transaction():
             whereStr = self._buildWhereClause(where, table)
@@ -311,6 +400,28 @@ class SqliteDatabase:
         cmd = 'CREATE INDEX %s "%s" ON "%s" (%s)' % (ine, name, table, colStr)
         self(cmd)
 
+    def listIndexes(self, table):
+        """
+        Return a list of the indexes on table, each given as a list of the indexed column names.
+        """
+        indexes = []
+        for idx in self('PRAGMA index_list("%s")' % table):
+            cols = self('PRAGMA index_info("%s")' % idx['name'])
+            indexes.append([c['name'] for c in sorted(cols, key=lambda c: c['seqno'])])
+        return indexes
+
+    def isView(self, table):
+        """Return True if *table* is a view rather than a table."""
+        res = self("select type from sqlite_master where lower(name)=lower('%s')" % table)
+        return len(res) > 0 and res[0]['type'] == 'view'
+
+    def explainQuery(self, cmd):
+        """
+        Return the query plan that sqlite would use for the SQL statement *cmd*
+        as a list of strings (see sqlite 'EXPLAIN QUERY PLAN').
+        """
+        return [tuple(rec)[-1] for rec in self('EXPLAIN QUERY PLAN ' + cmd, toDict=False)]
+
     def addColumn(self, table, colName, colType, constraints=None):
         """
         Add a column to a table.
@@ -424,6 +535,24 @@ class SqliteDatabase:
         #print "new data:", newData
         return newData
 
+    def _prepareColumns(self, table, data, ignoreUnknownColumns=False):
+        ## Columnar equivalent of _prepareData for insertArray (internal use only).
+        ## *data* is a structured array or dict of columns; returns an OrderedDict of
+        ## {columnName: list of values ready to bind}, converted one column at a time.
+        if isinstance(data, np.ndarray):
+            names = data.dtype.names
+        else:
+            names = list(data.keys())
+        schema = self.tableSchema(table)
+        columns = collections.OrderedDict()
+        for k in names:
+            if k not in schema and k.lower() != 'rowid':
+                if ignoreUnknownColumns:
+                    continue
+                raise Exception("Column '%s' not present in table '%s'" % (k, table))
+            columns[k] = convertColumn(data[k], schema.get(k, '').lower())
+        return columns
+
     def _queryToDict(self, q):
         prof = debug.Profiler("_queryToDict", disabled=True)
         res = []
@@ -478,8 +607,99 @@ class SqliteDatabase:
             
         self.tables = tables
 
+    def _rolledBack(self):
+        ## called when a transaction has been rolled back
+        self.tables = None  ## make sure we are forced to re-read the table list after the rollback.
+
+
 
 
+def columnDType(typ):
+    """Return the numpy dtype used by selectArray() for an SQL column type."""
+    typ = typ.lower()
+    if typ.startswith('int'):
+        return np.int64
+    elif typ in ('real', 'float', 'double'):
+        return np.float64
+    else:
+        return object
+
+
+def convertColumn(values, typ):
+    """Convert a column of values (array or list) into a list of values ready to be
+    bound for a column of SQL type *typ*. Uses the same conversions as
+    SqliteDatabase._prepareData, but converts whole arrays at once where possible.
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'biuf':
+        if typ.startswith('int') and values.dtype.kind != 'f':
+            return values.astype(np.int64).tolist()
+        elif typ == 'real':
+            return values.astype(np.float64).tolist()
+        elif typ not in ('text', 'blob'):
+            return values.tolist()
+    elif isinstance(values, np.ndarray) and values.dtype.kind == 'U' and typ not in ('blob', 'int', 'real'):
+        return values.astype(six.text_type).tolist()
+
+    ## general case: convert one value at a time
+    if isinstance(values, np.ndarray):
+        values = values.tolist() if values.dtype != object else list(values)
+    if typ == 'blob':
+        conv = lambda obj: sqlite3.Binary(pickle.dumps(obj))
+    elif typ == 'int':
+        conv = int
+    elif typ == 'real':
+        conv = float
+    elif typ == 'text':
+        conv = str
+    else:
+        conv = None
+    if conv is None:
+        return list(values)
+    out = []
+    for v in values:
+        if v is None:
+            out.append(None)
+            continue
+        try:
+            out.append(conv(v))
+        except Exception:
+            out.append(v)
+    return out
+
+
+def _setField(arr, name, index, values):
+    ## Write a column of values returned by sqlite into arr[name][index], widening the
+    ## field's dtype if the values do not fit (int -> float64 for NULL, anything -> object).
+    ## Returns the (possibly new) array.
+    kind = arr.dtype[name].kind
+    if kind in 'if':
+        vals = np.array(values)
+        if vals.dtype.kind in 'biu' or (kind == 'f' and vals.dtype.kind == 'f'):
+            arr[name][index] = vals
+            return arr
+        if vals.dtype.kind == 'f' or vals.dtype.kind == 'O':
+            try:
+                vals = np.array(values, dtype=np.float64)  ## None -> NaN
+                if kind == 'i':
+                    arr = _changeFieldType(arr, name, np.float64)
+                arr[name][index] = vals
+                return arr
+            except (TypeError, ValueError):
+                pass
+        arr = _changeFieldType(arr, name, object)
+    vals = np.empty(len(values), dtype=object)
+    vals[:] = values
+    arr[name][index] = vals
+    return arr
+
+
+def _changeFieldType(arr, name, dtype):
+    ## Return a copy of arr with field *name* converted to *dtype*
+    newDType = [(n, dtype if n == name else arr.dtype[n]) for n in arr.dtype.names]
+    newArr = np.empty(arr.shape, dtype=newDType)
+    for n in arr.dtype.names:
+        newArr[n] = arr[n]
+    return newArr
 
 
 def quoteList(strns):
@@ -508,7 +728,7 @@ class Transaction:
         else:
             try:
                 self.db('ROLLBACK TRANSACTION TO %s' % self.name)
-                self.db.tables = None  ## make sure we are forced to re-read the table list after the rollback.
+                self.db._rolledBack()
             except Exception:
                 print("WARNING: Error occurred during transaction and rollback failed.")
                 
@@ -1,5 +1,5 @@
 from __future__ import print_function
-import os, sys
+import os, sys, re
 path = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(path, '..', '..', '..'))
 
@@ -84,3 +84,47 @@ def testBatchInsert():
     
     for i, row in enumerate(db.iterSelect('t', limit=1)):
         assert tuple(row[0].values()) == tuple(data[i])
+
+
+def testInsertSelectArray():
+    db = SqliteDatabase()
+    db("create table 't' ('int' int, 'real' real, 'text' text, 'blob' blob, 'other' other)")
+
+    data = np.array([
+        (1, 27.3, u'x', [5], None),
+        (3, 23.4, u'yy', None, 4),
+        (5, 21.3, u'zzz', [(5,3), 'q'], None),
+        (7, 24.3, u'wwww', 'q', u'o'),
+    ], dtype=[('int', int), ('real', float), ('text', object), ('blob', object), ('other', object)])
+
+    assert db.insertArray('t', data) == 4
+    result = db.selectArray('t')
+    assert result.dtype['int'] == np.int64 and result.dtype['real'] == np.float64
+    assert np.all(result == data)
+
+    ## columns may also be given as a dict; chunks are inserted in one transaction
+    steps = list(db.iterInsertArray('t', {'int': np.arange(5), 'text': ['a'] * 5}, chunkSize=2))
+    assert steps == [(2, 5), (4, 5), (5, 5)]
+    result = db.selectArray('t', ['int', 'real'], sql='order by rowid', limit=5, offset=4)
+    assert list(result['int']) == list(range(5))
+    ## NULL in a real column is NaN, in an int column the field is widened to float
+    assert np.all(np.isnan(result['real']))
+    db('update t set "int"=NULL where rowid=5')
+    result = db.selectArray('t', ['int'], limit=6)
+    assert result.dtype['int'] == np.float64 and np.isnan(result['int'][4])
+
+    ## empty results keep their fields
+    empty = db.selectArray('t', where={'text': 'none'})
+    assert len(empty) == 0 and empty.dtype.names == ('int', 'real', 'text', 'blob', 'other')
+
+
+def testIndexes():
+    db = SqliteDatabase()
+    db("create table 't' ('a' int, 'b' text)")
+    assert db.listIndexes('t') == []
+    assert any(line.startswith('SCAN') for line in db.explainQuery("select * from t where a=1"))
+    db.createIndex('t', ['a', 'b'])
+    assert db.listIndexes('t') == [['a', 'b']]
+    ## newer sqlite reports 'USING COVERING INDEX' when the index holds every selected column
+    assert any(re.search(r'USING (COVERING )?INDEX', line) for line in db.explainQuery("select * from t where a=1"))
+    assert not db.isView('t')
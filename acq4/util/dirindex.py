@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends for the per-directory meta-info index used by DataManager.DirHandle.
+
+Two formats are supported:
+
+* TextIndex - the original `.index` file written in the indented configfile
+  format. Any change other than adding a new entry rewrites the whole file,
+  and any external change causes the whole file to be parsed again.
+* LogIndex - a binary append-only log (`.indexlog`). Each change (new entry,
+  update of some keys, removal) appends one record, so writes are O(1).
+  Opening the index only reads the small record headers; the meta-info for
+  an entry is parsed the first time it is requested. The log is compacted
+  (rewritten with one record per entry) when superseded records outnumber
+  live ones.
+
+Index files live in shared data directories, so neither format may execute
+code when read: record payloads are written in the configfile format and
+parsed with its restricted evaluator, exactly like `.index` files.
+
+Both classes expose the same read-only mapping interface (``name in index``,
+``index[name]``, iteration in insertion order, ``len()``) plus methods for
+modifying the index.
+"""
+from __future__ import print_function
+import os, struct
+from collections import OrderedDict
+import six
+from acq4.util.configfile import readConfigFile, writeConfigFile, appendConfigFile, genString, parseString
+
+
+def openIndex(dirPath):
+    """Return the index backend for an existing index in *dirPath*, or None
+    if the directory is not managed. A log index takes precedence over a
+    text index if both exist.
+    """
+    for cls in (LogIndex, TextIndex):
+        index = cls(dirPath)
+        if index.exists():
+            return index
+    return None
+
+
+def newIndex(dirPath, fmt):
+    """Return a (not yet written) index backend of format *fmt* ('text' or 'log')."""
+    return {'text': TextIndex, 'log': LogIndex}[fmt](dirPath)
+
+
+class DirIndex(object):
+    """Base class for index backends.
+
+    Subclasses provide the mapping interface (``__contains__``,
+    ``__getitem__``, ``__iter__``, ``__len__``) and:
+
+    * reload() - re-read the index if the file has been changed by another
+      handle or process.
+    * update(name, info) - set the keys in *info* for entry *name*, creating
+      the entry if needed.
+    * remove(name) - remove entry *name* from the index.
+    * write(data) - replace the entire contents of the index with *data*
+      (a dict of dicts).
+    """
+    format = None
+    fileName = None
+
+    def __init__(self, dirPath):
+        self.dirPath = dirPath
+
+    def path(self):
+        return os.path.join(self.dirPath, self.fileName)
+
+    def exists(self):
+        return os.path.isfile(self.path())
+
+    def keys(self):
+        return list(self)
+
+    def toDict(self):
+        """Return the complete index as an OrderedDict."""
+        return OrderedDict([(k, self[k]) for k in self])
+
+
+class TextIndex(DirIndex):
+    """Index stored as a configfile-format `.index` file.
+    """
+    format = 'text'
+    fileName = '.index'
+
+    def __init__(self, dirPath):
+        DirIndex.__init__(self, dirPath)
+        self._data = None
+        self._mtime = None
+
+    def reload(self):
+        fileName = self.path()
+        mtime = os.path.getmtime(fileName)
+        if self._data is None or mtime != self._mtime:
+            try:
+                self._data = readConfigFile(fileName)
+                self._mtime = mtime
+            except:
+                print("***************Error while reading index file %s!*******************" % fileName)
+                raise
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def __getitem__(self, name):
+        return self._data[name]
+
+    def __iter__(self):
+        return iter(list(self._data.keys()))
+
+    def __len__(self):
+        return len(self._data)
+
+    def update(self, name, info):
+        if name not in self._data:
+            self._data[name] = {}
+            append = True
+        else:
+            append = False
+        for k in info:
+            self._data[name][k] = info[k]
+        if append:
+            appendConfigFile({name: info}, self.path())
+            self._mtime = os.path.getmtime(self.path())
+        else:
+            self.write(self._data)
+
+    def remove(self, name):
+        del self._data[name]
+        self.write(self._data)
+
+    def write(self, data):
+        writeConfigFile(data, self.path())
+        self._data = data
+        self._mtime = os.path.getmtime(self.path())
+
+
+class LogIndex(DirIndex):
+    """Index stored as a binary append-only log in `.indexlog`.
+
+    File layout: an 8-byte magic string followed by records. Each record is
+    a header (operation, payload length, name length), the utf-8 entry name,
+    and a payload holding the dict in utf-8 configfile format. Operations
+    are UPDATE (merge keys into the entry), REPLACE (set the entire entry)
+    and REMOVE. A truncated record at the end of the file (eg. from an
+    interrupted write) is ignored and overwritten by the next append.
+
+    Only record headers are read when the index is opened; the file offsets
+    of each entry's payloads are kept, and payloads are read from the file
+    when the entry is first requested.
+    """
+    format = 'log'
+    fileName = '.indexlog'
+    magic = b'ACQ4IDX2'
+    header = struct.Struct('<BIH')
+    UPDATE, REPLACE, REMOVE = 0, 1, 2
+
+    # compact when there are this many more records than live entries
+    compactThreshold = 1000
+
+    def __init__(self, dirPath):
+        DirIndex.__init__(self, dirPath)
+        self._entries = OrderedDict()   # name: list of (offset, length) of payloads since the last REPLACE
+        self._cache = {}                # name: decoded info dict
+        self._nRecords = 0
+        self._end = None                # file offset of the end of the last complete record
+        self._stat = None               # (inode, mtime, size) when last read or written
+
+    def reload(self):
+        st = os.stat(self.path())
+        stat = (st.st_ino, st.st_mtime, st.st_size)
+        if stat == self._stat:
+            return
+        if self._end is None or self._stat is None or st.st_ino != self._stat[0] or st.st_size < self._end:
+            # first read, or the file was rewritten (compacted) elsewhere
+            self._reset()
+        self._scan()
+        self._stat = stat
+
+    def _reset(self):
+        self._entries.clear()
+        self._cache.clear()
+        self._nRecords = 0
+        self._end = None
+        self._stat = None
+
+    def _scan(self):
+        # parse record headers from the last known position to the end of the file,
+        # skipping over the payloads
+        hsize = self.header.size
+        with open(self.path(), 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            if self._end is None:
+                magic = fh.read(len(self.magic))
+                if magic != self.magic:
+                    raise Exception("File %s is not a valid index log." % self.path())
+                self._end = len(magic)
+            pos = self._end
+            fh.seek(pos)
+            while pos + hsize <= size:
+                op, length, nameLen = self.header.unpack(fh.read(hsize))
+                end = pos + hsize + nameLen + length
+                if end > size:
+                    break  # incomplete record
+                name = fh.read(nameLen).decode('utf-8')
+                self._addRecord(op, name, pos + hsize + nameLen, length)
+                fh.seek(length, 1)
+                pos = end
+        self._end = pos
+
+    def _addRecord(self, op, name, offset, length):
+        self._nRecords += 1
+        self._cache.pop(name, None)
+        if op == self.REMOVE:
+            self._entries.pop(name, None)
+            return
+        records = self._entries.setdefault(name, [])
+        if op == self.REPLACE:
+            del records[:]
+        records.append((offset, length))
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __getitem__(self, name):
+        info = self._cache.get(name, None)
+        if info is not None:
+            return info
+        records = self._entries[name]   # raises KeyError for missing entries
+        with open(self.path(), 'rb') as fh:
+            if self._stat is not None and os.fstat(fh.fileno()).st_ino != self._stat[0]:
+                # compacted by another handle or process; offsets are no longer valid
+                self.reload()
+                return self[name]
+            info = {}
+            for offset, length in records:
+                fh.seek(offset)
+                info.update(parseString(fh.read(length).decode('utf-8'))[1])
+        self._cache[name] = info
+        return info
+
+    def __iter__(self):
+        return iter(list(self._entries.keys()))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def update(self, name, info):
+        if self.exists():
+            self.reload()
+        if len(info) == 0 and name in self._entries:
+            return
+        if name in self._cache:
+            cached = self._cache[name]
+            cached.update(info)
+        elif name not in self._entries:
+            cached = dict(info)
+        else:
+            cached = None
+        self._append([(self.UPDATE, name, info)])
+        if cached is not None:
+            self._cache[name] = cached
+        self._maybeCompact()
+
+    def remove(self, name):
+        self.reload()
+        if name not in self._entries:
+            return
+        self._append([(self.REMOVE, name, {})])
+        self._maybeCompact()
+
+    def write(self, data):
+        """Rewrite the log with one REPLACE record per entry in *data*."""
+        data = OrderedDict([(k, dict(data[k])) for k in data])
+        fileName = self.path()
+        tmpFile = fileName + '.tmp'
+        with open(tmpFile, 'wb') as fh:
+            fh.write(self.magic)
+            for name, info in data.items():
+                fh.write(self._encode(self.REPLACE, name, info)[0])
+        if os.path.exists(fileName) and not hasattr(os, 'replace'):
+            os.remove(fileName)
+        getattr(os, 'replace', os.rename)(tmpFile, fileName)
+
+        self._reset()
+        self.reload()
+        self._cache.update(data)
+
+    def compact(self):
+        """Rewrite the log with a single record per entry."""
+        self.write(self.toDict())
+
+    def _maybeCompact(self):
+        if self._nRecords - len(self._entries) > max(self.compactThreshold, len(self._entries)):
+            self.compact()
+
+    def _encode(self, op, name, info):
+        # return the encoded record and the offset of its payload within the record
+        name = name.encode('utf-8') if isinstance(name, six.text_type) else name
+        payload = genString(info).encode('utf-8')
+        head = self.header.pack(op, len(payload), len(name)) + name
+        return head + payload, len(head)
+
+    def _append(self, records):
+        fileName = self.path()
+        if not os.path.exists(fileName):
+            with open(fileName, 'wb') as fh:
+                fh.write(self.magic)
+            self._reset()
+        self.reload()
+        with open(fileName, 'r+b') as fh:
+            # overwrite any incomplete record left at the end of the file
+            fh.seek(self._end)
+            for op, name, info in records:
+                rec, payloadOffset = self._encode(op, name, info)
+                fh.write(rec)
+                self._addRecord(op, name, self._end + payloadOffset, len(rec) - payloadOffset)
+                self._end += len(rec)
+            fh.truncate()
+        st = os.stat(fileName)
+        self._stat = (st.st_ino, st.st_mtime, st.st_size)
@@ -0,0 +1,303 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the vectorized event detection functions in acq4.util.functions
+(thresholdEvents, zeroCrossingEvents) against the previous, per-event loop
+implementations, which are kept here as a reference.
+
+Traces are filtered noise with exponential events, similar to those analyzed
+by the EventDetector/Photostim flowcharts; noisier traces have more crossings.
+
+Clements-Bekkers template matching of a sequence of traces is compared
+between the previous one-trace-at-a-time implementation and a single batch
+ClementsBekkersMatcher call.
+
+Usage:  python -m acq4.util.events_benchmark [nSamples]
+"""
+from __future__ import print_function
+import sys
+import numpy as np
+from numpy import ndarray, histogram
+import scipy.ndimage
+import acq4.util.ptime as ptime
+from acq4.util.functions import thresholdEvents, zeroCrossingEvents, measureNoise, fitGaussian, rollingSum, expTemplate, ClementsBekkersMatcher
+
+
+def makeTrace(n=100000, nEvents=200, noise=1.0, seed=0):
+    """Return a trace of *n* samples containing *nEvents* exponential events of both signs in lowpass-filtered noise."""
+    rng = np.random.RandomState(seed)
+    trace = scipy.ndimage.gaussian_filter(rng.normal(size=n), 3) * noise * 5
+    kernel = np.exp(-np.arange(300) / 40.)
+    impulses = np.zeros(n)
+    impulses[rng.randint(0, n, size=nEvents)] = rng.choice([-1, 1], size=nEvents) * rng.uniform(2, 10, size=nEvents)
+    trace += np.convolve(impulses, kernel)[:n]
+    return trace
+
+
+## Previous implementations (only changed to run on python 3 / current numpy)
+
+def zeroCrossingEventsOriginal(data, minLength=3, minPeak=0.0, minSum=0.0, noiseThreshold=None):
+    """Locate events of any shape in a signal. Works by finding regions of the signal
+    that deviate from noise, using the area beneath the deviation as the detection criteria.
+    
+    Makes the following assumptions about the signal:
+      - noise is gaussian
+      - baseline is centered at 0 (high-pass filtering may be required to achieve this).
+      - no 0 crossings within an event due to noise (low-pass filtering may be required to achieve this)
+      - Events last more than minLength samples
+      Return an array of events where each row is (start, length, sum, peak)
+    """
+    ## just make sure this is an ndarray and not a MetaArray before operating..
+    data1 = data.view(ndarray)
+    xvals = None
+    if (hasattr(data, 'implements') and data.implements('MetaArray')):
+        try:
+            xvals = data.xvals(0)
+        except:
+            pass
+
+    ## find all 0 crossings
+    mask = data1 > 0
+    diff = mask[1:] != mask[:-1]  ## mask is True every time the trace crosses 0 between i and i+1
+    times1 = np.argwhere(diff)[:, 0]  ## index of each point immediately before crossing.
+    
+    times = np.empty(len(times1)+2, dtype=times1.dtype)  ## add first/last indexes to list of crossing times
+    times[0] = 0                                         ## this is a bit suspicious, but we'd rather know
+    times[-1] = len(data1)                               ## about large events at the beginning/end
+    times[1:-1] = times1                                 ## rather than ignore them.
+    
+    ## select only events longer than minLength.
+    ## We do this check early for performance--it eliminates the vast majority of events
+    longEvents = np.argwhere(times[1:] - times[:-1] > minLength)
+    if len(longEvents) < 1:
+        nEvents = 0
+    else:
+        longEvents = longEvents[:, 0]
+        nEvents = len(longEvents)
+    
+    ## Measure sum of values within each region between crossings, combine into single array
+    if xvals is None:
+        events = np.empty(nEvents, dtype=[('index',int),('len', int),('sum', float),('peak', float)])  ### rows are [start, length, sum]
+    else:
+        events = np.empty(nEvents, dtype=[('index',int),('time',float),('len', int),('sum', float),('peak', float)])  ### rows are [start, length, sum]
+    for i in range(nEvents):
+        t1 = times[longEvents[i]]+1
+        t2 = times[longEvents[i]+1]+1
+        events[i]['index'] = t1
+        events[i]['len'] = t2-t1
+        evData = data1[t1:t2]
+        events[i]['sum'] = evData.sum()
+        if events[i]['sum'] > 0:
+            peak = evData.max()
+        else:
+            peak = evData.min()
+        events[i]['peak'] = peak
+    
+    if xvals is not None:
+        events['time'] = xvals[events['index']]
+    
+    if noiseThreshold is not None and noiseThreshold > 0:
+        ## Fit gaussian to peak in size histogram, use fit sigma as criteria for noise rejection
+        stdev = measureNoise(data1)
+        hist = histogram(events['sum'], bins=100)
+        histx = 0.5*(hist[1][1:] + hist[1][:-1]) ## get x values from middle of histogram bins
+        fit = fitGaussian(histx, hist[0], [hist[0].max(), 0, stdev*3, 0])
+        sigma = fit[0][2]
+        minSize = sigma * noiseThreshold
+        
+        ## Generate new set of events, ignoring those with sum < minSize
+        mask = abs(events['sum']) >= minSize
+        events = events[mask]
+
+    if minPeak > 0:
+        events = events[abs(events['peak']) > minPeak]
+    
+    if minSum > 0:
+        events = events[abs(events['sum']) > minSum]
+
+    return events
+
+
+def thresholdEventsOriginal(data, threshold, adjustTimes=True, baseline=0.0):
+    """Finds regions in a trace that cross a threshold value (as measured by distance from baseline). Returns the index, time, length, peak, and sum of each event.
+    Optionally adjusts times to an extrapolated baseline-crossing."""
+    threshold = abs(threshold)
+    data1 = data.view(ndarray)
+    data1 = data1-baseline
+    try:
+        xvals = data.xvals(0)
+        dt = xvals[1]-xvals[0]
+    except:
+        dt = 1
+        xvals = None
+    
+    ## find all threshold crossings
+    masks = [(data1 > threshold).astype(np.byte), (data1 < -threshold).astype(np.byte)]
+    hits = []
+    for mask in masks:
+        diff = mask[1:] - mask[:-1]
+        onTimes = np.argwhere(diff==1)[:,0]+1
+        offTimes = np.argwhere(diff==-1)[:,0]+1
+        if len(onTimes) == 0 or len(offTimes) == 0:
+            continue
+        if offTimes[0] < onTimes[0]:
+            offTimes = offTimes[1:]
+            if len(offTimes) == 0:
+                continue
+        if offTimes[-1] < onTimes[-1]:
+            onTimes = onTimes[:-1]
+        for i in range(len(onTimes)):
+            hits.append((onTimes[i], offTimes[i]))
+    
+    ## sort hits  ## NOTE: this can be sped up since we already know how to interleave the events..
+    hits.sort(key=lambda h: h[0])
+    
+    nEvents = len(hits)
+    if xvals is None:
+        events = np.empty(nEvents, dtype=[('index',int),('len', int),('sum', float),('peak', float),('peakIndex', int)])  ### rows are [start, length, sum]
+    else:
+        events = np.empty(nEvents, dtype=[('index',int),('time',float),('len', int),('sum', float),('peak', float),('peakIndex', int)])  ### rows are     
+
+    mask = np.ones(nEvents, dtype=bool)
+    
+    ## Lots of work ahead:
+    ## 1) compute length, peak, sum for each event
+    ## 2) adjust event times if requested, then recompute parameters
+    for i in range(nEvents):
+        t1, t2 = hits[i]
+        ln = t2-t1
+        evData = data1[t1:t2]
+        sum = evData.sum()
+        if sum > 0:
+            peakInd = np.argmax(evData)
+        else:
+            peakInd = np.argmin(evData)
+        peak = evData[peakInd]
+        peakInd += t1
+            
+        if adjustTimes:  ## Move start and end times outward, estimating the zero-crossing point for the event
+        
+            ## adjust t1 first
+            mind = np.argmax(evData)
+            pdiff = abs(peak - evData[0])
+            if pdiff == 0:
+                adj1 = 0
+            else:
+                adj1 = int(threshold * mind / pdiff)
+                adj1 = min(ln, adj1)
+            t1 -= adj1
+            
+            ## check for collisions with previous events
+            if i > 0:
+                lt2 = hits[i-1][1]
+                if t1 < lt2:
+                    diff = lt2-t1   ## if events have collided, force them to compromise
+                    tot = adj1 + lastAdj
+                    if tot != 0:
+                        d1 = diff * float(lastAdj) / tot
+                        d2 = diff * float(adj1) / tot
+                        hits[i-1] = (hits[i-1][0], hits[i-1][1]-(d1+1))
+                        t1 += d2
+            
+            ## adjust t2
+            mind = ln - mind
+            pdiff = abs(peak - evData[-1])
+            if pdiff == 0:
+                adj2 = 0
+            else:
+                adj2 = int(threshold * mind / pdiff)
+                adj2 = min(ln, adj2)
+            t2 += adj2
+            lastAdj = adj2
+
+        hits[i] = (t1, t2)
+        events[i]['peak'] = peak
+        events[i]['index'] = t1
+        events[i]['peakIndex'] = peakInd
+        events[i]['len'] = ln
+        events[i]['sum'] = sum
+        
+    if adjustTimes:  ## go back and re-compute event parameters.
+        for i in range(nEvents):
+            t1, t2 = hits[i]
+            
+            ln = t2-t1
+            evData = data1[int(t1):int(t2)]
+            sum = evData.sum()
+            if len(evData) == 0:
+                mask[i] = False
+                continue
+            if sum > 0:
+                peakInd = np.argmax(evData)
+            else:
+                peakInd = np.argmin(evData)
+            peak = evData[peakInd]
+            peakInd += t1
+                
+            events[i]['peak'] = peak
+            events[i]['index'] = t1
+            events[i]['peakIndex'] = peakInd
+            events[i]['len'] = ln
+            events[i]['sum'] = sum
+    
+    ## remove masked events
+    events = events[mask]
+    
+    if xvals is not None:
+        events['time'] = xvals[events['index']]
+
+    return events
+
+
+def clementsBekkersOriginal(data, template):
+    D = data.view(ndarray)
+    T = template.view(ndarray)
+    N = len(T)
+    sumT = T.sum()
+    sumT2 = (T**2).sum()
+    sumD = rollingSum(D, N)
+    sumD2 = rollingSum(D**2, N)
+    sumTD = np.correlate(D, T, mode='valid')
+    scale = (sumTD - sumT * sumD /N) / (sumT2 - sumT**2 /N)
+    offset = (sumD - scale * sumT) /N
+    SSE = sumD2 + scale**2 * sumT2 + N * offset**2 - 2 * (scale*sumTD + offset*sumD - scale*offset*sumT)
+    error = np.sqrt(SSE / (N-1))
+    DC = scale / error
+    return DC, scale, offset
+
+
+def runCB(n, nTraces=20):
+    traces = np.vstack([makeTrace(n, noise=1.0, seed=i) for i in range(nTraces)])
+    for decay in (2e-3, 20e-3):
+        template = expTemplate(1e-4, 0.5e-3, decay)
+        start = ptime.time()
+        for trace in traces:
+            clementsBekkersOriginal(trace, template)
+        t1 = ptime.time() - start
+        start = ptime.time()
+        matcher = ClementsBekkersMatcher(template)
+        matcher.match(traces)
+        t2 = ptime.time() - start
+        print("clementsBekkers      %d x %d samples, template %d samples (%s)   per trace %0.3f s   batch %0.3f s   (%0.1fx)" % (
+            nTraces, n, len(template), matcher.method, t1, t2, t1 / max(t2, 1e-9)))
+
+
+def run(n):
+    for noise in (0.3, 1.0, 3.0):
+        data = makeTrace(n, noise=noise)
+        for name, new, old, args in [
+                ('thresholdEvents', thresholdEvents, thresholdEventsOriginal, (1.0,)),
+                ('zeroCrossingEvents', zeroCrossingEvents, zeroCrossingEventsOriginal, ()),
+            ]:
+            times = []
+            for fn in (old, new):
+                start = ptime.time()
+                result = fn(data, *args)
+                times.append(ptime.time() - start)
+            print("%-20s noise=%0.1f  %6d events   original %0.4f s   new %0.4f s   (%0.1fx)" % (
+                name, noise, len(result), times[0], times[1], times[0] / max(times[1], 1e-9)))
+
+
+if __name__ == '__main__':
+    n = int(float(sys.argv[1])) if len(sys.argv) > 1 else 1000000
+    run(n)
+    runCB(n // 10)
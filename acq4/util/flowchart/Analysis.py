@@ -7,25 +7,34 @@ import numpy as np
 import scipy
 #from acq4.pyqtgraph import graphicsItems
 import acq4.pyqtgraph as pg
+import acq4.pyqtgraph.multiprocess as mp
 import acq4.util.metaarray as metaarray
 #import acq4.pyqtgraph.CheckTable as CheckTable
 from collections import OrderedDict
+import os, tempfile, multiprocessing
 from acq4.analysis.tools.Fitting import Fitting
 
 class EventFitter(CtrlNode):
     """Takes a waveform and event list as input, returns extra information about each event.
     Optionally performs an exponential reconvolution before measuring each event.
-    Plots fits of reconstructed events if the plot output is connected."""
+    Plots fits of reconstructed events if the plot output is connected.
+    
+    If *parallel* is checked, events are fitted in chunks by a pool of *nProcesses*
+    worker processes; fits are plotted as each chunk finishes. Results are
+    identical to (and in the same order as) those of serial fitting. Workers are
+    started as new processes (pyqtgraph.multiprocess) rather than forked, so
+    they do not inherit the Qt state of this process."""
     nodeName = "EventFitter"
     uiTemplate = [
         ('multiFit', 'check', {'value': False}),
-        #('parallel', 'check', {'value': False}),
-        #('nProcesses', 'spin', {'value': 1, 'min': 1, 'int': True}),
+        ('parallel', 'check', {'value': False, 'tip': 'Fit events using a pool of worker processes'}),
+        ('nProcesses', 'intSpin', {'value': max(1, multiprocessing.cpu_count()-1), 'min': 1, 'max': 256, 'hidden': True}),
         ('plotFits', 'check', {'value': True}),
         ('plotGuess', 'check', {'value': False}),
         ('plotEvents', 'check', {'value': False}),
     ]
     
+    chunkSize = 25  ## number of events sent to a worker process at a time
     
     def __init__(self, name):
         CtrlNode.__init__(self, name, terminals={
@@ -37,25 +46,51 @@ class EventFitter(CtrlNode):
         self.plotItems = []
         self.selectedFit = None
         self.deletedFits = []
-        self.pool = None  ## multiprocessing pool
+        self.pool = None  ## list of (process, remote Analysis module) for each worker
         self.poolSize = 0
-        #self.ctrls['parallel'].toggled.connect(self.setupPool)
-        #self.ctrls['nProcesses'].valueChanged.connect(self.setupPool)
+        if 'parallel' in self.ctrls:  ## subclasses may not offer parallel fitting
+            self.ctrls['parallel'].toggled.connect(self.parallelToggled)
     
-    #def setupPool(self):
-        #import multiprocessing as mp
-        #if self.ctrls['parallel'].isChecked():
-            #nProc = self.ctrls['nProcesses'].value()
-            #if self.pool is not None and self.poolSize != nProc:
-                #self.pool.terminate()
-                #self.pool = None
-            #if self.pool is None:
-                #self.pool = mp.Pool(processes=nProc)
-                #self.poolSize = nProc
-        #else:
-            #if self.pool is not None:
-                #self.pool.terminate()
-                #self.pool = None
+    def parallelToggled(self, parallel):
+        if parallel:
+            self.showRow('nProcesses')
+        else:
+            self.hideRow('nProcesses')
+            self.closePool()
+    
+    def setupPool(self):
+        """Return the worker pool as a list of remote proxies to this module, 
+        (re)starting it if needed. The pool persists between calls to process()
+        so workers are only started once."""
+        nProc = self.ctrls['nProcesses'].value()
+        if self.pool is not None and self.poolSize != nProc:
+            self.closePool()
+        if self.pool is None:
+            self.pool = []
+            try:
+                for i in range(nProc):
+                    proc = mp.Process(name='EventFitter worker %d' % i)
+                    self.pool.append((proc, proc._import(__name__)))
+            except:
+                self.closePool()
+                raise
+            self.poolSize = nProc
+        return [mod for proc, mod in self.pool]
+        
+    def closePool(self):
+        ## Ask workers to exit once they finish the chunk they are fitting; do not wait for them
+        if self.pool is not None:
+            for proc, mod in self.pool:
+                try:
+                    proc.close()
+                except:
+                    pass  ## worker already gone
+            self.pool = None
+            self.poolSize = 0
+            
+    def close(self):
+        self.closePool()
+        CtrlNode.close(self)
     
     def process(self, waveform, events, display=True):
         self.deletedFits = []
@@ -74,69 +109,109 @@ class EventFitter(CtrlNode):
             'tvals': waveform.xvals('Time'),
         }
         
-        
-        #if not self.ctrls['parallel'].isChecked():
-        output = processEventFits(events, startEvent=0, stopEvent=len(events), opts=opts)
-        guesses = output['guesses']
-        eventData = output['eventData']
-        indexes = output['indexes']
-        xVals = output['xVals']
-        yVals = output['yVals']
-        output = output['output']
-        #else:
-            #print "parallel:", self.pool, self.poolSize
-            #results = []
-            #nProcesses = self.ctrls['nProcesses'].value()
-            #evPerProcess = int(len(events) / nProcesses)
-            #start = 0
-            #for i in range(nProcesses):
-                #stop = start + evPerProcess
-                #if stop > len(events):
-                    #stop = len(events)
-                #args = (events, start, stop, opts)
-                #results.append(self.pool.apply_async(processEventFits, args))
-                #print "started process", start, stop
-                #start = stop
-            #data = []
-            #guesses = []
-            #eventData = []
-            #indexes = []
-            #xVals = []
-            #yVals = []
-            #for res in results:  ## reconstruct results here
-                #print "getting result", res
-                #output = res.get(10)
-                #data.append(output['output'])
-                #guesses.extend(output['guesses'])
-                #eventData.extend(output['eventData'])
-                #indexes.extend(output['indexes'])
-                #xVals.extend(output['xVals'])
-                #yVals.extend(output['yVals'])
-            #output = np.concatenate(data)
-            
-        for i in range(len(indexes)):            
-            if display and self['plot'].isConnected():
-                if self.ctrls['plotFits'].isChecked():
-                    item = pg.PlotDataItem(x=xVals[i], y=yVals[i], pen=(0, 0, 255), clickable=True)
-                    item.setZValue(100)
-                    self.plotItems.append(item)
-                    item.eventIndex = indexes[i]
-                    item.sigClicked.connect(self.fitClicked)
-                    item.deleted = False
-                if self.ctrls['plotGuess'].isChecked():
-                    item2 = pg.PlotDataItem(x=xVals[i], y=functions.pspFunc(guesses[i], xVals[i]), pen=(255, 0, 0))
-                    item2.setZValue(100)
-                    self.plotItems.append(item2)
-                if self.ctrls['plotEvents'].isChecked():
-                    item2 = pg.PlotDataItem(x=xVals[i], y=eventData[i], pen=(0, 255, 0))
-                    item2.setZValue(100)
-                    self.plotItems.append(item2)
-                #plot = list(self.plot.connections().keys())[0].node().getPlot()
-                #plot.addItem(item)
+        if not self.ctrls['parallel'].isChecked() or len(events) <= self.chunkSize:
+            output = processEventFits(events, startEvent=0, stopEvent=len(events), opts=opts)
+            if display:
+                self.plotItems = self.makePlotItems(output)
+            output = output['output']
+        else:
+            output = self.processParallel(events, opts, display)
             
         self.outputData = output
         return {'output': output, 'plot': self.plotItems}
 
+    def processParallel(self, events, opts, display):
+        ## Fit events in chunks using the worker pool. The waveform and time
+        ## values are written once to a temporary file that each worker maps
+        ## into memory, rather than being pickled along with every chunk.
+        ## Chunks are collected in order, so the output is the same as serial fitting.
+        pool = self.setupPool()
+        shared = {}
+        try:
+            for key in ('waveform', 'tvals'):
+                shared[key] = _writeSharedArray(opts[key])
+            chunkOpts = dict([(k, v) for k, v in opts.items() if k not in shared])
+            tasks = []
+            for start in range(0, len(events), self.chunkSize):
+                stop = min(start + self.chunkSize, len(events))
+                ## include the next event; its start time limits the last fit in the chunk
+                tasks.append((events[start:stop+1], 0, stop-start, chunkOpts, shared))
+            
+            plots = []
+            if display and self['plot'].isConnected():
+                for term in self['plot'].connections():
+                    plot = term.node().getPlot()
+                    if plot is not None:
+                        plots.append(plot)
+                        
+            ## Each worker handles its requests in order; keep two chunks queued 
+            ## per worker and collect results in chunk order.
+            requests = {}
+            def submit(i):
+                if i < len(tasks):
+                    worker = pool[i % len(pool)]
+                    requests[i] = worker._fitEventChunk(tasks[i], _callSync='async', _returnType='value')
+            for i in range(2 * len(pool)):
+                submit(i)
+                
+            outputs = []
+            try:
+                with pg.ProgressDialog("Fitting events..", 0, len(events), disable=not display) as dlg:
+                    for n, start in enumerate(range(0, len(events), self.chunkSize)):
+                        output = requests.pop(n).result(timeout=None)
+                        submit(n + 2 * len(pool))
+                        outputs.append(output['output'])
+                        output['indexes'] = [i + start for i in output['indexes']]
+                        if display:
+                            items = self.makePlotItems(output)
+                            self.plotItems.extend(items)
+                            ## show partial results while the remaining chunks are fitted;
+                            ## connected plot nodes take over these items when we return
+                            for plot in plots:
+                                for item in items:
+                                    plot.addItem(item)
+                        dlg.setValue(min(start + self.chunkSize, len(events)))
+                        if dlg.wasCanceled():
+                            raise Exception("Event fitting canceled by user.")
+            except:
+                self.closePool()  ## abandon chunks that are still queued in the workers
+                raise
+            finally:
+                for plot in plots:
+                    for item in self.plotItems:
+                        plot.removeItem(item)
+        finally:
+            for fileName in shared.values():
+                try:
+                    os.remove(fileName)
+                except OSError:
+                    pass  ## may still be mapped by a worker (windows)
+        return np.concatenate(outputs)
+        
+    def makePlotItems(self, fits):
+        """Return plot items for the fits returned by processEventFits."""
+        items = []
+        if not self['plot'].isConnected():
+            return items
+        for i in range(len(fits['indexes'])):
+            xVals = fits['xVals'][i]
+            if self.ctrls['plotFits'].isChecked():
+                item = pg.PlotDataItem(x=xVals, y=fits['yVals'][i], pen=(0, 0, 255), clickable=True)
+                item.setZValue(100)
+                items.append(item)
+                item.eventIndex = fits['indexes'][i]
+                item.sigClicked.connect(self.fitClicked)
+                item.deleted = False
+            if self.ctrls['plotGuess'].isChecked():
+                item2 = pg.PlotDataItem(x=xVals, y=functions.pspFunc(fits['guesses'][i], xVals), pen=(255, 0, 0))
+                item2.setZValue(100)
+                items.append(item2)
+            if self.ctrls['plotEvents'].isChecked():
+                item2 = pg.PlotDataItem(x=xVals, y=fits['eventData'][i], pen=(0, 255, 0))
+                item2.setZValue(100)
+                items.append(item2)
+        return items
+
     def deleteSelected(self):
         item = self.selectedFit
         d = not item.deleted
@@ -210,7 +285,7 @@ def processEventFits(events, startEvent, stopEvent, opts):
     nFields = len(events.dtype.fields)
     
     dtype = [(n, events[n].dtype) for n in events.dtype.names]
-    output = np.empty(len(events), dtype=dtype + [
+    output = np.empty(stopEvent-startEvent, dtype=dtype + [
         ('fitAmplitude', float), 
         ('fitTime', float),
         ('fitRiseTau', float), 
@@ -326,7 +401,7 @@ def processEventFits(events, startEvent, stopEvent, opts):
         err = (diff**2).sum()
         fracError = diff.std() / computed.std()
         lengthOverDecay = (times[-1] - fit[1]) / fit[3]  # ratio of (length of data that was fit : decay constant)
-        output[i-offset] = tuple(events[i]) + tuple(fit) + (peakTime, err, fracError, lengthOverDecay)
+        output[i-startEvent-offset] = tuple(events[i]) + tuple(fit) + (peakTime, err, fracError, lengthOverDecay)
         #output['fitTime'] += output['time']
             
         #print fit
@@ -346,6 +421,36 @@ def processEventFits(events, startEvent, stopEvent, opts):
         
     return outputState
 
+
+def _writeSharedArray(data):
+    ## Write *data* to a temporary .npy file to be memory-mapped by worker processes.
+    fd, fileName = tempfile.mkstemp(prefix='acq4_eventfit_', suffix='.npy')
+    os.close(fd)
+    np.save(fileName, np.ascontiguousarray(data))
+    return fileName
+
+
+_sharedArrays = {}
+
+def _readSharedArray(fileName):
+    ## Map an array written by _writeSharedArray; only the most recent
+    ## arrays are kept open in each worker process.
+    if fileName not in _sharedArrays:
+        if len(_sharedArrays) >= 4:
+            _sharedArrays.clear()
+        _sharedArrays[fileName] = np.asarray(np.load(fileName, mmap_mode='r'))
+    return _sharedArrays[fileName]
+
+
+def _fitEventChunk(args):
+    ## Worker process entry point for parallel fitting in EventFitter.
+    events, startEvent, stopEvent, opts, shared = args
+    opts = opts.copy()
+    for key, fileName in shared.items():
+        opts[key] = _readSharedArray(fileName)
+    return processEventFits(events, startEvent, stopEvent, opts)
+
+
 class CaEventFitter(EventFitter):
     nodeName="CaEventFitter"
     uiTemplate = [
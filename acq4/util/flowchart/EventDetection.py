@@ -194,6 +194,60 @@ class ThresholdEvents(PlottingCtrlNode):
             
             
 
+class ClementsBekkers(CtrlNode):
+    """Detects events by Clements-Bekkers template matching with an exponential PSP template. 
+    Input may be a single trace or a 2D MetaArray (traces x Time), such as a whole sequence of 
+    sweeps, which is processed at once. Returns the index, time, detection criterion (dc), 
+    amplitude (scale) and baseline (offset) of each event, plus the trace number for 2D input."""
+    nodeName = 'ClementsBekkers'
+    uiTemplate = [
+        ('riseTau', 'spin', {'value': 1e-3, 'step': 1, 'minStep': 1e-6, 'dec': True, 'bounds': [1e-9, None], 'siPrefix': True, 'suffix': 's'}),
+        ('decayTau', 'spin', {'value': 10e-3, 'step': 1, 'minStep': 1e-6, 'dec': True, 'bounds': [1e-9, None], 'siPrefix': True, 'suffix': 's'}),
+        ('threshold', 'spin', {'value': 3.0, 'step': 1, 'minStep': 0.1, 'dec': True, 'bounds': [0, None], 'tip': 'Minimum detection criterion (template amplitude / fit error)'}),
+        ('eventLimit', 'intSpin', {'value': 400, 'min': 1, 'max': 1e9, 'tip': 'Limits the number of events that may be detected in a single trace.'}),
+    ]
+    
+    def __init__(self, name, **opts):
+        CtrlNode.__init__(self, name, self.uiTemplate)
+        self.matcher = None
+        self.matcherKey = None
+        
+    def processData(self, data):
+        s = self.stateGroup.state()
+        tvals = data.xvals('Time')
+        dt = tvals[1] - tvals[0]
+        
+        ## reuse the matcher (and its template statistics) while the template is unchanged
+        key = (dt, s['riseTau'], s['decayTau'])
+        if key != self.matcherKey:
+            rise, decay = s['riseTau'], s['decayTau']
+            template = functions.expTemplate(dt, rise, decay, rise*2, (rise+decay)*4)
+            self.matcher = functions.ClementsBekkersMatcher(template)
+            self.matcherKey = key
+        cbEvents = self.matcher.detect(data, s['threshold'])
+        
+        dtype = [('index', int), ('time', float), ('dc', float), ('scale', float), ('offset', float)]
+        if data.ndim == 2:
+            dtype.insert(0, ('trace', int))
+            ## limit number of events in each trace
+            first = np.searchsorted(cbEvents['trace'], cbEvents['trace'])
+            cbEvents = cbEvents[np.arange(len(cbEvents)) - first < s['eventLimit']]
+        else:
+            cbEvents = cbEvents[:s['eventLimit']]
+            
+        events = np.empty(len(cbEvents), dtype=dtype)
+        for name in ['dc', 'scale', 'offset']:
+            events[name] = cbEvents[name]
+        if data.ndim == 2:
+            events['trace'] = cbEvents['trace']
+        events['index'] = cbEvents['peak']
+        events['time'] = tvals[cbEvents['peak']]
+        return events
+
+    def processBypassed(self, args):
+        return {'Out': np.empty(0, dtype=[('index', int), ('time', float), ('dc', float), ('scale', float), ('offset', float)])}
+
+
 class SpikeDetector(CtrlNode):
     """Very simple spike detector. Returns the indexes of sharp spikes by comparing each sample to its neighbors."""
     nodeName = "SpikeDetect"
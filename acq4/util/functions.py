@@ -458,6 +458,11 @@ def downsample(data, n, axis=0, xvals='subsample'):
                 info[axis]['values'] = info[axis]['values'][::n][:nPts]
             elif xvals == 'downsample':
                 info[axis]['values'] = downsample(info[axis]['values'], n)
+        elif ma.axisIsImplicit(axis):
+            ## implicit axis values (start + i / rate)
+            if xvals == 'downsample':
+                info[axis]['start'] += (n - 1) / (2.0 * info[axis]['rate'])
+            info[axis]['rate'] /= float(n)
         return MetaArray(d2, info=info)
     
         
@@ -1398,6 +1403,40 @@ def measureNoise(data, threshold=2.0, iterations=2):
     #return median(data2.std(axis=0))
     
 
+def _segmentSums(data, starts, stops):
+    ## Return the sum, maximum and minimum of each segment data[starts[i]:stops[i]].
+    ## Segments must not be empty but may overlap.
+    idx = np.empty(len(starts)*2, dtype=int)
+    idx[0::2] = starts
+    idx[1::2] = stops
+    data = np.append(data, data[:1])  ## reduceat requires stops < len(data); the extra value is never used.
+    return (np.add.reduceat(data, idx)[0::2], 
+            np.maximum.reduceat(data, idx)[0::2], 
+            np.minimum.reduceat(data, idx)[0::2])
+
+
+def _segmentArgFirst(data, starts, stops, values):
+    ## Return, for each segment data[starts[i]:stops[i]], the index relative to starts[i] 
+    ## of the first occurrence of values[i] (which must be present) or of a NaN if values[i] is NaN.
+    lens = stops - starts
+    evIndex = np.repeat(np.arange(len(starts)), lens)
+    offsets = np.arange(len(evIndex)) - np.repeat(np.cumsum(lens) - lens, lens)
+    segData = data[np.repeat(starts, lens) + offsets]
+    match = segData == values[evIndex]
+    if np.isnan(values).any():
+        match |= np.isnan(segData)
+    hits = np.flatnonzero(match)
+    first = hits[np.searchsorted(evIndex[hits], np.arange(len(starts)))]
+    return offsets[first]
+
+
+def _sliceIndex(t, n):
+    ## Convert (float) indexes t to the effective start/stop used when slicing an array of length n with int(t)
+    t = t.astype(int)
+    t = np.where(t < 0, t + n, t)
+    return np.clip(t, 0, n)
+
+
 def stdevThresholdEvents(data, threshold=3.0):
     """Finds regions in data greater than threshold*stdev.
     Returns a record array with columns: index, length, sum, peak.
@@ -1459,8 +1498,7 @@ def zeroCrossingEvents(data, minLength=3, minPeak=0.0, minSum=0.0, noiseThreshol
     
     ## find all 0 crossings
     mask = data1 > 0
-    diff = mask[1:] - mask[:-1]  ## mask is True every time the trace crosses 0 between i and i+1
-    times1 = np.argwhere(diff)[:, 0]  ## index of each point immediately before crossing.
+    times1 = np.flatnonzero(mask[1:] != mask[:-1])  ## index of each point immediately before crossing.
     
     times = np.empty(len(times1)+2, dtype=times1.dtype)  ## add first/last indexes to list of crossing times
     times[0] = 0                                         ## this is a bit suspicious, but we'd rather know
@@ -1470,12 +1508,8 @@ def zeroCrossingEvents(data, minLength=3, minPeak=0.0, minSum=0.0, noiseThreshol
     
     ## select only events longer than minLength.
     ## We do this check early for performance--it eliminates the vast majority of events
-    longEvents = np.argwhere(times[1:] - times[:-1] > minLength)
-    if len(longEvents) < 1:
-        nEvents = 0
-    else:
-        longEvents = longEvents[:, 0]
-        nEvents = len(longEvents)
+    longEvents = np.flatnonzero(times[1:] - times[:-1] > minLength)
+    nEvents = len(longEvents)
     
     ## Measure sum of values within each region between crossings, combine into single array
     if xvals is None:
@@ -1483,25 +1517,20 @@ def zeroCrossingEvents(data, minLength=3, minPeak=0.0, minSum=0.0, noiseThreshol
     else:
         events = np.empty(nEvents, dtype=[('index',int),('time',float),('len', int),('sum', float),('peak', float)])  ### rows are [start, length, sum]
     #p.mark('empty %d -> %d'% (len(times), nEvents))
-    #n = 0
-    for i in range(nEvents):
-        t1 = times[longEvents[i]]+1
-        t2 = times[longEvents[i]+1]+1
-        events[i]['index'] = t1
-        events[i]['len'] = t2-t1
-        evData = data1[t1:t2]
-        events[i]['sum'] = evData.sum()
-        if events[i]['sum'] > 0:
-            peak = evData.max()
-        else:
-            peak = evData.min()
-        events[i]['peak'] = peak
+    t1 = times[longEvents]+1
+    t2 = times[longEvents+1]+1
+    events['index'] = t1
+    events['len'] = t2-t1
+    if nEvents > 0:
+        sums, maxs, mins = _segmentSums(data1, t1, np.minimum(t2, len(data1)))
+        events['sum'] = sums
+        events['peak'] = np.where(sums > 0, maxs, mins)
     #p.mark('generate event array')
     
     if xvals is not None:
         events['time'] = xvals[events['index']]
     
-    if noiseThreshold  > 0:
+    if noiseThreshold is not None and noiseThreshold > 0:
         ## Fit gaussian to peak in size histogram, use fit sigma as criteria for noise rejection
         stdev = measureNoise(data1)
         #p.mark('measureNoise')
@@ -1546,145 +1575,91 @@ def thresholdEvents(data, threshold, adjustTimes=True, baseline=0.0):
         xvals = None
     
     ## find all threshold crossings
-    masks = [(data1 > threshold).astype(np.byte), (data1 < -threshold).astype(np.byte)]
-    hits = []
-    for mask in masks:
-        diff = mask[1:] - mask[:-1]
-        onTimes = np.argwhere(diff==1)[:,0]+1
-        offTimes = np.argwhere(diff==-1)[:,0]+1
-        #print mask
-        #print diff
-        #print onTimes, offTimes
-        if len(onTimes) == 0 or len(offTimes) == 0:
+    ## Regions above and below threshold can not overlap, so sorting the starts
+    ## of both sets of regions interleaves them.
+    onTimes = []
+    offTimes = []
+    for mask in (data1 > threshold, data1 < -threshold):
+        diff = np.diff(mask.astype(np.byte))
+        on = np.flatnonzero(diff==1)+1
+        off = np.flatnonzero(diff==-1)+1
+        if len(on) == 0 or len(off) == 0:
             continue
-        if offTimes[0] < onTimes[0]:
-            offTimes = offTimes[1:]
-            if len(offTimes) == 0:
+        if off[0] < on[0]:
+            off = off[1:]
+            if len(off) == 0:
                 continue
-        if offTimes[-1] < onTimes[-1]:
-            onTimes = onTimes[:-1]
-        for i in range(len(onTimes)):
-            hits.append((onTimes[i], offTimes[i]))
-    
-    ## sort hits  ## NOTE: this can be sped up since we already know how to interleave the events..
-    hits.sort(lambda a,b: cmp(a[0], b[0]))
+        if off[-1] < on[-1]:
+            on = on[:-1]
+        onTimes.append(on)
+        offTimes.append(off)
+    if len(onTimes) == 0:
+        t1 = t2 = np.empty(0, dtype=int)
+    else:
+        t1 = np.concatenate(onTimes)
+        order = np.argsort(t1, kind='mergesort')
+        t1 = t1[order]
+        t2 = np.concatenate(offTimes)[order]
     
-    nEvents = len(hits)
+    nEvents = len(t1)
     if xvals is None:
         events = np.empty(nEvents, dtype=[('index',int),('len', int),('sum', float),('peak', float),('peakIndex', int)])  ### rows are [start, length, sum]
     else:
         events = np.empty(nEvents, dtype=[('index',int),('time',float),('len', int),('sum', float),('peak', float),('peakIndex', int)])  ### rows are     
+    if nEvents == 0:
+        return events
 
+    ## compute length, peak, sum for each event
+    ln = t2-t1
+    sums, maxs, mins = _segmentSums(data1, t1, t2)
+    positive = sums > 0
+    maxInd = _segmentArgFirst(data1, t1, t2, maxs)
+    peakInd = np.where(positive, maxInd, _segmentArgFirst(data1, t1, t2, mins))
+    peak = np.where(positive, maxs, mins)
     mask = np.ones(nEvents, dtype=bool)
     
-    ## Lots of work ahead:
-    ## 1) compute length, peak, sum for each event
-    ## 2) adjust event times if requested, then recompute parameters
-    for i in range(nEvents):
-        t1, t2 = hits[i]
+    if adjustTimes:  
+        ## Move start and end times outward, estimating the zero-crossing point for each event
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pdiff = abs(peak - data1[t1])
+            adj1 = np.where(pdiff == 0, 0, np.minimum(ln, threshold * maxInd / pdiff)).astype(int)
+            pdiff = abs(peak - data1[t2-1])
+            adj2 = np.where(pdiff == 0, 0, np.minimum(ln, threshold * (ln - maxInd) / pdiff)).astype(int)
+        t1 = (t1 - adj1).astype(float)
+        t2 = (t2 + adj2).astype(float)
+        
+        ## check for collisions with previous events; if events have collided, force them to compromise
+        coll = np.flatnonzero(t1[1:] < t2[:-1]) + 1
+        tot = adj1[coll] + adj2[coll-1]
+        coll = coll[tot != 0]
+        tot = tot[tot != 0]
+        diff = t2[coll-1] - t1[coll]
+        d1 = diff * adj2[coll-1] / tot
+        d2 = diff * adj1[coll] / tot
+        t2[coll-1] -= d1+1
+        t1[coll] += d2
+        
+        ## go back and re-compute event parameters.
+        ## (adjusted times are truncated and may be negative, exactly as when slicing data1[int(t1):int(t2)])
         ln = t2-t1
-        evData = data1[t1:t2]
-        sum = evData.sum()
-        if sum > 0:
-            #peak = evData.max()
-            #ind = argwhere(evData==peak)[0][0]+t1
-            peakInd = np.argmax(evData)
-        else:
-            #peak = evData.min()
-            #ind = argwhere(evData==peak)[0][0]+t1
-            peakInd = np.argmin(evData)
-        peak = evData[peakInd]
+        start = _sliceIndex(t1, len(data1))
+        stop = _sliceIndex(t2, len(data1))
+        mask = stop > start
+        sums = np.zeros(nEvents)
+        sums[mask], maxs, mins = _segmentSums(data1, start[mask], stop[mask])
+        positive = sums[mask] > 0
+        peakInd = np.zeros(nEvents)
+        peakInd[mask] = np.where(positive, _segmentArgFirst(data1, start[mask], stop[mask], maxs), 
+                                           _segmentArgFirst(data1, start[mask], stop[mask], mins))
         peakInd += t1
-            
-        #print "event %f: %d" % (xvals[t1], t1) 
-        if adjustTimes:  ## Move start and end times outward, estimating the zero-crossing point for the event
+        peak = np.zeros(nEvents)
+        peak[mask] = np.where(positive, maxs, mins)
         
-            ## adjust t1 first
-            mind = np.argmax(evData)
-            pdiff = abs(peak - evData[0])
-            if pdiff == 0:
-                adj1 = 0
-            else:
-                adj1 = int(threshold * mind / pdiff)
-                adj1 = min(ln, adj1)
-            t1 -= adj1
-            #print "   adjust t1", adj1
-            
-            ## check for collisions with previous events
-            if i > 0:
-                #lt2 = events[i-1]['index'] + events[i-1]['len']
-                lt2 = hits[i-1][1]
-                if t1 < lt2:
-                    diff = lt2-t1   ## if events have collided, force them to compromise
-                    tot = adj1 + lastAdj
-                    if tot != 0:
-                        d1 = diff * float(lastAdj) / tot
-                        d2 = diff * float(adj1) / tot
-                        #events[i-1]['len'] -= (d1+1)
-                        hits[i-1] = (hits[i-1][0], hits[i-1][1]-(d1+1))
-                        t1 += d2
-                        #recompute[i-1] = True
-                        #print "  correct t1", d2, "  correct prev.", d1+1
-            #try:
-                #print "   correct t1", d2, "  correct prev.", d1+1
-            #except:
-                #pass
-            
-            ## adjust t2
-            mind = ln - mind
-            pdiff = abs(peak - evData[-1])
-            if pdiff == 0:
-                adj2 = 0
-            else:
-                adj2 = int(threshold * mind / pdiff)
-                adj2 = min(ln, adj2)
-            t2 += adj2
-            lastAdj = adj2
-            #print "  adjust t2", adj2
-            
-            #recompute[i] = True
-            
-        #starts.append(t1)
-        #stops.append(t2)
-        hits[i] = (t1, t2)
-        events[i]['peak'] = peak
-        #if index == 'peak':
-            #events[i]['index']=ind
-        #else:
-        events[i]['index'] = t1
-        events[i]['peakIndex'] = peakInd
-        events[i]['len'] = ln
-        events[i]['sum'] = sum
-        
-    if adjustTimes:  ## go back and re-compute event parameters.
-        for i in range(nEvents):
-            t1, t2 = hits[i]
-            
-            ln = t2-t1
-            evData = data1[int(t1):int(t2)]
-            sum = evData.sum()
-            if len(evData) == 0:
-                mask[i] = False
-                continue
-            if sum > 0:
-                #peak = evData.max()
-                #ind = argwhere(evData==peak)[0][0]+t1
-                peakInd = np.argmax(evData)
-            else:
-                #peak = evData.min()
-                #ind = argwhere(evData==peak)[0][0]+t1
-                peakInd = np.argmin(evData)
-            peak = evData[peakInd]
-            peakInd += t1
-                
-            events[i]['peak'] = peak
-            #if index == 'peak':
-                #events[i]['index']=ind
-            #else:
-            events[i]['index'] = t1
-            events[i]['peakIndex'] = peakInd
-            events[i]['len'] = ln
-            events[i]['sum'] = sum
+    events['peak'] = peak
+    events['index'] = t1
+    events['peakIndex'] = peakInd if adjustTimes else peakInd + t1
+    events['len'] = ln
+    events['sum'] = sums
     
     ## remove masked events
     events = events[mask]
@@ -1855,69 +1830,158 @@ def denoise(data, radius=2, threshold=4):
 
 
 def rollingSum(data, n):
-    d1 = data.copy()
-    d1[1:] += d1[:-1]  # integrate
-    d2 = np.empty(len(d1) - n + 1, dtype=data.dtype)
-    d2[0] = d1[n-1]  # copy first point
-    d2[1:] = d1[n:] - d1[:-n]  # subtract
+    """Return the sums of all windows of *n* consecutive samples along the last axis of *data*."""
+    d1 = np.cumsum(data, axis=-1)  # integrate
+    d2 = np.empty(d1.shape[:-1] + (d1.shape[-1] - n + 1,), dtype=d1.dtype)
+    d2[..., 0] = d1[..., n-1]  # copy first point
+    d2[..., 1:] = d1[..., n:] - d1[..., :-n]  # subtract
     return d2
+
+
+class ClementsBekkersMatcher(object):
+    """Clements-Bekkers template matching: slides a template across data and 
+    measures the goodness of fit at every position.
+    Biophysical Journal, 73: 220-229, 1997.
     
+    Data may be a single trace or a 2D array of traces (traces x samples), which 
+    are all processed at once. Template statistics (and the template FFT used for 
+    long templates) are computed only once, so a single matcher may be used 
+    efficiently for many traces.
+    
+    ============== ================================================================
+    **Arguments:**
+    template       1D array
+    method         'direct' computes the correlation with numpy.correlate, 'fft' uses 
+                   FFT-based correlation. The default, 'auto', uses 'fft' for templates 
+                   longer than ClementsBekkersMatcher.fftThreshold samples.
+    ============== ================================================================
+    """
+    fftThreshold = 300
+    
+    def __init__(self, template, method='auto'):
+        T = np.asarray(template, dtype=float)
+        self.template = T
+        self.N = len(T)
+        self.sumT = T.sum()
+        self.sumT2 = (T**2).sum()
+        self.scaleDenom = self.sumT2 - self.sumT**2 / self.N
+        if method == 'auto':
+            method = 'fft' if self.N > self.fftThreshold else 'direct'
+        if method not in ('fft', 'direct'):
+            raise ValueError("method must be 'auto', 'fft', or 'direct'")
+        self.method = method
+        self._templateFFT = {}  # {fft length: conjugate of template FFT}
+        
+    def match(self, data):
+        """Return arrays (dc, scale, offset) giving the detection criterion and the scale 
+        and offset of the best-fitting template at every position in data. The last 
+        axis of each array has length data.shape[-1] - len(template) + 1.
+        """
+        if hasattr(data, 'implements') and data.implements('MetaArray'):
+            data = data.asarray()
+        D = np.array(data, dtype=float)
+        if D.ndim not in (1, 2):
+            raise ValueError("Data must be 1D or 2D (traces x samples).")
+        N = self.N
+        if D.shape[-1] < N:
+            raise ValueError("Data is shorter than template.")
+        
+        ## remove the mean of each trace to limit round-off error in the rolling sums
+        mean = D.mean(axis=-1)[..., np.newaxis]
+        D -= mean
+        sumD = rollingSum(D, N)
+        sumD2 = rollingSum(D**2, N)
+        sumTD = self._correlate(D)
+        
+        ## compute scale factor, offset at each location:
+        scale = (sumTD - self.sumT * sumD / N) / self.scaleDenom
+        offset = (sumD - scale * self.sumT) / N
+        
+        ## compute SSE at every location
+        SSE = sumD2 + scale**2 * self.sumT2 + N * offset**2 - 2 * (scale*sumTD + offset*sumD - scale*offset*self.sumT)
+        
+        ## finally, compute error and detection criterion
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error = np.sqrt(np.clip(SSE, 0, None) / (N-1))
+            dc = scale / error
+        offset += mean
+        return dc, scale, offset
+        
+    def detect(self, data, threshold=3.0):
+        """Return a record array with one event for each region where the detection criterion
+        exceeds *threshold*. Fields are 'peak' (the position where the criterion is largest), 
+        and the 'dc', 'scale' and 'offset' at that position. For 2D data, the field 'trace' 
+        gives the row of each event. Regions that touch either end of a trace are ignored.
+        """
+        dc, scale, offset = self.match(data)
+        dc2 = np.atleast_2d(dc)
+        nTraces, nPts = dc2.shape
+        
+        ## find start/stop of every region above threshold in all traces
+        mask = np.zeros((nTraces, nPts+2), dtype=np.byte)
+        mask[:, 1:-1] = dc2 > threshold
+        edges = np.diff(mask, axis=1)
+        rows, starts = np.nonzero(edges == 1)
+        stops = np.nonzero(edges == -1)[1]
+        keep = (starts > 0) & (stops < nPts)
+        rows, starts, stops = rows[keep], starts[keep], stops[keep]
+        
+        dtype = [('peak', int), ('dc', float), ('scale', float), ('offset', float)]
+        if dc.ndim == 2:
+            dtype.insert(0, ('trace', int))
+        result = np.empty(len(rows), dtype=dtype)
+        if len(rows) == 0:
+            return result
+        
+        flat = dc2.ravel()
+        rowStart = rows * nPts
+        maxs = _segmentSums(flat, starts + rowStart, stops + rowStart)[1]
+        peaks = starts + _segmentArgFirst(flat, starts + rowStart, stops + rowStart, maxs)
+        
+        if dc.ndim == 2:
+            result['trace'] = rows
+        result['peak'] = peaks
+        result['dc'] = dc2[rows, peaks]
+        result['scale'] = np.atleast_2d(scale)[rows, peaks]
+        result['offset'] = np.atleast_2d(offset)[rows, peaks]
+        return result
+        
+    def _correlate(self, D):
+        ## correlate template with each trace in D ('valid' region only)
+        T = self.template
+        nOut = D.shape[-1] - self.N + 1
+        if self.method == 'direct':
+            if D.ndim == 1:
+                return np.correlate(D, T, mode='valid')
+            out = np.empty((D.shape[0], nOut))
+            for i in range(D.shape[0]):
+                out[i] = np.correlate(D[i], T, mode='valid')
+            return out
+        
+        ## circular correlation does not wrap around within the valid region as long as n >= len(D)
+        n = 2**int(np.ceil(np.log2(D.shape[-1])))
+        tf = self._templateFFT.get(n, None)
+        if tf is None:
+            tf = np.conj(np.fft.rfft(T, n))
+            self._templateFFT[n] = tf
+        return np.fft.irfft(np.fft.rfft(D, n, axis=-1) * tf, n, axis=-1)[..., :nOut]
+        
 
 def clementsBekkers(data, template):
     """Implements Clements-bekkers algorithm: slides template across data,
-    returns array of points indicating goodness of fit.
-    Biophysical Journal, 73: 220-229, 1997.
+    returns arrays (dc, scale, offset) indicating goodness of fit.
+    Data may be a single trace or a 2D array (traces x samples).
+    See ClementsBekkersMatcher.
     """
-    
-    ## Strip out meta-data for faster computation
-    D = data.view(ndarray)
-    T = template.view(ndarray)
-    
-    ## Prepare a bunch of arrays we'll need later
-    N = len(T)
-    sumT = T.sum()
-    sumT2 = (T**2).sum()
-    sumD = rollingSum(D, N)
-    sumD2 = rollingSum(D**2, N)
-    sumTD = correlate(D, T, mode='valid')
-    
-    ## compute scale factor, offset at each location:
-    scale = (sumTD - sumT * sumD /N) / (sumT2 - sumT**2 /N)
-    offset = (sumD - scale * sumT) /N
-    
-    ## compute SSE at every location
-    SSE = sumD2 + scale**2 * sumT2 + N * offset**2 - 2 * (scale*sumTD + offset*sumD - scale*offset*sumT)
-    
-    ## finally, compute error and detection criterion
-    error = sqrt(SSE / (N-1))
-    DC = scale / error
-    return DC, scale, offset
+    return ClementsBekkersMatcher(template).match(data)
+
     
 def cbTemplateMatch(data, template, threshold=3.0):
-    dc, scale, offset = clementsBekkers(data, template)
-    mask = dc > threshold
-    diff = mask[1:] - mask[:-1]
-    times = np.argwhere(diff==1)[:, 0]  ## every time we start OR stop a spike
-    
-    ## in the unlikely event that the very first or last point is matched, remove it
-    if abs(dc[0]) > threshold:
-        times = times[1:]
-    if abs(dc[-1]) > threshold:
-        times = times[:-1]
-    
-    nEvents = len(times) / 2
-    
-    result = np.empty(nEvents, dtype=[('peak', int), ('dc', float), ('scale', float), ('offset', float)])
-    for i in range(nEvents):
-        i1 = times[i*2]
-        i2 = times[(i*2)+1]
-        d = dc[i1:i2]
-        p = argmax(d)
-        result[0] = p+i1
-        result[1] = d[p]
-        result[2] = scale[p+i1]
-        result[3] = offset[p+i1]
-    return result
+    """Return a record array of the events where the Clements-Bekkers detection criterion 
+    exceeds threshold. Data may be a single trace or a 2D array (traces x samples).
+    See ClementsBekkersMatcher.detect().
+    """
+    return ClementsBekkersMatcher(template).detect(data, threshold)
 
 
 def expTemplate(dt, rise, decay, delay=None, length=None, risePow=2.0):
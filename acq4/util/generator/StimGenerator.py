@@ -14,6 +14,7 @@ for evaluation are provided in waveforms.py.
 import sys, types, re
 import numpy as np
 from acq4.util import Qt
+from acq4.util.Mutex import Mutex
 from collections import OrderedDict
 import acq4.util.functions as fn
 from .GeneratorTemplate import *
@@ -29,6 +30,8 @@ import acq4.util.units as units
 
 class StimGenerator(Qt.QWidget):
     
+    cacheMaxBytes = 200e6  ## maximum total size of cached waveforms (see getSingle)
+
     sigDataChanged = Qt.Signal()        ## Emitted when the output of getSingle() is expected to have changed
     sigStateChanged = Qt.Signal()       ## Emitted when the output of saveState() is expected to have changed
     sigParametersChanged = Qt.Signal()  ## Emitted when the sequence parameter space has changed
@@ -50,9 +53,13 @@ class StimGenerator(Qt.QWidget):
         
         self.pSpace = None    ## cached sequence parameter space
         
-        self.cache = {}       ## cached waveforms
-        self.cacheRate = None
-        self.cacheNPts = None
+        self.lock = Mutex(recursive=True)  ## waveforms may be generated from the task thread
+        self.cache = OrderedDict()  ## cached waveforms, least recently used first
+        self.cacheBytes = 0
+        self._namespace = None      ## (namespace, wave function args, ...) reused by all evaluations
+        self._seqNames = set()      ## sequence parameters currently defined in the namespace
+        self._compiled = {}         ## function string: (mode, code object)
+        self._notVectorizable = set()  ## (function, sequence names) that failed vectorized evaluation
 
         
         
@@ -95,11 +102,13 @@ class StimGenerator(Qt.QWidget):
     def setEvalNames(self, **kargs):
         """Make variables accessible for use by evaluated functions."""
         self.extraParams.update(kargs)
+        self._namespace = None
         self.clearCache()
         self.autoUpdate()
         
     def delEvalName(self, name):
         del self.extraParams[name]
+        self._namespace = None
         self.clearCache()
         self.autoUpdate()
 
@@ -150,7 +159,9 @@ class StimGenerator(Qt.QWidget):
         self.stimParams.setMeta(axis, self.meta[axis])
 
     def clearCache(self):
-        self.cache = {}
+        with self.lock:
+            self.cache = OrderedDict()
+            self.cacheBytes = 0
     
     def functionString(self):
         return str(self.ui.functionText.toPlainText())
@@ -374,92 +385,219 @@ class StimGenerator(Qt.QWidget):
         """
         Return a single generated waveform (possibly cached) with the given sample rate
         number of samples, and sequence parameters.        
+
+        Waveforms are kept in a least-recently-used cache of at most
+        *cacheMaxBytes*; the returned array must not be modified.
         """
         if params is None:
             params = {}
             
-        if self.cacheRate != rate or self.cacheNPts != nPts:
-            self.clearCache()
+        key = self._cacheKey(rate, nPts, params)
+        with self.lock:
+            if key in self.cache:
+                self.cache[key] = self.cache.pop(key)  ## move to most-recent end
+                return self.cache[key][0]
             
-        paramKey = tuple(params.items())
-        if paramKey in self.cache:
-            return self.cache[paramKey]
+            ## add current sequence parameter values into namespace
+            values = self._paramValues(params)
+            ret, message = self._evaluate(rate, nPts, values)
+            if isinstance(ret, ndarray):
+                #ret *= self.scale
+                ret += self.offset
+                #print "===eval===", ret.min(), ret.max(), self.scale
+            elif ret is not None:
+                raise TypeError("Function must return ndarray or None.")
             
-        self.cacheRate = rate
-        self.cacheNPts = nPts
+            self.setError(message)
+            self._cacheStore(key, ret)
+            return ret
+
+    def getSequence(self, rate, nPts):
+        """
+        Return the waveforms for every point in the sequence parameter space as
+        a single array of shape (len(seq1), len(seq2), ..., nPts), with axes in
+        the order returned by listSequences(). Returns None if the function 
+        does not generate a waveform.
+
+        If possible, all waveforms are generated in one evaluation of the
+        function, with each sequence parameter given as an array that
+        broadcasts along its axis. Functions that do not produce an array of
+        the expected shape this way (for example, most functions in
+        waveforms.py) are evaluated once per point instead. Either way the
+        results are identical to calling getSingle() for each point, and are
+        cached the same way.
+        """
+        seqs = self.listSequences()
+        names = list(seqs.keys())
+        shape = tuple([len(seqs[k]) for k in names])
+        points = [(ind, dict(zip(names, ind))) for ind in np.ndindex(*shape)]
+        
+        with self.lock:
+            waves = None
+            vecKey = (self.functionString(), tuple(names))
+            missing = [ind for ind, p in points if self._cacheKey(rate, nPts, p) not in self.cache]
+            if len(names) > 0 and len(missing) > 1 and vecKey not in self._notVectorizable:
+                waves = self._evaluateSequence(rate, nPts, names, shape)
+                if waves is None:
+                    if len(self._notVectorizable) > 50:
+                        self._notVectorizable.clear()
+                    self._notVectorizable.add(vecKey)
             
-        ## create namespace with generator functions. 
-        ##   - iterates over all functions provided in waveforms module
-        ##   - wrap each function to automatically provide rate and nPts arguments
-        ns = {}
-        #arg = {'rate': rate * self.timeScale, 'nPts': nPts}
-        arg = {'rate': rate, 'nPts': nPts}
-        ns.update(arg)  ## copy rate and nPts to eval namespace
-        for i in dir(waveforms):
-            obj = getattr(waveforms, i)
-            if type(obj) is types.FunctionType:
-                ns[i] = self.makeWaveFunction(i, arg)
-        
-        ## add current sequence parameter values into namespace
+            out = None
+            for ind, p in points:
+                if waves is not None and ind in missing:
+                    wave = waves[ind] + self.offset
+                    self._cacheStore(self._cacheKey(rate, nPts, p), wave)
+                else:
+                    wave = self.getSingle(rate, nPts, p)
+                if wave is None:
+                    return None
+                if out is None:
+                    out = np.empty(shape + wave.shape, dtype=wave.dtype)
+                out[ind] = wave
+            return out
+
+    def cacheSequence(self, rate, nPts):
+        """
+        Generate the waveforms for every point in the sequence parameter space
+        at once (see getSequence) so that the following calls to getSingle()
+        are answered from the cache. Does nothing if the waveforms would not
+        all fit in the cache. Returns True if the sequence was generated.
+        """
+        nPoints = np.prod([len(v) for v in self.listSequences().values()])
+        if nPoints < 2 or nPoints * nPts * 8 > self.cacheMaxBytes:  ## assumes float64 waveforms
+            return False
+        return self.getSequence(rate, nPts) is not None
+
+    def _evaluateSequence(self, rate, nPts, names, shape):
+        ## Evaluate the function once with every sequence parameter given as an array
+        ## along its own axis; return None if that does not produce one waveform per point.
+        seq = self.paramSpace()
+        values = self._paramValues({})
+        for i, k in enumerate(names):
+            axShape = [1] * (len(shape) + 1)
+            axShape[i] = shape[i]
+            values[k] = np.array(seq[k][1], dtype=float).reshape(axShape)
+        try:
+            waves, message = self._evaluate(rate, nPts, values)
+        except Exception:
+            return None
+        if not isinstance(waves, ndarray) or waves.shape != shape + (nPts,):
+            return None
+        ## spot-check against single evaluations; this catches functions that reduce
+        ## across the whole array (eg. x - x.mean()) and would silently differ
+        for ind in set([(0,) * len(shape), tuple([n-1 for n in shape])]):
+            try:
+                single, _ = self._evaluate(rate, nPts, self._paramValues(dict(zip(names, ind))))
+            except Exception:
+                return None
+            if not isinstance(single, ndarray) or not np.allclose(single, waves[ind], rtol=1e-12, atol=0, equal_nan=True):
+                return None
+        self.setError(message)
+        return waves
+
+    def _paramValues(self, params):
+        ## Return {name: value} for all sequence parameters, using the sequence
+        ## indexes in *params* or the single values otherwise.
+        values = {}
         seq = self.paramSpace() # -- this is where the Laser bug was happening -- seq becomes 'Pulse_sum', but params was {'power.Pulse_sum': x}, so the default value is always used instead (fixed by removing 'power.' before the params are sent to stimGenerator, but perhaps there is a better place to fix this)
         for k in seq:
             if k in params:  ## select correct value from sequence list
                 try:
-                    ns[k] = float(seq[k][1][params[k]])
+                    values[k] = float(seq[k][1][params[k]])
                 except IndexError:
                     print("Requested value %d for param %s, but only %d in the param list." % (params[k], str(k), len(seq[k][1])))
                     raise
             else:  ## just use single value
-                ns[k] = float(seq[k][0])
-
-        ## add units into namespace
-        ns.update(units.allUnits)
-        
-        ## add extra parameters to namespace
-        ns.update(self.extraParams)
+                values[k] = float(seq[k][0])
+        return values
 
-        ## evaluate and return
-        fn = self.functionString()
-        
-        ## build global namespace with numpy imported
-        #gns = {}
-        ns['np'] = np
-        
-        #print "function: '%s'" % fn
-        if fn.strip() == '':
-            ret = np.zeros(nPts)
-        else:
+    def _evalNamespace(self):
+        ## Create namespace with generator functions, units and extra parameters.
+        ##   - iterates over all functions provided in waveforms module
+        ##   - wrap each function to automatically provide rate and nPts arguments
+        ## The namespace is built once and reused; rate, nPts and sequence parameter
+        ## values are updated for each evaluation.
+        if self._namespace is None:
+            ns = {}
+            arg = {}
+            for i in dir(waveforms):
+                obj = getattr(waveforms, i)
+                if type(obj) is types.FunctionType:
+                    ns[i] = self.makeWaveFunction(i, arg)
+            ## add units into namespace
+            ns.update(units.allUnits)
+            ## add extra parameters to namespace
+            ns.update(self.extraParams)
+            ## numpy is always available
+            ns['np'] = np
+            ## names that can not be replaced by sequence parameters
+            fixed = set(units.allUnits) | set(self.extraParams) | set(['np'])
+            self._namespace = (ns, arg, fixed, ns.copy())
+            self._seqNames = set()
+        return self._namespace
+
+    def _compileFunction(self, fnStr):
+        ## Return (mode, code) for the function string, compiling it only once.
+        if fnStr not in self._compiled:
             try:  # first try eval() without line breaks for backward compatibility
-                ret = eval(fn.replace('\n', ''), ns, {})
+                compiled = ('eval', compile(fnStr.replace('\n', ''), '<stimulus>', 'eval'))
             except SyntaxError:  # next try exec() as contents of a function
+                run = "\noutput=fn()\n"
+                code = "def fn():\n" + "\n".join(["    "+l for l in fnStr.split('\n')]) + run
                 try:
-                    run = "\noutput=fn()\n"
-                    code = "def fn():\n" + "\n".join(["    "+l for l in fn.split('\n')]) + run
-                    #print "--- Code: ---"
-                    #print code
-                    #print "-------------"
-                    lns = {}
-                    exec(code, ns, lns)
-                    ret = lns['output']
+                    compiled = ('exec', compile(code, '<stimulus>', 'exec'))
                 except SyntaxError as err:
                     err.lineno -= 1
                     raise err
-                
-            
-        if isinstance(ret, ndarray):
-            #ret *= self.scale
-            ret += self.offset
-            #print "===eval===", ret.min(), ret.max(), self.scale
-        elif ret is not None:
-            raise TypeError("Function must return ndarray or None.")
-        
-        if 'message' in arg:
-            self.setError(arg['message'])
+            if len(self._compiled) > 50:
+                self._compiled.clear()
+            self._compiled[fnStr] = compiled
+        return self._compiled[fnStr]
+
+    def _evaluate(self, rate, nPts, values):
+        ## Evaluate the function string with the given sequence parameter values.
+        ## Returns the function output and any message generated by wave functions.
+        ns, arg, fixed, base = self._evalNamespace()
+        arg.clear()
+        arg.update({'rate': rate, 'nPts': nPts})
+        for k in self._seqNames - set(values.keys()):  ## restore names that are no longer parameters
+            if k in base:
+                ns[k] = base[k]
+            else:
+                del ns[k]
+        self._seqNames = set()
+        for k, v in list(arg.items()) + list(values.items()):
+            if k not in fixed:
+                ns[k] = v
+                self._seqNames.add(k)
+        
+        fnStr = self.functionString()
+        if fnStr.strip() == '':
+            ret = np.zeros(nPts)
         else:
-            self.setError()
-            
-        self.cache[paramKey] = ret
-        return ret
+            mode, code = self._compileFunction(fnStr)
+            if mode == 'eval':
+                ret = eval(code, ns, {})
+            else:
+                lns = {}
+                exec(code, ns, lns)
+                ret = lns['output']
+        return ret, arg.get('message', None)
+
+    def _cacheKey(self, rate, nPts, params):
+        return (rate, nPts, tuple(sorted(params.items())))
+
+    def _cacheStore(self, key, wave):
+        ## add a waveform to the cache, evicting least recently used waveforms as needed
+        nbytes = 0 if wave is None else wave.nbytes
+        if nbytes > self.cacheMaxBytes:
+            return
+        while len(self.cache) > 0 and self.cacheBytes + nbytes > self.cacheMaxBytes:
+            k, (w, size) = self.cache.popitem(last=False)
+            self.cacheBytes -= size
+        self.cache[key] = (wave, nbytes)
+        self.cacheBytes += nbytes
         
     def makeWaveFunction(self, name, arg):
         ## Creates a copy of a wave function (such as steps or pulses) with the first parameter filled in
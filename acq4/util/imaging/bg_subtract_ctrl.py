@@ -4,6 +4,7 @@ import numpy as np
 from acq4.util import Qt
 
 from acq4 import pyqtgraph as pg
+from acq4.util.Mutex import Mutex
 from .bg_subtract_template import Ui_Form
 
 
@@ -23,13 +24,10 @@ class BgSubtractCtrl(Qt.QWidget):
         self.ui = Ui_Form()
         self.ui.setupUi(self)
 
-        self.backgroundFrame = None
-        self.blurredBackgroundFrame = None
-        self.lastFrameTime = None
+        self.model = BackgroundModel()
         self.requestBgReset = False
 
         ## Connect Background Subtraction Dock
-        self.ui.bgBlurSpin.valueChanged.connect(self.updateBackgroundBlur)
         self.ui.collectBgBtn.clicked.connect(self.collectBgClicked)
         self.ui.divideBgBtn.clicked.connect(self.divideClicked)
         self.ui.subtractBgBtn.clicked.connect(self.subtractClicked)
@@ -44,45 +42,39 @@ class BgSubtractCtrl(Qt.QWidget):
         self.ui.divideBgBtn.setChecked(False)
 
     def getBackgroundFrame(self):
-        if self.backgroundFrame is None:
-            return None
-        if self.blurredBackgroundFrame is None:
-            self.updateBackgroundBlur()
-        return self.blurredBackgroundFrame
-
-    def updateBackgroundBlur(self):
-        b = self.ui.bgBlurSpin.value()
-        if b > 0.0:
-            self.blurredBackgroundFrame = scipy.ndimage.gaussian_filter(self.backgroundFrame, (b, b))
+        """Return the (blurred) background image, or None if no background
+        has been collected.
+        """
+        return self.model.background(self.ui.bgBlurSpin.value())
+
+    def processingOpts(self):
+        """Return the background correction options used by FrameProcessor.
+        """
+        if self.ui.divideBgBtn.isChecked():
+            mode = 'divide'
+        elif self.ui.subtractBgBtn.isChecked():
+            mode = 'subtract'
         else:
-            self.blurredBackgroundFrame = self.backgroundFrame
+            mode = None
+        return {'bgMode': mode, 'bgBlur': self.ui.bgBlurSpin.value()}
 
     def collectBgClicked(self, checked):
         if checked:
             if not self.ui.contAvgBgCheck.isChecked():
-                # don't reset the background frame just yet; anyone may call processImage()
-                # before the next frame arrives.
+                # don't reset the background frame just yet; frames may still be
+                # displayed before the next frame arrives.
                 self.requestBgReset = True
-                self.bgFrameCount = 0
                 self.bgStartTime = pg.ptime.time()
             self.ui.collectBgBtn.setText("Collecting...")
         else:
             self.ui.collectBgBtn.setText("Collect Background")
 
     def newFrame(self, frame):
-        now = pg.ptime.time()
-        if self.lastFrameTime is None:
-            dt = 0
-        else:
-            dt = now - self.lastFrameTime
-        self.lastFrameTime = now
         if not self.ui.collectBgBtn.isChecked():
             return
         
-        # integrate new frame into background
-        if self.ui.contAvgBgCheck.isChecked():
-            x = np.exp(-dt * 5 / max(self.ui.bgTimeSpin.value(), 0.01))
-        else:
+        continuous = self.ui.contAvgBgCheck.isChecked()
+        if not continuous:
             ## stop collecting bg frames if we are in static mode and time is up
             timeLeft = self.ui.bgTimeSpin.value() - (pg.ptime.time()-self.bgStartTime)
             if timeLeft > 0:
@@ -91,26 +83,84 @@ class BgSubtractCtrl(Qt.QWidget):
                 self.ui.collectBgBtn.setChecked(False)
                 self.ui.collectBgBtn.setText("Collect Background")
 
-            x = float(self.bgFrameCount) / (self.bgFrameCount + 1)
-            self.bgFrameCount += 1
-    
-        img = frame.getImage().astype(np.float32)
-        if self.requestBgReset or self.backgroundFrame is None or self.backgroundFrame.shape != img.shape:
-            self.requestBgReset = False
-            self.backgroundFrame = img
+        # the frame is averaged into the background later by the display's FrameProcessor
+        reset = self.model.addFrame(frame.getImage(), pg.ptime.time(), continuous,
+                                    self.ui.bgTimeSpin.value(), reset=self.requestBgReset)
+        self.requestBgReset = False
+        if reset:
             self.needFrameUpdate.emit()
-        else:
-            self.backgroundFrame = x * self.backgroundFrame + (1-x) * img
-        self.blurredBackgroundFrame = None
-        
-    def processImage(self, data):
-        if self.ui.divideBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data / bg
-        elif self.ui.subtractBgBtn.isChecked():
-            bg = self.getBackgroundFrame()
-            if bg is not None and bg.shape == data.shape:
-                data = data - bg
 
-        return data
+
+class BackgroundModel(object):
+    """Running average of frames used as the background image for BgSubtractCtrl.
+
+    Frames are handed over with addFrame() (in the GUI thread) and averaged
+    into a float32 buffer in place by update(), which FrameProcessor calls from
+    its own thread; no arrays are allocated per frame. Only the most recent
+    frame added since the last update() is used. Its weight depends on the
+    time since the last averaged frame (continuous averaging) or on the
+    number of frames averaged so far.
+    """
+    def __init__(self):
+        self.lock = Mutex(recursive=True)
+        self._pending = None   # (image, time, continuous, timeConstant, reset)
+        self._frame = None     # running average
+        self._scratch = None
+        self._blurred = None
+        self._blur = None      # blur radius of _blurred, or None if it is out of date
+        self._count = 0
+        self._lastTime = None
+
+    def addFrame(self, image, now, continuous, timeConstant, reset=False):
+        """Queue *image* to be averaged into the background by the next update().
+
+        If *reset* is True, or the image shape has changed, the image replaces
+        the background instead. Returns True in that case.
+        """
+        with self.lock:
+            reset = reset or self._frame is None or self._frame.shape != image.shape
+            if self._pending is not None and self._pending[4]:
+                reset = True  # keep a reset that has not been applied yet
+            self._pending = (image, now, continuous, timeConstant, reset)
+            return reset
+
+    def update(self):
+        """Average the most recently added frame into the background."""
+        with self.lock:
+            if self._pending is None:
+                return
+            image, now, continuous, timeConstant, reset = self._pending
+            self._pending = None
+            if reset:
+                self._frame = image.astype(np.float32)
+                self._scratch = np.empty_like(self._frame)
+                self._blurred = np.empty_like(self._frame)
+                self._count = 1
+            else:
+                if continuous:
+                    x = np.exp(-(now - self._lastTime) * 5 / max(timeConstant, 0.01))
+                else:
+                    x = float(self._count) / (self._count + 1)
+                # frame = x * frame + (1-x) * image
+                np.multiply(image, 1-x, out=self._scratch)
+                self._frame *= x
+                self._frame += self._scratch
+                self._count += 1
+            self._lastTime = now
+            self._blur = None
+
+    def background(self, blur=0):
+        """Return the background image blurred by a gaussian of *blur* pixels,
+        or None if no frames have been averaged yet.
+
+        The returned array is reused; it is only valid until the next update().
+        """
+        with self.lock:
+            if self._frame is None:
+                return None
+            if blur <= 0:
+                return self._frame
+            if self._blur != blur:
+                scipy.ndimage.gaussian_filter(self._frame, (blur, blur), output=self._blurred)
+                self._blur = blur
+            return self._blurred
@@ -15,7 +15,13 @@ class ContrastCtrl(Qt.QWidget):
     * automatic gain control
     * center weighted gain control
     * zoom-to-image button
+
+    Levels and the lookup table are applied to each frame by FrameProcessor;
+    use processingOpts() to get the current settings and frameProcessed() to
+    display the measured histogram and auto gain levels.
     """
+    needFrameUpdate = Qt.Signal()  # levels or colors were changed by the user
+
     def __init__(self, parent=None):
         Qt.QWidget.__init__(self, parent)
         self.ui = Ui_Form()
@@ -38,9 +44,12 @@ class ContrastCtrl(Qt.QWidget):
 
     def setImageItem(self, item):
         """Sets the ImageItem that will be affected by the contrast / color controls
+
+        The histogram is not linked to the item, which displays frames that
+        were already converted to color; instead, changes to levels and colors
+        emit needFrameUpdate.
         """
         self.imageItem = item
-        self.ui.histogram.setImageItem(item)
         self.ui.histogram.fillHistogram(False)  ## for speed
 
     def zoomToImage(self):
@@ -49,16 +58,15 @@ class ContrastCtrl(Qt.QWidget):
         self.imageItem.getViewBox().autoRange(items=[self.imageItem])
 
     def levelsChanged(self):
-        if self.ui.btnAutoGain.isChecked() and not self.ignoreLevelChange:
-            if self.lastMinMax is None:
-                return
+        if self.ignoreLevelChange:
+            return
+        if self.ui.btnAutoGain.isChecked() and self.lastMinMax is not None:
             bl, wl = self.getLevels()
             mn, mx = self.lastMinMax
             rng = float(mx-mn)
-            if rng == 0:
-                return
-            newLevels = [(bl-mn) / rng, (wl-mn) / rng]
-            self.autoGainLevels = newLevels
+            if rng != 0:
+                self.autoGainLevels = [(bl-mn) / rng, (wl-mn) / rng]
+        self.needFrameUpdate.emit()
         
     def alphaChanged(self, val):
         self.alpha = val / self.ui.alphaSlider.maximum() ## slider only works in integers and we need a 0 to 1 value
@@ -80,41 +88,35 @@ class ContrastCtrl(Qt.QWidget):
         """
         self.lastMinMax = None
 
-    def processImage(self, data):
-        # Update auto gain for new image
-        # Note that histogram is linked to image item; this is what determines
-        # the final appearance of the image.
-
-        if self.ui.btnAutoGain.isChecked():
-            cw = self.ui.spinAutoGainCenterWeight.value()
-            (w, h) = data.shape
-            center = data[w//2-w//6:w//2+w//6, h//2-h//6:h//2+h//6]
-            minVal = data.min() * (1.0-cw) + center.min() * cw
-            maxVal = data.max() * (1.0-cw) + center.max() * cw
-
-            ## If there is inf/nan in the image, strip it out before computing min/max
-            if any([np.isnan(minVal), np.isinf(minVal),  np.isnan(minVal), np.isinf(minVal)]):
-                nanMask = np.isnan(data)
-                infMask = np.isinf(data)
-                valid = data[~nanMask * ~infMask]
-                minVal = valid.min() * (1.0-cw) + center.min() * cw
-                maxVal = valid.max() * (1.0-cw) + center.max() * cw
-            
-            ## Smooth min/max range to avoid noise
-            if self.lastMinMax is None:
-                minVal = minVal
-                maxVal = maxVal
-            else:
-                s = 1.0 - 1.0 / (self.ui.spinAutoGainSpeed.value()+1.0)
-                minVal = self.lastMinMax[0] * s + minVal * (1.0-s)
-                maxVal = self.lastMinMax[1] * s + maxVal * (1.0-s)
-            
-            self.lastMinMax = [minVal, maxVal]
-            
-            ## and convert fraction of previous range into new levels
-            bl = self.autoGainLevels[0] * (maxVal-minVal) + minVal
-            wl = self.autoGainLevels[1] * (maxVal-minVal) + minVal
-            
+    def processingOpts(self):
+        """Return the current contrast settings for FrameProcessor.
+        """
+        hist = self.ui.histogram
+        if hist.gradient.isLookupTrivial():
+            lut = None
+        else:
+            lut = hist.getLookupTable(n=256)
+        return {
+            'autoGain': self.ui.btnAutoGain.isChecked(),
+            'centerWeight': self.ui.spinAutoGainCenterWeight.value(),
+            'gainSpeed': self.ui.spinAutoGainSpeed.value(),
+            'autoGainLevels': list(self.autoGainLevels),
+            'lastMinMax': self.lastMinMax,
+            'levels': self.getLevels(),
+            'lut': lut,
+        }
+
+    def frameProcessed(self, result):
+        """Show the histogram and auto gain levels measured by FrameProcessor
+        for the frame that is about to be displayed.
+        """
+        # Note that the image item does not apply these levels; they were
+        # already used to generate the displayed image.
+        self.ui.histogram.plot.setData(*result['histogram'])
+        if result['minMax'] is not None:
+            self.lastMinMax = result['minMax']
+            minVal, maxVal = self.lastMinMax
+            bl, wl = result['levels']
             self.ignoreLevelChange = True
             try:
                 self.ui.histogram.setLevels(bl, wl)
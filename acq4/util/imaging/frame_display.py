@@ -3,6 +3,7 @@ from acq4.util import Qt
 from acq4 import pyqtgraph as pg
 from .contrast_ctrl import ContrastCtrl
 from .bg_subtract_ctrl import BgSubtractCtrl
+from .frame_processor import FrameProcessor
 from acq4.util.debug import printExc
 
 
@@ -14,6 +15,11 @@ class FrameDisplay(Qt.QObject):
     * frame rate limiting
     * contrast control widget
     * background subtraction control widget
+
+    Background correction, gain and color mapping are done by a FrameProcessor
+    thread; the GUI thread only displays the finished images. The display
+    frame rate and the time spent processing the last frame are available as
+    *displayFps* and *processingTime*.
     """
     # Allow subclasses to override these:
     contrastClass = ContrastCtrl
@@ -24,9 +30,10 @@ class FrameDisplay(Qt.QObject):
     def __init__(self):
         Qt.QObject.__init__(self)
 
-        self._imageItem = pg.ImageItem()
+        self._imageItem = FrameImageItem()
         self.contrastCtrl = self.contrastClass()
         self.contrastCtrl.setImageItem(self._imageItem)
+        self.contrastCtrl.needFrameUpdate.connect(self.contrastChanged)
         self.bgCtrl = self.bgSubtractClass()
         self.bgCtrl.needFrameUpdate.connect(self.updateFrame)
 
@@ -35,8 +42,14 @@ class FrameDisplay(Qt.QObject):
         self.currentFrame = None
         self.lastDrawTime = None
         self.displayFps = None
+        self.processingTime = None
         self.hasQuit = False
 
+        self.processor = FrameProcessor()
+        self.processor.sigFrameProcessed.connect(self.frameProcessed)
+        self.processor.start()
+        self._processing = False  # True while a frame is being processed
+
         ## Check for new frame updates every 16ms
         ## Some checks may be skipped even if there is a new frame waiting to avoid drawing more than
         ## 60fps.
@@ -55,6 +68,11 @@ class FrameDisplay(Qt.QObject):
         self._updateFrame = True
         self.contrastCtrl.resetAutoGain()
 
+    def contrastChanged(self):
+        """Redisplay the current frame with new levels or colors.
+        """
+        self._updateFrame = True
+
     def imageItem(self):
         return self._imageItem
 
@@ -68,7 +86,7 @@ class FrameDisplay(Qt.QObject):
         """Return the currently active background image or None if background
         subtraction is disabled.
         """
-        return self.bgCtrl.backgroundFrame()
+        return self.bgCtrl.getBackgroundFrame()
 
     def visibleImage(self):
         """Return a copy of the image as it is currently visible in the scene.
@@ -92,65 +110,114 @@ class FrameDisplay(Qt.QObject):
     def drawFrame(self):
         if self.hasQuit:
             return
-        #sys.stdout.write('+')
         try:
+            ## Wait until the previous frame has been displayed
+            if self._processing:
+                return
             
             ## If we last drew a frame < 1/30s ago, return.
             t = pg.ptime.time()
             if (self.lastDrawTime is not None) and (t - self.lastDrawTime < .03):
-                #sys.stdout.write('-')
                 return
             ## if there is no new frame and no controls have changed, just exit
             if not self._updateFrame and self.nextFrame is None:
-                #sys.stdout.write('-')
                 return
             self._updateFrame = False
             
             ## If there are no new frames and no previous frames, then there is nothing to draw.
             if self.currentFrame is None and self.nextFrame is None:
-                #sys.stdout.write('-')
                 return
             
+            ## Handle the next available frame, if there is one.
+            if self.nextFrame is not None:
+                self.currentFrame = self.nextFrame
+                self.nextFrame = None
+            
+            ## Hand the frame to the processing thread along with a snapshot of
+            ## the display settings; frameProcessed() is called when it is done.
+            opts = {'background': self.bgCtrl.model, 'axisOrder': self._imageItem.axisOrder}
+            opts.update(self.bgCtrl.processingOpts())
+            opts.update(self.contrastCtrl.processingOpts())
+            self._processing = True
+            self.processor.process(self.currentFrame, opts)
+        
+        except:
+            self._processing = False
+            printExc('Error while drawing new frames:')
+
+    def frameProcessed(self, result):
+        self._processing = False
+        if self.hasQuit or result['argb'] is None:
+            return
+        try:
             prof = pg.debug.Profiler()
             ## We will now draw a new frame (even if the frame is unchanged)
+            t = pg.ptime.time()
             if self.lastDrawTime is not None:
                 fps = 1.0 / (t - self.lastDrawTime)
                 self.displayFps = fps
             self.lastDrawTime = t
+            self.processingTime = result['processTime']
             prof()
-            
-            ## Handle the next available frame, if there is one.
-            if self.nextFrame is not None:
-                self.currentFrame = self.nextFrame
-                self.nextFrame = None
-            
-            data = self.currentFrame.getImage()
-            info = self.currentFrame.info()
-            prof()
-            
-            
-            ## divide the background out of the current frame if needed
-            data = self.bgCtrl.processImage(data)
-            prof()
-            
+
             ## Set new levels if auto gain is enabled
-            self.contrastCtrl.processImage(data)
+            self.contrastCtrl.frameProcessed(result)
             prof()
             
             ## update image in viewport
-            self._imageItem.updateImage(data.copy())  # using data.copy() here avoids crashes!
+            self._imageItem.setProcessedImage(result['frame'].getImage(), result['argb'], result['alpha'])
             prof()
 
-            self.imageUpdated.emit(self.currentFrame)
+            self.imageUpdated.emit(result['frame'])
             prof()
             
             prof.finish()
         
         except:
             printExc('Error while drawing new frames:')
-        finally:
-            pass
 
     def quit(self):
         self.imageItem = None
         self.hasQuit = True
+        self.processor.stop()
+        self.processor.wait()
+
+
+class FrameImageItem(pg.ImageItem):
+    """ImageItem that displays ARGB images prepared by FrameProcessor.
+
+    The item's image is still the frame data (this determines the item's size),
+    but it is drawn from the ARGB array without any further levels or lookup
+    table processing in the GUI thread.
+    """
+    def __init__(self):
+        pg.ImageItem.__init__(self)
+        self._argb = None
+        self._alpha = False
+
+    def setProcessedImage(self, image, argb, alpha=False):
+        """Display *argb* (as returned by FrameProcessor.makeARGB) for the frame data *image*.
+
+        The array is displayed without copying; it must not be modified until
+        another image has been set.
+        """
+        shapeChanged = self.image is None or image.shape != self.image.shape
+        self.image = image
+        self._argb = argb
+        self._alpha = alpha
+        if shapeChanged:
+            self.prepareGeometryChange()
+            self.informViewBoundsChanged()
+        self.qimage = None
+        self.update()
+        self.sigImageChanged.emit()
+
+    def setImage(self, image=None, autoLevels=None, **kargs):
+        if image is not None:
+            self._argb = None
+        pg.ImageItem.setImage(self, image, autoLevels=autoLevels, **kargs)
+
+    def render(self):
+        if self._argb is None:
+            return pg.ImageItem.render(self)
+        self.qimage = pg.functions.makeQImage(self._argb, self._alpha, copy=False, transpose=False)
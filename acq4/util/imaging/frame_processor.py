@@ -0,0 +1,234 @@
+from __future__ import print_function
+from __future__ import division
+import numpy as np
+from six.moves import queue
+from acq4.util import Qt
+from acq4.util.Thread import Thread
+import acq4.util.ptime as ptime
+import acq4.util.debug as debug
+
+
+class FrameProcessor(Thread):
+    """Worker thread that prepares live imaging frames for display.
+
+    Each frame passed to process() is background-corrected (see
+    BackgroundModel), its auto gain levels and histogram are measured from a
+    subsample of the image, and the levels and color lookup table are applied
+    to produce an 8-bit ARGB image. The result is emitted with
+    sigFrameProcessed; the GUI thread only has to wrap the ARGB array in a
+    QImage.
+
+    Intermediate arrays are allocated once per image shape and reused. The
+    ARGB output alternates between two buffers, so only one frame may be
+    submitted at a time, and the previous result must be displayed (or
+    discarded) before the next frame is submitted.
+    """
+    sigFrameProcessed = Qt.Signal(object)  # result dict; see processFrame()
+
+    # Number of pixels used to measure levels and the histogram
+    sampleSize = 512*512
+    histogramBins = 500
+
+    def __init__(self):
+        Thread.__init__(self)
+        self._jobs = queue.Queue()
+        self._buffers = {}
+        self._outputIndex = 0
+        self._lut = None          # (lut, bgraLut) last lookup table converted to BGRA order
+        self._lutSerial = 0       # incremented whenever a new BGRA table is built
+        self._effectiveLut = None # (key, lut) lookup table including levels, for integer images
+
+    def process(self, frame, opts):
+        """Ask the thread to prepare *frame* for display; see processFrame()
+        for *opts*. The result is emitted with sigFrameProcessed.
+        """
+        self._jobs.put((frame, opts))
+
+    def stop(self):
+        self._jobs.put(None)
+
+    def run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            frame, opts = job
+            try:
+                result = self.processFrame(frame, opts)
+            except Exception:
+                debug.printExc('Error processing frame for display:')
+                result = {'frame': frame, 'argb': None}
+            self.sigFrameProcessed.emit(result)
+
+    def processFrame(self, frame, opts):
+        """Return a dict describing *frame* as it should be displayed.
+
+        *opts* is a dict with the options returned by BgSubtractCtrl.processingOpts()
+        and ContrastCtrl.processingOpts(), plus 'background' (a BackgroundModel
+        or None) and 'axisOrder' of the ImageItem that will display the frame.
+
+        The result contains 'frame', 'argb' and 'alpha' (see pyqtgraph's
+        makeQImage), the 'levels' that were applied, 'minMax' (the smoothed
+        auto gain range, or None if auto gain is disabled), 'histogram' (x, y)
+        and 'processTime' in seconds.
+        """
+        start = ptime.time()
+        data = frame.getImage()
+        bgModel = opts.get('background', None)
+        if bgModel is not None:
+            bgModel.update()
+            if opts['bgMode'] is not None:
+                data = self.subtractBackground(data, bgModel.background(opts['bgBlur']), opts['bgMode'])
+
+        sample = self.finiteSample(data)
+        histogram = self.histogram(sample)
+        if opts['autoGain']:
+            minMax = self.autoGainRange(data, sample, opts)
+            mn, mx = minMax
+            bl = opts['autoGainLevels'][0] * (mx-mn) + mn
+            wl = opts['autoGainLevels'][1] * (mx-mn) + mn
+            levels = (bl, wl)
+        else:
+            minMax = None
+            levels = tuple(opts['levels'])
+
+        argb, alpha = self.makeARGB(data, levels, opts['lut'], opts['axisOrder'])
+        return {
+            'frame': frame, 'argb': argb, 'alpha': alpha, 'levels': levels, 'minMax': minMax,
+            'histogram': histogram, 'processTime': ptime.time() - start,
+        }
+
+    def subtractBackground(self, data, bg, mode):
+        """Divide or subtract *bg* from *data*, writing into a reused float32 buffer."""
+        if bg is None or bg.shape != data.shape:
+            return data
+        out = self._buffer('corrected', data.shape, np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if mode == 'divide':
+                np.divide(data, bg, out=out)
+            else:
+                np.subtract(data, bg, out=out)
+        return out
+
+    def subsample(self, data):
+        step = max(1, int(np.ceil((data.size / self.sampleSize) ** 0.5)))
+        return data[::step, ::step]
+
+    def finiteSample(self, data):
+        """Return a 1D subsample of the finite values in *data*."""
+        sample = self.subsample(data).ravel()
+        if sample.dtype.kind == 'f':
+            sample = sample[np.isfinite(sample)]
+        return sample
+
+    def histogram(self, sample):
+        """Return (x, y) for the histogram plot, as ImageItem.getHistogram() does."""
+        if sample.size == 0:
+            return np.array([0., 1.]), np.array([0, 0])
+        mn, mx = sample.min(), sample.max()
+        if mn == mx:
+            mn -= 0.5
+            mx += 0.5
+        if sample.dtype.kind in 'ui':
+            step = np.ceil((mx - mn) / self.histogramBins)
+            bins = np.arange(mn, mx + 1.01 * step, step, dtype=int)
+        else:
+            bins = np.linspace(mn, mx, self.histogramBins + 1)
+        y, x = np.histogram(sample, bins=bins)
+        return x[:-1], y
+
+    def autoGainRange(self, data, sample, opts):
+        """Return the [min, max] range for auto gain, weighted toward the
+        center of the image and smoothed against opts['lastMinMax'].
+        """
+        cw = opts['centerWeight']
+        (w, h) = data.shape[:2]
+        center = self.finiteSample(data[w//2-w//6:w//2+w//6, h//2-h//6:h//2+h//6])
+        if center.size == 0:
+            center = sample
+        if sample.size == 0:
+            return [0.0, 1.0]
+        minVal = sample.min() * (1.0-cw) + center.min() * cw
+        maxVal = sample.max() * (1.0-cw) + center.max() * cw
+
+        ## Smooth min/max range to avoid noise
+        lastMinMax = opts['lastMinMax']
+        if lastMinMax is not None:
+            s = 1.0 - 1.0 / (opts['gainSpeed']+1.0)
+            minVal = lastMinMax[0] * s + minVal * (1.0-s)
+            maxVal = lastMinMax[1] * s + maxVal * (1.0-s)
+        return [float(minVal), float(maxVal)]
+
+    def makeARGB(self, data, levels, lut, axisOrder='col-major'):
+        """Apply *levels* and *lut* to *data*, returning (argb, alpha) as
+        expected by makeQImage(transpose=False).
+
+        Integer images of up to 16 bits go through a single table combining
+        levels and lut; other images are scaled into a reused index buffer.
+        """
+        if axisOrder == 'col-major':
+            data = data.T
+        bgra, alpha = self._bgraLut(lut)
+        n = bgra.shape[0]
+        mn, mx = levels
+        rng = float(mx - mn)
+        scale = (n - 1) / (rng if rng != 0 else 1.0)
+
+        argb = self._nextOutput(data.shape[:2] + (4,))
+        if data.dtype.kind == 'u' and data.dtype.itemsize <= 2:
+            np.take(self._levelsLut(data.dtype, mn, scale, bgra), data, axis=0, out=argb, mode='clip')
+        else:
+            scaled = self._buffer('scaled', data.shape, np.float32)
+            index = self._buffer('index', data.shape, np.intp)
+            np.subtract(data, mn, out=scaled, casting='unsafe')
+            scaled *= scale
+            np.clip(scaled, 0, n - 1, out=scaled)
+            np.copyto(index, scaled, casting='unsafe')
+            np.take(bgra, index, axis=0, out=argb, mode='clip')
+        return argb, alpha
+
+    def _bgraLut(self, lut):
+        ## convert an RGB(A) lookup table to the BGRA order used by QImage
+        if self._lut is not None:
+            last = self._lut[0]
+            if (last is None and lut is None) or (lut is not None and last is not None and np.array_equal(last, lut)):
+                return self._lut[1]
+        if lut is None:
+            rgba = np.empty((256, 4), dtype=np.ubyte)
+            rgba[:, :3] = np.arange(256, dtype=np.ubyte)[:, np.newaxis]
+            rgba[:, 3] = 255
+            alpha = False
+        else:
+            ## keep a copy so that a table modified in place is still detected as a change
+            lut = np.array(lut)
+            rgba = np.empty((lut.shape[0], 4), dtype=np.ubyte)
+            rgba[:, :lut.shape[1]] = lut
+            if lut.shape[1] < 4:
+                rgba[:, 3] = 255
+            alpha = lut.shape[1] == 4
+        bgra = np.ascontiguousarray(rgba[:, [2, 1, 0, 3]])
+        self._lut = (lut, (bgra, alpha))
+        self._lutSerial += 1
+        return bgra, alpha
+
+    def _levelsLut(self, dtype, mn, scale, bgra):
+        ## lookup table mapping every value of an unsigned integer image directly to BGRA
+        key = (dtype, mn, scale, self._lutSerial)
+        if self._effectiveLut is None or self._effectiveLut[0] != key:
+            ind = np.arange(2**(dtype.itemsize*8), dtype=np.float64)
+            ind -= mn
+            ind *= scale
+            np.clip(ind, 0, bgra.shape[0] - 1, out=ind)
+            self._effectiveLut = (key, bgra[ind.astype(np.intp)])
+        return self._effectiveLut[1]
+
+    def _buffer(self, name, shape, dtype):
+        buf = self._buffers.get(name, None)
+        if buf is None or buf.shape != shape or buf.dtype != dtype:
+            buf = np.empty(shape, dtype=dtype)
+            self._buffers[name] = buf
+        return buf
+
+    def _nextOutput(self, shape):
+        self._outputIndex = 1 - self._outputIndex
+        return self._buffer('argb%d' % self._outputIndex, shape, np.ubyte)
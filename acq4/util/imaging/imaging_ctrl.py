@@ -43,7 +43,7 @@ class ImagingCtrl(Qt.QWidget):
     frameDisplayClass = FrameDisplay  # let subclasses override this class
 
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, compression=None):
         Qt.QWidget.__init__(self, parent)
 
         self.frameDisplay = self.frameDisplayClass()
@@ -72,7 +72,8 @@ class ImagingCtrl(Qt.QWidget):
         self.ui.pinFrameBtn.setEnabled(False)
 
         ## set up recording thread
-        self.recordThread = RecordThread(self)
+        ## compression: HDF5 compression for recorded stacks (None, 'lzf' or 'gzip')
+        self.recordThread = RecordThread(self, compression=compression)
         self.recordThread.start()
         # self.recordThread.sigShowMessage.connect(self.showMessage)
         self.recordThread.finished.connect(self.recordThreadStopped)
@@ -111,36 +112,56 @@ class ImagingCtrl(Qt.QWidget):
         btn.clicked.connect(lambda: self.acquireVideoClicked(None, name))
 
     def newFrame(self, frame):
+        self.newFrames([frame])
+
+    def newFrames(self, frames):
+        """Handle a batch of newly acquired frames.
+
+        Every frame is passed to the recording thread, but only the newest one
+        is sent to the display.
+        """
         self.ui.saveFrameBtn.setEnabled(True)
         self.ui.pinFrameBtn.setEnabled(True)
 
         # update acquisition frame rate
-        now = frame.info()['time']
+        now = frames[-1].info()['time']
+        acqFps = None
         if self.lastFrameTime is not None:
-            dt = now - self.lastFrameTime
+            dt = (now - self.lastFrameTime) / len(frames)
             if dt > 0:
-                fps = 1.0 / dt
-                self.ui.fpsLabel.setValue(fps)
+                acqFps = 1.0 / dt
+                self.ui.fpsLabel.setValue(acqFps)
         self.lastFrameTime = now
 
-        # update display frame rate
+        # update display frame rate, percentage of frames displayed, and processing time
         fps = self.frameDisplay.displayFps
         if fps is not None:
             self.ui.displayFpsLabel.setValue(fps)
-
-        if self.recordingStack():
-            frameShape = frame.getImage().shape
-            if self.stackShape is None:
-                self.stackShape = frameShape
-            elif self.stackShape != frameShape:
-                # new iamge does not match stack shape; need to stop recording.
-                self.endStack()
-
-        queued = self.recordThread.newFrame(frame)
+            if acqFps is not None:
+                self.ui.displayPercentLabel.setValue(min(100.0, 100.0 * fps / acqFps))
+        procTime = self.frameDisplay.processingTime
+        if procTime is not None:
+            self.ui.displayFpsLabel.setToolTip("Frame processing time: %0.1f ms" % (procTime * 1e3))
+
+        for frame in frames:
+            if self.recordingStack():
+                frameShape = frame.getImage().shape
+                if self.stackShape is None:
+                    self.stackShape = frameShape
+                elif self.stackShape != frameShape:
+                    # new iamge does not match stack shape; need to stop recording.
+                    self.endStack()
+
+            queued = self.recordThread.newFrame(frame)
         if self.ui.recordStackBtn.isChecked():
-            self.ui.stackSizeLabel.setText('%d frames' % self.recordThread.stackSize)
-
-        self.frameDisplay.newFrame(frame)
+            text = '%d frames' % self.recordThread.stackSize
+            stats = self.recordThread.writerStats()
+            if stats is not None:
+                # disk throughput and backlog; a growing queue means the disk can't keep up
+                text += ' (%0.1f MB/s, %d queued)' % (stats['MBps'], stats['queue'])
+            self.ui.stackSizeLabel.setText(text)
+
+        self.frameDisplay.newFrame(frames[-1])
 
     def saveFrameClicked(self):
         if self.ui.linkSavePinBtn.isChecked():
@@ -9,6 +9,7 @@ import numpy as np
 import acq4.util.ptime as ptime
 import acq4.Manager
 from acq4.util.DataManager import FileHandle, DirHandle
+from .stack_writer import StackWriter
 try:
     from acq4.filetypes.ImageFile import *
     HAVE_IMAGEFILE = True
@@ -24,10 +25,15 @@ class RecordThread(Thread):
     sigRecordingFinished = Qt.Signal(object, object)  # file handle, num frames
     sigSavedFrame = Qt.Signal(object)
     
-    def __init__(self, ui):
+    def __init__(self, ui, compression=None):
         Thread.__init__(self)
         self.m = acq4.Manager.getManager()
         
+        # HDF5 compression used for image stacks (None, 'lzf', or 'gzip')
+        if compression not in (None, 'lzf', 'gzip'):
+            raise ValueError("Unsupported image stack compression %r (use None, 'lzf' or 'gzip')" % (compression,))
+        self.compression = compression
+        
         self._stackSize = 0  # size of currently recorded stack
         self._recording = False
         self.currentFrame = None
@@ -39,6 +45,7 @@ class RecordThread(Thread):
 
         # Attributes private to worker thread:
         self.currentStack = None  # file handle of currently recorded stack
+        self.stackWriter = None   # StackWriter appending to currentStack
         self.startFrameTime = None
         self.lastFrameTime = None
         self.currentFrameNum = 0
@@ -99,6 +106,15 @@ class RecordThread(Thread):
                 self.stopRecording()
         return framesLeft
 
+    def writerStats(self):
+        """Return throughput statistics for the stack currently being written
+        (see StackWriter.stats), or None if no stack is being written.
+        """
+        writer = self.stackWriter
+        if writer is None:
+            return None
+        return writer.stats()
+
     @property
     def stackSize(self):
         """The total number of frames requested for storage in the current
@@ -135,6 +151,9 @@ class RecordThread(Thread):
                 
             time.sleep(100e-3)
 
+        if self.currentStack is not None:
+            self.finishStack()
+
     def handleFrames(self, frames):
         # Write as many frames into the stack as possible.
         # If False appears in the list of frames, it indicates the end of a stack
@@ -151,16 +170,7 @@ class RecordThread(Thread):
                     recFrames = []
 
                 if self.currentStack is not None:
-                    dur = self.lastFrameTime - self.startFrameTime
-                    if dur > 0:
-                        fps = (self.currentFrameNum+1) / dur
-                    else:
-                        fps = 0
-                    self.currentStack.setInfo({'frames': self.currentFrameNum, 'duration': dur, 'averageFPS': fps})
-                    # self.showMessage('Finished recording %s - %d frames, %02f sec' % (self.currentStack.name(), self.currentFrameNum, dur)) 
-                    self.sigRecordingFinished.emit(self.currentStack, self.currentFrameNum)
-                    self.currentStack = None
-                    self.currentFrameNum = 0
+                    self.finishStack()
                 continue
 
 
@@ -191,25 +201,61 @@ class RecordThread(Thread):
             
         if len(recFrames) > 0:
             self.writeFrames(recFrames, dh)
-            self.currentFrameNum += len(recFrames)
 
-    def writeFrames(self, frames, dh):
-        newRec = self.currentStack is None
-
-        if newRec:
-            self.startFrameTime = frames[0][1]['time']
-
-        times = [f[1]['time'] for f in frames]
-        translations = np.array([f[1]['transform'].getTranslation() for f in frames])
-        arrayInfo = [
-            {'name': 'Time', 'values': array(times) - self.startFrameTime, 'units': 's', 'translation': translations},
-            {'name': 'X'},
-            {'name': 'Y'}
-        ]
-        imgs = [f[0][np.newaxis,...] for f in frames]
-        
-        data = MetaArray(np.concatenate(imgs, axis=0), info=arrayInfo)
-        if newRec:
-            self.currentStack = dh.writeFile(data, 'video', autoIncrement=True, info=frames[0][1], appendAxis='Time', appendKeys=['translation'])
+    def finishStack(self):
+        """Close the stack currently being recorded and record its meta info.
+
+        If the remaining frames cannot be written (eg. the disk is full), the
+        error is reported and sigRecordingFailed is emitted instead of
+        sigRecordingFinished.
+        """
+        stack = self.currentStack
+        writer = self.stackWriter
+        nFrames = self.currentFrameNum
+        self.currentStack = None
+        self.stackWriter = None
+        self.currentFrameNum = 0
+        try:
+            writer.close()
+        except:
+            debug.printExc('Error closing image stack %s; some frames may not have been written:' % stack.name())
+            self.sigRecordingFailed.emit()
+            return
+
+        dur = self.lastFrameTime - self.startFrameTime
+        if dur > 0:
+            fps = (nFrames+1) / dur
         else:
-            data.write(self.currentStack.name(), appendAxis='Time', appendKeys=['translation'])
+            fps = 0
+        stack.setInfo({'frames': nFrames, 'duration': dur, 'averageFPS': fps})
+        # self.showMessage('Finished recording %s - %d frames, %02f sec' % (stack.name(), nFrames, dur)) 
+        self.sigRecordingFinished.emit(stack, nFrames)
+
+    def writeFrames(self, frames, dh):
+        """Append frames to the current stack, creating a new stack if needed.
+
+        The first frame of a stack is written immediately to create the file;
+        all others are queued for the StackWriter, which appends them from its
+        own thread while the file stays open.
+        """
+        if self.currentStack is None:
+            data, info = frames[0]
+            self.startFrameTime = info['time']
+            arrayInfo = [
+                {'name': 'Time', 'values': np.array([0.0]), 'units': 's',
+                 'translation': np.array([info['transform'].getTranslation()])},
+                {'name': 'X'},
+                {'name': 'Y'}
+            ]
+            opts = {}
+            if self.compression is not None:
+                opts['compression'] = self.compression
+            ma = MetaArray(data[np.newaxis, ...], info=arrayInfo)
+            self.currentStack = dh.writeFile(ma, 'video', autoIncrement=True, info=info, appendAxis='Time', appendKeys=['translation'], **opts)
+            self.stackWriter = StackWriter(self.currentStack.name())
+            self.currentFrameNum += 1
+            frames = frames[1:]
+
+        for data, info in frames:
+            self.stackWriter.append(data, info['time'] - self.startFrameTime, info['transform'].getTranslation())
+        self.currentFrameNum += len(frames)
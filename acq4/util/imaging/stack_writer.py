@@ -0,0 +1,154 @@
+from __future__ import print_function
+import threading
+import numpy as np
+from six.moves import queue
+import acq4.util.ptime as ptime
+import acq4.util.debug as debug
+try:
+    import h5py
+    HAVE_HDF5 = True
+except ImportError:
+    HAVE_HDF5 = False
+
+
+class StackWriter(object):
+    """Appends frames to an existing MetaArray HDF5 image stack from a
+    background thread.
+
+    The file must already exist with an appendable first ('Time') axis, as
+    written by ``MetaArray.write(..., appendAxis='Time', appendKeys=['translation'])``.
+    The file is kept open for the lifetime of the writer. Datasets are grown
+    *blockSize* frames at a time and trimmed to the number of frames actually
+    written when the writer is closed, so the file is not resized on every
+    append. Frame times and translations are written as columns into the Time
+    axis info.
+
+    ============== =========================================================
+    **Arguments**
+    fileName       Path of the existing MetaArray file
+    blockSize      Number of frames to add each time the datasets must grow
+    maxPending     Maximum number of frames waiting to be written; append()
+                   blocks when this many frames are queued.
+    ============== =========================================================
+    """
+    def __init__(self, fileName, blockSize=100, maxPending=500):
+        if not HAVE_HDF5:
+            raise Exception("StackWriter requires h5py.")
+        self.fileName = fileName
+        self.blockSize = blockSize
+        self.queue = queue.Queue(maxsize=maxPending)
+        self.error = None
+
+        self.file = h5py.File(fileName, 'r+')
+        self.data = self.file['data']
+        timeInfo = self.file['info']['0']
+        self.times = timeInfo['values']
+        self.translations = timeInfo['translation'] if 'translation' in timeInfo else None
+        self.nFrames = self.data.shape[0]
+
+        self._stats = {'frames': 0, 'bytes': 0, 'writeTime': 0.0, 'maxQueue': 0}
+        self._startTime = None
+        self.thread = threading.Thread(target=self._run, name="StackWriter")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def append(self, data, time, translation=None):
+        """Queue one frame to be appended to the stack.
+
+        *time* is the value to store on the Time axis for this frame. Raises the
+        exception from the writer thread if a previous write failed.
+        """
+        if self.error is not None:
+            raise self.error
+        if self._startTime is None:
+            self._startTime = ptime.time()
+        self.queue.put((data, time, translation))
+        depth = self.queue.qsize()
+        if depth > self._stats['maxQueue']:
+            self._stats['maxQueue'] = depth
+
+    def pending(self):
+        """Return the number of frames waiting to be written."""
+        return self.queue.qsize()
+
+    def stats(self):
+        """Return a dict describing writer throughput:
+
+        * frames, bytes: total written so far
+        * MBps: sustained rate since the first append (including idle time)
+        * writeMBps: rate while writing; if frames arrive faster than this,
+          the queue will grow until append() blocks
+        * queue, maxQueue: current and peak number of frames waiting
+        """
+        s = self._stats.copy()
+        elapsed = 0.0 if self._startTime is None else ptime.time() - self._startTime
+        s['MBps'] = s['bytes'] / elapsed / 1e6 if elapsed > 0 else 0.0
+        s['writeMBps'] = s['bytes'] / s['writeTime'] / 1e6 if s['writeTime'] > 0 else 0.0
+        s['queue'] = self.queue.qsize()
+        return s
+
+    def close(self):
+        """Write all queued frames, trim datasets to their final size and close
+        the file. Return the total number of frames in the stack.
+        """
+        if self.file is None:
+            return self.nFrames
+        self.queue.put(None)
+        self.thread.join()
+        try:
+            self._resize(self.nFrames)
+            self.file.flush()
+        finally:
+            self.file.close()
+            self.file = None
+        if self.error is not None:
+            raise self.error
+        return self.nFrames
+
+    def _run(self):
+        while True:
+            # collect everything that is waiting so that metadata columns
+            # can be written in one operation
+            item = self.queue.get()
+            batch = []
+            while item is not None:
+                batch.append(item)
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            if len(batch) > 0 and self.error is None:
+                try:
+                    self._write(batch)
+                except Exception as exc:
+                    self.error = exc
+                    debug.printExc("Error writing image stack %s:" % self.fileName)
+            if item is None:
+                break
+
+    def _write(self, batch):
+        start = ptime.time()
+        n = self.nFrames
+        k = len(batch)
+        if n + k > self.data.shape[0]:
+            self._resize(n + max(k, self.blockSize))
+
+        nbytes = 0
+        for i, (data, t, tr) in enumerate(batch):
+            self.data[n + i] = data
+            nbytes += data.nbytes
+        self.times[n:n + k] = [b[1] for b in batch]
+        if self.translations is not None:
+            self.translations[n:n + k] = np.array([b[2] for b in batch])
+        self.nFrames = n + k
+
+        s = self._stats
+        s['frames'] += k
+        s['bytes'] += nbytes
+        s['writeTime'] += ptime.time() - start
+
+    def _resize(self, size):
+        self.data.resize((size,) + self.data.shape[1:])
+        self.times.resize((size,) + self.times.shape[1:])
+        if self.translations is not None:
+            self.translations.resize((size,) + self.translations.shape[1:])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for the directory index formats used by DataManager.DirHandle.
+
+For each format, fills a temporary directory with N files (as a protocol
+sequence does: one writeFile() per sweep), then updates every entry once,
+and finally opens the directory with a fresh handle and reads one entry and
+all entries.
+
+Usage:  python -m acq4.util.index_benchmark [N]
+"""
+from __future__ import print_function
+import os, sys, tempfile, shutil
+import acq4.util.ptime as ptime
+import acq4.util.DataManager as DataManager
+from acq4.util import dirindex
+
+
+def run(fmt, n=10000):
+    path = tempfile.mkdtemp()
+    try:
+        DataManager.setIndexFormat(fmt, migrate=False)
+        dh = DataManager.getDirHandle(path)
+        dh.createIndex()
+        info = {'__object_type__': 'MetaArray', 'sequence': (3, 4), 'temperature': 22.5, 'notes': 'sweep'}
+        times = {}
+
+        start = ptime.time()
+        for i in range(n):
+            name = 'file_%05d.ma' % i
+            open(os.path.join(path, name), 'w').close()
+            dh._setFileInfo(name, dict(info, __timestamp__=start + i))
+        times['append'] = ptime.time() - start
+
+        start = ptime.time()
+        for i in range(0, n, 10):
+            dh._setFileInfo('file_%05d.ma' % i, {'checked': True})
+        times['update'] = (ptime.time() - start) * 10
+
+        # read back through a fresh index (as another process / handle would)
+        start = ptime.time()
+        index = dirindex.openIndex(path)
+        index.reload()
+        index['file_%05d.ma' % (n // 2)]
+        times['open+read one'] = ptime.time() - start
+
+        start = ptime.time()
+        index.toDict()
+        times['read all'] = ptime.time() - start
+
+        size = os.path.getsize(index.path())
+    finally:
+        DataManager.setIndexFormat('text', migrate=False)
+        shutil.rmtree(path)
+
+    print("%-5s %d entries (%0.1f kB):  " % (fmt, n, size / 1e3) +
+          "  ".join(["%s %0.3f s" % (k, times[k]) for k in ['append', 'update', 'open+read one', 'read all']]))
+    print("      per entry: append %0.1f us  update %0.1f us" % (times['append'] / n * 1e6, times['update'] / n * 1e6))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for fmt in ['log', 'text']:
+        run(fmt, n)
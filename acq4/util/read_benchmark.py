@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark for partial reads through FileHandle.read(selection=...).
+
+Writes a camera-style image stack (frames x width x height, uint16) and a
+two-channel clamp recording into a temporary directory, then compares reading
+the whole file and indexing it against reading only the selection, and reading
+meta-info only.
+
+Usage:  python -m acq4.util.read_benchmark [nFrames]
+"""
+from __future__ import print_function
+import sys, tempfile, shutil
+import numpy as np
+import acq4.util.ptime as ptime
+import acq4.util.DataManager as DataManager
+from acq4.util.metaarray import MetaArray
+
+
+def timeit(fn, n=3):
+    best = None
+    for i in range(n):
+        start = ptime.time()
+        fn()
+        t = ptime.time() - start
+        best = t if best is None else min(best, t)
+    return best
+
+
+def run(nFrames=500, shape=(512, 512)):
+    path = tempfile.mkdtemp()
+    try:
+        dh = DataManager.getDirHandle(path)
+        stack = MetaArray(np.random.randint(0, 4096, size=(nFrames,) + shape).astype(np.uint16), info=[
+            {'name': 'Time', 'units': 's', 'values': np.arange(nFrames) * 0.01},
+            {'name': 'X'}, {'name': 'Y'}, {}])
+        fh = dh.writeFile(stack, 'stack.ma')
+        mid = nFrames // 2
+
+        clamp = MetaArray(np.random.normal(size=(2, nFrames * 2000)), info=[
+            {'name': 'Channel', 'cols': [{'name': 'primary'}, {'name': 'secondary'}]},
+            {'name': 'Time', 'values': np.arange(nFrames * 2000) * 1e-5}, {}])
+        ch = dh.writeFile(clamp, 'clamp.ma')
+        del stack, clamp
+
+        results = [
+            ('stack: one frame, full read', timeit(lambda: fh.read()['Time': mid])),
+            ('stack: one frame, selection', timeit(lambda: fh.read(selection={'Time': mid}))),
+            ('stack: meta only', timeit(lambda: fh.read(readAllData=False))),
+            ('clamp: one channel, full read', timeit(lambda: ch.read()['Channel': 'primary'])),
+            ('clamp: one channel, selection', timeit(lambda: ch.read(selection={'Channel': 'primary'}))),
+        ]
+        size = fh.read(readAllData=False).shape
+    finally:
+        shutil.rmtree(path)
+
+    print("stack shape %s" % (size,))
+    for name, t in results:
+        print("  %-32s %0.4f s" % (name, t))
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    run(n)
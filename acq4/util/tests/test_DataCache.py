@@ -0,0 +1,82 @@
+from __future__ import print_function
+import os, tempfile, shutil, time
+import numpy as np
+import pytest
+from acq4.util.DataCache import DataCache
+
+
+class FakeHandle(object):
+    """Stands in for a FileHandle; counts reads of a .npy file."""
+    def __init__(self, path):
+        self.path = path
+        self.reads = 0
+
+    def name(self):
+        return self.path
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def read(self, selection=None):
+        self.reads += 1
+        data = np.load(self.path)
+        if selection is not None:
+            data = data[selection]
+        return data
+
+
+@pytest.fixture
+def files():
+    path = tempfile.mkdtemp()
+    handles = []
+    for i in range(4):
+        fn = os.path.join(path, 'data%d.npy' % i)
+        np.save(fn, np.arange(1000, dtype=np.float64) + i)   # 8000 bytes each
+        handles.append(FakeHandle(fn))
+    yield handles
+    shutil.rmtree(path)
+
+
+def test_lru(files):
+    cache = DataCache(maxBytes=20000)
+    a = cache.read(files[0])
+    b = cache.read(files[0])
+    assert files[0].reads == 1
+    assert np.all(a == b) and a.base is not None
+    with pytest.raises(ValueError):
+        a[0] = 1
+
+    # selections are cached separately
+    s = cache.read(files[0], selection=slice(10, 20))
+    assert files[0].reads == 2 and len(s) == 10
+    cache.read(files[0], selection=slice(10, 20))
+    assert files[0].reads == 2
+
+    # only two full arrays fit; the least recently used one is evicted
+    cache.read(files[1])
+    cache.read(files[0])
+    cache.read(files[2])
+    stats = cache.stats()
+    assert stats['evictions'] == 2 and stats['bytes'] <= 20000
+    cache.read(files[0])
+    assert files[0].reads == 2
+    cache.read(files[1])
+    assert files[1].reads == 2
+
+    # a changed file is read again
+    time.sleep(0.01)
+    np.save(files[2].path, np.zeros(10))
+    os.utime(files[2].path, None)
+    assert np.all(cache.read(files[2]) == 0)
+
+
+def test_prefetch(files):
+    cache = DataCache()
+    cache.prefetch(files[1:])
+    start = time.time()
+    while cache.stats()['entries'] < 3 and time.time() - start < 5:
+        time.sleep(0.01)
+    for fh in files[1:]:
+        cache.read(fh)
+        assert fh.reads == 1
+    assert cache.stats()['hits'] == 3
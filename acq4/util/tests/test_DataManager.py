@@ -75,3 +75,32 @@ def test_datamanager():
 
 
 
+
+
+def test_read_selection():
+    import numpy as np
+    from acq4.util.metaarray import MetaArray
+    rh = dm.getDirHandle(root)
+    info = [
+        {'name': 'Channel', 'cols': [{'name': 'primary', 'units': 'A'}, {'name': 'secondary', 'units': 'V'}]},
+        {'name': 'Time', 'units': 's', 'values': np.arange(1000) * 1e-4},
+        {'ClampState': {'mode': 'VC'}},
+    ]
+    data = MetaArray(np.random.normal(size=(2, 1000)), info=info)
+    fh = rh.writeFile(data, 'clamp.ma')
+
+    full = fh.read()
+    prim = fh.read(selection={'Channel': 'primary'})
+    assert prim.shape == (1000,)
+    assert np.all(prim.asarray() == full['Channel': 'primary'].asarray())
+    assert prim._info[-1]['name'] == 'Channel: primary'
+
+    part = fh.read(selection={'Channel': 'secondary', 'Time': slice(10, 20)})
+    assert np.all(part.asarray() == full.asarray()[1, 10:20])
+    assert np.allclose(part.xvals('Time'), full.xvals('Time')[10:20])
+
+    byValue = fh.read(selection={'Time': slice(0.01, 0.02)})
+    mask = (full.xvals('Time') >= 0.01) & (full.xvals('Time') < 0.02)
+    assert np.all(byValue.asarray() == full.asarray()[:, mask])
+
+    assert fh.read(selection=(0, 5)) == full[0, 5]
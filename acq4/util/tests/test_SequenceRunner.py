@@ -0,0 +1,45 @@
+from __future__ import print_function
+from acq4.util.SequenceRunner import runSequence, iterSequence, SequenceRunner
+
+
+def test_iterSequence():
+    params = {'x': [1, 3, 5], 'y': [2, 4], 'z': 7}
+    order = ['x', 'y']
+    linked = {'y': ['w']}
+
+    # iterParams must visit the same points in the same order as start()
+    visited = []
+    def fn(p):
+        visited.append(p)
+        return p['x'] * p['y']
+    result = runSequence(fn, params, order, linkedParams=linked)
+
+    points = list(iterSequence(params, order, linkedParams=linked))
+    assert [p for ind, p in points] == visited
+    for ind, p in points:
+        assert result[ind] == p['x'] * p['y']
+        assert p['w'] == p['y']
+        assert p['z'] == 7
+
+    # generator is lazy; no values are computed until requested
+    gen = iterSequence({'x': list(range(10**6))}, ['x'])
+    assert next(gen) == ((0,), {'x': 0})
+    assert next(gen) == ((1,), {'x': 1})
+
+
+def test_stop():
+    # Exception('stop', result) records a final result; Exception('stop') ends
+    # the sequence without one
+    for withResult in (True, False):
+        visited = []
+        def fn(p):
+            visited.append(p['x'])
+            if p['x'] == 3:
+                raise Exception('stop', 30) if withResult else Exception('stop')
+            return p['x'] * 10
+        result, mask = SequenceRunner({'x': [1, 2, 3, 4]}, ['x']).start(fn, returnMask=True)
+        assert visited == [1, 2, 3]
+        assert list(mask) == [True, True, withResult, False]
+        assert list(result[:2]) == [10, 20]
+        if withResult:
+            assert result[2] == 30
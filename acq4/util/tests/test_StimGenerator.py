@@ -0,0 +1,142 @@
+from __future__ import print_function
+from collections import OrderedDict
+import numpy as np
+import pytest
+from acq4.util.Mutex import Mutex
+from acq4.util.generator.StimGenerator import StimGenerator
+
+
+def makeGenerator(fnStr, pSpace):
+    # Build a StimGenerator without its widget; only the evaluation machinery is set up.
+    gen = StimGenerator.__new__(StimGenerator)
+    gen.offset = 0.0
+    gen.lock = Mutex(recursive=True)
+    gen.cache = OrderedDict()
+    gen.cacheBytes = 0
+    gen._namespace = None
+    gen._seqNames = set()
+    gen._compiled = {}
+    gen._notVectorizable = set()
+    gen.extraParams = {}
+    gen.pSpace = pSpace
+    gen.fnStr = fnStr
+    gen.errors = []
+    gen.functionString = lambda: gen.fnStr
+    gen.setError = lambda msg=None: gen.errors.append(msg)
+    return gen
+
+
+def countEvaluations(gen):
+    calls = []
+    evaluate = gen._evaluate
+    def countingEvaluate(*args):
+        calls.append(args)
+        return evaluate(*args)
+    gen._evaluate = countingEvaluate
+    return calls
+
+
+def params2d():
+    return OrderedDict([('amp', (1.0, [1.0, 2.0, 3.0])), ('start', (0.001, [0.001, 0.002]))])
+
+
+def test_cached_vs_fresh():
+    gen = makeGenerator("amp * (np.arange(nPts) / rate >= start)", params2d())
+    calls = countEvaluations(gen)
+    w1 = gen.getSingle(1e4, 50, {'amp': 2, 'start': 1})
+    assert len(calls) == 1
+    assert gen.getSingle(1e4, 50, {'amp': 2, 'start': 1}) is w1
+    assert len(calls) == 1
+
+    # a fresh evaluation gives the same result
+    gen.clearCache()
+    w2 = gen.getSingle(1e4, 50, {'amp': 2, 'start': 1})
+    assert len(calls) == 2
+    assert w2 is not w1 and np.array_equal(w1, w2)
+    assert w1[19] == 0 and w1[20] == 3.0
+
+    # rate and nPts are part of the key
+    assert len(gen.getSingle(2e4, 50, {'amp': 2, 'start': 1})) == 50
+    assert len(calls) == 3
+
+    # the cache is bounded, least recently used first out
+    gen.cacheMaxBytes = 2 * w1.nbytes
+    gen.clearCache()
+    gen.getSingle(1e4, 50, {'amp': 0})
+    gen.getSingle(1e4, 50, {'amp': 1})
+    gen.getSingle(1e4, 50, {'amp': 0})
+    gen.getSingle(1e4, 50, {'amp': 2})
+    assert list(gen.cache.keys()) == [gen._cacheKey(1e4, 50, {'amp': 0}), gen._cacheKey(1e4, 50, {'amp': 2})]
+    assert gen.cacheBytes == 2 * w1.nbytes
+
+
+def test_namespace_restored_after_error():
+    gen = makeGenerator("np.ones(nPts) * amp if amp < 2.5 else undefinedName", params2d())
+    assert gen.getSingle(1e4, 10, {'amp': 1})[0] == 2.0
+    with pytest.raises(NameError):
+        gen.getSingle(1e4, 10, {'amp': 2})
+    assert gen.getSingle(1e4, 10, {'amp': 0})[0] == 1.0
+
+    # parameters left over from the failed evaluation are removed
+    gen.fnStr = "np.ones(nPts) * amp"
+    gen.pSpace = OrderedDict()
+    gen.clearCache()
+    with pytest.raises(NameError):
+        gen.getSingle(1e4, 10)
+
+    # names that are not sequence parameters keep their original values
+    gen.pSpace = OrderedDict([('pulse', (1.0, [1.0, 2.0]))])
+    gen.fnStr = "np.ones(nPts) * pulse"
+    assert gen.getSingle(1e4, 10, {'pulse': 1})[0] == 2.0
+    gen.pSpace = OrderedDict()
+    gen.fnStr = "pulse(0.001, 0.002, 5)"
+    wave = gen.getSingle(1e4, 50)
+    assert wave[9] == 0 and wave[10] == 5 and wave[30] == 0
+
+
+def test_syntax_error_line():
+    gen = makeGenerator("x = 1\ny = (\n", OrderedDict())
+    with pytest.raises(SyntaxError):
+        gen.getSingle(1e4, 10)
+
+
+@pytest.mark.parametrize('fnStr, vectorized', [
+    ("amp * (np.arange(nPts) / rate >= start)", True),
+    ("pulse(start, 0.002, amp)", False),              # waveforms.py functions take scalars
+    ("x = np.arange(nPts) * amp\nreturn x - x.mean()", False),  # reduces across all points
+])
+def test_sequence_matches_single(fnStr, vectorized):
+    gen = makeGenerator(fnStr, params2d())
+    calls = countEvaluations(gen)
+    seq = gen.getSequence(1e4, 50)
+    assert seq.shape == (3, 2, 50)
+    if vectorized:
+        assert len(calls) < 6
+    assert (gen._notVectorizable == set()) == vectorized
+
+    ref = makeGenerator(fnStr, params2d())
+    for ind in np.ndindex(3, 2):
+        single = ref.getSingle(1e4, 50, {'amp': ind[0], 'start': ind[1]})
+        assert np.allclose(seq[ind], single, rtol=1e-12, atol=0)
+        # the sequence is cached point by point
+        assert gen.getSingle(1e4, 50, {'amp': ind[0], 'start': ind[1]}) is not None
+    n = len(calls)
+    gen.getSequence(1e4, 50)
+    assert len(calls) == n
+
+
+def test_cache_sequence():
+    gen = makeGenerator("amp * (np.arange(nPts) / rate >= start)", params2d())
+    gen.offset = 0.5
+    calls = countEvaluations(gen)
+    assert gen.cacheSequence(1e4, 50)
+    n = len(calls)
+    wave = gen.getSingle(1e4, 50, {'amp': 2, 'start': 0})
+    assert len(calls) == n
+    assert wave[0] == 0.5 and wave[10] == 3.5
+
+    # sequences that do not fit in the cache are not generated
+    gen.clearCache()
+    gen.cacheMaxBytes = 5 * 50 * 8
+    assert not gen.cacheSequence(1e4, 50)
+    assert len(gen.cache) == 0
@@ -0,0 +1,68 @@
+from __future__ import print_function
+import threading, time
+import pytest
+from acq4.util.WriterPool import WriterPool
+
+
+def test_queue_bound():
+    pool = WriterPool(threads=1, maxPending=2)
+    release = threading.Event()
+    started = threading.Event()
+
+    def block():
+        started.set()
+        release.wait()
+
+    jobs = [pool.submit('a', block)]
+    started.wait(5)
+    jobs += [pool.submit('a', lambda: None) for i in range(2)]
+
+    # the queue is full; the next submit must block until a job is taken
+    submitted = threading.Event()
+    def submit():
+        jobs.append(pool.submit('b', lambda: None))
+        submitted.set()
+    t = threading.Thread(target=submit)
+    t.start()
+    assert not submitted.wait(0.2)
+    release.set()
+    assert submitted.wait(5)
+    t.join()
+    for job in jobs:
+        job.wait(5)
+    assert pool.stats()['a']['count'] == 3
+    assert pool.shutdown()
+
+
+def test_errors():
+    pool = WriterPool(threads=2)
+    def fail():
+        raise ValueError('disk full')
+    bad = pool.submit('cam', fail)
+    good = pool.submit('daq', lambda: None)
+    with pytest.raises(ValueError):
+        bad.wait(5)
+    good.wait(5)
+    assert pool.stats()['cam']['errors'] == 1
+    assert pool.stats()['daq']['errors'] == 0
+    errors = pool.errors(clear=True)
+    assert len(errors) == 1 and errors[0][0] == 'cam' and isinstance(errors[0][1], ValueError)
+    assert pool.errors() == []
+    pool.shutdown()
+
+
+def test_shutdown():
+    pool = WriterPool(threads=2, maxPending=100)
+    done = []
+    def write(i):
+        time.sleep(0.01)
+        done.append(i)
+    for i in range(20):
+        pool.submit('x', write, i)
+
+    # all queued jobs finish before the threads exit
+    assert pool.shutdown(wait=True)
+    assert sorted(done) == list(range(20))
+    assert not any(t.is_alive() for t in pool.threads)
+    with pytest.raises(RuntimeError):
+        pool.submit('x', write, 20)
@@ -0,0 +1,146 @@
+from __future__ import print_function
+import os, tempfile, datetime
+import numpy as np
+import pytest
+import acq4.pyqtgraph.configfile as oldcf
+import acq4.util.configfile as cf
+from acq4.util.configfile import OrderedDict, ParseError
+
+
+cfgString = """
+## comment
+key: 'value'
+key2:              ##comment
+                   ##comment
+    key21: 'value' ## comment
+                   ##comment
+    key22: [1,2,3]
+    key23: 234  #comment
+    empty:
+    nested:
+        (1, 2): 10*ms
+        (notatuple): -1.5e-3 / 2
+        arr: array([1, 2, 3], dtype=int32)
+    od: OrderedDict([('a', 1), ('b', {'c': (None, True)})])
+key3: 1/5
+empty2:
+"""
+
+
+def test_parse_matches_original():
+    ref = oldcf.parseString(cfgString)[1]
+    data = cf.parseString(cfgString)[1]
+    assert list(data.keys()) == list(ref.keys())
+    arr = data['key2']['nested'].pop('arr')
+    refArr = ref['key2']['nested'].pop('arr')
+    assert arr.dtype == refArr.dtype and np.all(arr == refArr)
+    assert data == ref
+    assert list(data['key2'].keys()) == ['key21', 'key22', 'key23', 'empty', 'nested', 'od']
+    assert data['key2']['nested'][(1, 2)] == 0.01
+    assert data['key2']['empty'] == {} and data['empty2'] == {}
+
+    # first-line indentation sets the top level; anything dedented below it is ignored
+    assert cf.parseString("  a: 1\n  b: 2\nc: 3\n")[1] == oldcf.parseString("  a: 1\n  b: 2\nc: 3\n")[1]
+
+
+@pytest.mark.parametrize('s', [
+    "a:\n    b: 1\n  c: 2\n",   # dedent to a level that was never opened
+    "a: 1\n    b: 2\n",         # unexpected indent
+    "a 1\n",                    # missing colon
+    ": 1\n",                    # missing name
+    "a: undefinedName\n",
+])
+def test_parse_errors(s):
+    with pytest.raises(ParseError):
+        cf.parseString(s)
+
+
+@pytest.mark.parametrize('expr', [
+    "__import__('os')",
+    "().__class__",
+    "[x for x in (1, 2)]",
+    "(lambda: 1)()",
+    "dict(**{'a': 1})",
+    "open('/etc/passwd')",
+    "getattr(1, 'real')",
+    "array([65, 66]).astype('uint8').tofile('/tmp/pwned_cfg')",
+    "QtCore.QProcess.startDetached('touch', ['/tmp/pwned_cfg'])",
+    "(1).real",
+    "'%s'.join",
+    "datetime.datetime.now()",
+    "Point(1, 2).norm()",
+    "readConfigFile.__globals__",
+    "(array or 0)([1])",
+])
+def test_restricted_eval(expr):
+    with pytest.raises(Exception):
+        cf.evalExpression(expr)
+
+
+@pytest.mark.parametrize('expr', [
+    "float('nan') != 0",
+    "int('3') + int(2.7)",
+    "list(range(0, 10, 3))",
+    "abs(-2*ms)",
+    "min(1, 2) + max([3, 4]) + round(2.567, 2)",
+    "str(5) + 'x'",
+    "bool(0) or tuple([1, 2])",
+    "dict(a=1, b=set([2]))",
+    "1 if 3 > 2 else 0",
+    "0 < 1 <= 1 < 0",
+    "'a' in 'abc' and None is not 1",
+    "not (1 == 2)",
+])
+def test_eval_builtins(expr):
+    # builtins and expressions accepted by eval() in the original parser
+    ref = oldcf.parseString("x: " + expr)[1]['x']
+    assert cf.evalExpression(expr) == ref
+
+
+def test_restricted_eval_no_side_effects(tmpdir):
+    fn = str(tmpdir.join('out'))
+    with pytest.raises(ParseError):
+        cf.parseString("a: array([65, 66]).astype('uint8').tofile(%r)\n" % fn)
+    assert not os.path.exists(fn)
+
+
+@pytest.mark.parametrize('val', [
+    datetime.datetime(2019, 3, 4, 5, 6, 7, 89),
+    datetime.date(2019, 3, 4),
+    datetime.timedelta(seconds=3.5),
+    cf.Point(1.5, -2),
+    OrderedDict([('a', 1.5), ('b', [3, 'x'])]),
+])
+def test_eval_constructors(val):
+    assert cf.evalExpression(repr(val)) == val
+
+
+def test_eval_results_not_shared():
+    a = cf.evalExpression("[1, {'x': 2}]")
+    a[1]['x'] = 3
+    assert cf.evalExpression("[1, {'x': 2}]") == [1, {'x': 2}]
+
+
+def test_write_read():
+    data = OrderedDict([
+        ('.', {'__timestamp__': 1234.5678, 'notes': 'line "1"\nline 2'}),
+        ('file.ma', OrderedDict([('sequence', (3, 4)), ('arr', [1.5, -2e-5]), ('sub', {})])),
+    ])
+    assert cf.genString(data) == oldcf.genString(data)
+
+    fh, fn = tempfile.mkstemp()
+    os.close(fh)
+    try:
+        cf.writeConfigFile(data, fn)
+        cf.appendConfigFile({'extra': {'a': 1}}, fn)
+        data2 = cf.readConfigFile(fn)
+    finally:
+        os.remove(fn)
+    data['extra'] = {'a': 1}
+    assert data2 == data
+
+
+def test_eval_array():
+    arr = cf.evalExpression("array([[1, 2], [3, 4]], dtype=uint16)")
+    assert arr.dtype == np.uint16 and arr.tolist() == [[1, 2], [3, 4]]
+    assert cf.evalExpression("float32(1.5) * ms") == 1.5e-3
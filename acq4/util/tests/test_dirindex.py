@@ -0,0 +1,134 @@
+from __future__ import print_function
+import os, tempfile, shutil
+import numpy as np
+import pytest
+import acq4.util.DataManager as dm
+from acq4.util.dirindex import LogIndex, TextIndex, openIndex
+
+
+@pytest.fixture
+def tmpdir_():
+    path = tempfile.mkdtemp()
+    yield path
+    shutil.rmtree(path)
+
+
+def test_logindex(tmpdir_):
+    ind = LogIndex(tmpdir_)
+    assert not ind.exists()
+    ind.update('.', {'a': 1})
+    ind.update('file1', {'__timestamp__': 1.0, 'arr': np.arange(3)})
+    ind.update('file2', {'__timestamp__': 2.0})
+    ind.update('file1', {'b': 'x'})
+    ind.remove('file2')
+    assert list(ind) == ['.', 'file1']
+    assert ind['file1']['b'] == 'x'
+
+    # a second reader sees the same index, reading entries on demand
+    ind2 = openIndex(tmpdir_)
+    assert isinstance(ind2, LogIndex)
+    ind2.reload()
+    assert list(ind2) == ['.', 'file1']
+    assert len(ind2._cache) == 0
+    info = ind2['file1']
+    assert info['__timestamp__'] == 1.0 and info['b'] == 'x'
+    assert np.all(info['arr'] == np.arange(3))
+
+    # appends by one handle are picked up incrementally by the other
+    ind.update('file3', {'c': 3})
+    ind2.reload()
+    assert ind2['file3'] == {'c': 3}
+    assert ind2['file1'] is info
+
+    # an incomplete record at the end of the file is ignored and later overwritten
+    with open(ind.path(), 'ab') as fh:
+        fh.write(b'\x00\x10\x00')
+    ind3 = LogIndex(tmpdir_)
+    ind3.reload()
+    assert list(ind3) == ['.', 'file1', 'file3']
+    ind3.update('file4', {})
+    ind4 = LogIndex(tmpdir_)
+    ind4.reload()
+    assert list(ind4) == ['.', 'file1', 'file3', 'file4']
+
+
+def test_logindex_no_code_execution(tmpdir_):
+    # payloads are parsed with the restricted configfile evaluator, never unpickled
+    ind = LogIndex(tmpdir_)
+    ind.update('file', {'a': 1})
+    payload = b"x: __import__('os').system('echo pwned')\n"
+    rec = LogIndex.header.pack(LogIndex.UPDATE, len(payload), 4) + b'evil' + payload
+    with open(ind.path(), 'ab') as fh:
+        fh.write(rec)
+    ind2 = LogIndex(tmpdir_)
+    ind2.reload()
+    assert ind2['file'] == {'a': 1}
+    with pytest.raises(Exception):
+        ind2['evil']
+
+
+def test_logindex_compaction(tmpdir_):
+    ind = LogIndex(tmpdir_)
+    ind.compactThreshold = 10
+    for i in range(50):
+        ind.update('file', {'count': i})
+    assert ind._nRecords <= 11
+    assert ind['file'] == {'count': 49}
+    ind2 = LogIndex(tmpdir_)
+    ind2.reload()
+    assert ind2['file'] == {'count': 49}
+
+
+def test_logindex_offsets(tmpdir_):
+    # payloads are read from the file on demand rather than held in memory
+    ind = LogIndex(tmpdir_)
+    for i in range(20):
+        ind.update('file%d' % i, {'data': 'x' * 1000, 'i': i})
+    ind2 = LogIndex(tmpdir_)
+    ind2.reload()
+    assert not any(isinstance(v, (bytes, bytearray)) and len(v) > 1000 for v in vars(ind2).values())
+    assert ind2._end == os.path.getsize(ind.path())
+    assert ind2['file7']['i'] == 7
+
+    # compaction by another handle invalidates the offsets; entries are re-read
+    ind.update('file3', {'i': 'three'})
+    ind.compact()
+    assert ind2['file3'] == {'data': 'x' * 1000, 'i': 'three'}
+    assert ind2['file7']['i'] == 7
+
+
+def test_migration(tmpdir_):
+    rh = dm.getDirHandle(tmpdir_)
+    rh.setInfo({'x': 1})
+    sub = rh.mkdir('subdir', info={'a': 'b'})
+    fh = rh.createFile('file.txt', info={'c': 2})
+    assert isinstance(rh._readIndex(), TextIndex)
+    try:
+        dm.setIndexFormat('log')
+        # reading does not convert
+        assert rh.info()['x'] == 1
+        assert isinstance(rh._readIndex(), TextIndex)
+
+        # writing converts the index; .index is kept for older versions of acq4
+        fh.setInfo({'d': 3})
+        assert isinstance(rh._readIndex(), LogIndex)
+        assert TextIndex(tmpdir_).exists()
+        old = TextIndex(tmpdir_)
+        old.reload()
+        assert old['file.txt']['c'] == 2 and 'd' not in old['file.txt']
+        assert rh.info()['x'] == 1
+        assert fh.info()['c'] == 2 and fh.info()['d'] == 3
+        assert 'subdir' in rh.ls() and '.indexlog' not in rh.ls()
+
+        # new directories use the new format
+        sub2 = rh.mkdir('subdir2', info={'e': 4})
+        assert isinstance(sub2._readIndex(), LogIndex)
+        assert sub2.info()['e'] == 4
+        assert rh.ls() == ['subdir', 'file.txt', 'subdir2']
+
+        rh.convertIndex('text')
+        assert isinstance(rh._readIndex(), TextIndex)
+        assert fh.info()['d'] == 3
+        assert os.path.exists(os.path.join(tmpdir_, '.indexlog.old'))
+    finally:
+        dm.setIndexFormat('text', migrate=False)
@@ -0,0 +1,54 @@
+from __future__ import print_function
+import numpy as np
+import acq4.pyqtgraph as pg
+import acq4.util.functions as functions
+import acq4.util.metaarray as metaarray
+from acq4.util.flowchart.Analysis import EventFitter, processEventFits
+
+
+def makeData(nEvents=60, dt=1e-4):
+    rng = np.random.RandomState(0)
+    t = np.arange(100000) * dt
+    waveform = rng.normal(0, 0.3, len(t))
+    times = np.sort(rng.choice(np.arange(100, len(t)-1000), nEvents, replace=False)) * dt
+    for start in times:
+        mask = t >= start
+        waveform[mask] += functions.pspFunc([5, start, 1e-3, 5e-3], t[mask])
+    events = np.zeros(nEvents, dtype=[('index', int), ('time', float), ('len', int), ('sum', float), ('peak', float)])
+    events['time'] = times
+    events['index'] = (times / dt).astype(int)
+    events['len'] = 60
+    waveform = metaarray.MetaArray(waveform, info=[{'name': 'Time', 'values': t}, {}])
+    return events, waveform
+
+
+def test_parallel_fits_match_serial():
+    pg.mkQApp()
+    events, waveform = makeData()
+    node = EventFitter('fitter')
+    try:
+        serial = node.process(waveform, events, display=False)['output']
+
+        # fitted in chunks by two worker processes
+        node.ctrls['parallel'].setChecked(True)
+        node.ctrls['nProcesses'].setValue(2)
+        node.chunkSize = 7
+        parallel = node.process(waveform, events, display=False)['output']
+        assert len(node.pool) == 2
+        assert np.array_equal(parallel, serial)
+
+        # the workers persist between calls
+        pool = node.pool
+        parallel = node.process(waveform, events, display=False)['output']
+        assert node.pool is pool
+        assert np.array_equal(parallel, serial)
+    finally:
+        node.close()
+    assert node.pool is None
+
+    # a sub-range of events gives the matching subset of the serial output
+    opts = {'dt': 1e-4, 'tau': None, 'multiFit': False, 'waveform': waveform.view(np.ndarray), 'tvals': waveform.xvals('Time')}
+    full = processEventFits(events, 0, len(events), opts)
+    part = processEventFits(events, 10, 30, opts)
+    mask = [10 <= i < 30 for i in full['indexes']]
+    assert np.array_equal(part['output'], full['output'][mask])
@@ -0,0 +1,81 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+from acq4.util.functions import thresholdEvents, zeroCrossingEvents, expTemplate, clementsBekkers, cbTemplateMatch, ClementsBekkersMatcher
+from acq4.util.events_benchmark import makeTrace, thresholdEventsOriginal, zeroCrossingEventsOriginal
+
+
+def assertEventsEqual(ev, ref):
+    assert ev.dtype == ref.dtype
+    assert len(ev) == len(ref)
+    for name in ev.dtype.names:
+        if name == 'sum':
+            ## summation order differs from ndarray.sum(), so allow for rounding
+            assert np.allclose(ev[name], ref[name], rtol=1e-9, atol=1e-12)
+        else:
+            assert np.all(ev[name] == ref[name]), name
+
+
+@pytest.mark.parametrize('noise', [0.3, 1.0, 3.0])
+def test_thresholdEvents(noise):
+    data = makeTrace(20000, noise=noise, seed=int(noise*10))
+    data[:20] = 5   ## event already in progress at the start of the trace
+    for threshold in [0.5, 2.0]:
+        for adjust in [True, False]:
+            ev = thresholdEvents(data, threshold, adjustTimes=adjust)
+            assertEventsEqual(ev, thresholdEventsOriginal(data, threshold, adjustTimes=adjust))
+    assert len(thresholdEvents(np.zeros(100), 1.0)) == 0
+
+
+@pytest.mark.parametrize('noise', [0.3, 1.0, 3.0])
+def test_zeroCrossingEvents(noise):
+    data = makeTrace(20000, noise=noise, seed=int(noise*10))
+    for minLength in [0, 3, 10]:
+        ev = zeroCrossingEvents(data, minLength=minLength, minPeak=0.1)
+        assertEventsEqual(ev, zeroCrossingEventsOriginal(data, minLength=minLength, minPeak=0.1))
+    ## the start and end of the trace count as crossings
+    ev = zeroCrossingEvents(np.zeros(100))
+    assert len(ev) == 1 and ev[0]['index'] == 1 and ev[0]['sum'] == 0
+
+
+def cbReference(data, template):
+    ## least-squares fit of scale*template+offset at every position
+    N = len(template)
+    A = np.vstack([template, np.ones(N)]).T
+    out = []
+    for i in range(len(data)-N+1):
+        d = data[i:i+N]
+        scale, offset = np.linalg.lstsq(A, d, rcond=None)[0]
+        sse = ((A.dot([scale, offset]) - d)**2).sum()
+        out.append((scale / np.sqrt(sse / (N-1)), scale, offset))
+    return np.array(out).T
+
+
+def test_clementsBekkers():
+    template = expTemplate(1e-4, 1e-3, 4e-3, delay=2e-4, length=10e-3)
+    rng = np.random.RandomState(0)
+    traces = rng.normal(size=(3, 1000)) * 0.1 - 65.
+    eventTimes = [(0, 200), (0, 700), (1, 400), (2, 50)]
+    for trace, t in eventTimes:
+        traces[trace, t:t+len(template)] += template * 2.0
+
+    ref = cbReference(traces[0], template)
+    for method in ['direct', 'fft']:
+        matcher = ClementsBekkersMatcher(template, method=method)
+        dc, scale, offset = matcher.match(traces)
+        assert dc.shape == (3, 1000-len(template)+1)
+        assert np.allclose(dc[0], ref[0], rtol=1e-6)
+        assert np.allclose(scale[0], ref[1], rtol=1e-6, atol=1e-9)
+        assert np.allclose(offset[0], ref[2], rtol=1e-6)
+        ## batch results match single-trace results
+        for i in range(3):
+            assert np.allclose(clementsBekkers(traces[i], template)[0], dc[i], rtol=1e-6)
+
+        events = matcher.detect(traces, threshold=10.)
+        assert [(ev['trace'], ev['peak']) for ev in events] == eventTimes
+        assert np.allclose(events['scale'], 2.0, rtol=0.1)
+        assert np.allclose(events['offset'], -65., atol=0.1)
+
+    events = cbTemplateMatch(traces[1], template, threshold=10.)
+    assert events.dtype.names == ('peak', 'dc', 'scale', 'offset')
+    assert list(events['peak']) == [400]
@@ -0,0 +1,75 @@
+from __future__ import print_function
+import numpy as np
+from acq4.util.imaging.frame_processor import FrameProcessor
+from acq4.util.imaging.bg_subtract_ctrl import BackgroundModel
+
+
+class FakeFrame(object):
+    def __init__(self, data):
+        self.data = data
+
+    def getImage(self):
+        return self.data
+
+
+def referenceARGB(data, levels, lut):
+    # levels + lut as applied by pyqtgraph's makeARGB, in (row, col, BGRA) order
+    mn, mx = levels
+    index = np.clip((data.T.astype(float) - mn) * (len(lut) - 1) / (mx - mn), 0, len(lut) - 1).astype(int)
+    argb = np.empty(data.T.shape + (4,), dtype=np.ubyte)
+    argb[..., :3] = lut[index][..., ::-1]
+    argb[..., 3] = 255
+    return argb
+
+
+def test_makeARGB():
+    rng = np.random.RandomState(0)
+    lut = (rng.rand(256, 3) * 255).astype(np.ubyte)
+    img = rng.normal(1000, 100, (120, 80)).clip(0).astype(np.uint16)
+    proc = FrameProcessor()
+    for data in (img, img.astype(np.float32) / 7.):
+        levels = (float(np.percentile(data, 5)), float(np.percentile(data, 95)))
+        argb, alpha = proc.makeARGB(data, levels, lut)
+        assert argb.shape == (80, 120, 4) and alpha is False
+        assert np.all(argb == referenceARGB(data, levels, lut))
+
+    # output buffers alternate so the displayed image is never overwritten
+    a1 = proc.makeARGB(img, (0, 2000), None)[0]
+    a2 = proc.makeARGB(img, (0, 2000), None)[0]
+    assert a1 is not a2
+
+
+def test_makeARGB_lut_change():
+    # the integer lookup table must be rebuilt whenever the lut changes, even
+    # if the new BGRA table happens to reuse the memory of the old one
+    rng = np.random.RandomState(1)
+    img = rng.randint(0, 1000, (50, 40)).astype(np.uint16)
+    levels = (100, 900)
+    proc = FrameProcessor()
+    for i in range(5):
+        lut = (rng.rand(256, 3) * 255).astype(np.ubyte)
+        assert np.all(proc.makeARGB(img, levels, lut)[0] == referenceARGB(img, levels, lut))
+
+    # a table modified in place is also picked up
+    lut[:] = 255 - lut
+    assert np.all(proc.makeARGB(img, levels, lut)[0] == referenceARGB(img, levels, lut))
+
+
+def test_processFrame():
+    rng = np.random.RandomState(0)
+    frames = [rng.normal(1000, 100, (64, 48)).astype(np.uint16) for i in range(4)]
+    bg = BackgroundModel()
+    for i, img in enumerate(frames):
+        assert bg.addFrame(img, float(i), continuous=False, timeConstant=1.0, reset=(i == 0)) == (i == 0)
+        bg.update()
+    assert np.allclose(bg.background(), np.mean(frames, axis=0), rtol=1e-5)
+
+    opts = {'background': bg, 'bgMode': 'divide', 'bgBlur': 0, 'autoGain': True, 'centerWeight': 0.0,
+            'gainSpeed': 1.0, 'autoGainLevels': [0.0, 1.0], 'lastMinMax': None, 'levels': (0, 1),
+            'lut': None, 'axisOrder': 'col-major'}
+    proc = FrameProcessor()
+    result = proc.processFrame(FakeFrame(frames[0]), opts)
+    corrected = frames[0] / bg.background()
+    assert np.allclose(result['minMax'], [corrected.min(), corrected.max()], rtol=1e-5)
+    assert result['argb'].shape == (48, 64, 4)
+    assert result['histogram'][1].sum() == corrected.size
@@ -0,0 +1,101 @@
+from __future__ import print_function
+import numpy as np
+import pytest
+from acq4.util.metaarray import MetaArray, axis
+from acq4.filetypes.MetaArray import applyRawMapping
+
+
+def makeArrays():
+    rate = 10000.
+    data = np.random.normal(size=(2, 1000))
+    cols = [('a', 'V'), ('b', 'A')]
+    explicit = MetaArray(data, info=[axis('Channel', cols=cols), axis('Time', units='s', values=np.arange(1000) / rate)])
+    implicit = MetaArray(data, info=[axis('Channel', cols=cols), axis('Time', units='s', start=0.0, rate=rate)])
+    return explicit, implicit
+
+
+@pytest.mark.parametrize('index', [
+    np.s_[:, 10:500:3],
+    np.s_[:, ::-2],
+    np.s_['Time':0.0123:0.05],
+    np.s_['Time':0.01:],
+    np.s_['a', 5:20],
+    np.s_[:, [1, 5, 7]],
+])
+def test_implicit_axis(index):
+    explicit, implicit = makeArrays()
+    assert 'values' not in implicit._info[1]
+    assert implicit.axisHasValues('Time')
+    assert np.all(implicit.xvals('Time') == explicit.xvals('Time'))
+
+    a = explicit[index]
+    b = implicit[index]
+    assert np.all(a.asarray() == b.asarray())
+    assert np.allclose(a.xvals('Time'), b.xvals('Time'), rtol=1e-12, atol=0)
+
+
+def test_raw_mapping():
+    raw = (np.random.normal(size=(2, 100)) * 1000).astype(np.int16)
+    cols = [
+        {'name': 'a', 'units': 'V', 'rawScale': 2e-3, 'rawOffset': 0.1},
+        {'name': 'b', 'units': 'A', 'rawScale': 5.0, 'rawOffset': -2.5},
+    ]
+    arr = MetaArray(raw, info=[{'name': 'Channel', 'cols': cols}, axis('Time', start=0, rate=1000.)])
+    mapped = applyRawMapping(arr)
+    assert mapped.dtype == np.float64
+    assert np.allclose(mapped['Channel': 'a'].asarray(), raw[0] * 2e-3 + 0.1)
+    assert np.allclose(applyRawMapping(arr['Channel': 'b']).asarray(), raw[1] * 5.0 - 2.5)
+    assert 'rawScale' not in mapped._info[0]['cols'][0]
+
+    # arrays without raw columns are returned unchanged
+    explicit, implicit = makeArrays()
+    assert applyRawMapping(explicit) is explicit
+
+
+def test_raw_mapping_from_disk(tmpdir):
+    # data that are not read into memory are converted as they are read
+    raw = (np.random.normal(size=(3, 100)) * 1000).astype(np.int16)
+    cols = [
+        {'name': 'a', 'units': 'V', 'rawScale': 2e-3, 'rawOffset': 0.1},
+        {'name': 'b', 'units': 'A', 'rawScale': 5.0, 'rawOffset': -2.5},
+        {'name': 'c', 'units': 'V'},
+    ]
+    fileName = str(tmpdir.join('raw.ma'))
+    MetaArray(raw, info=[{'name': 'Channel', 'cols': cols}, axis('Time', start=0, rate=1000.)]).write(fileName)
+    expected = raw * np.array([[2e-3], [5.0], [1.0]]) + np.array([[0.1], [-2.5], [0.0]])
+
+    arr = MetaArray(file=fileName, readAllData=False)
+    assert not isinstance(arr._data, np.ndarray)
+    mapped = applyRawMapping(arr)
+    try:
+        assert mapped.dtype == np.float64 and mapped.shape == raw.shape
+        assert 'rawScale' not in mapped._info[0]['cols'][0]
+        assert 'rawScale' in arr._info[0]['cols'][0]
+        assert np.allclose(mapped.asarray(), expected)
+        assert np.allclose(mapped['Channel': 'b'].asarray(), expected[1])
+        assert np.allclose(mapped['Channel': 1:3, 'Time': 10:20].asarray(), expected[1:3, 10:20])
+        assert np.allclose(mapped[:, 5].asarray(), expected[:, 5])
+        assert np.isclose(mapped[0, 7], expected[0, 7])
+        assert np.allclose(np.array(mapped), expected)
+    finally:
+        arr._openFile.close()
+
+
+@pytest.mark.parametrize('module', [
+    'acq4.util.functions',
+    'acq4.pyqtgraph.functions',
+    'acq4.pyqtgraph.flowchart.library.functions',
+])
+@pytest.mark.parametrize('xvals', ['subsample', 'downsample'])
+def test_downsample_implicit_axis(module, xvals):
+    # 1000 samples at 1 kHz downsampled by 10 must still span ~1 s
+    downsample = __import__(module, fromlist=['downsample']).downsample
+    data = np.random.normal(size=1000)
+    explicit = MetaArray(data, info=[axis('Time', units='s', values=np.arange(1000) / 1000.)])
+    implicit = MetaArray(data, info=[axis('Time', units='s', start=0.0, rate=1000.)])
+    a = downsample(explicit, 10, xvals=xvals)
+    b = downsample(implicit, 10, xvals=xvals)
+    assert b.axisIsImplicit('Time')
+    assert np.all(a.asarray() == b.asarray())
+    assert np.allclose(a.xvals('Time'), b.xvals('Time'), rtol=1e-12, atol=0)
+    assert b.xvals('Time')[-1] > 0.98
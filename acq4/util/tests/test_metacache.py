@@ -0,0 +1,115 @@
+from __future__ import print_function
+import os, tempfile, shutil, zlib
+import pytest
+import acq4.util.DataManager as dm
+
+
+@pytest.fixture
+def tree():
+    path = tempfile.mkdtemp()
+    snapshotDir = tempfile.mkdtemp()
+    dm.MetaCache.snapshotDir = snapshotDir
+    rh = dm.getDirHandle(path)
+    rh.setInfo({'dirType': 'Day'})
+    seq = rh.mkdir('seq', info={'dirType': 'ProtocolSequence', 'sequenceParams': {('Clamp1', 'holding'): [0, 1, 2]}})
+    for i in range(3):
+        seq.mkdir('%03d' % i, info={('Clamp1', 'holding'): i})
+    with open(os.path.join(path, 'notes.txt'), 'w') as fh:
+        fh.write('notes')
+    rh.indexFile('notes.txt', info={'kind': 'notes'})
+    yield path
+    manager = dm.getDataManager()
+    manager.metaCache = None
+    dm.MetaCache.snapshotDir = None
+    shutil.rmtree(path)
+    shutil.rmtree(snapshotDir)
+
+
+def test_metacache(tree):
+    manager = dm.getDataManager()
+    rh = dm.getDirHandle(tree)
+    seq = rh['seq']
+    expectedLs = rh.ls()
+    expectedSub = seq.subDirs()
+
+    dm.crawl(tree)
+    cache = manager.metaCache
+    assert cache.covers(os.path.join(tree, 'seq', '001'))
+    # the snapshot is kept out of the data tree
+    assert os.path.isfile(cache.snapshotPath(tree))
+    assert not cache.snapshotPath(tree).startswith(tree)
+    assert rh.ls() == expectedLs
+
+    # queries are answered from the cache
+    assert rh.ls() == expectedLs
+    assert seq.subDirs() == expectedSub == ['000', '001', '002']
+    assert cache.dirType(seq.name()) == 'ProtocolSequence'
+    assert cache.sequenceParams(seq.name()) == {('Clamp1', 'holding'): [0, 1, 2]}
+    assert seq['002'].info()[('Clamp1', 'holding')] == 2
+    assert rh['notes.txt'].info()['kind'] == 'notes'
+
+    # changes made through handles invalidate the affected entries
+    seq['001'].setInfo({'checked': True})
+    assert dm.abspath(seq['001'].name()) not in cache.entries
+    assert seq['001'].info()['checked'] is True
+    seq.mkdir('003', info={('Clamp1', 'holding'): 3})
+    assert seq.subDirs() == ['000', '001', '002', '003']
+    seq['000'].delete()
+    assert seq.subDirs() == ['001', '002', '003']
+
+
+def test_metacache_snapshot(tree):
+    cache = dm.MetaCache()
+    cache.crawl(tree)
+    scanned = []
+    orig = dm.MetaCache._scanDir
+
+    class CountingCache(dm.MetaCache):
+        def _scanDir(self, path):
+            scanned.append(os.path.basename(path))
+            return orig(self, path)
+
+    # a second crawl re-reads only directories that changed since the snapshot
+    with open(os.path.join(tree, 'seq', '002', 'new.txt'), 'w') as fh:
+        fh.write('x')
+    cache2 = CountingCache()
+    cache2.crawl(tree)
+    assert scanned == ['002']
+    assert 'new.txt' in cache2.ls(os.path.join(tree, 'seq', '002'))
+    assert cache2.info(os.path.join(tree, 'seq'))['dirType'] == 'ProtocolSequence'
+    assert cache2.sequenceParams(os.path.join(tree, 'seq')) == {('Clamp1', 'holding'): [0, 1, 2]}
+
+
+def test_metacache_snapshot_no_code_execution(tree):
+    # snapshots are read with the restricted evaluator; anything else is ignored
+    cache = dm.MetaCache()
+    fileName = cache.snapshotPath(tree)
+    cache._writeSnapshot(fileName, {'version': cache.snapshotVersion, 'root': dm.abspath(tree), 'entries': {}})
+    assert cache._loadSnapshot(dm.abspath(tree)) == {}
+    with open(fileName, 'wb') as fh:
+        fh.write(zlib.compress(b"__import__('os').system('echo pwned')"))
+    assert cache._loadSnapshot(dm.abspath(tree)) == {}
+
+
+def test_metacache_external_change(tree):
+    # changes made outside of this process are picked up from the time stamps
+    rh = dm.getDirHandle(tree)
+    dm.crawl(tree)
+    cache = dm.getDataManager().metaCache
+    seqPath = os.path.join(tree, 'seq')
+    assert cache.covers(seqPath)
+    assert 'other.txt' not in rh.ls()
+
+    with open(os.path.join(tree, 'other.txt'), 'w') as fh:
+        fh.write('x')
+    st = os.stat(tree)
+    os.utime(tree, (st.st_atime, st.st_mtime + 10))
+    assert 'other.txt' in rh.ls()
+
+    index = dm.dirindex.openIndex(seqPath)
+    index.reload()
+    index.update('.', {'dirType': 'Cell'})
+    st = os.stat(index.path())
+    os.utime(index.path(), (st.st_atime, st.st_mtime + 10))
+    assert cache.dirType(seqPath) == 'Cell'
+    assert rh['seq'].info()['dirType'] == 'Cell'
@@ -0,0 +1,91 @@
+from __future__ import print_function
+import os
+import numpy as np
+import pytest
+import h5py
+import acq4.Manager
+import acq4.util.DataManager as dm
+from acq4.util.imaging import record_thread
+from acq4.util.imaging.record_thread import RecordThread
+
+
+class Transform(object):
+    def getTranslation(self):
+        return [0., 0., 0.]
+
+
+class Frame(object):
+    def __init__(self, data, time):
+        self.data = data
+        self._info = {'time': time, 'transform': Transform()}
+
+    def getImage(self):
+        return self.data
+
+    def info(self):
+        return self._info
+
+
+class FakeManager(object):
+    def __init__(self, dh):
+        self.dh = dh
+
+    def getCurrentDir(self):
+        return self.dh
+
+
+@pytest.fixture
+def manager(tmpdir, monkeypatch):
+    man = FakeManager(dm.getDirHandle(str(tmpdir)))
+    monkeypatch.setattr(acq4.Manager, 'getManager', lambda: man)
+    return man
+
+
+def recordStack(thread, nFrames):
+    # queue a stack and write it from this thread
+    frames = np.random.randint(0, 4096, size=(nFrames, 32, 24)).astype(np.uint16)
+    thread.startRecording()
+    for i, data in enumerate(frames):
+        thread.newFrame(Frame(data, i * 0.01))
+    thread.stopRecording()
+    thread.handleFrames(thread.newFrames)
+    thread.newFrames = []
+    return frames
+
+
+@pytest.mark.parametrize('compression', [None, 'lzf'])
+def test_record_compression(manager, compression):
+    thread = RecordThread(None, compression=compression)
+    finished = []
+    thread.sigRecordingFinished.connect(lambda fh, n: finished.append((fh, n)))
+    frames = recordStack(thread, 10)
+    assert len(finished) == 1 and finished[0][1] == 10
+    with h5py.File(finished[0][0].name(), 'r') as f:
+        assert f['data'].compression == compression
+        assert np.all(f['data'][:] == frames)
+
+    with pytest.raises(ValueError):
+        RecordThread(None, compression='zip')
+
+
+def test_record_close_error(manager, monkeypatch):
+    # an error while closing the stack is reported, not raised out of the thread
+    def close(self):
+        raise IOError("No space left on device")
+    monkeypatch.setattr(record_thread.StackWriter, 'close', close)
+    monkeypatch.setattr(record_thread.debug, 'printExc', lambda *args, **kwds: None)
+
+    thread = RecordThread(None)
+    failed = []
+    finished = []
+    thread.sigRecordingFailed.connect(lambda: failed.append(True))
+    thread.sigRecordingFinished.connect(lambda fh, n: finished.append(n))
+    recordStack(thread, 5)
+    assert failed == [True] and finished == []
+    assert thread.currentStack is None and thread.stackWriter is None
+
+    # the next recording starts a new stack
+    monkeypatch.undo()
+    monkeypatch.setattr(acq4.Manager, 'getManager', lambda: manager)
+    recordStack(thread, 3)
+    assert finished == [3]
@@ -0,0 +1,43 @@
+from __future__ import print_function
+import os
+import numpy as np
+import pytest
+import h5py
+from acq4.util.metaarray import MetaArray
+from acq4.util.imaging.stack_writer import StackWriter
+
+
+@pytest.mark.parametrize('compression', [None, 'lzf'])
+def test_stack_writer(tmpdir, compression):
+    fileName = os.path.join(str(tmpdir), 'video.ma')
+    frames = np.random.randint(0, 4096, size=(257, 64, 48)).astype(np.uint16)
+    times = np.arange(len(frames)) * 0.01
+    trans = np.random.normal(size=(len(frames), 3))
+
+    # first frame creates the file, as RecordThread does
+    info = [
+        {'name': 'Time', 'values': times[:1], 'units': 's', 'translation': trans[:1]},
+        {'name': 'X'},
+        {'name': 'Y'},
+    ]
+    opts = {} if compression is None else {'compression': compression}
+    MetaArray(frames[:1], info=info).write(fileName, appendAxis='Time', appendKeys=['translation'], **opts)
+
+    writer = StackWriter(fileName, blockSize=100)
+    for i in range(1, len(frames)):
+        writer.append(frames[i], times[i], trans[i])
+    assert writer.close() == len(frames)
+    stats = writer.stats()
+    assert stats['frames'] == len(frames) - 1
+    assert stats['bytes'] == frames[1:].nbytes
+    assert stats['queue'] == 0
+    print("wrote %d frames: %0.1f MB/s sustained, %0.1f MB/s while writing, max queue %d" % (
+        stats['frames'], stats['MBps'], stats['writeMBps'], stats['maxQueue']))
+
+    # datasets were pre-sized in blocks and trimmed on close
+    with h5py.File(fileName, 'r') as f:
+        assert f['data'].shape == frames.shape
+        assert np.all(f['data'][:] == frames)
+        meta = MetaArray.readHDF5Meta(f['info'])
+    assert np.allclose(meta[0]['values'], times)
+    assert np.allclose(meta[0]['translation'], trans)